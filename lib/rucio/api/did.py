@@ -34,7 +34,7 @@ from rucio.common.utils import api_update_return_dict
 from rucio.db.sqla.constants import DIDType
 
 
-def list_dids(scope, filters, type='collection', ignore_case=False, limit=None, offset=None, long=False, recursive=False):
+def list_dids(scope, filters, type='collection', ignore_case=False, limit=None, offset=None, long=False, recursive=False, marker=None):
     """
     List dids in a scope.
 
@@ -46,6 +46,7 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
     :param offset: Offset number.
     :param long: Long format option to display more information for each DID.
     :param recursive: Recursively list DIDs content.
+    :param marker: Only list the DIDs with a name greater than the marker, i.e. the name of the last DID of the previous page.
     """
     validate_schema(name='did_filters', obj=filters)
 
@@ -57,7 +58,7 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
         filters['scope'] = InternalScope(filters['scope'])
 
     result = did.list_dids(scope=scope, filters=filters, type=type, ignore_case=ignore_case,
-                           limit=limit, offset=offset, long=long, recursive=recursive)
+                           limit=limit, offset=offset, long=long, recursive=recursive, marker=marker)
 
     for d in result:
         yield api_update_return_dict(d)
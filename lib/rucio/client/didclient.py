@@ -55,15 +55,20 @@ class DIDClient(BaseClient):
         super(DIDClient, self).__init__(rucio_host, auth_host, account, ca_cert,
                                         auth_type, creds, timeout, user_agent)
 
-    def list_dids(self, scope, filters, type='collection', long=False, recursive=False):
+    def list_dids(self, scope, filters, type='collection', long=False, recursive=False, limit=None, marker=None):
         """
         List all data identifiers in a scope which match a given pattern.
 
+        With a limit the data identifiers are returned ordered by name. The name of the last one
+        can then be given as marker to get the next page.
+
         :param scope: The scope name.
         :param filters: A dictionary of key/value pairs like {'name': 'file_name','rse-expression': 'tier0'}.
         :param type: The type of the did: 'all'(container, dataset or file)|'collection'(dataset or container)|'dataset'|'container'|'file'
         :param long: Long format option to display more information for each DID.
         :param recursive: Recursively list DIDs content.
+        :param limit: Optional: maximum number of data identifiers to return.
+        :param marker: Optional: only list the data identifiers with a name greater than the marker.
         """
         path = '/'.join([self.DIDS_BASEURL, quote_plus(scope), 'dids', 'search'])
         payload = {}
@@ -77,6 +82,10 @@ class DIDClient(BaseClient):
                 payload[k] = v
         payload['type'] = type
         payload['recursive'] = recursive
+        if limit:
+            payload['limit'] = limit
+        if marker is not None:
+            payload['marker'] = marker
 
         url = build_url(choice(self.list_hosts), path=path, params=payload)
 
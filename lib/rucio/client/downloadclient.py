@@ -37,14 +37,20 @@ try:
     from Queue import Queue, Empty, deque
 except ImportError:
     from queue import Queue, Empty, deque
-from threading import Thread
+from threading import Condition, Event, Lock, Thread
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 
 from rucio.client.client import Client
-from rucio.common.exception import (InputValidationError, NoFilesDownloaded, NotAllFilesDownloaded, RucioException)
+from rucio.common.config import config_get_int
+from rucio.common.exception import (InputValidationError, NoFilesDownloaded, NotAllFilesDownloaded, RangeNotSupported, RucioException)
 from rucio.common.pcache import Pcache
 from rucio.common.utils import adler32, detect_client_location, generate_uuid, parse_replicas_from_string, \
     send_trace, sizefmt, execute, parse_replicas_from_file
-from rucio.common.utils import GLOBALLY_SUPPORTED_CHECKSUMS, CHECKSUM_ALGO_DICT, PREFERRED_CHECKSUM
+from rucio.common.utils import GLOBALLY_SUPPORTED_CHECKSUMS, CHECKSUM_ALGO_DICT, CHECKSUM_FACTORY_DICT, PREFERRED_CHECKSUM, adler32_combine
 from rucio.rse import rsemanager as rsemgr
 from rucio import version
 
@@ -114,15 +120,97 @@ class BaseExtractionTool:
         return False
 
 
+RANGE_CHUNK_SIZE = 1024 ** 2
+RANGE_MIN_PART_SIZE = 64 * 1024 ** 2
+
+
+class EndpointLimiter:
+    """
+    Limits the number of concurrent downloads per storage endpoint and keeps track of their load.
+    """
+
+    def __init__(self, max_per_endpoint=None):
+        """
+        :param max_per_endpoint: Maximum number of concurrent downloads per endpoint. If None, the downloads are not limited.
+        """
+        self.max_per_endpoint = max_per_endpoint
+        self.active = {}
+        self.condition = Condition(Lock())
+
+    def is_full(self, endpoint):
+        """
+        Checks if the given endpoint has no free download slot.
+
+        :param endpoint: the endpoint, e.g. the hostname and port of the storage
+        """
+        return bool(self.max_per_endpoint) and self.active.get(endpoint, 0) >= self.max_per_endpoint
+
+    def acquire(self, endpoint):
+        """
+        Waits for a free download slot on the given endpoint and takes it.
+
+        :param endpoint: the endpoint, e.g. the hostname and port of the storage
+        """
+        with self.condition:
+            while self.is_full(endpoint):
+                self.condition.wait()
+            self.active[endpoint] = self.active.get(endpoint, 0) + 1
+
+    def release(self, endpoint):
+        """
+        Frees a download slot taken on the given endpoint.
+
+        :param endpoint: the endpoint, e.g. the hostname and port of the storage
+        """
+        with self.condition:
+            self.active[endpoint] -= 1
+            self.condition.notify_all()
+
+
+class BandwidthBudget:
+    """
+    Bandwidth budget shared by all download threads. Each download reserves its size
+    on the budget before starting, so the average download rate stays below the limit.
+    """
+
+    def __init__(self, bytes_per_second):
+        """
+        :param bytes_per_second: the maximum average download rate
+        """
+        self.bytes_per_second = bytes_per_second
+        self.next_start = time.time()
+        self.lock = Lock()
+
+    def reserve(self, nbytes):
+        """
+        Reserves the given number of bytes on the budget.
+
+        :param nbytes: the size of the download
+
+        :returns: the number of seconds to wait before starting the download
+        """
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_start)
+            self.next_start = start + (nbytes or 0) / self.bytes_per_second
+            return start - now
+
+
 class DownloadClient:
 
-    def __init__(self, client=None, logger=None, tracing=True, check_admin=False, check_pcache=False):
+    def __init__(self, client=None, logger=None, tracing=True, check_admin=False, check_pcache=False, max_endpoint_threads=None, max_bandwidth=None,
+                 hedge_delay=None, range_streams=4):
         """
         Initialises the basic settings for an DownloadClient object
 
         :param client: Optional: rucio.client.client.Client object. If None, a new object will be created.
         :param external_traces: Optional: reference to a list where traces can be added
         :param logger: Optional: logging.Logger object to use for downloads. If None nothing will be logged.
+        :param max_endpoint_threads: Optional: maximum number of concurrent downloads from the same storage endpoint.
+        :param max_bandwidth: Optional: maximum average download rate, in bytes per second, for all threads together.
+        :param hedge_delay: Optional: seconds after which the download of a file is also started from its next replica,
+                            the first one to finish is kept. If None, the replicas are only tried one after the other.
+        :param range_streams: Optional: maximum number of parallel range requests for the download of a large file.
         """
         if not logger:
             logger = logging.getLogger('%s.null' % __name__)
@@ -130,6 +218,10 @@ class DownloadClient:
 
         self.check_pcache = check_pcache
         self.logger = logger
+        self.endpoint_limiter = EndpointLimiter(max_endpoint_threads)
+        self.bandwidth_budget = BandwidthBudget(max_bandwidth) if max_bandwidth else None
+        self.hedge_delay = hedge_delay
+        self.range_streams = max(1, range_streams or 1)
         self.tracing = tracing
         if not self.tracing:
             logger.debug('Tracing is turned off.')
@@ -350,7 +442,7 @@ class DownloadClient:
         logger = self.logger
 
         num_files = len(input_items)
-        nlimit = 5
+        nlimit = config_get_int('download', 'max_threads', False, 5)
         num_threads = max(1, num_threads)
         num_threads = min(num_files, num_threads, nlimit)
 
@@ -488,11 +580,9 @@ class DownloadClient:
             rse_name = sources[0]['rse']
 
             # protocols are needed to extract deterministic part of the pfn
-            scheme = None
             prots = self.client.get_protocols(rse_name)
             for prot in prots:
                 if prot['scheme'] in pfn and prot['prefix'] in pfn:
-                    scheme = prot['scheme']
                     storage_prefix = prot['prefix']
 
             # proceed with the actual check
@@ -517,85 +607,46 @@ class DownloadClient:
                 logger.info('File not found in pcache.')
 
         # try different PFNs until one succeeded
+        # the sources on endpoints without free download slot are tried last, so that
+        # the concurrent downloads are spread over the replicas
         temp_file_path = item['temp_file_path']
-        success = False
-        i = 0
-        while not success and i < len(sources):
-            source = sources[i]
-            i += 1
-            pfn = source['pfn']
-            rse_name = source['rse']
-            scheme = pfn.split(':')[0]
-
-            try:
-                rse = rsemgr.get_rse_info(rse_name)
-            except RucioException as error:
-                logger.warning('%sCould not get info of RSE %s: %s' % (log_prefix, rse_name, error))
-                trace['stateReason'] = str(error)
-                continue
-
-            trace['remoteSite'] = rse_name
-            trace['clientState'] = 'DOWNLOAD_ATTEMPT'
-            trace['protocol'] = scheme
-
-            logger.info('%sTrying to download with %s from %s: %s ' % (log_prefix, scheme, rse_name, did_str))
-
-            try:
-                protocol = rsemgr.create_protocol(rse, operation='read', scheme=scheme)
-                protocol.connect()
-            except Exception as error:
-                logger.warning('%sFailed to create protocol for PFN: %s' % (log_prefix, pfn))
-                logger.debug('scheme: %s, exception: %s' % (scheme, error))
-                trace['stateReason'] = str(error)
-                continue
-
-            attempt = 0
-            retries = 2
-            # do some retries with the same PFN if the download fails
-            while not success and attempt < retries:
-                attempt += 1
-                item['attemptnr'] = attempt
-
-                if os.path.isfile(temp_file_path):
-                    logger.debug('%sDeleting existing temporary file: %s' % (log_prefix, temp_file_path))
-                    os.unlink(temp_file_path)
-
-                start_time = time.time()
-
-                try:
-                    protocol.get(pfn, temp_file_path, transfer_timeout=item.get('merged_options', {}).get('transfer_timeout'))
-                    success = True
-                except Exception as error:
-                    logger.debug(error)
-                    trace['clientState'] = str(type(error).__name__)
-                    trace['stateReason'] = str(error)
-
-                end_time = time.time()
-
-                if success and not item.get('merged_options', {}).get('ignore_checksum', False):
-                    verified, rucio_checksum, local_checksum = _verify_checksum(item, temp_file_path)
-                    if not verified:
-                        success = False
-                        os.unlink(temp_file_path)
-                        logger.warning('%sChecksum validation failed for file: %s' % (log_prefix, did_str))
-                        logger.debug('Local checksum: %s, Rucio checksum: %s' % (local_checksum, rucio_checksum))
-                        trace['clientState'] = 'FAIL_VALIDATE'
-                        trace['stateReason'] = 'Checksum validation failed: Local checksum: %s, Rucio checksum: %s' % (local_checksum, rucio_checksum)
-                if not success:
-                    logger.warning('%sDownload attempt failed. Try %s/%s' % (log_prefix, attempt, retries))
-                    self._send_trace(trace)
-
-            protocol.close()
-
-        if not success:
+        sources = sorted(sources, key=lambda source: self.endpoint_limiter.is_full(_get_endpoint(source['pfn'])))
+        hedged = self.hedge_delay is not None and len(sources) > 1
+        source_traces = [copy.deepcopy(trace) for _ in sources]
+        started = []
+
+        def download_source(index):
+            # with hedging, the replicas can be downloaded in parallel, each one into its own file
+            path = '%s.%d' % (temp_file_path, index) if hedged else temp_file_path
+
+            def attempt(cancel):
+                started.append(index)
+                return self._download_source(item, sources[index], path, source_traces[index], cancel, log_prefix)
+            return attempt
+
+        def discard(result):
+            if os.path.isfile(result['path']):
+                os.unlink(result['path'])
+
+        result = run_hedged([download_source(index) for index in range(len(sources))], self.hedge_delay if hedged else None, discard=discard)
+        if result:
+            trace.update(result['trace'])
+        elif started:
+            trace.update(source_traces[started[-1]])
+
+        if not result:
             logger.error('%sFailed to download file %s' % (log_prefix, did_str))
             item['clientState'] = 'FAILED'
             return item
 
+        pfn = result['pfn']
+        start_time = result['start_time']
+        end_time = result['end_time']
+
         dest_file_path_iter = iter(dest_file_paths)
         first_dest_file_path = next(dest_file_path_iter)
-        logger.debug("renaming '%s' to '%s'" % (temp_file_path, first_dest_file_path))
-        os.rename(temp_file_path, first_dest_file_path)
+        logger.debug("renaming '%s' to '%s'" % (result['path'], first_dest_file_path))
+        os.rename(result['path'], first_dest_file_path)
 
         # if the file was downloaded with success, it can be linked to pcache
         if pcache:
@@ -658,6 +709,117 @@ class DownloadClient:
 
         return item
 
+    def _download_source(self, item, source, temp_file_path, trace, cancel, log_prefix=''):
+        """
+        Downloads the given item from one of its sources, with retries, and verifies its checksum.
+        The download is done with range requests if the protocol supports them.
+        (This function is meant to be used as class internal only)
+
+        :param item: dictionary that describes the item to download
+        :param source: dictionary that describes the source, with the pfn and the rse
+        :param temp_file_path: path of the file to download into
+        :param trace: dictionary representing the trace of the attempts from this source
+        :param cancel: threading.Event set when the download is not needed anymore
+        :param log_prefix: string that will be put at the beginning of every log message
+
+        :returns: dictionary with the path, pfn, start_time, end_time and trace of the download, or None if it failed
+        """
+        logger = self.logger
+        did_str = '%s:%s' % (item['scope'], item['name'])
+        pfn = source['pfn']
+        rse_name = source['rse']
+        scheme = pfn.split(':')[0]
+
+        try:
+            rse = rsemgr.get_rse_info(rse_name)
+        except RucioException as error:
+            logger.warning('%sCould not get info of RSE %s: %s' % (log_prefix, rse_name, error))
+            trace['stateReason'] = str(error)
+            return None
+
+        trace['remoteSite'] = rse_name
+        trace['clientState'] = 'DOWNLOAD_ATTEMPT'
+        trace['protocol'] = scheme
+
+        logger.info('%sTrying to download with %s from %s: %s ' % (log_prefix, scheme, rse_name, did_str))
+
+        try:
+            protocol = rsemgr.create_protocol(rse, operation='read', scheme=scheme)
+            protocol.connect()
+        except Exception as error:
+            logger.warning('%sFailed to create protocol for PFN: %s' % (log_prefix, pfn))
+            logger.debug('scheme: %s, exception: %s' % (scheme, error))
+            trace['stateReason'] = str(error)
+            return None
+
+        ignore_checksum = item.get('merged_options', {}).get('ignore_checksum', False)
+        checksum_name = None if ignore_checksum else _get_checksum_name(item)
+        success = False
+        attempt = 0
+        retries = 2
+        # do some retries with the same PFN if the download fails
+        while not success and attempt < retries and not cancel.is_set():
+            attempt += 1
+            item['attemptnr'] = attempt
+
+            if os.path.isfile(temp_file_path):
+                logger.debug('%sDeleting existing temporary file: %s' % (log_prefix, temp_file_path))
+                os.unlink(temp_file_path)
+
+            if self.bandwidth_budget:
+                wait_time = self.bandwidth_budget.reserve(item.get('bytes'))
+                if wait_time > 0:
+                    logger.debug('%sWaiting %.2f seconds for the bandwidth budget' % (log_prefix, wait_time))
+                    time.sleep(wait_time)
+
+            endpoint = _get_endpoint(pfn)
+            self.endpoint_limiter.acquire(endpoint)
+            start_time = time.time()
+
+            local_checksums = None
+            try:
+                if hasattr(protocol, 'iter_range') and item.get('bytes') is not None:
+                    # only adler32 can be combined over the parts of a file downloaded in parallel
+                    streams = self.range_streams if checksum_name in (None, 'adler32') else 1
+                    try:
+                        local_checksums = download_ranged(protocol, pfn, temp_file_path, item['bytes'], [checksum_name] if checksum_name else [],
+                                                          streams=streams, cancel=cancel)
+                    except RangeNotSupported:
+                        logger.debug('%sStorage does not support range requests, downloading %s in one go' % (log_prefix, pfn))
+                        protocol.get(pfn, temp_file_path, transfer_timeout=item.get('merged_options', {}).get('transfer_timeout'))
+                else:
+                    protocol.get(pfn, temp_file_path, transfer_timeout=item.get('merged_options', {}).get('transfer_timeout'))
+                success = True
+            except Exception as error:
+                logger.debug(error)
+                trace['clientState'] = str(type(error).__name__)
+                trace['stateReason'] = str(error)
+            finally:
+                self.endpoint_limiter.release(endpoint)
+
+            end_time = time.time()
+
+            if success and not ignore_checksum:
+                verified, rucio_checksum, local_checksum = _verify_checksum(item, temp_file_path, local_checksums)
+                if not verified:
+                    success = False
+                    os.unlink(temp_file_path)
+                    logger.warning('%sChecksum validation failed for file: %s' % (log_prefix, did_str))
+                    logger.debug('Local checksum: %s, Rucio checksum: %s' % (local_checksum, rucio_checksum))
+                    trace['clientState'] = 'FAIL_VALIDATE'
+                    trace['stateReason'] = 'Checksum validation failed: Local checksum: %s, Rucio checksum: %s' % (local_checksum, rucio_checksum)
+            if not success and not cancel.is_set():
+                logger.warning('%sDownload attempt failed. Try %s/%s' % (log_prefix, attempt, retries))
+                self._send_trace(trace)
+
+        protocol.close()
+
+        if not success:
+            if os.path.isfile(temp_file_path):
+                os.unlink(temp_file_path)
+            return None
+        return {'path': temp_file_path, 'pfn': pfn, 'start_time': start_time, 'end_time': end_time, 'trace': trace}
+
     def download_aria2c(self, items, trace_custom_fields={}, filters={}):
         """
         Uses aria2c to download the items with given DIDs. This function can also download datasets and wildcarded DIDs.
@@ -1446,20 +1608,210 @@ class DownloadClient:
             send_trace(trace, self.client.host, self.client.user_agent)
 
 
-def _verify_checksum(item, path):
-    rucio_checksum = item.get(PREFERRED_CHECKSUM)
-    local_checksum = None
-    checksum_algo = CHECKSUM_ALGO_DICT.get(PREFERRED_CHECKSUM)
+def _get_endpoint(pfn):
+    """
+    Returns the storage endpoint of a PFN, i.e. its hostname and port.
+
+    :param pfn: the PFN
+    """
+    return urlparse(pfn).netloc
+
+
+def _get_checksum_name(item):
+    """
+    Returns the name of the checksum used to verify a downloaded file, the preferred one if the item has it.
+
+    :param item: dictionary that describes the item to download
+    """
+    for checksum_name in [PREFERRED_CHECKSUM] + GLOBALLY_SUPPORTED_CHECKSUMS:
+        if item.get(checksum_name) and CHECKSUM_ALGO_DICT.get(checksum_name):
+            return checksum_name
+    return None
+
+
+def _verify_checksum(item, path, local_checksums=None):
+    """
+    Verifies the checksum of a downloaded file.
+
+    :param item: dictionary that describes the downloaded item
+    :param path: path of the downloaded file
+    :param local_checksums: Optional: dictionary {checksum_name: checksum} already computed during the download
 
-    if rucio_checksum and checksum_algo:
-        local_checksum = checksum_algo(path)
-        return rucio_checksum == local_checksum, rucio_checksum, local_checksum
+    :returns: tuple with True if the checksum is valid, the checksum known by rucio and the local checksum
+    """
+    checksum_name = _get_checksum_name(item)
+    if not checksum_name:
+        return False, None, None
 
-    for checksum_name in GLOBALLY_SUPPORTED_CHECKSUMS:
-        rucio_checksum = item.get(checksum_name)
-        checksum_algo = CHECKSUM_ALGO_DICT.get(checksum_name)
-        if rucio_checksum and checksum_algo:
-            local_checksum = checksum_algo(path)
-            return rucio_checksum == local_checksum, rucio_checksum, local_checksum
+    rucio_checksum = item.get(checksum_name)
+    local_checksum = (local_checksums or {}).get(checksum_name)
+    if local_checksum is None:
+        local_checksum = CHECKSUM_ALGO_DICT[checksum_name](path)
+    return rucio_checksum == local_checksum, rucio_checksum, local_checksum
 
-    return False, None, None
+
+def run_hedged(attempts, hedge_delay=None, discard=None):
+    """
+    Runs the attempts in their order until one succeeds. The next attempt is started when the
+    previous one failed, or, with a hedge_delay, when it did not finish within hedge_delay seconds,
+    so that both run in parallel. The attempts still running when one succeeds are cancelled.
+
+    :param attempts: list of callables taking a threading.Event, set once the attempt is not needed anymore,
+                     and returning a result which evaluates to False if the attempt failed
+    :param hedge_delay: seconds after which the next attempt is started in parallel. If None, the attempts are run one after the other.
+    :param discard: Optional: callable receiving the results of the attempts which succeeded after the first one
+
+    :returns: the result of the first successful attempt, or None if all of them failed
+    """
+    cancel = Event()
+    if hedge_delay is None:
+        for attempt in attempts:
+            result = attempt(cancel)
+            if result:
+                return result
+        return None
+
+    results = Queue()
+    lock = Lock()
+    state = {'won': False}
+
+    def run(attempt):
+        result = None
+        try:
+            result = attempt(cancel)
+        finally:
+            with lock:
+                if result and state['won']:
+                    if discard:
+                        discard(result)
+                    result = None
+                elif result:
+                    state['won'] = True
+            results.put(result)
+
+    def start(attempt):
+        thread = Thread(target=run, args=(attempt, ))
+        thread.daemon = True
+        thread.start()
+
+    start(attempts[0])
+    started, running = 1, 1
+    while running:
+        try:
+            result = results.get(timeout=hedge_delay if started < len(attempts) else None)
+        except Empty:
+            # the running attempts are too slow, hedge with the next one
+            start(attempts[started])
+            started, running = started + 1, running + 1
+            continue
+        running -= 1
+        if result:
+            cancel.set()
+            return result
+        if started < len(attempts):
+            start(attempts[started])
+            started, running = started + 1, running + 1
+    return None
+
+
+def download_ranged(protocol, pfn, path, size, checksum_names=None, streams=1, chunk_size=RANGE_CHUNK_SIZE, retries=2, cancel=None):
+    """
+    Downloads a file with range requests, computing its checksums on the fly. Large files are split
+    into parts downloaded in parallel, which is only possible if adler32 is the only checksum to compute.
+    A part which fails is requested again from the last byte received, at most retries times.
+    If the storage ignores the range requests, the file is downloaded again as a single stream from the first byte.
+
+    :param protocol: the connected protocol, implementing iter_range
+    :param pfn: the PFN of the file
+    :param path: path of the file to download into
+    :param size: size of the file in bytes
+    :param checksum_names: list of the checksums to compute
+    :param streams: maximum number of parts downloaded in parallel
+    :param chunk_size: size of the chunks read from the storage
+    :param retries: number of times the download of a part is resumed after an error
+    :param cancel: Optional: threading.Event set when the download is not needed anymore
+
+    :returns: dictionary {checksum_name: checksum}
+    """
+    checksum_names = checksum_names or []
+    if set(checksum_names) - set(['adler32']):
+        streams = 1
+    streams = max(1, min(streams, size // RANGE_MIN_PART_SIZE))
+    part_size = -(-size // streams) if size else 0
+    parts = [(start, min(start + part_size, size)) for start in range(0, size, part_size)] if size else [(0, 0)]
+    part_checksums = [None] * len(parts)
+    errors = []
+    abort = Event()
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+    def download_part(index):
+        start, end = parts[index]
+        algorithms = dict((checksum_name, CHECKSUM_FACTORY_DICT[checksum_name]()) for checksum_name in checksum_names)
+        offset, failures = start, 0
+        try:
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                while offset < end:
+                    if (cancel is not None and cancel.is_set()) or abort.is_set():
+                        raise RucioException('Download of %s cancelled' % pfn)
+                    progress = offset
+                    try:
+                        for chunk in protocol.iter_range(pfn, offset, end - 1, chunk_size):
+                            chunk = chunk[:end - offset]
+                            f.write(chunk)
+                            for algorithm in algorithms.values():
+                                algorithm.update(chunk)
+                            offset += len(chunk)
+                            if offset >= end or (cancel is not None and cancel.is_set()) or abort.is_set():
+                                break
+                    except RangeNotSupported:
+                        if start > 0:
+                            raise
+                        # The storage only sends the whole file, so the part starts over from the first byte
+                        failures += 1
+                        if failures > retries:
+                            raise
+                        algorithms = dict((checksum_name, CHECKSUM_FACTORY_DICT[checksum_name]()) for checksum_name in checksum_names)
+                        offset = start
+                        f.seek(start)
+                        continue
+                    except Exception:
+                        failures += 1
+                        if failures > retries:
+                            raise
+                        continue
+                    if offset < end and offset == progress:
+                        raise RucioException('Could not read bytes %d-%d of %s' % (offset, end - 1, pfn))
+            part_checksums[index] = algorithms
+        except Exception as error:
+            abort.set()
+            errors.append(error)
+
+    if len(parts) == 1:
+        download_part(0)
+    else:
+        threads = [Thread(target=download_part, args=(index, )) for index in range(len(parts))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if any(isinstance(error, RangeNotSupported) for error in errors) and not (cancel is not None and cancel.is_set()):
+            # Download the whole file as a single stream instead
+            parts, part_checksums, errors = [(0, size)], [None], []
+            abort.clear()
+            download_part(0)
+    if errors:
+        raise errors[0]
+
+    local_checksums = {}
+    for checksum_name in checksum_names:
+        if len(parts) == 1:
+            local_checksums[checksum_name] = part_checksums[0][checksum_name].hexdigest()
+        else:
+            value = part_checksums[0][checksum_name].value
+            for (start, end), algorithms in zip(parts[1:], part_checksums[1:]):
+                value = adler32_combine(value, algorithms[checksum_name].value, end - start)
+            local_checksums[checksum_name] = '%08x' % (value & 0xffffffff)
+    return local_checksums
@@ -33,11 +33,18 @@ import socket
 import logging
 import time
 
+try:
+    from Queue import Queue, Empty, deque
+except ImportError:
+    from queue import Queue, Empty, deque
+from threading import Thread
+
 from rucio.client.client import Client
+from rucio.common.config import config_get_int
 from rucio.common.exception import (RucioException, RSEBlacklisted, DataIdentifierAlreadyExists,
                                     DataIdentifierNotFound, NoFilesUploaded, NotAllFilesUploaded,
                                     ResourceTemporaryUnavailable, ServiceUnavailable, InputValidationError)
-from rucio.common.utils import adler32, execute, generate_uuid, md5, send_trace, GLOBALLY_SUPPORTED_CHECKSUMS
+from rucio.common.utils import bulk_checksums, chunks, execute, generate_uuid, send_trace, GLOBALLY_SUPPORTED_CHECKSUMS
 from rucio.rse import rsemanager as rsemgr
 from rucio import version
 
@@ -69,7 +76,7 @@ class UploadClient:
         self.trace['eventType'] = 'upload'
         self.trace['eventVersion'] = version.RUCIO_VERSION[0]
 
-    def upload(self, items, summary_file_path=None, traces_copy_out=None):
+    def upload(self, items, summary_file_path=None, traces_copy_out=None, num_threads=None, bulk_size=None):
         """
         :param items: List of dictionaries. Each dictionary describing a file to upload. Keys:
             path                  - path of the file that will be uploaded
@@ -87,6 +94,9 @@ class UploadClient:
             guid                  - Optional: guid of the file
         :param summary_file_path: Optional: a path where a summary in form of a json file will be stored
         :param traces_copy_out: reference to an external list, where the traces should be uploaded
+        :param num_threads: Optional: number of threads uploading in parallel. With more than one thread the files
+                            are registered in bulk (Default: upload.num_threads or 1)
+        :param bulk_size: Optional: number of files per registration call in parallel mode (Default: upload.bulk_size or 100)
 
         :returns: 0 on success
 
@@ -129,124 +139,38 @@ class UploadClient:
 
         # clear this set again to ensure that we only try to register datasets once
         registered_dataset_dids = set()
-        num_succeeded = 0
-        summary = []
-
-        for file in files:
-            basename = file['basename']
-            logger.info('Preparing upload for file %s' % basename)
-
-            no_register = file.get('no_register')
-            register_after_upload = file.get('register_after_upload') and not no_register
-            pfn = file.get('pfn')
-            force_scheme = file.get('force_scheme')
-            delete_existing = False
-
-            trace = copy.deepcopy(self.trace)
-            # appending trace to list reference, if the reference exists
-            if traces_copy_out is not None:
-                traces_copy_out.append(trace)
-
-            trace['scope'] = file['did_scope']
-            trace['datasetScope'] = file.get('dataset_scope', '')
-            trace['dataset'] = file.get('dataset_name', '')
-            trace['remoteSite'] = rse
-            trace['filesize'] = file['bytes']
-
-            file_did = {'scope': file['did_scope'], 'name': file['did_name']}
-            dataset_did_str = file.get('dataset_did_str')
-
-            rse = file['rse']
-            rse_settings = self.rses[rse]
-            rse_sign_service = rse_settings.get('sign_url', None)
-            is_deterministic = rse_settings.get('deterministic', True)
-            if not is_deterministic and not pfn:
-                logger.error('PFN has to be defined for NON-DETERMINISTIC RSE.')
-                continue
-            if pfn and is_deterministic:
-                logger.warning('Upload with given pfn implies that no_register is True, except non-deterministic RSEs')
-                no_register = True
 
-            if not no_register and not register_after_upload:
-                self._register_file(file, registered_dataset_dids)
+        if num_threads is None:
+            num_threads = config_get_int('upload', 'num_threads', False, 1)
+        if bulk_size is None:
+            bulk_size = config_get_int('upload', 'bulk_size', False, 100)
 
-            # if register_after_upload, file should be overwritten if it is not registered
-            # otherwise if file already exists on RSE we're done
-            if register_after_upload:
-                if rsemgr.exists(rse_settings, pfn if pfn else file_did):
-                    try:
-                        self.client.get_did(file['did_scope'], file['did_name'])
-                        logger.info('File already registered. Skipping upload.')
-                        trace['stateReason'] = 'File already exists'
-                        continue
-                    except DataIdentifierNotFound:
-                        logger.info('File already exists on RSE. Previous left overs will be overwritten.')
-                        delete_existing = True
-            elif not is_deterministic and not no_register:
-                if rsemgr.exists(rse_settings, pfn):
-                    logger.info('File already exists on RSE with given pfn. Skipping upload. Existing replica has to be removed first.')
-                    trace['stateReason'] = 'File already exists'
-                    continue
-                elif rsemgr.exists(rse_settings, file_did):
-                    logger.info('File already exists on RSE with different pfn. Skipping upload.')
-                    trace['stateReason'] = 'File already exists'
-                    continue
-            else:
-                if rsemgr.exists(rse_settings, pfn if pfn else file_did):
-                    logger.info('File already exists on RSE. Skipping upload')
-                    trace['stateReason'] = 'File already exists'
+        if num_threads > 1:
+            uploaded_files = self._upload_pipelined(files, num_threads, bulk_size, registered_dataset_dids, traces_copy_out)
+        else:
+            uploaded_files = []
+            for file in files:
+                logger.info('Preparing upload for file %s' % file['basename'])
+                if not self._check_rse_settings(file):
                     continue
-            protocols = rsemgr.get_protocols_ordered(rse_settings=rse_settings, operation='write', scheme=force_scheme)
-            protocols.reverse()
-            success = False
-            state_reason = ''
-            while not success and len(protocols):
-                protocol = protocols.pop()
-                cur_scheme = protocol['scheme']
-                logger.info('Trying upload with %s to %s' % (cur_scheme, rse))
-                lfn = {}
-                lfn['filename'] = basename
-                lfn['scope'] = file['did_scope']
-                lfn['name'] = file['did_name']
 
-                for checksum_name in GLOBALLY_SUPPORTED_CHECKSUMS:
-                    if checksum_name in file:
-                        lfn[checksum_name] = file[checksum_name]
+                no_register = file.get('no_register')
+                register_after_upload = file.get('register_after_upload') and not no_register
+                dataset_did_str = file.get('dataset_did_str')
+                file_did = {'scope': file['did_scope'], 'name': file['did_name']}
+                rse = file['rse']
 
-                lfn['filesize'] = file['bytes']
+                trace = copy.deepcopy(self.trace)
+                # appending trace to list reference, if the reference exists
+                if traces_copy_out is not None:
+                    traces_copy_out.append(trace)
 
-                sign_service = None
-                if cur_scheme == 'https':
-                    sign_service = rse_sign_service
+                if not no_register and not register_after_upload:
+                    self._register_file(file, registered_dataset_dids)
 
-                trace['protocol'] = cur_scheme
-                trace['transferStart'] = time.time()
-                try:
-                    state = rsemgr.upload(rse_settings=rse_settings,
-                                          lfns=lfn,
-                                          source_dir=file['dirname'],
-                                          force_scheme=cur_scheme,
-                                          force_pfn=pfn,
-                                          transfer_timeout=file.get('transfer_timeout'),
-                                          delete_existing=delete_existing,
-                                          sign_service=sign_service)
-                    success = state['success']
-                    file['upload_result'] = state
-                except (ServiceUnavailable, ResourceTemporaryUnavailable) as error:
-                    logger.warning('Upload attempt failed')
-                    logger.debug('Exception: %s' % str(error))
-                    state_reason = str(error)
-
-            if success:
-                num_succeeded += 1
-                trace['transferEnd'] = time.time()
-                trace['clientState'] = 'DONE'
-                file['state'] = 'A'
-                logger.info('Successfully uploaded file %s' % basename)
-                self._send_trace(trace)
-
-                if summary_file_path:
-                    summary.append(copy.deepcopy(file))
+                if not self._upload_file(file, trace):
+                    continue
+                uploaded_files.append(file)
 
                 if not no_register:
                     if register_after_upload:
@@ -262,11 +186,9 @@ class UploadClient:
                     except Exception as error:
                         logger.warning('Failed to attach file to the dataset')
                         logger.debug(error)
-            else:
-                trace['clientState'] = 'FAILED'
-                trace['stateReason'] = state_reason
-                self._send_trace(trace)
-                logger.error('Failed to upload file %s' % basename)
+
+        num_succeeded = len(uploaded_files)
+        summary = [copy.deepcopy(file) for file in uploaded_files] if summary_file_path else []
 
         if summary_file_path:
             final_summary = {}
@@ -294,23 +216,262 @@ class UploadClient:
             raise NotAllFilesUploaded()
         return 0
 
-    def _register_file(self, file, registered_dataset_dids):
+    def _check_rse_settings(self, file):
         """
-        Registers the given file in Rucio. Creates a dataset if
-        needed. Registers the file DID and creates the replication
-        rule if needed. Adds a replica to the file did.
+        Checks if the file can be uploaded to its RSE with the given options and
+        sets no_register if a PFN is given for a deterministic RSE
         (This function is meant to be used as class internal only)
 
         :param file: dictionary describing the file
-        :param registered_dataset_dids: set of dataset dids that were already registered
 
-        :raises DataIdentifierAlreadyExists: if file DID is already registered and the checksums do not match
+        :returns: False if the file cannot be uploaded, True otherwise
         """
         logger = self.logger
-        logger.debug('Registering file')
+        rse_settings = self.rses[file['rse']]
+        is_deterministic = rse_settings.get('deterministic', True)
+        if not is_deterministic and not file.get('pfn'):
+            logger.error('PFN has to be defined for NON-DETERMINISTIC RSE.')
+            return False
+        if file.get('pfn') and is_deterministic:
+            logger.warning('Upload with given pfn implies that no_register is True, except non-deterministic RSEs')
+            file['no_register'] = True
+        return True
+
+    def _upload_file(self, file, trace, log_prefix=''):
+        """
+        Uploads the file to its RSE, trying all available protocols, and sends the trace.
+        Registration of the file is left to the caller.
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file
+        :param trace: dictionary representing the trace that will be send
+        :param log_prefix: string that will be put at the beginning of every log message
+
+        :returns: True if the file was uploaded, False otherwise
+        """
+        logger = self.logger
+        basename = file['basename']
         rse = file['rse']
+        rse_settings = self.rses[rse]
+        rse_sign_service = rse_settings.get('sign_url', None)
+        is_deterministic = rse_settings.get('deterministic', True)
+        no_register = file.get('no_register')
+        register_after_upload = file.get('register_after_upload') and not no_register
+        pfn = file.get('pfn')
+        force_scheme = file.get('force_scheme')
+        delete_existing = False
+        file_did = {'scope': file['did_scope'], 'name': file['did_name']}
+
+        trace['scope'] = file['did_scope']
+        trace['datasetScope'] = file.get('dataset_scope', '')
+        trace['dataset'] = file.get('dataset_name', '')
+        trace['remoteSite'] = rse
+        trace['filesize'] = file['bytes']
+
+        # if register_after_upload, file should be overwritten if it is not registered
+        # otherwise if file already exists on RSE we're done
+        if register_after_upload:
+            if rsemgr.exists(rse_settings, pfn if pfn else file_did):
+                try:
+                    self.client.get_did(file['did_scope'], file['did_name'])
+                    logger.info('%sFile already registered. Skipping upload.' % log_prefix)
+                    trace['stateReason'] = 'File already exists'
+                    return False
+                except DataIdentifierNotFound:
+                    logger.info('%sFile already exists on RSE. Previous left overs will be overwritten.' % log_prefix)
+                    delete_existing = True
+        elif not is_deterministic and not no_register:
+            if rsemgr.exists(rse_settings, pfn):
+                logger.info('%sFile already exists on RSE with given pfn. Skipping upload. Existing replica has to be removed first.' % log_prefix)
+                trace['stateReason'] = 'File already exists'
+                return False
+            elif rsemgr.exists(rse_settings, file_did):
+                logger.info('%sFile already exists on RSE with different pfn. Skipping upload.' % log_prefix)
+                trace['stateReason'] = 'File already exists'
+                return False
+        else:
+            if rsemgr.exists(rse_settings, pfn if pfn else file_did):
+                logger.info('%sFile already exists on RSE. Skipping upload' % log_prefix)
+                trace['stateReason'] = 'File already exists'
+                return False
+        protocols = rsemgr.get_protocols_ordered(rse_settings=rse_settings, operation='write', scheme=force_scheme)
+        protocols.reverse()
+        success = False
+        state_reason = ''
+        while not success and len(protocols):
+            protocol = protocols.pop()
+            cur_scheme = protocol['scheme']
+            logger.info('%sTrying upload with %s to %s' % (log_prefix, cur_scheme, rse))
+            lfn = {}
+            lfn['filename'] = basename
+            lfn['scope'] = file['did_scope']
+            lfn['name'] = file['did_name']
+
+            for checksum_name in GLOBALLY_SUPPORTED_CHECKSUMS:
+                if checksum_name in file:
+                    lfn[checksum_name] = file[checksum_name]
+
+            lfn['filesize'] = file['bytes']
+
+            sign_service = None
+            if cur_scheme == 'https':
+                sign_service = rse_sign_service
+
+            trace['protocol'] = cur_scheme
+            trace['transferStart'] = time.time()
+            try:
+                state = rsemgr.upload(rse_settings=rse_settings,
+                                      lfns=lfn,
+                                      source_dir=file['dirname'],
+                                      force_scheme=cur_scheme,
+                                      force_pfn=pfn,
+                                      transfer_timeout=file.get('transfer_timeout'),
+                                      delete_existing=delete_existing,
+                                      sign_service=sign_service)
+                success = state['success']
+                file['upload_result'] = state
+            except (ServiceUnavailable, ResourceTemporaryUnavailable) as error:
+                logger.warning('%sUpload attempt failed' % log_prefix)
+                logger.debug('Exception: %s' % str(error))
+                state_reason = str(error)
+
+        if success:
+            trace['transferEnd'] = time.time()
+            trace['clientState'] = 'DONE'
+            file['state'] = 'A'
+            logger.info('%sSuccessfully uploaded file %s' % (log_prefix, basename))
+            self._send_trace(trace)
+        else:
+            trace['clientState'] = 'FAILED'
+            trace['stateReason'] = state_reason
+            self._send_trace(trace)
+            logger.error('%sFailed to upload file %s' % (log_prefix, basename))
+        return success
+
+    def _upload_pipelined(self, files, num_threads, bulk_size, registered_dataset_dids, traces_copy_out):
+        """
+        Registers the files in bulk, uploads them with a pool of threads and
+        finally updates the replica states and attaches the files to their
+        datasets in bulk.
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the files to upload
+        :param num_threads: number of threads uploading in parallel
+        :param bulk_size: maximum number of files per registration call
+        :param registered_dataset_dids: set of dataset dids that were already registered
+        :param traces_copy_out: reference to an external list, where the traces should be uploaded
+
+        :returns: list of the successfully uploaded files
+        """
+        logger = self.logger
+
+        files = [file for file in files if self._check_rse_settings(file)]
+        if not files:
+            return []
+
+        # files without register_after_upload are registered with state C before the upload
+        self._register_files_bulk([file for file in files if not file.get('no_register') and not file.get('register_after_upload')],
+                                  registered_dataset_dids, bulk_size)
+
+        input_queue = Queue()
+        output_queue = Queue()
+        input_queue.queue = deque(files)
+
+        num_threads = min(num_threads, len(files))
+        logger.info('Using %d threads to upload %d files' % (num_threads, len(files)))
+        threads = []
+        for thread_num in range(1, num_threads + 1):
+            kwargs = {'input_queue': input_queue,
+                      'output_queue': output_queue,
+                      'traces_copy_out': traces_copy_out,
+                      'log_prefix': 'Thread %s/%s: ' % (thread_num, num_threads)}
+            try:
+                thread = Thread(target=self._upload_worker, kwargs=kwargs)
+                thread.start()
+                threads.append(thread)
+            except Exception as error:
+                logger.warning('Failed to start thread %d' % thread_num)
+                logger.debug(error)
+
+        logger.debug('Waiting for threads to finish')
+        for thread in threads:
+            thread.join()
+
+        uploaded_files = list(output_queue.queue)
+        registered_files = [file for file in uploaded_files if not file.get('no_register')]
+        self._register_files_bulk([file for file in registered_files if file.get('register_after_upload')],
+                                  registered_dataset_dids, bulk_size)
+
+        replicas_per_rse = {}
+        files_per_dataset = {}
+        for file in registered_files:
+            replicas_per_rse.setdefault(file['rse'], []).append(self._convert_file_for_api(file))
+            if file.get('dataset_did_str'):
+                files_per_dataset.setdefault((file['dataset_scope'], file['dataset_name']), []).append({'scope': file['did_scope'],
+                                                                                                        'name': file['did_name']})
+
+        for rse, replicas in replicas_per_rse.items():
+            if not self.client.update_replicas_states(rse, files=replicas):
+                logger.warning('Failed to update replica states at %s' % rse)
+
+        for (dataset_scope, dataset_name), file_dids in files_per_dataset.items():
+            for chunk in chunks(file_dids, bulk_size):
+                try:
+                    self.client.attach_dids(dataset_scope, dataset_name, chunk)
+                except Exception as error:
+                    # one of the files may already be attached, fall back to attaching them one by one
+                    logger.debug(error)
+                    for file_did in chunk:
+                        try:
+                            self.client.attach_dids(dataset_scope, dataset_name, [file_did])
+                        except Exception as error:
+                            logger.warning('Failed to attach file %s:%s to the dataset' % (file_did['scope'], file_did['name']))
+                            logger.debug(error)
+
+        return uploaded_files
+
+    def _upload_worker(self, input_queue, output_queue, traces_copy_out, log_prefix):
+        """
+        This function runs as long as there are files in the input queue,
+        uploads them and stores the successfully uploaded ones in the output queue.
+        (This function is meant to be used as class internal only)
+
+        :param input_queue: queue containing the files to upload
+        :param output_queue: queue where the uploaded files will be stored
+        :param traces_copy_out: reference to an external list, where the traces should be uploaded
+        :param log_prefix: string that will be put at the beginning of every log message
+        """
+        logger = self.logger
+
+        logger.debug('%sStart processing queued uploads' % log_prefix)
+        while True:
+            try:
+                file = input_queue.get_nowait()
+            except Empty:
+                break
+            logger.info('%sPreparing upload for file %s' % (log_prefix, file['basename']))
+            trace = copy.deepcopy(self.trace)
+            # appending trace to list reference, if the reference exists
+            if traces_copy_out is not None:
+                traces_copy_out.append(trace)
+            try:
+                if self._upload_file(file, trace, log_prefix):
+                    output_queue.put(file)
+            except Exception as error:
+                logger.error('%sFailed to upload file %s' % (log_prefix, file['basename']))
+                logger.debug(error)
+
+    def _register_dataset(self, file, registered_dataset_dids):
+        """
+        Creates the dataset of the given file, with a replication rule on the RSE of the file,
+        if it was not already created by this client.
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file
+        :param registered_dataset_dids: set of dataset dids that were already registered
+        """
+        logger = self.logger
         dataset_did_str = file.get('dataset_did_str')
-        # register a dataset if we need to
         if dataset_did_str and dataset_did_str not in registered_dataset_dids:
             registered_dataset_dids.add(dataset_did_str)
             try:
@@ -319,7 +480,7 @@ class UploadClient:
                                         name=file['dataset_name'],
                                         rules=[{'account': self.client.account,
                                                 'copies': 1,
-                                                'rse_expression': rse,
+                                                'rse_expression': file['rse'],
                                                 'grouping': 'DATASET',
                                                 'lifetime': file.get('lifetime')}])
                 logger.info('Successfully created dataset %s' % dataset_did_str)
@@ -328,6 +489,74 @@ class UploadClient:
         else:
             logger.debug('Skipping dataset registration')
 
+    def _register_files_bulk(self, files, registered_dataset_dids, bulk_size):
+        """
+        Registers the given files in Rucio like _register_file, but with one
+        list_replicas and one add_replicas call per bulk_size files of a RSE.
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the files
+        :param registered_dataset_dids: set of dataset dids that were already registered
+        :param bulk_size: maximum number of files per call
+
+        :raises DataIdentifierAlreadyExists: if a file DID is already registered and the checksums do not match
+        """
+        logger = self.logger
+        files_per_rse = {}
+        for file in files:
+            self._register_dataset(file, registered_dataset_dids)
+            files_per_rse.setdefault(file['rse'], []).append(file)
+
+        for rse, rse_files in files_per_rse.items():
+            for chunk in chunks(rse_files, bulk_size):
+                logger.debug('Registering %d files at %s' % (len(chunk), rse))
+                file_dids = [{'scope': file['did_scope'], 'name': file['did_name']} for file in chunk]
+                existing_replicas = {}
+                for replica in self.client.list_replicas(file_dids, all_states=True):
+                    existing_replicas['%s:%s' % (replica['scope'], replica['name'])] = replica
+
+                replicas_for_api = []
+                rule_dids = {}
+                for file, file_did in zip(chunk, file_dids):
+                    replica = existing_replicas.get('%s:%s' % (file['did_scope'], file['did_name']))
+                    if replica:
+                        # if the remote checksum is different this did must not be used
+                        if replica['adler32'] != file['adler32']:
+                            logger.error('Local checksum %s does not match remote checksum %s' % (file['adler32'], replica['adler32']))
+                            raise DataIdentifierAlreadyExists
+                        if rse in replica['rses']:
+                            continue
+                    elif not file.get('dataset_did_str'):
+                        # only need to add rules for files if no dataset is given
+                        rule_dids.setdefault(file.get('lifetime'), []).append(file_did)
+                    replicas_for_api.append(self._convert_file_for_api(file))
+
+                if replicas_for_api:
+                    self.client.add_replicas(rse=rse, files=replicas_for_api)
+                    logger.info('Successfully added %d replicas in Rucio catalogue at %s' % (len(replicas_for_api), rse))
+                for lifetime, dids in rule_dids.items():
+                    self.client.add_replication_rule(dids, copies=1, rse_expression=rse, lifetime=lifetime)
+                    logger.info('Successfully added replication rule at %s' % rse)
+
+    def _register_file(self, file, registered_dataset_dids):
+        """
+        Registers the given file in Rucio. Creates a dataset if
+        needed. Registers the file DID and creates the replication
+        rule if needed. Adds a replica to the file did.
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file
+        :param registered_dataset_dids: set of dataset dids that were already registered
+
+        :raises DataIdentifierAlreadyExists: if file DID is already registered and the checksums do not match
+        """
+        logger = self.logger
+        logger.debug('Registering file')
+        rse = file['rse']
+        dataset_did_str = file.get('dataset_did_str')
+        # register a dataset if we need to
+        self._register_dataset(file, registered_dataset_dids)
+
         file_scope = file['did_scope']
         file_name = file['did_name']
         file_did = {'scope': file_scope, 'name': file_name}
@@ -383,7 +612,7 @@ class UploadClient:
             guid = generate_uuid()
         return guid
 
-    def _collect_file_info(self, filepath, item):
+    def _collect_file_info(self, filepath, item, checksums=None):
         """
         Collects infos (e.g. size, checksums, etc.) about the file and
         returns them as a dictionary
@@ -391,17 +620,21 @@ class UploadClient:
 
         :param filepath: path where the file is stored
         :param item: input options for the given file
+        :param checksums: Optional: already computed adler32 and md5 checksums of the file
 
         :returns: a dictionary containing all collected info and the input options
         """
+        if checksums is None:
+            checksums = bulk_checksums([filepath], ['adler32', 'md5'])[0]
+
         new_item = copy.deepcopy(item)
         new_item['path'] = filepath
         new_item['dirname'] = os.path.dirname(filepath)
         new_item['basename'] = os.path.basename(filepath)
 
         new_item['bytes'] = os.stat(filepath).st_size
-        new_item['adler32'] = adler32(filepath)
-        new_item['md5'] = md5(filepath)
+        new_item['adler32'] = checksums['adler32']
+        new_item['md5'] = checksums['md5']
         new_item['meta'] = {'guid': self._get_file_guid(new_item)}
         new_item['state'] = 'C'
         if not new_item.get('did_scope'):
@@ -424,7 +657,7 @@ class UploadClient:
         :raises InputValidationError: if an input option has a wrong format
         """
         logger = self.logger
-        files = []
+        file_paths = []
         for item in items:
             path = item.get('path')
             pfn = item.get('pfn')
@@ -440,21 +673,24 @@ class UploadClient:
             if os.path.isdir(path):
                 dname, subdirs, fnames = next(os.walk(path))
                 for fname in fnames:
-                    file = self._collect_file_info(os.path.join(dname, fname), item)
-                    files.append(file)
+                    file_paths.append((os.path.join(dname, fname), item))
                 if not len(fnames) and not len(subdirs):
                     logger.warning('Skipping %s because it is empty.' % dname)
                 elif not len(fnames):
                     logger.warning('Skipping %s because it has no files in it. Subdirectories are not supported.' % dname)
             elif os.path.isfile(path):
-                file = self._collect_file_info(path, item)
-                files.append(file)
+                file_paths.append((path, item))
             else:
                 logger.warning('No such file or directory: %s' % path)
 
-        if not len(files):
+        if not len(file_paths):
             raise InputValidationError('No valid input files given')
 
+        # checksum all the files at once, large uploads are spread over the available cpus
+        file_checksums = bulk_checksums([filepath for filepath, _ in file_paths], ['adler32', 'md5'],
+                                        processes=config_get_int('upload', 'checksum_processes', False, None))
+        files = [self._collect_file_info(filepath, item, checksums) for (filepath, item), checksums in zip(file_paths, file_checksums)]
+
         return files
 
     def _convert_file_for_api(self, file):
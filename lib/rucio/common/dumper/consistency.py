@@ -11,8 +11,11 @@
 
 from rucio.common import dumper
 from rucio.common.dumper import error, DUMPS_CACHE_DIR, data_models, path_parsing
+from six import PY3
 import datetime
+import heapq
 import logging
+import multiprocessing
 import os
 import re
 import subprocess
@@ -35,9 +38,9 @@ class Consistency(data_models.DataModel):
         logger = logging.getLogger('auditor.consistency')
         if subcommand == 'consistency':
             prev_date_fname = data_models.Replica.download(
-                ddm_endpoint, prev_date)
+                ddm_endpoint, prev_date, cache_dir=cache_dir)
             next_date_fname = data_models.Replica.download(
-                ddm_endpoint, next_date)
+                ddm_endpoint, next_date, cache_dir=cache_dir)
             assert prev_date_fname is not None
             assert next_date_fname is not None
         else:
@@ -78,14 +81,14 @@ class Consistency(data_models.DataModel):
             return '/'.join(relative)
 
         if sort_rucio_replica_dumps:
-            prev_date_fname_sorted = gnu_sort(
+            prev_date_fname_sorted = external_sort(
                 parse_and_filter_file(prev_date_fname, parser=parser, cache_dir=cache_dir),
                 delimiter=',',
                 fieldspec='1',
                 cache_dir=cache_dir,
             )
 
-            next_date_fname_sorted = gnu_sort(
+            next_date_fname_sorted = external_sort(
                 parse_and_filter_file(next_date_fname, parser=parser, cache_dir=cache_dir),
                 delimiter=',',
                 fieldspec='1',
@@ -129,7 +132,7 @@ class Consistency(data_models.DataModel):
                 sd_prefix,
             )
 
-        storage_dump_fname_sorted = gnu_sort(
+        storage_dump_fname_sorted = external_sort(
             parse_and_filter_file(
                 storage_dump,
                 parser=strip_storage_dump,
@@ -140,18 +143,20 @@ class Consistency(data_models.DataModel):
             cache_dir=cache_dir,
         )
 
-        with open(prev_date_fname_sorted) as prevf:
-            with open(next_date_fname_sorted) as nextf:
-                with open(storage_dump_fname_sorted) as sdump:
-                    for path, where, status in compare3(prevf, sdump, nextf):
+        # The dumps are compared as bytes, consistently with the byte order
+        # used to sort them, only the reported paths are decoded.
+        with open(prev_date_fname_sorted, 'rb') as prevf:
+            with open(next_date_fname_sorted, 'rb') as nextf:
+                with open(storage_dump_fname_sorted, 'rb') as sdump:
+                    for path, where, status in compare3(prevf, sdump, nextf, sep=b','):
                         prevstatus, nextstatus = status
 
                         if where[0] and not where[1] and where[2]:
-                            if prevstatus == 'A' and nextstatus == 'A':
-                                yield cls('LOST', path)
+                            if prevstatus == b'A' and nextstatus == b'A':
+                                yield cls('LOST', path.decode('utf-8') if PY3 else path)
 
                         if not where[0] and where[1] and not where[2]:
-                            yield cls('DARK', path)
+                            yield cls('DARK', path.decode('utf-8') if PY3 else path)
 
 
 def _try_to_advance(it, default=None):
@@ -171,11 +176,21 @@ def min3(*values):
     return min(values)
 
 
-def split_if_not_none(value, sep=',', fields=2):
-    return value.split(sep) if value is not None else ([None] * fields)
+def _split_records(iterable, sep):
+    '''
+    Generator splitting each stripped line of `iterable` in a (path, status)
+    tuple on the last occurrence of `sep`. The status is None if there is
+    no `sep` in the line.
+    '''
+    for line in iterable:
+        path, found, status = line.strip().rpartition(sep)
+        if found:
+            yield path, status
+        else:
+            yield status, None
 
 
-def compare3(it0, it1, it2):
+def compare3(it0, it1, it2, sep=','):
     '''
     Generator to compare 3 sorted iterables, in each
     iteration it yields a tuple of the form (current, (bool, bool, bool))
@@ -184,58 +199,53 @@ def compare3(it0, it1, it2):
     a true value if current is contained in the it0, it1 or it2
     respectively.
 
+    The elements of it0 and it2 are records of the form path<sep>status,
+    they are split only once when read. The iterables can contain either
+    strings or bytes, `sep` must be of the same type.
+
     This function can't compare the iterators properly if None is
     a valid value.
     '''
 
-    it0 = iter(it0)
-    it1 = iter(it1)
-    it2 = iter(it2)
-    v0 = _try_to_advance(it0)
-    v1 = _try_to_advance(it1)
-    v2 = _try_to_advance(it2)
-
-    while v0 is not None or v1 is not None or v2 is not None:
-        path0, status0 = split_if_not_none(v0)
-        path2, status2 = split_if_not_none(v2)
-
-        vmin = min3(path0, v1, path2)
-        in0 = in1 = in2 = False
-        in0_status = in2_status = None
+    done = (None, None)
+    it0 = _split_records(it0, sep)
+    it1 = (line.strip() for line in it1)
+    it2 = _split_records(it2, sep)
+    path0, status0 = next(it0, done)
+    v1 = next(it1, None)
+    path2, status2 = next(it2, done)
+
+    while path0 is not None or v1 is not None or path2 is not None:
+        vmin = path0
+        if v1 is not None and (vmin is None or v1 < vmin):
+            vmin = v1
+        if path2 is not None and (vmin is None or path2 < vmin):
+            vmin = path2
 
         # Detect in which iterables the value is present
         #   inN is True if the value is present on the N iterable.
         #   sN  is the status of the path in the rucio replica
         #       dumps (N is either 0 or 2).
-        if path0 is not None and path0 == vmin:
-            in0 = True
-            in0_status = status0
-
-        if v1 is not None and v1 == vmin:
-            in1 = True
-
-        if path2 is not None and path2 == vmin:
-            in2 = True
-            in2_status = status2
+        in0 = path0 is not None and path0 == vmin
+        in1 = v1 is not None and v1 == vmin
+        in2 = path2 is not None and path2 == vmin
 
         # yield the value, in which iterables is present, and the status
         # in each rucio replica dumps (if it is present there, else None).
-        yield (vmin, (in0, in1, in2), (in0_status, in2_status))
+        yield (vmin, (in0, in1, in2), (status0 if in0 else None, status2 if in2 else None))
 
         # Discard duplicate entries (it shouldn't be duplicate entries
         # anyways) and
-        # advance the iterators, if the iterator N is depleted vN is set
-        # to None.
-        while v0 is not None and path0 == vmin:
-            v0 = _try_to_advance(it0)
-            path0, status0 = split_if_not_none(v0)
+        # advance the iterators, if the iterator N is depleted its
+        # value is set to None.
+        while path0 is not None and path0 == vmin:
+            path0, status0 = next(it0, done)
 
         while v1 is not None and v1 == vmin:
-            v1 = _try_to_advance(it1)
+            v1 = next(it1, None)
 
-        while v2 is not None and path2 == vmin:
-            v2 = _try_to_advance(it2)
-            path2, status2 = split_if_not_none(v2)
+        while path2 is not None and path2 == vmin:
+            path2, status2 = next(it2, done)
 
 
 def parse_and_filter_file(filepath, parser=lambda s: s, filter_=lambda s: s, prefix=None, postfix='parsed', cache_dir=DUMPS_CACHE_DIR):
@@ -330,6 +340,166 @@ def gnu_sort(file_path, prefix=None, delimiter=None, fieldspec=None, cache_dir=D
     return sorted_path
 
 
+def _sort_key(delimiter, fieldspec):
+    '''
+    Returns the function giving the sort key of a line (without its end of
+    line), following the semantics of the -t and -k options of GNU sort.
+    Lines with the same key are ordered by the whole line. Returns None if
+    the whole line is the key.
+
+    :param delimiter: Delimiter character (as bytes) or None.
+    :param fieldspec: 'N' to sort from the N-th field to the end of the
+    line or 'N,M' to sort from the N-th to the M-th field.
+    '''
+    if delimiter is None:
+        return None
+    fields = [int(field) for field in fieldspec.split(',')]
+    start = fields[0] - 1
+    end = fields[1] if len(fields) > 1 else None
+    if start == 0 and end is None:
+        return None
+
+    def key(line):
+        return delimiter.join(line.split(delimiter)[start:end]), line
+    return key
+
+
+def _sort_run(args):
+    '''
+    Sort in memory the lines of `file_path` between the offsets `start`
+    and `end`, and write them to the file `run_path`.
+    '''
+    file_path, start, end, delimiter, fieldspec, run_path = args
+    with open(file_path, 'rb') as input_:
+        input_.seek(start)
+        lines = input_.read(end - start).split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    lines.sort(key=_sort_key(delimiter, fieldspec))
+    with open(run_path, 'wb') as output:
+        if lines:
+            output.write(b'\n'.join(lines))
+            output.write(b'\n')
+    return run_path
+
+
+def _merge_runs(run_paths, output, key=None):
+    '''
+    k-way merge of the sorted files in `run_paths` into the file object `output`.
+    '''
+    inputs = [open(run_path, 'rb') for run_path in run_paths]
+    try:
+        heap = []
+        for index, input_ in enumerate(inputs):
+            line = input_.readline()
+            if line:
+                heap.append((key(line[:-1]) if key else line[:-1], index, line))
+        heapq.heapify(heap)
+        while heap:
+            _, index, line = heap[0]
+            output.write(line)
+            line = inputs[index].readline()
+            if line:
+                heapq.heapreplace(heap, (key(line[:-1]) if key else line[:-1], index, line))
+            else:
+                heapq.heappop(heap)
+    finally:
+        for input_ in inputs:
+            input_.close()
+
+
+def external_sort(file_path, prefix=None, delimiter=None, fieldspec=None, cache_dir=DUMPS_CACHE_DIR,
+                  buffer_size=256 * 1024 ** 2, processes=None, max_merge=64):
+    '''
+    Sort the file with path `file_path` with an external merge sort, the
+    original file is unchanged, the output file is saved with path
+    <cache_dir>/<prefix>_sorted.
+
+    The file is split in runs of `buffer_size` / `processes` bytes which are
+    sorted in parallel and then merged. Lines are compared byte by byte, as
+    GNU sort does with LC_ALL=C, so the output is the same as `gnu_sort`.
+
+    :param prefix: If given the output file will be named <prefix>_sorted.
+    Otherwise the prefix is the name of the input file.
+    :param delimiter: Delimiter character if the data is formated in
+    columns (as the argument of -t in the sort command).
+    :param fieldspec: String with the specification of column or columns
+    to be used to sort (as the argument -k in the sort command).
+    :param cachedir: Working dir where the output and run files will be placed.
+    :param buffer_size: Approximate number of bytes of the file sorted in
+    memory at once, over all the processes.
+    :param processes: Number of processes sorting runs, by default the number
+    of cores.
+    :param max_merge: Maximum number of runs merged at once.
+    '''
+    assert (delimiter is None and fieldspec is None) or (delimiter is not None and fieldspec is not None)
+    if delimiter is not None and not isinstance(delimiter, bytes):
+        delimiter = delimiter.encode('utf-8')
+
+    prefix = os.path.basename(file_path) if prefix is None else prefix
+
+    sorted_name = '_'.join((prefix, 'sorted'))
+    sorted_path = os.path.join(cache_dir, sorted_name)
+
+    if os.path.exists(sorted_path):
+        return sorted_path
+
+    processes = processes or multiprocessing.cpu_count()
+    run_size = max(buffer_size // processes, 1)
+
+    # Split the file in runs ending at line boundaries
+    file_size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, 'rb') as input_:
+        while boundaries[-1] < file_size:
+            input_.seek(min(boundaries[-1] + run_size, file_size))
+            input_.readline()
+            boundaries.append(min(input_.tell(), file_size))
+
+    tasks = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        fd, run_path = tempfile.mkstemp(dir=cache_dir)
+        os.close(fd)
+        tasks.append((file_path, start, end, delimiter, fieldspec, run_path))
+
+    run_paths = [task[-1] for task in tasks]
+    try:
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(processes=min(processes, len(tasks)))
+            try:
+                pool.map(_sort_run, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                _sort_run(task)
+
+        key = _sort_key(delimiter, fieldspec)
+        while len(run_paths) > max_merge:
+            merged_paths = []
+            for index in range(0, len(run_paths), max_merge):
+                fd, merged_path = tempfile.mkstemp(dir=cache_dir)
+                with os.fdopen(fd, 'wb') as output:
+                    _merge_runs(run_paths[index:index + max_merge], output, key)
+                for run_path in run_paths[index:index + max_merge]:
+                    os.unlink(run_path)
+                merged_paths.append(merged_path)
+            run_paths = merged_paths
+
+        fd, tpath = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as output:
+            _merge_runs(run_paths, output, key)
+        os.link(tpath, sorted_path)
+        os.unlink(tpath)
+    finally:
+        for run_path in run_paths:
+            if os.path.exists(run_path):
+                os.unlink(run_path)
+
+    return sorted_path
+
+
 def populate_args(argparser):
     # Option to download the rucio replica dumps automaticaly
     parser = argparser.add_parser(
@@ -972,3 +972,13 @@ class NoDistance(RucioException):
         super(NoDistance, self).__init__(*args, **kwargs)
         self._message = 'Cannot found a distance between 2 RSEs'
         self.error_code = 92
+
+
+class RangeNotSupported(RucioException):
+    """
+    The storage ignored a range request and sent the whole file.
+    """
+    def __init__(self, *args, **kwargs):
+        super(RangeNotSupported, self).__init__(*args, **kwargs)
+        self._message = 'The storage does not support range requests.'
+        self.error_code = 93
@@ -38,6 +38,7 @@ import getpass
 import hashlib
 import imp
 import json
+import multiprocessing
 import os
 import os.path
 import re
@@ -49,6 +50,7 @@ import threading
 import time
 import zlib
 
+from collections import OrderedDict
 from logging import getLogger, Formatter
 from logging.handlers import RotatingFileHandler
 from uuid import uuid4 as uuid
@@ -208,6 +210,105 @@ def set_checksum_value(file, checksum_names_list):
                 break
 
 
+CHECKSUM_CHUNK_SIZE = 8 * 1024 ** 2
+BULK_CHECKSUMS_MIN_SIZE = 1024 ** 3
+
+
+class ZlibChecksum(object):
+    """
+    Wraps a zlib running checksum (adler32, crc32) in the update/hexdigest interface of hashlib.
+    """
+
+    def __init__(self, function, value, digest_format):
+        self.function = function
+        self.value = value
+        self.digest_format = digest_format
+
+    def update(self, data):
+        self.value = self.function(data, self.value)
+
+    def hexdigest(self):
+        # backflip on 32bit
+        return str(self.digest_format % (self.value & 0xffffffff))
+
+
+def adler32_combine(adler1, adler2, len2):
+    """
+    Combines the Adler-32 checksums of two consecutive blocks of data, like zlib's adler32_combine.
+
+    :param adler1: Adler-32 checksum of the first block, as an integer
+    :param adler2: Adler-32 checksum of the second block, as an integer
+    :param len2: length in bytes of the second block
+    :returns: the Adler-32 checksum of the concatenation of both blocks, as an integer
+    """
+    base = 65521
+    adler1, adler2 = adler1 & 0xffffffff, adler2 & 0xffffffff
+    rem = len2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % base
+    sum1 += (adler2 & 0xffff) + base - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + base - rem
+    if sum1 >= base:
+        sum1 -= base
+    if sum1 >= base:
+        sum1 -= base
+    if sum2 >= (base << 1):
+        sum2 -= (base << 1)
+    if sum2 >= base:
+        sum2 -= base
+    return sum1 | (sum2 << 16)
+
+
+CHECKSUM_FACTORY_DICT = {'adler32': lambda: ZlibChecksum(zlib.adler32, 1, '%08x'),  # adler starting value is _not_ 0
+                         'md5': hashlib.md5,
+                         'sha256': hashlib.sha256,
+                         'crc32': lambda: ZlibChecksum(zlib.crc32, 0, '%X')}
+
+
+def checksums(file, checksum_names=None):
+    """
+    Computes several checksums of a file in a single pass over its content,
+    read in buffers of CHECKSUM_CHUNK_SIZE bytes.
+
+    :param file: file name
+    :param checksum_names: list of the checksums to compute (Default: GLOBALLY_SUPPORTED_CHECKSUMS)
+    :returns: dictionary {checksum_name: hexadecimal digest}
+    """
+    algorithms = dict((checksum_name, CHECKSUM_FACTORY_DICT[checksum_name]()) for checksum_name in checksum_names or GLOBALLY_SUPPORTED_CHECKSUMS)
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b''):
+            for algorithm in algorithms.values():
+                algorithm.update(chunk)
+    return dict((checksum_name, algorithm.hexdigest()) for checksum_name, algorithm in algorithms.items())
+
+
+def _checksums_worker(args):
+    return checksums(*args)
+
+
+def bulk_checksums(files, checksum_names=None, processes=None, min_size=BULK_CHECKSUMS_MIN_SIZE):
+    """
+    Computes the checksums of several files, distributing the files over a pool of processes
+    when their total size is large enough to pay for starting the pool.
+
+    :param files: list of file names
+    :param checksum_names: list of the checksums to compute (Default: GLOBALLY_SUPPORTED_CHECKSUMS)
+    :param processes: maximum number of processes to use (Default: number of cpus)
+    :param min_size: minimum total size in bytes of the files to use a pool of processes
+    :returns: list of dictionaries {checksum_name: hexadecimal digest}, in the order of files
+    """
+    processes = min(processes or multiprocessing.cpu_count(), len(files))
+    if processes < 2 or sum(os.path.getsize(file) for file in files) < min_size:
+        return [checksums(file, checksum_names) for file in files]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_checksums_worker, [(file, checksum_names) for file in files], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def adler32(file):
     """
     An Adler-32 checksum is obtained by calculating two 16-bit checksums A and B and concatenating their bits into a 32-bit integer. A is the sum of all bytes in the stream plus one, and B is the sum of the individual values of A from each step.
@@ -215,23 +316,11 @@ def adler32(file):
     :param file: file name
     :returns: Hexified string, padded to 8 values.
     """
-
-    # adler starting value is _not_ 0
-    adler = 1
-
     try:
-        with open(file, 'rb') as openFile:
-            for line in openFile:
-                adler = zlib.adler32(line, adler)
+        return checksums(file, ['adler32'])['adler32']
     except Exception as e:
         raise Exception('FATAL - could not get Adler32 checksum of file %s - %s' % (file, e))
 
-    # backflip on 32bit
-    if adler < 0:
-        adler = adler + 2 ** 32
-
-    return str('%08x' % adler)
-
 
 CHECKSUM_ALGO_DICT['adler32'] = adler32
 
@@ -243,15 +332,11 @@ def md5(file):
     :param file: file name
     :returns: string of 32 hexadecimal digits
     """
-    hash_md5 = hashlib.md5()
     try:
-        with open(file, "rb") as f:
-            list(map(hash_md5.update, iter(lambda: f.read(4096), b"")))
+        return checksums(file, ['md5'])['md5']
     except Exception as e:
         raise Exception('FATAL - could not get MD5 checksum of file %s - %s' % (file, e))
 
-    return hash_md5.hexdigest()
-
 
 CHECKSUM_ALGO_DICT['md5'] = md5
 
@@ -261,13 +346,9 @@ def sha256(file):
     Runs the SHA256 algorithm on the binary content of the file named file and returns the hexadecimal digest
 
     :param file: file name
-    :returns: string of 32 hexadecimal digits
+    :returns: string of 64 hexadecimal digits
     """
-    with open(file, "rb") as f:
-        bytes = f.read()  # read entire file as bytes
-        readable_hash = hashlib.sha256(bytes).hexdigest()
-        print(readable_hash)
-        return readable_hash
+    return checksums(file, ['sha256'])['sha256']
 
 
 CHECKSUM_ALGO_DICT['sha256'] = sha256
@@ -278,12 +359,9 @@ def crc32(file):
     Runs the CRC32 algorithm on the binary content of the file named file and returns the hexadecimal digest
 
     :param file: file name
-    :returns: string of 32 hexadecimal digits
+    :returns: string of up to 8 hexadecimal digits
     """
-    prev = 0
-    for eachLine in open(file, "rb"):
-        prev = zlib.crc32(eachLine, prev)
-    return "%X" % (prev & 0xFFFFFFFF)
+    return checksums(file, ['crc32'])['crc32']
 
 
 CHECKSUM_ALGO_DICT['crc32'] = crc32
@@ -463,6 +541,67 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
+class LRUCache(object):
+    """
+    Thread safe in-memory cache keeping the most recently used entries.
+    """
+
+    def __init__(self, maxsize=1000):
+        """
+        :param maxsize: Maximum number of entries kept in the cache.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get an entry of the cache and mark it as the most recently used.
+
+        :param key: The key of the entry.
+        :param default: Value returned if the key is not in the cache.
+        """
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return default
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Set an entry of the cache, evicting the least recently used entry if the cache is full.
+
+        :param key: The key of the entry.
+        :param value: The value of the entry.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove an entry from the cache.
+
+        :param key: The key of the entry.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all the entries of the cache.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
 def my_key_generator(namespace, fn, **kw):
     """
     Customyzed key generator for dogpile
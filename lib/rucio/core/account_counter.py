@@ -15,14 +15,16 @@
 # PY3K COMPATIBLE
 
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import bindparam, text
 
 from rucio.common.exception import CounterNotFound
+from rucio.common.utils import chunks
 import rucio.core.account
 import rucio.core.rse
 
 from rucio.db.sqla import models
-from rucio.db.sqla.session import read_session, transactional_session
+from rucio.db.sqla.session import read_session, transactional_session, read_from_primary
 
 MAX_COUNTERS = 10
 
@@ -110,6 +112,7 @@ def del_counter(rse_id, account, session=None):
 
 
 @read_session
+@read_from_primary
 def get_updated_account_counters(total_workers, worker_number, session=None):
     """
     Get updated rse_counters.
@@ -135,6 +138,43 @@ def get_updated_account_counters(total_workers, worker_number, session=None):
     return query.all()
 
 
+def __consume_updated_account_counters(update_ids, session):
+    """
+    Sum the given updated_account_counters per account and rse_id in the database,
+    add the sums to the account counters and delete the consumed rows.
+
+    :param update_ids:  The ids of the updated_account_counters to consume.
+    :param session:     Database session in use.
+    """
+    deltas = {}
+    for chunk in chunks(update_ids, 1000):
+        query = session.query(models.UpdatedAccountCounter.account,
+                              models.UpdatedAccountCounter.rse_id,
+                              func.sum(models.UpdatedAccountCounter.files),
+                              func.sum(models.UpdatedAccountCounter.bytes)).\
+            filter(models.UpdatedAccountCounter.id.in_(chunk)).\
+            group_by(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id)
+        for account, rse_id, files, bytes in query:
+            sum_files, sum_bytes = deltas.get((account, rse_id), (0, 0))
+            deltas[(account, rse_id)] = (sum_files + files, sum_bytes + bytes)
+
+    new_counters = []
+    for (account, rse_id), (files, bytes) in deltas.items():
+        rowcount = session.query(models.AccountUsage).\
+            filter_by(account=account, rse_id=rse_id).\
+            update({'files': models.AccountUsage.files + files,
+                    'bytes': models.AccountUsage.bytes + bytes}, synchronize_session=False)
+        if not rowcount:
+            new_counters.append({'account': account, 'rse_id': rse_id, 'files': files, 'bytes': bytes})
+    if new_counters:
+        session.bulk_insert_mappings(models.AccountUsage, new_counters)
+
+    for chunk in chunks(update_ids, 1000):
+        session.query(models.UpdatedAccountCounter).\
+            filter(models.UpdatedAccountCounter.id.in_(chunk)).\
+            delete(synchronize_session=False)
+
+
 @transactional_session
 def update_account_counter(account, rse_id, session=None):
     """
@@ -145,20 +185,37 @@ def update_account_counter(account, rse_id, session=None):
     :param session:  Database session in use.
     """
 
-    updated_account_counters = session.query(models.UpdatedAccountCounter).filter_by(account=account, rse_id=rse_id).all()
+    query = session.query(models.UpdatedAccountCounter.id).filter_by(account=account, rse_id=rse_id)
+    __consume_updated_account_counters(update_ids=[update_id for update_id, in query], session=session)
 
-    try:
-        account_counter = session.query(models.AccountUsage).filter_by(account=account, rse_id=rse_id).one()
-        account_counter.bytes += sum([updated_account_counter.bytes for updated_account_counter in updated_account_counters])
-        account_counter.files += sum([updated_account_counter.files for updated_account_counter in updated_account_counters])
-    except NoResultFound:
-        models.AccountUsage(rse_id=rse_id,
-                            account=account,
-                            files=sum([updated_account_counter.files for updated_account_counter in updated_account_counters]),
-                            bytes=sum([updated_account_counter.bytes for updated_account_counter in updated_account_counters])).save(session=session)
 
-    for update in updated_account_counters:
-        update.delete(flush=False, session=session)
+@transactional_session
+def update_account_counters(total_workers, worker_number, limit=10000, session=None):
+    """
+    Read a bounded number of updated_account_counters of this worker, for any account
+    and rse_id, and update the account_counters.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param limit:              Maximum number of updated_account_counters to read.
+    :param session:            Database session in use.
+    :returns:                  The number of updated_account_counters read.
+    """
+    query = session.query(models.UpdatedAccountCounter.id)
+
+    if total_workers > 0:
+        if session.bind.dialect.name == 'oracle':
+            bindparams = [bindparam('worker_number', worker_number),
+                          bindparam('total_workers', total_workers)]
+            query = query.filter(text('ORA_HASH(CONCAT(account, rse_id), :total_workers) = :worker_number', bindparams=bindparams))
+        elif session.bind.dialect.name == 'mysql':
+            query = query.filter(text('mod(md5(concat(account, rse_id)), %s) = %s' % (total_workers + 1, worker_number)))
+        elif session.bind.dialect.name == 'postgresql':
+            query = query.filter(text('mod(abs((\'x\'||md5(concat(account, rse_id)))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number)))
+
+    update_ids = [update_id for update_id, in query.limit(limit)]
+    __consume_updated_account_counters(update_ids=update_ids, session=session)
+    return len(update_ids)
 
 
 @transactional_session
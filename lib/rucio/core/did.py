@@ -58,7 +58,7 @@ from rucio.core.naming_convention import validate_name
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import DIDType, DIDReEvaluation, DIDAvailability, RuleState
 from rucio.db.sqla.enum import EnumSymbol
-from rucio.db.sqla.session import read_session, transactional_session, stream_session
+from rucio.db.sqla.session import read_session, transactional_session, stream_session, read_from_primary
 
 
 logging.basicConfig(stream=sys.stdout,
@@ -70,6 +70,7 @@ logging.basicConfig(stream=sys.stdout,
 
 
 @read_session
+@read_from_primary
 def list_expired_dids(worker_number=None, total_workers=None, limit=None, session=None):
     """
     List expired data identifiers.
@@ -794,6 +795,7 @@ def detach_dids(scope, name, dids, session=None):
 
 
 @stream_session
+@read_from_primary
 def list_new_dids(did_type, thread=None, total_threads=None, chunk_size=1000, session=None):
     """
     List recent identifiers.
@@ -1519,12 +1521,22 @@ def set_status(scope, name, session=None, **kwargs):
                 rucio.core.rule.generate_rule_notifications(rule=rule, session=session)
 
 
+# Indexes on (scope, <key>, name) for exact match filters on the most common metadata keys,
+# the most selective first
+LIST_DIDS_META_INDEXES = (('run_number', 'DIDS_SCOPE_RUN_NUMBER_IDX'),
+                          ('datatype', 'DIDS_SCOPE_DATATYPE_IDX'),
+                          ('project', 'DIDS_SCOPE_PROJECT_IDX'))
+
+
 @stream_session
 def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
-              offset=None, long=False, recursive=False, session=None):
+              offset=None, long=False, recursive=False, marker=None, session=None):
     """
     Search data identifiers
 
+    If a limit or a marker is given, the dids are returned ordered by name, so that the next
+    page can be requested with the name of the last did as marker.
+
     :param scope: the scope name.
     :param filters: dictionary of attributes by which the results should be filtered.
     :param type: the type of the did: all(container, dataset, file), collection(dataset or container), dataset, container, file.
@@ -1534,6 +1546,7 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
     :param long: Long format option to display more information for each DID.
     :param session: The database session in use.
     :param recursive: Recursively list DIDs content.
+    :param marker: Only list the dids with a name greater than the marker.
     """
     types = ['all', 'collection', 'container', 'dataset', 'file']
     if type not in types:
@@ -1601,17 +1614,33 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
         else:
             query = query.filter(getattr(models.DataIdentifier, k) == v)
 
-    if 'name' in filters:
-        if '*' in filters['name']:
-            query = query.\
-                with_hint(models.DataIdentifier, "NO_INDEX(dids(SCOPE,NAME))", 'oracle')
-        else:
-            query = query.\
-                with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
+    meta_index = None
+    for key, index in LIST_DIDS_META_INDEXES:
+        value = filters.get(key)
+        if value is not None and not (isinstance(value, string_types) and ('*' in value or '%' in value)):
+            meta_index = index
+            break
+
+    if 'name' in filters and '*' not in filters['name']:
+        query = query.\
+            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
+    elif meta_index:
+        query = query.\
+            with_hint(models.DataIdentifier, "INDEX(DIDS %s)" % meta_index, 'oracle')
+    elif 'name' in filters:
+        query = query.\
+            with_hint(models.DataIdentifier, "NO_INDEX(dids(SCOPE,NAME))", 'oracle')
+
+    if marker is not None:
+        query = query.filter(models.DataIdentifier.name > marker)
+    if limit or marker is not None:
+        query = query.order_by(models.DataIdentifier.name)
 
     if limit:
         query = query.limit(limit)
 
+    batch_size = int(config_get('did', 'list_dids_batch_size', False, 100))
+
     if recursive:
         # Get attachted DIDs and save in list because query has to be finished before starting a new one in the recursion
         collections_content = []
@@ -1627,14 +1656,14 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
                 yield result
 
     if long:
-        for scope, name, did_type, bytes, length in query.yield_per(5):
+        for scope, name, did_type, bytes, length in query.yield_per(batch_size):
             yield {'scope': scope,
                    'name': name,
                    'did_type': str(did_type),
                    'bytes': bytes,
                    'length': length}
     else:
-        for scope, name, did_type, bytes, length in query.yield_per(5):
+        for scope, name, did_type, bytes, length in query.yield_per(batch_size):
             yield name
 
 
@@ -14,13 +14,119 @@
  PY3K COMPATIBLE
 """
 
+import datetime
+import threading
+
+from sqlalchemy import event
 from sqlalchemy.exc import DatabaseError, IntegrityError
-from sqlalchemy.orm import aliased
+from sqlalchemy.orm import aliased, scoped_session
+from sqlalchemy.sql.expression import false
 
 from rucio.common import exception
 from rucio.core.rse import get_rse_name
 from rucio.db.sqla.models import Distance, RSE
-from rucio.db.sqla.session import transactional_session, read_session
+from rucio.db.sqla.session import transactional_session, read_session, read_from_primary
+
+
+class DistanceGraph(object):
+    """
+    In-memory copy of the distance graph, shared by all threads of a process.
+
+    The graph is loaded once from the distances table and afterwards refreshed
+    incrementally with the distances updated since the last refresh. It is fully
+    reloaded periodically, or after a change done in this process, so that deleted
+    distances and RSEs are dropped as well.
+
+    The graph is replaced, never modified in place, so a graph returned by get_graph
+    can be traversed while another thread refreshes it.
+    """
+
+    def __init__(self, refresh_interval=60, reload_interval=3600):
+        """
+        :param refresh_interval: Seconds after which updated distances are fetched.
+        :param reload_interval:  Seconds after which the whole graph is reloaded.
+        """
+        self.refresh_interval = datetime.timedelta(seconds=refresh_interval)
+        self.reload_interval = datetime.timedelta(seconds=reload_interval)
+        self.graph = {}
+        self.last_refresh = None
+        self.last_reload = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Force a full reload of the graph on next access.
+        """
+        self.last_reload = None
+
+    @read_session
+    @read_from_primary
+    def get_graph(self, session=None):
+        """
+        Get the distance graph, refreshing it if needed.
+
+        :param session: The database session to use.
+        :returns: Dictionary {src_rse_id: {dest_rse_id: ranking}}.
+        """
+        now = datetime.datetime.utcnow()
+        if self.last_reload is None or now - self.last_reload > self.reload_interval:
+            with self.lock:
+                if self.last_reload is None or now - self.last_reload > self.reload_interval:
+                    graph = {}
+                    for src_rse_id, dest_rse_id, ranking in self.__query_distances(session=session):
+                        graph.setdefault(src_rse_id, {})[dest_rse_id] = ranking
+                    self.graph = graph
+                    self.last_reload = self.last_refresh = now
+        elif now - self.last_refresh > self.refresh_interval:
+            with self.lock:
+                if now - self.last_refresh > self.refresh_interval:
+                    # Overlap with the previous refresh to tolerate clock skew between hosts
+                    updated_after = self.last_refresh - self.refresh_interval
+                    distances = self.__query_distances(updated_after=updated_after, session=session)
+                    if distances:
+                        graph, copied = dict(self.graph), set()
+                        for src_rse_id, dest_rse_id, ranking in distances:
+                            if src_rse_id not in copied:
+                                graph[src_rse_id] = dict(graph.get(src_rse_id, {}))
+                                copied.add(src_rse_id)
+                            graph[src_rse_id][dest_rse_id] = ranking
+                        self.graph = graph
+                    self.last_refresh = now
+        return self.graph
+
+    def get_edges(self, rse_id, session=None):
+        """
+        Get the outgoing edges of one node of the distance graph.
+
+        :param rse_id: The source RSE ID.
+        :param session: The database session to use.
+        :returns: Dictionary {dest_rse_id: ranking}.
+        """
+        return self.get_graph(session=session).get(rse_id, {})
+
+    @staticmethod
+    def __query_distances(updated_after=None, session=None):
+        query = session.query(Distance.src_rse_id, Distance.dest_rse_id, Distance.ranking)\
+                       .join(RSE, RSE.id == Distance.dest_rse_id)\
+                       .filter(RSE.deleted == false())
+        if updated_after:
+            query = query.filter(Distance.updated_at >= updated_after)
+        return query.all()
+
+
+DISTANCE_GRAPH = DistanceGraph()
+
+
+def __invalidate_graph_on_commit(session):
+    """
+    Invalidate the distance graph once the transaction of the session is committed, so that
+    a reload running concurrently cannot cache the distances as they were before the commit.
+
+    :param session: The database session in use.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    event.listen(session, 'after_commit', lambda _: DISTANCE_GRAPH.invalidate(), once=True)
 
 
 @transactional_session
@@ -46,6 +152,7 @@ def add_distance(src_rse_id, dest_rse_id, ranking=None, agis_distance=None, geoi
         new_distance = Distance(src_rse_id=src_rse_id, dest_rse_id=dest_rse_id, ranking=ranking, agis_distance=agis_distance, geoip_distance=geoip_distance,
                                 active=active, submitted=submitted, finished=finished, failed=failed, transfer_speed=transfer_speed)
         new_distance.save(session=session)
+        __invalidate_graph_on_commit(session)
     except IntegrityError:
         raise exception.Duplicate('Distance from %s to %s already exists!' % (get_rse_name(rse_id=src_rse_id, session=session), get_rse_name(rse_id=dest_rse_id, session=session)))
     except DatabaseError as error:
@@ -119,6 +226,7 @@ def delete_distances(src_rse_id=None, dest_rse_id=None, session=None):
             query = query.filter(Distance.dest_rse_id == dest_rse_id)
 
         query.delete()
+        __invalidate_graph_on_commit(session)
     except IntegrityError as error:
         raise exception.RucioException(error.args)
 
@@ -144,6 +252,7 @@ def update_distances(src_rse_id=None, dest_rse_id=None, parameters=None, session
         if dest_rse_id:
             query = query.filter(Distance.dest_rse_id == dest_rse_id)
         query.update(params)
+        __invalidate_graph_on_commit(session)
     except IntegrityError as error:
         raise exception.RucioException(error.args)
 
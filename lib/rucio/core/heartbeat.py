@@ -13,16 +13,126 @@
 #
 # PY3K COMPATIBLE
 
+import bisect
 import datetime
 import hashlib
+import threading
+import time
 
 from sqlalchemy import func
-from sqlalchemy.sql import distinct
+from sqlalchemy.sql import distinct, text
+from sqlalchemy.sql.expression import false
 
 from rucio.db.sqla.models import Heartbeats
 from rucio.db.sqla.session import read_session, transactional_session
+from rucio.common.config import config_get_int
 from rucio.common.exception import DatabaseException
-from rucio.common.utils import pid_exists
+from rucio.common.utils import pid_exists, LRUCache
+
+
+class HashRing(object):
+    """
+    Consistent hashing ring with virtual nodes.
+    When a member joins or leaves the ring, only the partitions of its neighbours move.
+    """
+
+    def __init__(self, members, vnodes=64):
+        """
+        :param members: List of member identifiers.
+        :param vnodes: Number of virtual nodes per member.
+        """
+        self.ring = sorted((self.hash('%s-%s' % (member, vnode)), member) for member in members for vnode in range(vnodes))
+        self.positions = [position for position, _ in self.ring]
+
+    @staticmethod
+    def hash(key):
+        """
+        Position of a key on the ring.
+
+        :param key: The key as a string.
+        """
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get_member(self, key):
+        """
+        Return the member owning a key, or None if the ring is empty.
+
+        :param key: The key.
+        """
+        if not self.ring:
+            return None
+        return self.ring[bisect.bisect(self.positions, self.hash(str(key))) % len(self.ring)][1]
+
+    def get_partitions(self, nr_partitions):
+        """
+        Assign the partitions [0, nr_partitions) to the members.
+
+        :param nr_partitions: The number of partitions.
+        :returns: Dictionary {member: [partition, ...]}
+        """
+        partitions = {}
+        for partition in range(nr_partitions):
+            partitions.setdefault(self.get_member(partition), []).append(partition)
+        return partitions
+
+
+# Membership of the executables, cached between the cycles of the daemons: {(hash_executable, older_than): (expires_at, members)}
+MEMBERSHIPS = {}
+MEMBERSHIPS_LOCK = threading.Lock()
+PARTITIONS = LRUCache(maxsize=100)
+
+
+def invalidate_membership(hash_executable):
+    """
+    Drop the cached membership of an executable.
+
+    :param hash_executable: Hash of the executable.
+    """
+    with MEMBERSHIPS_LOCK:
+        for key in list(MEMBERSHIPS):
+            if key[0] == hash_executable:
+                del MEMBERSHIPS[key]
+
+
+def get_partitions(members, member, nr_partitions):
+    """
+    Return the partitions assigned to a member by the consistent hashing ring of the membership.
+
+    :param members: List of the (hostname, pid, thread_id) of the live members.
+    :param member: The (hostname, pid, thread_id) of the member.
+    :param nr_partitions: The number of partitions.
+    :returns: Sorted list of partition numbers.
+    """
+    key = (tuple(members), nr_partitions)
+    assignments = PARTITIONS.get(key)
+    if assignments is None:
+        assignments = HashRing(['%s:%s:%s' % m for m in members]).get_partitions(nr_partitions)
+        PARTITIONS.set(key, assignments)
+    return assignments.get('%s:%s:%s' % member, [])
+
+
+def filter_partitions(query, hash_variable, nr_partitions, partitions, session):
+    """
+    Restrict a query to the rows whose hash falls into the given partitions.
+    Same hashes as the total_workers/worker_number split, without the filter on sqlite.
+
+    :param query: The query to filter.
+    :param hash_variable: The column used for the partitioning.
+    :param nr_partitions: The number of partitions.
+    :param partitions: The partitions assigned to the worker.
+    :param session: The database session in use.
+    :returns: The filtered query.
+    """
+    if not partitions:
+        return query.filter(false())
+    partitions = ', '.join([str(int(partition)) for partition in partitions])
+    if session.bind.dialect.name == 'oracle':
+        query = query.filter(text('ORA_HASH(%s, %s) IN (%s)' % (hash_variable, nr_partitions - 1, partitions)))
+    elif session.bind.dialect.name == 'mysql':
+        query = query.filter(text('mod(md5(%s), %s) IN (%s)' % (hash_variable, nr_partitions, partitions)))
+    elif session.bind.dialect.name == 'postgresql':
+        query = query.filter(text('mod(abs((\'x\'||md5(%s::text))::bit(32)::int), %s) IN (%s)' % (hash_variable, nr_partitions, partitions)))
+    return query
 
 
 @transactional_session
@@ -72,13 +182,17 @@ def _sanity_check(executable, hostname, hash_executable=None, session=None):
 
 
 @transactional_session
-def live(executable, hostname, pid, thread, older_than=600, hash_executable=None, payload=None, session=None):
+def live(executable, hostname, pid, thread, older_than=600, hash_executable=None, payload=None, nr_partitions=None, session=None):
     """
     Register a heartbeat for a process/thread on a given node.
     The executable name is used for the calculation of thread assignments.
     Removal of stale heartbeats is done as a scheduled database job.
 
-    TODO: Returns an assignment dictionary for the given executable.
+    If heartbeat.membership_cache_ttl is set, the membership is only read from the database
+    when the cached one is older than this amount of seconds or does not contain the thread.
+    The partitions are always computed from the membership read from the heartbeat table in
+    a single query, as threads working from cached memberships of different ages would
+    process overlapping partitions or leave some partitions unprocessed.
 
     :param executable: Executable name as a string, e.g., conveyor-submitter.
     :param hostname: Hostname as a string, e.g., rucio-daemon-prod-01.cern.ch.
@@ -87,9 +201,10 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
     :param older_than: Ignore specified heartbeats older than specified nr of seconds.
     :param hash_executable: Hash of the executable.
     :param payload: Payload identifier which can be further used to identify the work a certain thread is executing.
+    :param nr_partitions: If set, also return the partitions assigned to the thread by consistent hashing.
     :param session: The database session in use.
 
-    :returns heartbeats: Dictionary {assign_thread, nr_threads}
+    :returns heartbeats: Dictionary {assign_thread, nr_threads} and the partitions if nr_partitions is set.
     """
     if not hash_executable:
         hash_executable = calc_hash(executable)
@@ -110,7 +225,39 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
                    thread_name=thread.name,
                    payload=payload).save(session=session)
 
+    member = (hostname, pid, thread.ident)
+    ttl = config_get_int('heartbeat', 'membership_cache_ttl', False, 0)
+    members = None
+    if ttl > 0 and not nr_partitions:
+        with MEMBERSHIPS_LOCK:
+            expires_at, cached_members = MEMBERSHIPS.get((hash_executable, older_than), (0, []))
+        if expires_at > time.time() and member in cached_members:
+            members = cached_members
+
+    if members is None:
+        members = __list_members(hash_executable, older_than, session=session)
+        if ttl > 0:
+            with MEMBERSHIPS_LOCK:
+                MEMBERSHIPS[(hash_executable, older_than)] = (time.time() + ttl, members)
+
     # assign thread identifier
+    assign_thread = members.index(member) if member in members else 0
+    result = {'assign_thread': assign_thread,
+              'nr_threads': len(members)}
+    if nr_partitions:
+        result['partitions'] = get_partitions(members, member, nr_partitions)
+    return result
+
+
+def __list_members(hash_executable, older_than, session):
+    """
+    List the live threads of an executable, ordered by hostname, pid and thread.
+
+    :param hash_executable: Hash of the executable.
+    :param older_than: Ignore specified heartbeats older than specified nr of seconds.
+    :param session: The database session in use.
+    :returns: List of (hostname, pid, thread_id).
+    """
     query = session.query(Heartbeats.hostname,
                           Heartbeats.pid,
                           Heartbeats.thread_id)\
@@ -123,18 +270,9 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
                    .order_by(Heartbeats.hostname,
                              Heartbeats.pid,
                              Heartbeats.thread_id)
-    result = query.all()
-
     # there is no universally applicable rownumber in SQLAlchemy
     # so we have to do it in Python
-    assign_thread = 0
-    for r in range(len(result)):
-        if result[r][0] == hostname and result[r][1] == pid and result[r][2] == thread.ident:
-            assign_thread = r
-            break
-
-    return {'assign_thread': assign_thread,
-            'nr_threads': len(result)}
+    return [(row[0], row[1], row[2]) for row in query.all()]
 
 
 @transactional_session
@@ -164,6 +302,7 @@ def die(executable, hostname, pid, thread, older_than=None, hash_executable=None
         query = query.filter(Heartbeats.updated_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than))
 
     query.delete()
+    invalidate_membership(hash_executable)
 
 
 @transactional_session
@@ -27,6 +27,7 @@ import rucio.core.did
 
 from rucio.common.config import config_get
 from rucio.common.exception import RSENotFound
+from rucio.common.utils import chunks
 from rucio.core.lifetime_exception import define_eol
 from rucio.core.rse import get_rse_name, get_rse_id
 from rucio.db.sqla import models
@@ -277,6 +278,40 @@ def get_files_and_replica_locks_of_dataset(scope, name, nowait=False, restrict_r
     return locks
 
 
+def __get_replica_locks_for_update(files, nowait, session):
+    """
+    Get and lock all the replica locks of a list of files, using one query per chunk of files.
+
+    :param files:    List of dictionaries with the scope, name and rse_id of the files.
+    :param nowait:   Nowait parameter for the for_update queries.
+    :param session:  DB Session.
+    :returns:        List of ReplicaLock objects.
+    """
+    locks = []
+    for chunk in chunks(files, 100):
+        conditions = [and_(models.ReplicaLock.scope == file['scope'],
+                           models.ReplicaLock.name == file['name'],
+                           models.ReplicaLock.rse_id == file['rse_id']) for file in chunk]
+        locks.extend(session.query(models.ReplicaLock).with_for_update(nowait=nowait).filter(or_(*conditions)).all())
+    return locks
+
+
+def __get_rules_for_update(rule_ids, nowait, session):
+    """
+    Get and lock a set of replication rules, using one query per chunk of rule ids.
+
+    :param rule_ids: List of rule ids.
+    :param nowait:   Nowait parameter for the for_update queries.
+    :param session:  DB Session.
+    :returns:        Dictionary {rule_id: ReplicationRule}.
+    """
+    rules = {}
+    for chunk in chunks(list(set(rule_ids)), 100):
+        for rule in session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter(models.ReplicationRule.id.in_(chunk)):
+            rules[rule.id] = rule
+    return rules
+
+
 @transactional_session
 def successful_transfer(scope, name, rse_id, nowait, session=None):
     """
@@ -288,14 +323,29 @@ def successful_transfer(scope, name, rse_id, nowait, session=None):
     :param nowait:   Nowait parameter for the for_update queries.
     :param session:  DB Session.
     """
+    successful_transfers(files=[{'scope': scope, 'name': name, 'rse_id': rse_id}], nowait=nowait, session=session)
 
-    locks = session.query(models.ReplicaLock).with_for_update(nowait=nowait).filter_by(scope=scope, name=name, rse_id=rse_id)
+
+@transactional_session
+def successful_transfers(files, nowait, session=None):
+    """
+    Update the state of all replica locks because of successful transfers.
+    The locks and their rules are fetched in bulk.
+
+    :param files:    List of dictionaries with the scope, name and rse_id of the files.
+    :param nowait:   Nowait parameter for the for_update queries.
+    :param session:  DB Session.
+    """
+
+    locks = [lock for lock in __get_replica_locks_for_update(files, nowait=nowait, session=session) if lock.state != LockState.OK]
+    rules = __get_rules_for_update([lock.rule_id for lock in locks], nowait=nowait, session=session)
     for lock in locks:
         if lock.state == LockState.OK:
             continue
+        rse_id = lock.rse_id
         logging.debug('Marking lock %s:%s for rule %s on rse %s as OK' % (lock.scope, lock.name, str(lock.rule_id), get_rse_name(rse_id=lock.rse_id, session=session)))
         # Update the rule counters
-        rule = session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter_by(id=lock.rule_id).one()
+        rule = rules[lock.rule_id]
         logging.debug('Updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
 
         if lock.state == LockState.REPLICATING:
@@ -361,14 +411,37 @@ def failed_transfer(scope, name, rse_id, error_message=None, broken_rule_id=None
     :param nowait:          Nowait parameter for the for_update queries.
     :param session:         The database session in use.
     """
+    failed_transfers(files=[{'scope': scope, 'name': name, 'rse_id': rse_id,
+                             'error_message': error_message,
+                             'broken_rule_id': broken_rule_id,
+                             'broken_message': broken_message}], nowait=nowait, session=session)
+
+
+@transactional_session
+def failed_transfers(files, nowait=True, session=None):
+    """
+    Update the state of all replica locks because of failed transfers.
+    The locks and their rules are fetched in bulk.
+
+    :param files:    List of dictionaries with the scope, name, rse_id and optionally the error_message, broken_rule_id and broken_message of the files.
+    :param nowait:   Nowait parameter for the for_update queries.
+    :param session:  The database session in use.
+    """
+
+    files_by_key = {}
+    for file in files:
+        files_by_key.setdefault((file['scope'], file['name'], file['rse_id']), file)
 
-    locks = session.query(models.ReplicaLock).with_for_update(nowait=nowait).filter_by(scope=scope, name=name, rse_id=rse_id)
+    locks = [lock for lock in __get_replica_locks_for_update(files, nowait=nowait, session=session) if lock.state != LockState.STUCK]
+    rules = __get_rules_for_update([lock.rule_id for lock in locks], nowait=nowait, session=session)
     for lock in locks:
         if lock.state == LockState.STUCK:
             continue
+        file = files_by_key[(lock.scope, lock.name, lock.rse_id)]
+        error_message, broken_rule_id, broken_message = file.get('error_message'), file.get('broken_rule_id'), file.get('broken_message')
         logging.debug('Marking lock %s:%s for rule %s on rse %s as STUCK' % (lock.scope, lock.name, str(lock.rule_id), get_rse_name(rse_id=lock.rse_id, session=session)))
         # Update the rule counters
-        rule = session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter_by(id=lock.rule_id).one()
+        rule = rules[lock.rule_id]
         logging.debug('Updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
         if lock.state == LockState.REPLICATING:
             rule.locks_replicating_cnt -= 1
@@ -102,7 +102,8 @@ def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=Non
         query = session.query(Message.id,
                               Message.created_at,
                               Message.event_type,
-                              Message.payload)\
+                              Message.payload,
+                              Message.payload_nolimit)\
             .filter(Message.id.in_(subquery))\
             .with_for_update(nowait=True)
 
@@ -114,15 +115,13 @@ def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=Non
 
         # Step 3:
         # Assemble message object
-        for id, created_at, event_type, payload in query:
+        for id, created_at, event_type, payload, payload_nolimit in query:
             message = {'id': id,
                        'created_at': created_at,
                        'event_type': event_type}
 
-            # Only switch SQL context when necessary
             if payload == 'nolimit':
-                nolimit_query = session.query(Message.payload_nolimit).filter(Message.id == id).one()[0]
-                message['payload'] = json.loads(str(nolimit_query))
+                message['payload'] = json.loads(str(payload_nolimit))
             else:
                 message['payload'] = json.loads(str(payload))
 
@@ -28,7 +28,7 @@ from sqlalchemy.sql.expression import bindparam, text, select, false
 
 from rucio.common.utils import chunks
 from rucio.db.sqla import models
-from rucio.db.sqla.session import read_session, transactional_session
+from rucio.db.sqla.session import read_session, read_from_primary, transactional_session
 
 
 @transactional_session
@@ -107,6 +107,7 @@ def delete_quarantined_replicas(rse_id, replicas, session=None):
 
 
 @read_session
+@read_from_primary
 def list_quarantined_replicas(rse_id, limit, worker_number=None, total_workers=None, session=None):
     """
     List RSE Quarantined File replicas.
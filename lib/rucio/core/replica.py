@@ -60,7 +60,7 @@ from rucio.core.rse_expression_parser import parse_expression
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import (DIDType, ReplicaState, OBSOLETE, DIDAvailability,
                                      BadFilesStatus, RuleState, BadPFNStatus)
-from rucio.db.sqla.session import (read_session, stream_session, transactional_session,
+from rucio.db.sqla.session import (read_session, stream_session, transactional_session, read_from_primary,
                                    DEFAULT_SCHEMA_NAME, get_engine)
 from rucio.rse import rsemanager as rsemgr
 
@@ -299,7 +299,7 @@ def __declare_bad_file_replicas(pfns, rse_id, reason, issuer, status=BadFilesSta
     declared_replicas = []
     rse_info = rsemgr.get_rse_info(rse=get_rse_name(rse_id=rse_id, session=session), session=session)
     replicas = []
-    proto = rsemgr.create_protocol(rse_info, 'read', scheme=scheme)
+    proto = rsemgr.create_protocol(rse_info, 'read', scheme=scheme, pooled=True)
     if rse_info['deterministic']:
         parsed_pfn = proto.parse_pfns(pfns=pfns)
         for pfn in parsed_pfn:
@@ -470,6 +470,7 @@ def get_pfn_to_rse(pfns, session=None):
 
 
 @read_session
+@read_from_primary
 def list_bad_replicas(limit=10000, thread=None, total_threads=None, session=None):
     """
     List RSE File replicas with no locks.
@@ -540,7 +541,7 @@ def get_did_from_pfns(pfns, rse_id=None, session=None):
         pfns = dict_rse[rse_id]
         rse_info = rsemgr.get_rse_info(rse=get_rse_name(rse_id=rse_id, session=session), session=session)
         pfndict = {}
-        proto = rsemgr.create_protocol(rse_info, 'read', scheme=scheme)
+        proto = rsemgr.create_protocol(rse_info, 'read', scheme=scheme, pooled=True)
         if rse_info['deterministic']:
             parsed_pfn = proto.parse_pfns(pfns=pfns)
             # WARNING : this part is ATLAS specific and must be changed
@@ -915,18 +916,21 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                                 protocols.append(('lan', rsemgr.create_protocol(rse_settings=rse_info[rse_id],
                                                                                 operation='read',
                                                                                 scheme=s,
-                                                                                domain='lan'),
+                                                                                domain='lan',
+                                                                                pooled=True),
                                                   rse_info[rse_id]['priority_lan'][s]))
                                 protocols.append(('wan', rsemgr.create_protocol(rse_settings=rse_info[rse_id],
                                                                                 operation='read',
                                                                                 scheme=s,
-                                                                                domain='wan'),
+                                                                                domain='wan',
+                                                                                pooled=True),
                                                   rse_info[rse_id]['priority_wan'][s]))
                             else:
                                 protocols.append((domain, rsemgr.create_protocol(rse_settings=rse_info[rse_id],
                                                                                  operation='read',
                                                                                  scheme=s,
-                                                                                 domain=domain),
+                                                                                 domain=domain,
+                                                                                 pooled=True),
                                                   rse_info[rse_id]['priority_%s' % domain][s]))
                         except exception.RSEProtocolNotSupported:
                             pass  # no need to be verbose
@@ -1593,6 +1597,7 @@ def get_replica(rse_id, scope, name, session=None):
 
 
 @read_session
+@read_from_primary
 def list_unlocked_replicas(rse_id, limit, bytes=None, worker_number=None, total_workers=None, delay_seconds=0, session=None):
     """
     List RSE File replicas with no locks.
@@ -1816,6 +1821,91 @@ def update_replicas_states(replicas, nowait=False, add_tombstone=False, session=
     return True
 
 
+@transactional_session
+def bulk_update_replicas_states(replicas, nowait=False, add_tombstone=False, session=None):
+    """
+    Update the state of a list of file replicas with set-based statements.
+    Replicas becoming AVAILABLE or UNAVAILABLE are updated in bulk together with their locks and rules,
+    the other states are handled by update_replicas_states.
+
+    :param replicas:        The list of replicas.
+    :param nowait:          Nowait parameter for the for_update queries.
+    :param add_tombstone:   To set a tombstone in case there is no lock on the replica.
+    :param session:         The database session in use.
+
+    :raises ReplicaNotFound:        If one of the replicas does not exist.
+    :raises UnsupportedOperation:   If the state of one of the replicas cannot be updated.
+    """
+
+    bulk_replicas, other_replicas = {}, []
+    for replica in replicas:
+        if isinstance(replica['state'], string_types):
+            replica['state'] = ReplicaState.from_string(replica['state'])
+        if replica['state'] in (ReplicaState.AVAILABLE, ReplicaState.UNAVAILABLE):
+            bulk_replicas[(replica['scope'], replica['name'], replica['rse_id'])] = replica
+        else:
+            other_replicas.append(replica)
+
+    if other_replicas:
+        update_replicas_states(other_replicas, nowait=nowait, add_tombstone=add_tombstone, session=session)
+    if not bulk_replicas:
+        return True
+
+    # Lock the replicas and fetch their lock counters
+    lock_cnts = {}
+    for chunk in chunks(list(bulk_replicas), 100):
+        query = session.query(models.RSEFileAssociation.scope, models.RSEFileAssociation.name, models.RSEFileAssociation.rse_id, models.RSEFileAssociation.lock_cnt).\
+            filter(or_(*[and_(models.RSEFileAssociation.scope == scope,
+                              models.RSEFileAssociation.name == name,
+                              models.RSEFileAssociation.rse_id == rse_id) for scope, name, rse_id in chunk]))
+        if nowait:
+            query = query.with_for_update(nowait=True)
+        for scope, name, rse_id, lock_cnt in query:
+            lock_cnts[(scope, name, rse_id)] = lock_cnt
+
+    for key in bulk_replicas:
+        if key not in lock_cnts:
+            raise exception.ReplicaNotFound("No row found for scope: %s name: %s rse: %s" % (key[0], key[1], get_rse_name(key[2], session=session)))
+
+    rucio.core.lock.successful_transfers(files=[replica for replica in bulk_replicas.values() if replica['state'] == ReplicaState.AVAILABLE], nowait=nowait, session=session)
+    rucio.core.lock.failed_transfers(files=[replica for replica in bulk_replicas.values() if replica['state'] == ReplicaState.UNAVAILABLE], nowait=nowait, session=session)
+
+    # If No locks we set a tombstone in the future
+    if add_tombstone:
+        tombstone = datetime.utcnow() + timedelta(hours=2)
+        stmt = exists().where(and_(models.ReplicaLock.scope == models.RSEFileAssociation.scope,
+                                   models.ReplicaLock.name == models.RSEFileAssociation.name,
+                                   models.ReplicaLock.rse_id == models.RSEFileAssociation.rse_id))
+        for chunk in chunks([key for key in bulk_replicas if lock_cnts[key] == 0], 100):
+            session.query(models.RSEFileAssociation).\
+                filter(or_(*[and_(models.RSEFileAssociation.scope == scope,
+                                  models.RSEFileAssociation.name == name,
+                                  models.RSEFileAssociation.rse_id == rse_id) for scope, name, rse_id in chunk])).\
+                filter(not_(stmt)).\
+                update({'tombstone': tombstone}, synchronize_session=False)
+
+    # Replicas with a path are updated one by one, the others with one statement per state
+    states = {}
+    for key, replica in bulk_replicas.items():
+        if 'path' in replica and replica['path']:
+            if not session.query(models.RSEFileAssociation).filter_by(scope=key[0], name=key[1], rse_id=key[2]).\
+                    update({'state': replica['state'], 'path': replica['path']}, synchronize_session=False):
+                raise exception.UnsupportedOperation('State %s for replica %s:%s on %s cannot be updated' % (replica['state'], key[0], key[1], get_rse_name(rse_id=key[2], session=session)))
+        else:
+            states.setdefault(replica['state'], []).append(key)
+
+    for state, keys in states.items():
+        for chunk in chunks(keys, 100):
+            rowcount = session.query(models.RSEFileAssociation).\
+                filter(or_(*[and_(models.RSEFileAssociation.scope == scope,
+                                  models.RSEFileAssociation.name == name,
+                                  models.RSEFileAssociation.rse_id == rse_id) for scope, name, rse_id in chunk])).\
+                update({'state': state}, synchronize_session=False)
+            if rowcount != len(chunk):
+                raise exception.UnsupportedOperation('State %s cannot be updated for %s of %s replicas' % (state, len(chunk) - rowcount, len(chunk)))
+    return True
+
+
 @transactional_session
 def touch_replica(replica, session=None):
     """
@@ -2492,49 +2582,122 @@ def mark_unlocked_replicas(rse_id, bytes, session=None):
 
 
 @transactional_session
-def get_cleaned_updated_collection_replicas(total_workers, worker_number, session=None):
+def get_cleaned_updated_collection_replicas(total_workers, worker_number, limit=None, session=None):
     """
     Get update request for collection replicas.
     :param total_workers:      Number of total workers.
     :param worker_number:      id of the executing worker.
+    :param limit:              Maximum number of requests to return.
     :param session:            Database session in use.
     :returns:                  List of update requests for collection replicas.
     """
+
+    def filter_worker(query):
+        if total_workers > 0:
+            if session.bind.dialect.name == 'oracle':
+                bindparams = [bindparam('worker_number', worker_number),
+                              bindparam('total_workers', total_workers)]
+                query = query.filter(text('ORA_HASH(name, :total_workers) = :worker_number', bindparams=bindparams))
+            elif session.bind.dialect.name == 'mysql':
+                query = query.filter(text('mod(md5(name), %s) = %s' % (total_workers + 1, worker_number)))
+            elif session.bind.dialect.name == 'postgresql':
+                query = query.filter(text('mod(abs((\'x\'||md5(name))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number)))
+        return query
+
     # Delete duplicates
-    replica_update_requests = session.query(models.UpdatedCollectionReplica)
-    update_requests_with_rse_id = []
-    update_requests_without_rse_id = []
+    replica_update_requests = filter_worker(session.query(models.UpdatedCollectionReplica.id,
+                                                          models.UpdatedCollectionReplica.scope,
+                                                          models.UpdatedCollectionReplica.name,
+                                                          models.UpdatedCollectionReplica.rse_id))
+    update_requests = set()
     duplicate_request_ids = []
-    for update_request in replica_update_requests.all():
-        if update_request.rse_id is not None:
-            small_request = {'name': update_request.name, 'scope': update_request.scope, 'rse_id': update_request.rse_id}
-            if small_request not in update_requests_with_rse_id:
-                update_requests_with_rse_id.append(small_request)
-            else:
-                duplicate_request_ids.append(update_request.id)
-                continue
+    for request_id, scope, name, rse_id in replica_update_requests.yield_per(1000):
+        if (scope, name, rse_id) in update_requests:
+            duplicate_request_ids.append(request_id)
         else:
-            small_request = {'name': update_request.name, 'scope': update_request.scope}
-            if small_request not in update_requests_without_rse_id:
-                update_requests_without_rse_id.append(small_request)
-            else:
-                duplicate_request_ids.append(update_request.id)
-                continue
-    replica_update_requests.filter(models.UpdatedCollectionReplica.id.in_(duplicate_request_ids)).delete(synchronize_session=False)
+            update_requests.add((scope, name, rse_id))
+    for chunk in chunks(duplicate_request_ids, 1000):
+        session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.id.in_(chunk)).delete(synchronize_session=False)
 
     # Delete update requests which do not have collection_replicas
-    session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.rse_id.is_(None)
-                                                          & ~exists().where(and_(models.CollectionReplica.name == models.UpdatedCollectionReplica.name,  # NOQA: W503
-                                                                                 models.CollectionReplica.scope == models.UpdatedCollectionReplica.scope))).delete(synchronize_session=False)
-    session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.rse_id.isnot(None)
-                                                          & ~exists().where(and_(models.CollectionReplica.name == models.UpdatedCollectionReplica.name,  # NOQA: W503
-                                                                                 models.CollectionReplica.scope == models.UpdatedCollectionReplica.scope,
-                                                                                 models.CollectionReplica.rse_id == models.UpdatedCollectionReplica.rse_id))).delete(synchronize_session=False)
-
-    query = session.query(models.UpdatedCollectionReplica)
+    filter_worker(session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.rse_id.is_(None)
+                                                                        & ~exists().where(and_(models.CollectionReplica.name == models.UpdatedCollectionReplica.name,  # NOQA: W503
+                                                                                               models.CollectionReplica.scope == models.UpdatedCollectionReplica.scope)))).delete(synchronize_session=False)
+    filter_worker(session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.rse_id.isnot(None)
+                                                                        & ~exists().where(and_(models.CollectionReplica.name == models.UpdatedCollectionReplica.name,  # NOQA: W503
+                                                                                               models.CollectionReplica.scope == models.UpdatedCollectionReplica.scope,
+                                                                                               models.CollectionReplica.rse_id == models.UpdatedCollectionReplica.rse_id)))).delete(synchronize_session=False)
+
+    query = filter_worker(session.query(models.UpdatedCollectionReplica))
+    if limit:
+        query = query.limit(limit)
     return [update_request.to_dict() for update_request in query.all()]
 
 
+@transactional_session
+def update_collection_replicas(update_requests, session=None):
+    """
+    Update several collection replicas. The collection replicas of the requests with a
+    rse_id, and their available files, are read with one query per chunk of requests.
+    :param update_requests: list of update requests from the upated_col_rep table.
+    """
+    requests_per_replica = {}
+    for update_request in update_requests:
+        if update_request['rse_id'] is None:
+            update_collection_replica(update_request, session=session)
+        else:
+            key = (update_request['scope'], update_request['name'], update_request['rse_id'])
+            requests_per_replica.setdefault(key, []).append(update_request['id'])
+
+    for keys in chunks(list(requests_per_replica), 100):
+        collection_replicas = {}
+        query = session.query(models.CollectionReplica)\
+                       .filter(or_(*[and_(models.CollectionReplica.scope == scope,
+                                          models.CollectionReplica.name == name,
+                                          models.CollectionReplica.rse_id == rse_id) for scope, name, rse_id in keys]))
+        for collection_replica in query:
+            collection_replicas[(collection_replica.scope, collection_replica.name, collection_replica.rse_id)] = collection_replica
+
+        file_replicas = {}
+        query = session.query(models.RSEFileAssociation, models.DataIdentifierAssociation)\
+                       .filter(models.RSEFileAssociation.scope == models.DataIdentifierAssociation.child_scope,
+                               models.RSEFileAssociation.name == models.DataIdentifierAssociation.child_name,
+                               models.RSEFileAssociation.state == ReplicaState.AVAILABLE,
+                               or_(*[and_(models.DataIdentifierAssociation.scope == scope,
+                                          models.DataIdentifierAssociation.name == name,
+                                          models.RSEFileAssociation.rse_id == rse_id) for scope, name, rse_id in keys]))\
+                       .with_entities(models.DataIdentifierAssociation.scope,
+                                      models.DataIdentifierAssociation.name,
+                                      models.RSEFileAssociation.rse_id,
+                                      label('ds_available_bytes', func.sum(models.RSEFileAssociation.bytes)),
+                                      label('available_replicas', func.count()))\
+                       .group_by(models.DataIdentifierAssociation.scope,
+                                 models.DataIdentifierAssociation.name,
+                                 models.RSEFileAssociation.rse_id)
+        for scope, name, rse_id, ds_available_bytes, available_replicas in query:
+            file_replicas[(scope, name, rse_id)] = (ds_available_bytes, available_replicas)
+
+        request_ids = []
+        for key in keys:
+            request_ids.extend(requests_per_replica[key])
+            collection_replica = collection_replicas.get(key)
+            if not collection_replica:
+                continue
+            ds_available_bytes, available_replicas = file_replicas.get(key, (None, 0))
+            ds_length = collection_replica.length or 0
+
+            if (collection_replica.available_replicas_cnt or 0) > 0 and available_replicas == 0:
+                session.delete(collection_replica)
+            else:
+                if available_replicas >= ds_length:
+                    collection_replica.state = ReplicaState.AVAILABLE
+                else:
+                    collection_replica.state = ReplicaState.UNAVAILABLE
+                collection_replica.available_replicas_cnt = available_replicas
+                collection_replica.available_bytes = ds_available_bytes
+        session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.id.in_(request_ids)).delete(synchronize_session=False)
+
+
 @transactional_session
 def update_collection_replica(update_request, session=None):
     """
@@ -2651,6 +2814,7 @@ def update_collection_replica(update_request, session=None):
 
 
 @read_session
+@read_from_primary
 def get_bad_pfns(limit=10000, thread=None, total_threads=None, session=None):
     """
     Returns a list of bad PFNs
@@ -2800,6 +2964,7 @@ def add_bad_pfns(pfns, account, state, reason=None, expires_at=None, session=Non
 
 
 @read_session
+@read_from_primary
 def list_expired_temporary_unavailable_replicas(total_workers, worker_number, limit=10000, session=None):
     """
     List the expired temporary unavailable replicas
@@ -19,8 +19,10 @@
 # PY3K COMPATIBLE
 
 import datetime
+import heapq
 import json
 import logging
+import threading
 import time
 import traceback
 
@@ -35,12 +37,13 @@ from rucio.common.exception import RequestNotFound, RucioException, UnsupportedO
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid, chunks, get_parsed_throttler_mode
 from rucio.core.config import get
+from rucio.core.heartbeat import filter_partitions
 from rucio.core.message import add_message
 from rucio.core.monitor import record_counter, record_timer
 from rucio.core.rse import get_rse_name, get_rse_transfer_limits
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import RequestState, RequestType, FTSState, ReplicaState, LockState, RequestErrMsg
-from rucio.db.sqla.session import read_session, transactional_session, stream_session
+from rucio.db.sqla.session import read_session, transactional_session, stream_session, read_from_primary
 from rucio.transfertool.fts3 import FTS3Transfertool
 
 """
@@ -297,9 +300,10 @@ def queue_requests(requests, session=None):
 
 
 @read_session
+@read_from_primary
 def get_next(request_type, state, limit=100, older_than=None, rse_id=None, activity=None,
              total_workers=0, worker_number=0, mode_all=False, hash_variable='id',
-             activity_shares=None, session=None):
+             activity_shares=None, nr_partitions=0, partitions=None, session=None):
     """
     Retrieve the next requests matching the request type and state.
     Workers are balanced via hashing to reduce concurrency on database.
@@ -315,6 +319,8 @@ def get_next(request_type, state, limit=100, older_than=None, rse_id=None, activ
     :param mode_all:          If set to True the function returns everything, if set to False returns list of dictionaries  {'request_id': x, 'external_host': y, 'external_id': z}.
     :param hash_variable:     The variable to use to perform the partitioning. By default it uses the request id.
     :param activity_shares:   Activity shares dictionary, with number of requests
+    :param nr_partitions:     If set, the workers are balanced on this number of partitions instead of total_workers.
+    :param partitions:        The partitions assigned to the executing worker.
     :param session:           Database session to use.
     :returns:                 Request as a dictionary.
     """
@@ -353,7 +359,9 @@ def get_next(request_type, state, limit=100, older_than=None, rse_id=None, activ
         elif activity:
             query = query.filter(models.Request.activity == activity)
 
-        if total_workers > 0:
+        if nr_partitions:
+            query = filter_partitions(query, hash_variable, nr_partitions, partitions, session=session)
+        elif total_workers > 0:
             if session.bind.dialect.name == 'oracle':
                 bindparams = [bindparam('worker_number', worker_number),
                               bindparam('total_workers', total_workers)]
@@ -697,6 +705,38 @@ def archive_request(request_id, session=None):
             raise RucioException(error.args)
 
 
+@transactional_session
+def archive_requests(request_ids, session=None):
+    """
+    Move a list of requests to the history table with bulk statements.
+
+    :param request_ids:  List of Request-IDs as 32 character hex strings.
+    :param session:      Database session to use.
+    """
+
+    history_columns = ['id', 'created_at', 'request_type', 'scope', 'name', 'dest_rse_id', 'source_rse_id', 'attributes',
+                       'state', 'account', 'external_id', 'retry_count', 'err_msg', 'previous_attempt_id', 'external_host',
+                       'rule_id', 'activity', 'bytes', 'md5', 'adler32', 'dest_url', 'requested_at', 'submitted_at',
+                       'staging_started_at', 'staging_finished_at', 'started_at', 'estimated_started_at', 'estimated_at',
+                       'transferred_at', 'estimated_transferred_at']
+
+    for chunk in chunks(list(set(request_ids)), 100):
+        reqs = session.query(models.Request).filter(models.Request.id.in_(chunk)).all()
+        if not reqs:
+            continue
+        record_counter('core.request.archive', delta=len(reqs))
+        session.bulk_insert_mappings(models.Request.__history_mapper__.class_,
+                                     [dict((column, getattr(req, column)) for column in history_columns) for req in reqs])
+        for req in reqs:
+            time_diff = req.updated_at - req.created_at
+            record_timer('core.request.archive_request.%s' % req.activity.replace(' ', '_'), time_diff.seconds + time_diff.days * 24 * 3600)
+        try:
+            session.query(models.Source).filter(models.Source.request_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(models.Request).filter(models.Request.id.in_(chunk)).delete(synchronize_session=False)
+        except IntegrityError as error:
+            raise RucioException(error.args)
+
+
 @transactional_session
 def cancel_request_did(scope, name, dest_rse_id, request_type=RequestType.TRANSFER, session=None):
     """
@@ -753,6 +793,7 @@ def cancel_request_external_id(transfer_id, transfer_host):
 
 
 @read_session
+@read_from_primary
 def list_stagein_requests_and_source_replicas(total_workers=0, worker_number=0, limit=None, activity=None, older_than=None, rses=None, session=None):
     """
     List stagein requests with source replicas
@@ -909,6 +950,7 @@ def get_heavy_load_rses(threshold, session=None):
 
 
 @read_session
+@read_from_primary
 def get_stats_by_activity_direction_state(state, all_activities=False, direction='destination', session=None):
     """
     Retrieve statistics about requests by destination, activity and state.
@@ -1260,6 +1302,174 @@ def release_all_waiting_requests(rse_id, activity=None, account=None, direction=
         raise RucioException(error.args)
 
 
+class WaitingRequestQueues(object):
+    """
+    In-memory priority queues of the waiting requests, per RSE, activity and account.
+
+    The requests with the highest priority are released first and, for the same priority,
+    the ones that were requested first (FIFO). The queues are loaded once and then refreshed
+    incrementally with the requests which were updated since the previous refresh, so that
+    a release of k requests only costs O(k log n). A request whose priority changed is pushed
+    again with its new priority, its previous entry is skipped when popped. Requests which left
+    the waiting state in the meantime are dropped lazily when they are popped.
+
+    Only the fifo strategy is served from the queues: the grouped_fifo strategy and the release
+    per deadline or free volume still query the database on each release.
+    """
+
+    default_priority = 3
+    refresh_margin = 60     # seconds of overlap between two refreshes, for late commits
+    reload_interval = 3600  # seconds between two full reloads, to get rid of the stale entries
+
+    def __init__(self, direction='destination'):
+        """
+        :param direction:  Direction if requests are grouped by source RSE or destination RSE.
+        """
+        self.direction = direction
+        self.queues = {}  # {rse_id: {(activity, account): [(-priority, requested_at, request_id)]}}
+        self.entries = {}  # {request_id: (rse_id, (activity, account), entry)}, the current entry of each queued request
+        self.unconfirmed = set()  # requests released in a transaction of the caller, checked again on refresh
+        self.loaded_at = None
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Force a full reload of the queues on the next refresh.
+        """
+        self.loaded_at = None
+
+    @read_session
+    @read_from_primary
+    def refresh(self, session=None):
+        """
+        Add the requests which became waiting since the last refresh to the queues,
+        and requeue the known ones whose priority changed.
+
+        :param session:  The database session in use.
+        """
+        with self.lock:
+            now = datetime.datetime.utcnow()
+            full_reload = self.loaded_at is None or now - self.loaded_at > datetime.timedelta(seconds=self.reload_interval) or len(self.unconfirmed) > 1000
+
+            rse_column = models.Request.source_rse_id if self.direction == 'source' else models.Request.dest_rse_id
+            query = session.query(models.Request.id,
+                                  rse_column,
+                                  models.Request.activity,
+                                  models.Request.account,
+                                  models.Request.priority,
+                                  models.Request.requested_at)\
+                           .filter(models.Request.state == RequestState.WAITING)
+            if full_reload:
+                self.queues, self.entries, self.loaded_at = {}, {}, now
+            elif self.unconfirmed:
+                # the released requests whose transaction was rolled back are still waiting
+                query = query.filter(or_(models.Request.updated_at >= self.refreshed_at - datetime.timedelta(seconds=self.refresh_margin),
+                                         models.Request.id.in_(list(self.unconfirmed))))
+            else:
+                query = query.filter(models.Request.updated_at >= self.refreshed_at - datetime.timedelta(seconds=self.refresh_margin))
+            self.unconfirmed = set()
+
+            for request_id, rse_id, activity, account, priority, requested_at in query.yield_per(1000):
+                entry = (-(priority if priority is not None else self.default_priority), requested_at or datetime.datetime.max, request_id)
+                location = (rse_id, (activity, account), entry)
+                if self.entries.get(request_id) == location:
+                    continue
+                # the previous entry of a request whose priority changed stays in its queue until popped
+                self.entries[request_id] = location
+                queue = self.queues.setdefault(rse_id, {}).setdefault((activity, account), [])
+                if full_reload:
+                    queue.append(entry)
+                else:
+                    heapq.heappush(queue, entry)
+
+            if full_reload:
+                for rse_queues in self.queues.values():
+                    for queue in rse_queues.values():
+                        heapq.heapify(queue)
+            self.refreshed_at = now
+
+    def release(self, rse_id, count=None, activity=None, account=None, session=None):
+        """
+        Release the waiting requests with the highest priority, and requested first, of an RSE.
+
+        The popped requests are only dropped from the queues once the transaction is committed. Without
+        a session, the transaction is committed here and the requests are put back into the queues if it
+        fails. With the session of the caller, the outcome is unknown, so the released requests are checked
+        again on the next refresh and put back if they are still waiting.
+
+        :param rse_id:           The RSE id.
+        :param count:            The count to be released. If None, release all waiting requests.
+        :param activity:         The activity. If None, release requests of all activities.
+        :param account:          The account name whose requests to release. If None, release requests of all accounts.
+        :param session:          The database session in use.
+        :returns:                The number of released requests.
+        """
+        with self.lock:
+            popped = []
+            try:
+                rowcount = self.__release(rse_id, count=count, activity=activity, account=account, popped=popped, session=session)
+            except Exception:
+                # the transaction is rolled back, the popped requests are still waiting
+                for queue, entry in popped:
+                    heapq.heappush(queue, entry)
+                raise
+
+            for _, entry in popped:
+                self.entries.pop(entry[2], None)
+            if session is not None:
+                self.unconfirmed.update(entry[2] for _, entry in popped)
+            rse_queues = self.queues.get(rse_id, {})
+            for key in [key for key, queue in rse_queues.items() if not queue]:
+                del rse_queues[key]
+            return rowcount
+
+    @transactional_session
+    def __release(self, rse_id, count, activity, account, popped, session=None):
+        """
+        Pop the waiting requests to release from the queues and mark them as queued.
+
+        :param rse_id:           The RSE id.
+        :param count:            The count to be released. If None, release all waiting requests.
+        :param activity:         The activity. If None, release requests of all activities.
+        :param account:          The account name whose requests to release. If None, release requests of all accounts.
+        :param popped:           List to which the (queue, entry) popped from the queues are appended.
+        :param session:          The database session in use.
+        :returns:                The number of released requests.
+        """
+        keys, queues = [], []
+        for (queue_activity, queue_account), queue in self.queues.get(rse_id, {}).items():
+            if queue and activity in (None, queue_activity) and account in (None, queue_account):
+                keys.append((queue_activity, queue_account))
+                queues.append(queue)
+
+        # k-way pop over the heads of the matching queues
+        heads = [(queue[0], index) for index, queue in enumerate(queues)]
+        heapq.heapify(heads)
+        count = float('inf') if count is None else count
+        rowcount = 0
+        while rowcount < count and heads:
+            request_ids = []
+            while heads and len(request_ids) < count - rowcount:
+                entry, index = heads[0]
+                heapq.heappop(queues[index])
+                if self.entries.get(entry[2]) == (rse_id, keys[index], entry):
+                    popped.append((queues[index], entry))
+                    request_ids.append(entry[2])
+                if queues[index]:
+                    heapq.heapreplace(heads, (queues[index][0], index))
+                else:
+                    heapq.heappop(heads)
+
+            # the requests which are not waiting anymore are not updated, and replaced in the next round
+            for chunk in chunks(request_ids, 1000):
+                rowcount += session.query(models.Request)\
+                                   .filter(models.Request.id.in_(chunk),
+                                           models.Request.state == RequestState.WAITING)\
+                                   .update({'state': RequestState.QUEUED}, synchronize_session=False)
+        return rowcount
+
+
 @read_session
 def update_requests_priority(priority, filter, session=None):
     """
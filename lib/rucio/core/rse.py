@@ -37,20 +37,24 @@ try:
 except ImportError:
     from io import StringIO
 
+import datetime
 import json
 import sqlalchemy
 import sqlalchemy.orm
+import threading
 
+from collections import namedtuple
 from re import match
 from six import string_types
 
 from dogpile.cache import make_region
 from dogpile.cache.api import NO_VALUE
 
+from sqlalchemy import event
 from sqlalchemy.exc import DatabaseError, IntegrityError, OperationalError
-from sqlalchemy.orm import aliased
+from sqlalchemy.orm import aliased, scoped_session
 from sqlalchemy.orm.exc import FlushError
-from sqlalchemy.sql.expression import or_, false
+from sqlalchemy.sql.expression import or_, false, func
 
 import rucio.core.account_counter
 
@@ -60,7 +64,7 @@ from rucio.common.config import get_lfn2pfn_algorithm_default, config_get
 from rucio.common.utils import CHECKSUM_KEY, is_checksum_valid, GLOBALLY_SUPPORTED_CHECKSUMS
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import RSEType
-from rucio.db.sqla.session import read_session, transactional_session, stream_session
+from rucio.db.sqla.session import read_session, transactional_session, stream_session, read_from_primary
 
 
 REGION = make_region().configure('dogpile.cache.memcached',
@@ -68,6 +72,180 @@ REGION = make_region().configure('dogpile.cache.memcached',
                                  arguments={'url': config_get('cache', 'url', False, '127.0.0.1:11211'),
                                             'distributed_lock': True})
 
+RSEIndex = namedtuple('RSEIndex', ['rses', 'positions', 'attributes', 'all_rses'])
+
+
+class RSEAttributeIndex(object):
+    """
+    In-memory index of the RSEs and of their attributes, shared by all threads of a process.
+
+    Every RSE gets a position in a bitset, so that a set of RSEs can be represented by an
+    integer and combined with the bitwise operators. The index is rebuilt on next access
+    after a change of the RSEs or of their attributes done in this process is committed or
+    rolled back. A session with such pending changes gets an index of its own, which is
+    never shared. At most once per version_interval, a version of the rses and
+    rse_attr_map tables (row counts and latest updated_at) is read in a single query, and
+    the index is rebuilt if it changed, so that the changes done by other processes are
+    seen too. The index is also rebuilt when it is older than reload_interval. An index is
+    replaced, never modified in place.
+    """
+
+    def __init__(self, reload_interval=600, version_interval=10):
+        """
+        :param reload_interval: Seconds after which the index is rebuilt.
+        :param version_interval: Seconds after which the version of the tables is read again.
+        """
+        self.reload_interval = datetime.timedelta(seconds=reload_interval)
+        self.version_interval = datetime.timedelta(seconds=version_interval)
+        self.index = None
+        self.version = None
+        self.last_reload = None
+        self.last_version_check = None
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Force a rebuild of the index on next access.
+        """
+        self.generation += 1
+        self.last_reload = None
+
+    @staticmethod
+    def get_version(session):
+        """
+        Get the version of the RSEs and of their attributes, as seen by the session.
+
+        :param session: The database session in use.
+        :returns: Tuple with the count and the latest update of the RSEs and of the RSE attributes.
+        """
+        return tuple(session.query(session.query(func.count(models.RSE.id)).as_scalar(),
+                                   session.query(func.max(models.RSE.updated_at)).as_scalar(),
+                                   session.query(func.count(models.RSEAttrAssociation.rse_id)).as_scalar(),
+                                   session.query(func.max(models.RSEAttrAssociation.updated_at)).as_scalar()).one())
+
+    @staticmethod
+    def build(session):
+        """
+        Build an index of the RSEs and of their attributes, as seen by the session.
+
+        :param session: The database session in use.
+        :returns: RSEIndex.
+        """
+        rses, positions, attributes = [], {}, {}
+        for row in session.query(models.RSE).filter_by(deleted=False).order_by(models.RSE.rse):
+            positions[row.id] = len(rses)
+            rses.append(dict((column.name, getattr(row, column.name)) for column in row.__table__.columns))
+        query = session.query(models.RSEAttrAssociation.rse_id,
+                              models.RSEAttrAssociation.key,
+                              models.RSEAttrAssociation.value)
+        for rse_id, key, value in query:
+            if rse_id in positions:
+                attributes.setdefault(key, {})[positions[rse_id]] = value
+        return RSEIndex(rses=rses, positions=positions, attributes=attributes, all_rses=(1 << len(rses)) - 1)
+
+    def __is_outdated(self, version, now):
+        """
+        Tell if the index has to be rebuilt.
+
+        :param version: The current version of the RSEs and of their attributes.
+        :param now: The current time.
+        :returns: True if the index has to be rebuilt.
+        """
+        return self.last_reload is None or version != self.version or now - self.last_reload > self.reload_interval
+
+    @read_session
+    @read_from_primary
+    def get_index(self, session=None):
+        """
+        Get the RSE index, rebuilding it if needed.
+
+        :param session: The database session in use.
+        :returns: RSEIndex with the list of RSE dictionaries ordered by position, the
+                  dictionary {rse_id: position}, the dictionary {key: {position: value}}
+                  of the RSE attributes and the bitset of all RSEs.
+        """
+        if isinstance(session, scoped_session):
+            session = session()
+        if session.info.get('rse_index_changed'):
+            # The session sees its own uncommitted changes, which must not be shared
+            return self.build(session)
+
+        now = datetime.datetime.utcnow()
+        version = self.version
+        if self.last_version_check is None or now - self.last_version_check > self.version_interval:
+            version = self.get_version(session)
+            self.last_version_check = now
+        if self.__is_outdated(version, now):
+            with self.lock:
+                if self.__is_outdated(version, now):
+                    generation = self.generation
+                    index = self.build(session)
+                    if generation != self.generation:
+                        # Invalidated while building, the index may miss a committed change
+                        return index
+                    self.index = index
+                    self.version = version
+                    self.last_reload = now
+        return self.index
+
+
+RSE_ATTRIBUTE_INDEX = RSEAttributeIndex()
+
+
+def __invalidate_rse_index(session):
+    """
+    Invalidate the RSE index once the transaction is committed or rolled back. Until then,
+    the session builds its own index, so that it sees its changes without sharing them.
+
+    :param session: The database session in use.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    session.info['rse_index_changed'] = True
+
+
+@event.listens_for(sqlalchemy.orm.Session, 'after_flush')
+def __flush_rse_index_changes(session, flush_context):
+    """
+    Mark a session flushing RSEs or RSE attributes as having changed the RSE index.
+
+    :param session: The database session.
+    :param flush_context: The flush context.
+    """
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, (models.RSE, models.RSEAttrAssociation)):
+            session.info['rse_index_changed'] = True
+            return
+
+
+@event.listens_for(sqlalchemy.orm.Session, 'after_commit')
+@event.listens_for(sqlalchemy.orm.Session, 'after_rollback')
+def __end_rse_index_changes(session):
+    """
+    Invalidate the RSE index at the end of a transaction which changed the RSEs or their attributes.
+
+    :param session: The database session.
+    """
+    if session.info.pop('rse_index_changed', None):
+        RSE_ATTRIBUTE_INDEX.invalidate()
+
+
+def __invalidate_rse_info(rse, session):
+    """
+    Invalidate the protocol related information of an RSE cached by the rsemanager, now
+    and again once the transaction is committed, so that a concurrent reader cannot cache
+    the information as it was before the commit.
+
+    :param rse: The name of the RSE.
+    :param session: The database session in use.
+    """
+    from rucio.rse import rsemanager
+    rsemanager.invalidate_rse_info(rse)
+    if isinstance(session, scoped_session):
+        session = session()
+    event.listen(session, 'after_commit', lambda _: rsemanager.invalidate_rse_info(rse), once=True)
+
 
 @transactional_session
 def add_rse(rse, deterministic=True, volatile=False, city=None, region_code=None, country_name=None, continent=None, time_zone=None,
@@ -178,6 +356,8 @@ def del_rse(rse_id, session=None):
         raise exception.RSENotFound('RSE with id \'%s\' cannot be found' % rse_id)
     rse = old_rse.rse
     old_rse.delete(session=session)
+    __invalidate_rse_index(session)
+    __invalidate_rse_info(rse, session=session)
     try:
         del_rse_attribute(rse_id=rse_id, key=rse, session=session)
     except exception.RSEAttributeNotFound:
@@ -373,6 +553,8 @@ def add_rse_attribute(rse_id, key, value, session=None):
         new_rse_attr = models.RSEAttrAssociation(rse_id=rse_id, key=key, value=value)
         new_rse_attr = session.merge(new_rse_attr)
         new_rse_attr.save(session=session)
+        __invalidate_rse_index(session)
+        __invalidate_rse_info(get_rse_name(rse_id=rse_id, session=session), session=session)
     except IntegrityError:
         rse = get_rse_name(rse_id=rse_id, session=session)
         raise exception.Duplicate("RSE attribute '%(key)s-%(value)s\' for RSE '%(rse)s' already exists!" % locals())
@@ -397,6 +579,8 @@ def del_rse_attribute(rse_id, key, session=None):
     except sqlalchemy.orm.exc.NoResultFound:
         raise exception.RSEAttributeNotFound('RSE attribute \'%s\' cannot be found' % key)
     rse_attr.delete(session=session)
+    __invalidate_rse_index(session)
+    __invalidate_rse_info(get_rse_name(rse_id=rse_id, session=session), session=session)
     return True
 
 
@@ -872,10 +1056,12 @@ def add_protocol(rse_id, parameter, session=None):
              or match('.*OperationalError.*cannot be null.*', error.args[0]):
             raise exception.InvalidObject('Missing values!')
         raise error
+    __invalidate_rse_info(rse, session=session)
     return new_protocol
 
 
 @read_session
+@read_from_primary
 def get_rse_protocols(rse_id, schemes=None, session=None):
     """
     Returns protocol information. Parameter combinations are: (operation OR default) XOR scheme.
@@ -1084,6 +1270,7 @@ def update_protocols(rse_id, scheme, data, hostname, port, session=None):
                         val += 1
 
         up.update(data, flush=True, session=session)
+        __invalidate_rse_info(rse, session=session)
     except (IntegrityError, OperationalError) as error:
         if 'UNIQUE'.lower() in error.args[0].lower() or 'Duplicate' in error.args[0]:  # Covers SQLite, Oracle and MySQL error
             raise exception.Duplicate('Protocol \'%s\' on port %s already registered for  \'%s\' with hostname \'%s\'.' % (scheme, port, rse, hostname))
@@ -1145,6 +1332,7 @@ def del_protocols(rse_id, scheme, hostname=None, port=None, session=None):
                 for p in prots:
                     p.update({op_name: i})
                     i += 1
+    __invalidate_rse_info(rse_name, session=session)
 
 
 @transactional_session
@@ -1181,7 +1369,10 @@ def update_rse(rse_id, parameters, session=None):
             param[key] = parameters[key]
     param['availability'] = availability
     query.update(param)
+    __invalidate_rse_index(session)
+    __invalidate_rse_info(rse, session=session)
     if 'name' in parameters:
+        __invalidate_rse_info(parameters['name'], session=session)
         add_rse_attribute(rse_id=rse_id, key=parameters['name'], value=1, session=session)
         query = session.query(models.RSEAttrAssociation).filter_by(rse_id=rse_id).filter(models.RSEAttrAssociation.key == rse)
         rse_attr = query.one()
@@ -12,11 +12,13 @@
 # - Hannes Hansen, <hannes.jakob.hansen@cern.ch>, 2018-2019
 
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import bindparam, text
 
 from rucio.common.exception import CounterNotFound
+from rucio.common.utils import chunks
 from rucio.db.sqla import models
-from rucio.db.sqla.session import read_session, transactional_session
+from rucio.db.sqla.session import read_session, transactional_session, read_from_primary
 
 
 @transactional_session
@@ -94,6 +96,7 @@ def get_counter(rse_id, session=None):
 
 
 @read_session
+@read_from_primary
 def get_updated_rse_counters(total_workers, worker_number, session=None):
     """
     Get updated rse_counters.
@@ -120,6 +123,42 @@ def get_updated_rse_counters(total_workers, worker_number, session=None):
     return [result.rse_id for result in results]
 
 
+def __consume_updated_rse_counters(update_ids, session):
+    """
+    Sum the given updated_rse_counters per rse_id in the database,
+    add the sums to the rse_counters and delete the consumed rows.
+
+    :param update_ids:  The ids of the updated_rse_counters to consume.
+    :param session:     Database session in use.
+    """
+    deltas = {}
+    for chunk in chunks(update_ids, 1000):
+        query = session.query(models.UpdatedRSECounter.rse_id,
+                              func.sum(models.UpdatedRSECounter.files),
+                              func.sum(models.UpdatedRSECounter.bytes)).\
+            filter(models.UpdatedRSECounter.id.in_(chunk)).\
+            group_by(models.UpdatedRSECounter.rse_id)
+        for rse_id, files, bytes in query:
+            sum_files, sum_bytes = deltas.get(rse_id, (0, 0))
+            deltas[rse_id] = (sum_files + files, sum_bytes + bytes)
+
+    new_counters = []
+    for rse_id, (files, bytes) in deltas.items():
+        rowcount = session.query(models.RSEUsage).\
+            filter_by(rse_id=rse_id, source='rucio').\
+            update({'files': models.RSEUsage.files + files,
+                    'used': models.RSEUsage.used + bytes}, synchronize_session=False)
+        if not rowcount:
+            new_counters.append({'rse_id': rse_id, 'files': files, 'used': bytes, 'source': 'rucio'})
+    if new_counters:
+        session.bulk_insert_mappings(models.RSEUsage, new_counters)
+
+    for chunk in chunks(update_ids, 1000):
+        session.query(models.UpdatedRSECounter).\
+            filter(models.UpdatedRSECounter.id.in_(chunk)).\
+            delete(synchronize_session=False)
+
+
 @transactional_session
 def update_rse_counter(rse_id, session=None):
     """
@@ -129,22 +168,37 @@ def update_rse_counter(rse_id, session=None):
     :param session:  Database session in use.
     """
 
-    updated_rse_counters = session.query(models.UpdatedRSECounter).filter_by(rse_id=rse_id).all()
-    sum_bytes = sum([updated_rse_counter.bytes for updated_rse_counter in updated_rse_counters])
-    sum_files = sum([updated_rse_counter.files for updated_rse_counter in updated_rse_counters])
+    query = session.query(models.UpdatedRSECounter.id).filter_by(rse_id=rse_id)
+    __consume_updated_rse_counters(update_ids=[update_id for update_id, in query], session=session)
 
-    try:
-        rse_counter = session.query(models.RSEUsage).filter_by(rse_id=rse_id, source='rucio').one()
-        rse_counter.used += sum_bytes
-        rse_counter.files += sum_files
-    except NoResultFound:
-        models.RSEUsage(rse_id=rse_id,
-                        used=sum_bytes,
-                        files=sum_files,
-                        source='rucio').save(session=session)
 
-    for update in updated_rse_counters:
-        update.delete(flush=False, session=session)
+@transactional_session
+def update_rse_counters(total_workers, worker_number, limit=10000, session=None):
+    """
+    Read a bounded number of updated_rse_counters of this worker, for any rse_id,
+    and update the rse_counters.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param limit:              Maximum number of updated_rse_counters to read.
+    :param session:            Database session in use.
+    :returns:                  The number of updated_rse_counters read.
+    """
+    query = session.query(models.UpdatedRSECounter.id)
+
+    if total_workers > 0:
+        if session.bind.dialect.name == 'oracle':
+            bindparams = [bindparam('worker_number', worker_number),
+                          bindparam('total_workers', total_workers)]
+            query = query.filter(text('ORA_HASH(rse_id, :total_workers) = :worker_number', bindparams=bindparams))
+        elif session.bind.dialect.name == 'mysql':
+            query = query.filter(text('mod(md5(rse_id), %s) = %s' % (total_workers + 1, worker_number)))
+        elif session.bind.dialect.name == 'postgresql':
+            query = query.filter(text('mod(abs((\'x\'||md5(rse_id::text))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number)))
+
+    update_ids = [update_id for update_id, in query.limit(limit)]
+    __consume_updated_rse_counters(update_ids=update_ids, session=session)
+    return len(update_ids)
 
 
 @transactional_session
@@ -25,16 +25,16 @@
 import abc
 import re
 
-from dogpile.cache import make_region
-from dogpile.cache.api import NoValue
-from hashlib import sha256
 from six import add_metaclass
 
 from rucio.common import schema
-from rucio.common.config import config_get
+from rucio.common.config import config_get_int
 from rucio.common.exception import InvalidRSEExpression, RSEBlacklisted
-from rucio.core.rse import list_rses, get_rses_with_attribute, get_rse_attribute
+from rucio.common.utils import LRUCache
+from rucio.core.rse import list_rses, RSE_ATTRIBUTE_INDEX
+from rucio.db.sqla import models
 from rucio.db.sqla.session import transactional_session
+from rucio.db.sqla.types import BooleanString
 
 
 DEFAULT_RSE_ATTRIBUTE = schema.DEFAULT_RSE_ATTRIBUTE['pattern']
@@ -46,10 +46,8 @@ COMPLEMENT = r'(\\%s)' % (PRIMITIVE)
 
 PATTERN = r'^%s(%s|%s|%s)*' % (PRIMITIVE, UNION, INTERSECTION, COMPLEMENT)
 
-
-REGION = make_region().configure('dogpile.cache.memcached',
-                                 expiration_time=600,
-                                 arguments={'url': config_get('cache', 'url', False, '127.0.0.1:11211'), 'distributed_lock': True})
+# {expression: [compiled expression, RSE index used for the evaluation, bitset of the evaluated RSEs]}
+EXPRESSIONS = LRUCache(maxsize=config_get_int('core', 'rse_expression_cache_size', False, 1000))
 
 
 @transactional_session
@@ -63,35 +61,16 @@ def parse_expression(expression, filter=None, session=None):
     :returns:             A list of rse dictionaries.
     :raises:              InvalidRSEExpression, RSENotFound, RSEBlacklisted
     """
-    result = REGION.get(sha256(expression.encode()).hexdigest())
-    if type(result) is NoValue:
-        # Evaluate the correctness of the parentheses
-        parantheses_open_count = 0
-        parantheses_close_count = 0
-        for char in expression:
-            if (char == '('):
-                parantheses_open_count += 1
-            elif (char == ')'):
-                parantheses_close_count += 1
-            if (parantheses_close_count > parantheses_open_count):
-                raise InvalidRSEExpression('Problem with parantheses.')
-        if (parantheses_open_count != parantheses_close_count):
-            raise InvalidRSEExpression('Problem with parantheses.')
-
-        # Check the expression pattern
-        match = re.match(PATTERN, expression)
-        if match is None:
-            raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        else:
-            if match.group() != expression:
-                raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        result_tuple = __resolve_term_expression(expression)[0].resolve_elements(session=session)
-        # result_tuple = ([rse_ids], {rse_id: {rse_info}})
-        result = []
-        for rse in list(result_tuple[0]):
-            result.append(result_tuple[1][rse])
-        REGION.set(sha256(expression.encode()).hexdigest(), result)
-
+    index = RSE_ATTRIBUTE_INDEX.get_index(session=session)
+    cached = EXPRESSIONS.get(expression)
+    if cached is None:
+        cached = [compile_expression(expression), None, None]
+    if cached[1] is not index:
+        # Evaluate again the compiled expression against the current RSE index
+        cached = [cached[0], index, cached[0].resolve_elements(index=index, session=session)]
+    EXPRESSIONS.set(expression, cached)
+
+    result = [dict(index.rses[position]) for position in bitset_positions(cached[2])]
     if not result:
         raise InvalidRSEExpression('RSE Expression resulted in an empty set.')
 
@@ -111,6 +90,45 @@ def parse_expression(expression, filter=None, session=None):
     return final_result
 
 
+def compile_expression(expression):
+    """
+    Validate a RSE expression and compile it into a tree of BaseExpressionElement.
+
+    :param expression:    RSE expression, e.g: 'CERN|BNL'.
+    :returns:             The root BaseExpressionElement of the expression.
+    :raises:              InvalidRSEExpression
+    """
+    # Evaluate the correctness of the parentheses
+    parantheses_open_count = 0
+    for char in expression:
+        if char == '(':
+            parantheses_open_count += 1
+        elif char == ')':
+            parantheses_open_count -= 1
+            if parantheses_open_count < 0:
+                raise InvalidRSEExpression('Problem with parantheses.')
+    if parantheses_open_count != 0:
+        raise InvalidRSEExpression('Problem with parantheses.')
+
+    # Check the expression pattern
+    match = re.match(PATTERN, expression)
+    if match is None or match.group() != expression:
+        raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
+    return __resolve_term_expression(expression)[0]
+
+
+def bitset_positions(bitset):
+    """
+    Generator of the positions of the bits set in a bitset, from the lowest.
+
+    :param bitset:  The bitset as an integer.
+    """
+    while bitset:
+        lowest_bit = bitset & -bitset
+        yield lowest_bit.bit_length() - 1
+        bitset ^= lowest_bit
+
+
 def __resolve_term_expression(expression):
     """
     Resolves a Term Expression and returns an object of type BaseExpressionElement
@@ -212,13 +230,14 @@ def __extract_term(expression):
 @add_metaclass(abc.ABCMeta)
 class BaseExpressionElement:
     @abc.abstractmethod
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
-        Resolve the ExpressionElement and return a set of RSE ids
+        Resolve the ExpressionElement and return the set of RSEs as a bitset
 
+        :param index:    RSEIndex the bitset refers to
         :param session:  Database session in use
-        :returns:        (Set of RSE ids, Dictionary of RSE dicts)
-        :rtype:          (Set of Strings, Dictionary of RSE dicts organized by rse_id)
+        :returns:        Bitset of the positions of the RSEs in the index
+        :rtype:          Integer
         """
         pass
 
@@ -228,17 +247,11 @@ class RSEAll(BaseExpressionElement):
     Representation of all RSEs
     """
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        output = list_rses(session=session)
-        if not output:
-            return (set(), {})
-        rse_dict = {}
-        for rse in output:
-            rse_dict[rse['id']] = rse
-        return (set([rse['id'] for rse in output]), rse_dict)
+        return index.all_rses
 
 
 class RSEAttributeEqualCheck(BaseExpressionElement):
@@ -256,17 +269,25 @@ class RSEAttributeEqualCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        output = list_rses({self.key: self.value}, session=session)
-        if not output:
-            return (set(), {})
-        rse_dict = {}
-        for rse in output:
-            rse_dict[rse['id']] = rse
-        return (set([rse['id'] for rse in output]), rse_dict)
+        bitset = 0
+        if hasattr(models.RSE, self.key) or self.key in ['availability_read', 'availability_write', 'availability_delete']:
+            # Filters on the RSE columns are resolved by the database
+            for rse in list_rses({self.key: self.value}, session=session):
+                if rse['id'] in index.positions:
+                    bitset |= 1 << index.positions[rse['id']]
+            return bitset
+
+        # Compare the values as they are stored in the database
+        boolean_string = BooleanString()
+        value = boolean_string.process_bind_param(self.value, None)
+        for position, attribute_value in index.attributes.get(self.key, {}).items():
+            if boolean_string.process_bind_param(attribute_value, None) == value:
+                bitset |= 1 << position
+        return bitset
 
 
 class RSEAttributeSmallerCheck(BaseExpressionElement):
@@ -284,24 +305,18 @@ class RSEAttributeSmallerCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        rse_list = get_rses_with_attribute(key=self.key, session=session)
-        if not rse_list:
-            return (set(), {})
-
-        output = []
-        rse_dict = {}
-        for rse in rse_list:
+        bitset = 0
+        for position, attribute_value in index.attributes.get(self.key, {}).items():
             try:
-                if float(get_rse_attribute(key=self.key, rse_id=rse['id'], session=session)[0]) < float(self.value):
-                    rse_dict[rse['id']] = rse
-                    output.append(rse['id'])
+                if float(attribute_value) < float(self.value):
+                    bitset |= 1 << position
             except ValueError:
                 continue
-        return (set(output), rse_dict)
+        return bitset
 
 
 class RSEAttributeLargerCheck(BaseExpressionElement):
@@ -319,24 +334,18 @@ class RSEAttributeLargerCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        rse_list = get_rses_with_attribute(key=self.key, session=session)
-        if not rse_list:
-            return (set(), {})
-
-        output = []
-        rse_dict = {}
-        for rse in rse_list:
+        bitset = 0
+        for position, attribute_value in index.attributes.get(self.key, {}).items():
             try:
-                if float(get_rse_attribute(key=self.key, rse_id=rse['id'], session=session)[0]) > float(self.value):
-                    rse_dict[rse['id']] = rse
-                    output.append(rse['id'])
+                if float(attribute_value) > float(self.value):
+                    bitset |= 1 << position
             except ValueError:
                 continue
-        return (set(output), rse_dict)
+        return bitset
 
 
 @add_metaclass(abc.ABCMeta)
@@ -385,13 +394,11 @@ class ComplementOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] - right_term_tuple[0], dict(list(left_term_tuple[1].items()) + list(right_term_tuple[1].items())))
+        return self.left_term.resolve_elements(index=index, session=session) & ~self.right_term.resolve_elements(index=index, session=session)
 
 
 class UnionOperator(BaseRSEOperator):
@@ -419,13 +426,11 @@ class UnionOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] | right_term_tuple[0], dict(list(left_term_tuple[1].items()) + list(right_term_tuple[1].items())))
+        return self.left_term.resolve_elements(index=index, session=session) | self.right_term.resolve_elements(index=index, session=session)
 
 
 class IntersectOperator(BaseRSEOperator):
@@ -453,10 +458,8 @@ class IntersectOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] & right_term_tuple[0], dict(list(left_term_tuple[1].items()) + list(right_term_tuple[1].items())))
+        return self.left_term.resolve_elements(index=index, session=session) & self.right_term.resolve_elements(index=index, session=session)
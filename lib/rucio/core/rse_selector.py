@@ -14,16 +14,71 @@
 #
 # PY3K COMPATIBLE
 
+import time
+
 from random import uniform, shuffle
 
-from rucio.common.exception import InsufficientAccountLimit, InsufficientTargetRSEs, InvalidRuleWeight, RSEOverQuota
-from rucio.core.account import has_account_attribute, get_usage, get_all_rse_usages_per_account
-from rucio.core.account_limit import get_local_account_limit, get_global_account_limits
-from rucio.core.rse import list_rse_attributes, has_rse_attribute, get_rse_limits
-from rucio.core.rse_counter import get_counter as get_rse_counter
+from rucio.common.config import config_get_int
+from rucio.common.exception import InsufficientAccountLimit, InsufficientTargetRSEs, InvalidRuleWeight, RSEOverQuota, CounterNotFound
+from rucio.common.utils import chunks, LRUCache
+from rucio.core.account import has_account_attribute, get_all_rse_usages_per_account
+from rucio.core.account_limit import get_global_account_limits
+from rucio.db.sqla import models
 from rucio.db.sqla.session import read_session
 
 
+SNAPSHOTS = LRUCache(maxsize=config_get_int('core', 'rse_selector_snapshot_cache_size', False, 100))
+
+
+@read_session
+def get_rse_snapshot(account, rse_ids, weight=None, quota=True, session=None):
+    """
+    Load the attributes, account quota and space of a set of RSEs with one query per table.
+    If core.rse_selector_snapshot_ttl is set, the snapshots are shared in-process for this amount of seconds.
+
+    :param account:  The account owning the rule.
+    :param rse_ids:  List of RSE ids.
+    :param weight:   Name of the weight attribute to load.
+    :param quota:    If False, only the attributes are loaded.
+    :param session:  The database session in use.
+    :returns:        Dictionary {rse_id: {'attributes': {key: value}, 'local_limit': bytes or None, 'usage': bytes,
+                     'space_limit': bytes or None, 'space_used': bytes or None}}
+    """
+    ttl = config_get_int('core', 'rse_selector_snapshot_ttl', False, 0)
+    key = (account, weight, quota, tuple(sorted(rse_ids)))
+    if ttl > 0:
+        cached = SNAPSHOTS.get(key)
+        if cached is not None and cached[0] > time.time() - ttl:
+            return cached[1]
+
+    snapshot = {rse_id: {'attributes': {}, 'local_limit': None, 'usage': 0, 'space_limit': None, 'space_used': None} for rse_id in rse_ids}
+    keys = ['mock'] if weight is None else ['mock', weight]
+    for chunk in chunks(list(snapshot), 500):
+        for rse_id, attr_key, value in session.query(models.RSEAttrAssociation.rse_id, models.RSEAttrAssociation.key, models.RSEAttrAssociation.value).\
+                filter(models.RSEAttrAssociation.rse_id.in_(chunk), models.RSEAttrAssociation.key.in_(keys)):
+            snapshot[rse_id]['attributes'][attr_key] = value
+
+        if not quota:
+            continue
+
+        for rse_id, value in session.query(models.AccountLimit.rse_id, models.AccountLimit.bytes).\
+                filter(models.AccountLimit.account == account, models.AccountLimit.rse_id.in_(chunk)):
+            snapshot[rse_id]['local_limit'] = float('inf') if value == -1 else value
+        for rse_id, value in session.query(models.AccountUsage.rse_id, models.AccountUsage.bytes).\
+                filter(models.AccountUsage.account == account, models.AccountUsage.rse_id.in_(chunk)):
+            snapshot[rse_id]['usage'] = value
+        for rse_id, value in session.query(models.RSELimit.rse_id, models.RSELimit.value).\
+                filter(models.RSELimit.name == 'MaxSpaceAvailable', models.RSELimit.rse_id.in_(chunk)):
+            snapshot[rse_id]['space_limit'] = value
+        for rse_id, value in session.query(models.RSEUsage.rse_id, models.RSEUsage.used).\
+                filter(models.RSEUsage.source == 'rucio', models.RSEUsage.rse_id.in_(chunk)):
+            snapshot[rse_id]['space_used'] = value
+
+    if ttl > 0:
+        SNAPSHOTS.set(key, (time.time(), snapshot))
+    return snapshot
+
+
 class RSESelector():
     """
     Representation of the RSE selector
@@ -45,9 +100,11 @@ class RSESelector():
         self.account = account
         self.rses = []  # [{'rse_id':, 'weight':, 'staging_area'}]
         self.copies = copies
+        ignore_quota = ignore_account_limit or has_account_attribute(account=account, key='admin', session=session)
+        snapshot = get_rse_snapshot(account=account, rse_ids=[rse['id'] for rse in rses], weight=weight, quota=not ignore_quota, session=session)
         if weight is not None:
             for rse in rses:
-                attributes = list_rse_attributes(rse_id=rse['id'], session=session)
+                attributes = snapshot[rse['id']]['attributes']
                 availability_write = True if rse.get('availability', 7) & 2 else False
                 if weight not in attributes:
                     continue  # The RSE does not have the required weight set, therefore it is ignored
@@ -61,7 +118,7 @@ class RSESelector():
                     raise InvalidRuleWeight('The RSE \'%s\' has a non-number specified for the weight \'%s\'' % (rse['rse'], weight))
         else:
             for rse in rses:
-                mock_rse = has_rse_attribute(rse['id'], 'mock', session=session)
+                mock_rse = 'mock' in snapshot[rse['id']]['attributes']
                 availability_write = True if rse.get('availability', 7) & 2 else False
                 self.rses.append({'rse_id': rse['id'],
                                   'weight': 1,
@@ -73,7 +130,7 @@ class RSESelector():
             raise InsufficientTargetRSEs('Target RSE set not sufficient for number of copies. (%s copies requested, RSE set size %s)' % (self.copies, len(self.rses)))
 
         rses_with_enough_quota = []
-        if has_account_attribute(account=account, key='admin', session=session) or ignore_account_limit:
+        if ignore_quota:
             for rse in self.rses:
                 rse['quota_left'] = float('inf')
                 rse['space_left'] = float('inf')
@@ -87,13 +144,14 @@ class RSESelector():
                     rse['space_left'] = float('inf')
                     rses_with_enough_quota.append(rse)
                 else:
+                    rse_snapshot = snapshot[rse['rse_id']]
                     # check local quota
                     local_quota_left = None
-                    quota_limit = get_local_account_limit(account=account, rse_id=rse['rse_id'], session=session)
+                    quota_limit = rse_snapshot['local_limit']
                     if quota_limit is None:
                         local_quota_left = 0
                     else:
-                        local_quota_left = quota_limit - get_usage(rse_id=rse['rse_id'], account=account, session=session)['bytes']
+                        local_quota_left = quota_limit - rse_snapshot['usage']
 
                     # check global quota
                     rse['global_quota_left'] = {}
@@ -116,11 +174,13 @@ class RSESelector():
                                 rse['global_quota_left'][rse_expression] = global_quota_left
                     if local_quota_left > 0 and all_global_quota_enough:
                         rse['quota_left'] = local_quota_left
-                        space_limit = get_rse_limits(name='MaxSpaceAvailable', rse_id=rse['rse_id'], session=session).get('MaxSpaceAvailable')
+                        space_limit = rse_snapshot['space_limit']
                         if space_limit is None or space_limit < 0:
                             rse['space_left'] = float('inf')
+                        elif rse_snapshot['space_used'] is None:
+                            raise CounterNotFound()
                         else:
-                            rse['space_left'] = space_limit - get_rse_counter(rse_id=rse['rse_id'], session=session)['bytes']
+                            rse['space_left'] = space_limit - rse_snapshot['space_used']
                         rses_with_enough_quota.append(rse)
 
         self.rses = rses_with_enough_quota
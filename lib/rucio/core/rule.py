@@ -63,7 +63,7 @@ from rucio.common.exception import (InvalidRSEExpression, InvalidReplicationRule
                                     ManualRuleApprovalBlocked, UnsupportedOperation, UndefinedPolicy)
 from rucio.common.schema import validate_schema
 from rucio.common.types import InternalScope, InternalAccount
-from rucio.common.utils import str_to_date, sizefmt
+from rucio.common.utils import chunks, str_to_date, sizefmt
 from rucio.core import account_counter, rse_counter, request as request_core
 from rucio.core.account import get_account
 from rucio.core.lifetime_exception import define_eol
@@ -77,7 +77,7 @@ from rucio.db.sqla import models
 from rucio.db.sqla.constants import (LockState, ReplicaState, RuleState, RuleGrouping,
                                      DIDAvailability, DIDReEvaluation, DIDType,
                                      RequestType, RuleNotification, OBSOLETE, RSEType)
-from rucio.db.sqla.session import read_session, transactional_session, stream_session
+from rucio.db.sqla.session import read_session, transactional_session, stream_session, read_from_primary
 from rucio.extensions.forecast import T3CModel
 
 logging.basicConfig(stream=sys.stdout,
@@ -1468,6 +1468,112 @@ def re_evaluate_did(scope, name, rule_evaluation_action, session=None):
     else:
         __evaluate_did_detach(did, session=session)
 
+    __update_re_evaluated_did(did, session=session)
+
+
+@transactional_session
+def re_evaluate_dids(dids, session=None):
+    """
+    Re-Evaluates a batch of dids in a single transaction.
+
+    The dids, all their parents, the rules of both and the new children of the dids are
+    resolved with set-based queries for the whole batch, then every did is evaluated for
+    its actions on the resolved rules. The rules are locked for the whole transaction.
+
+    :param dids:     List of (scope, name, [rule_evaluation_action]) of the dids to be re-evaluated.
+    :param session:  The database session in use.
+    :returns:        List of (scope, name) of the dids which do not exist.
+    """
+
+    with record_timer_block('rule.re_evaluate_dids.resolve'):
+        keys = [(scope, name) for scope, name, _ in dids]
+
+        # Get the dids
+        eval_dids = {}
+        for chunk in chunks(keys, 50):
+            query = session.query(models.DataIdentifier).\
+                filter(or_(*[and_(models.DataIdentifier.scope == scope,
+                                  models.DataIdentifier.name == name) for scope, name in chunk]))
+            for did in query:
+                eval_dids[(did.scope, did.name)] = did
+
+        # Get all parents of the dids, one level at a time
+        parents = {}  # {(scope, name): [(scope, name)]}
+        level = list(eval_dids)
+        while level:
+            next_level = []
+            for chunk in chunks(level, 50):
+                query = session.query(models.DataIdentifierAssociation.child_scope,
+                                      models.DataIdentifierAssociation.child_name,
+                                      models.DataIdentifierAssociation.scope,
+                                      models.DataIdentifierAssociation.name).\
+                    filter(or_(*[and_(models.DataIdentifierAssociation.child_scope == scope,
+                                      models.DataIdentifierAssociation.child_name == name) for scope, name in chunk]))
+                for child_scope, child_name, scope, name in query:
+                    parents.setdefault((child_scope, child_name), []).append((scope, name))
+                    if (scope, name) not in parents and (scope, name) not in next_level:
+                        next_level.append((scope, name))
+                        parents[(scope, name)] = []
+            level = next_level
+
+        # Get and lock all RR of the dids and their parents
+        rules = {}  # {(scope, name): [rule]}
+        for chunk in chunks(list(set(list(eval_dids) + list(parents))), 50):
+            query = session.query(models.ReplicationRule).\
+                filter(or_(*[and_(models.ReplicationRule.scope == scope,
+                                  models.ReplicationRule.name == name) for scope, name in chunk])).\
+                with_for_update(nowait=True)
+            for rule in query:
+                rules.setdefault((rule.scope, rule.name), []).append(rule)
+
+        # Get the new children of the dids to attach
+        new_child_dids = {}  # {(scope, name): [DataIdentifierAssociation]}
+        attach_keys = [(scope, name) for scope, name, actions in dids if DIDReEvaluation.ATTACH in actions and (scope, name) in eval_dids]
+        for chunk in chunks(attach_keys, 50):
+            query = session.query(models.DataIdentifierAssociation).\
+                filter(or_(*[and_(models.DataIdentifierAssociation.scope == scope,
+                                  models.DataIdentifierAssociation.name == name) for scope, name in chunk]),
+                       models.DataIdentifierAssociation.rule_evaluation == True)  # noqa
+            for did in query:
+                new_child_dids.setdefault((did.scope, did.name), []).append(did)
+
+    not_found = []
+    for scope, name, actions in dids:
+        did = eval_dids.get((scope, name))
+        if did is None:
+            not_found.append((scope, name))
+            continue
+
+        # Collect the rules of the did and of all its parents
+        did_rules, seen, stack = [], set(), [(scope, name)]
+        while stack:
+            key = stack.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+            did_rules.extend(rules.get(key, []))
+            stack.extend(parents.get(key, []))
+
+        for rule_evaluation_action in actions:
+            if rule_evaluation_action == DIDReEvaluation.ATTACH:
+                __evaluate_did_attach(did, rules=did_rules, new_child_dids=new_child_dids.get((scope, name), []), session=session)
+            else:
+                __evaluate_did_detach(did, rules=did_rules, session=session)
+
+        __update_re_evaluated_did(did, session=session)
+    return not_found
+
+
+@transactional_session
+def __update_re_evaluated_did(did, session=None):
+    """
+    Update the size and length of a re-evaluated did and mark its collection replicas for update.
+
+    :param did:      The did object in use.
+    :param session:  The database session in use.
+    """
+    scope, name = did.scope, did.name
+
     # Update size and length of did
     if session.bind.dialect.name == 'oracle':
         stmt = session.query(func.sum(models.DataIdentifierAssociation.bytes),
@@ -1488,6 +1594,7 @@ def re_evaluate_did(scope, name, rule_evaluation_action, session=None):
 
 
 @read_session
+@read_from_primary
 def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[], session=None):
     """
     Get updated dids.
@@ -1529,6 +1636,7 @@ def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[
 
 
 @read_session
+@read_from_primary
 def get_rules_beyond_eol(date_check, worker_number, total_workers, session):
     """
     Get rules which have eol_at before a certain date.
@@ -1559,6 +1667,7 @@ def get_rules_beyond_eol(date_check, worker_number, total_workers, session):
 
 
 @read_session
+@read_from_primary
 def get_expired_rules(total_workers, worker_number, limit=100, blacklisted_rules=[], session=None):
     """
     Get expired rules.
@@ -1601,6 +1710,7 @@ def get_expired_rules(total_workers, worker_number, limit=100, blacklisted_rules
 
 
 @read_session
+@read_from_primary
 def get_injected_rules(total_workers, worker_number, limit=100, blacklisted_rules=[], session=None):
     """
     Get rules to be injected.
@@ -1649,6 +1759,7 @@ def get_injected_rules(total_workers, worker_number, limit=100, blacklisted_rule
 
 
 @read_session
+@read_from_primary
 def get_stuck_rules(total_workers, worker_number, delta=600, limit=10, blacklisted_rules=[], session=None):
     """
     Get stuck rules.
@@ -1716,6 +1827,18 @@ def delete_updated_did(id, session=None):
     session.query(models.UpdatedDID).filter(models.UpdatedDID.id == id).delete()
 
 
+@transactional_session
+def delete_updated_dids(ids, session=None):
+    """
+    Bulk delete updated_dids by id.
+
+    :param ids:                     List of ids of the rows to delete.
+    :param session:                 The database session in use.
+    """
+    for chunk in chunks(ids, 1000):
+        session.query(models.UpdatedDID).filter(models.UpdatedDID.id.in_(chunk)).delete(synchronize_session=False)
+
+
 @transactional_session
 def update_rules_for_lost_replica(scope, name, rse_id, nowait=False, session=None):
     """
@@ -2360,24 +2483,26 @@ def __find_stuck_locks_and_repair_them(datasetfiles, locks, replicas, source_rep
 
 
 @transactional_session
-def __evaluate_did_detach(eval_did, session=None):
+def __evaluate_did_detach(eval_did, rules=None, session=None):
     """
     Evaluate a parent did which has children removed.
 
     :param eval_did:  The did object in use.
+    :param rules:     The rules of eval_did and its parents, already locked, if resolved for a batch of dids.
     :param session:   The database session in use.
     """
 
     logging.info("Re-Evaluating did %s:%s for DETACH", eval_did.scope, eval_did.name)
 
     with record_timer_block('rule.evaluate_did_detach'):
-        # Get all parent DID's
-        parent_dids = rucio.core.did.list_all_parent_dids(scope=eval_did.scope, name=eval_did.name, session=session)
+        if rules is None:
+            # Get all parent DID's
+            parent_dids = rucio.core.did.list_all_parent_dids(scope=eval_did.scope, name=eval_did.name, session=session)
 
-        # Get all RR from parents and eval_did
-        rules = session.query(models.ReplicationRule).filter_by(scope=eval_did.scope, name=eval_did.name).with_for_update(nowait=True).all()
-        for did in parent_dids:
-            rules.extend(session.query(models.ReplicationRule).filter_by(scope=did['scope'], name=did['name']).with_for_update(nowait=True).all())
+            # Get all RR from parents and eval_did
+            rules = session.query(models.ReplicationRule).filter_by(scope=eval_did.scope, name=eval_did.name).with_for_update(nowait=True).all()
+            for did in parent_dids:
+                rules.extend(session.query(models.ReplicationRule).filter_by(scope=did['scope'], name=did['name']).with_for_update(nowait=True).all())
 
         # Iterate rules and delete locks
         transfers_to_delete = []  # [{'scope': , 'name':, 'rse_id':}]
@@ -2446,43 +2571,50 @@ def __evaluate_did_detach(eval_did, session=None):
 
 
 @transactional_session
-def __evaluate_did_attach(eval_did, session=None):
+def __evaluate_did_attach(eval_did, rules=None, new_child_dids=None, session=None):
     """
     Evaluate a parent did which has new childs
 
-    :param eval_did:  The did object in use.
-    :param session:   The database session in use.
-    :raises:          ReplicationRuleCreationTemporaryFailed
+    :param eval_did:        The did object in use.
+    :param rules:           The rules of eval_did and its parents, already locked, if resolved for a batch of dids.
+    :param new_child_dids:  The new child associations of eval_did, if resolved for a batch of dids.
+    :param session:         The database session in use.
+    :raises:                ReplicationRuleCreationTemporaryFailed
     """
 
     logging.info("Re-Evaluating did %s:%s for ATTACH", eval_did.scope, eval_did.name)
 
     with record_timer_block('rule.evaluate_did_attach'):
-        # Get all parent DID's
-        with record_timer_block('rule.evaluate_did_attach.list_parent_dids'):
-            parent_dids = rucio.core.did.list_all_parent_dids(scope=eval_did.scope, name=eval_did.name, session=session)
-
-        # Get immediate new child DID's
-        with record_timer_block('rule.evaluate_did_attach.list_new_child_dids'):
-            new_child_dids = session.query(models.DataIdentifierAssociation).filter(
-                models.DataIdentifierAssociation.scope == eval_did.scope,
-                models.DataIdentifierAssociation.name == eval_did.name,
-                models.DataIdentifierAssociation.rule_evaluation == True).all()  # noqa
+        if rules is None:
+            # Get all parent DID's
+            with record_timer_block('rule.evaluate_did_attach.list_parent_dids'):
+                parent_dids = rucio.core.did.list_all_parent_dids(scope=eval_did.scope, name=eval_did.name, session=session)
+
+        if new_child_dids is None:
+            # Get immediate new child DID's
+            with record_timer_block('rule.evaluate_did_attach.list_new_child_dids'):
+                new_child_dids = session.query(models.DataIdentifierAssociation).filter(
+                    models.DataIdentifierAssociation.scope == eval_did.scope,
+                    models.DataIdentifierAssociation.name == eval_did.name,
+                    models.DataIdentifierAssociation.rule_evaluation == True).all()  # noqa
 
         if new_child_dids:
             # Get all unsuspended RR from parents and eval_did
             with record_timer_block('rule.evaluate_did_attach.get_rules'):
-                rule_clauses = []
-                for did in parent_dids:
-                    rule_clauses.append(and_(models.ReplicationRule.scope == did['scope'],
-                                             models.ReplicationRule.name == did['name']))
-                rule_clauses.append(and_(models.ReplicationRule.scope == eval_did.scope,
-                                         models.ReplicationRule.name == eval_did.name))
-                rules = session.query(models.ReplicationRule).filter(
-                    or_(*rule_clauses),
-                    models.ReplicationRule.state != RuleState.SUSPENDED,
-                    models.ReplicationRule.state != RuleState.WAITING_APPROVAL,
-                    models.ReplicationRule.state != RuleState.INJECT).with_for_update(nowait=True).all()
+                if rules is None:
+                    rule_clauses = []
+                    for did in parent_dids:
+                        rule_clauses.append(and_(models.ReplicationRule.scope == did['scope'],
+                                                 models.ReplicationRule.name == did['name']))
+                    rule_clauses.append(and_(models.ReplicationRule.scope == eval_did.scope,
+                                             models.ReplicationRule.name == eval_did.name))
+                    rules = session.query(models.ReplicationRule).filter(
+                        or_(*rule_clauses),
+                        models.ReplicationRule.state != RuleState.SUSPENDED,
+                        models.ReplicationRule.state != RuleState.WAITING_APPROVAL,
+                        models.ReplicationRule.state != RuleState.INJECT).with_for_update(nowait=True).all()
+                else:
+                    rules = [rule for rule in rules if rule.state not in (RuleState.SUSPENDED, RuleState.WAITING_APPROVAL, RuleState.INJECT)]
 
             if rules:
                 # Resolve the new_child_dids to its locks
@@ -120,7 +120,7 @@ def get_stagein_requests_and_source_replicas(total_workers=0, worker_number=0, f
                         rse_attrs[source_rse_id] = get_rse_attributes(rse_id=source_rse_id, session=session)
 
                     if source_rse_id not in protocols:
-                        protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes)
+                        protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes, pooled=True)
 
                     # we need to set the spacetoken if we use SRM
                     dest_spacetoken = None
@@ -153,7 +153,7 @@ def get_stagein_requests_and_source_replicas(total_workers=0, worker_number=0, f
                         rse_attrs[source_rse_id] = get_rse_attributes(rse_id=source_rse_id, session=session)
 
                     if source_rse_id not in protocols:
-                        protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes)
+                        protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes, pooled=True)
 
                     # we need to set the spacetoken if we use SRM
                     dest_spacetoken = None
@@ -20,12 +20,14 @@ from __future__ import division
 
 import copy
 import datetime
+import heapq
 import imp
 import json
 import logging
 import time
 import traceback
 
+from collections import namedtuple
 from dogpile.cache import make_region
 from dogpile.cache.api import NoValue
 from sqlalchemy import and_
@@ -42,6 +44,7 @@ from rucio.common.utils import construct_surl
 from rucio.common.constants import SUPPORTED_PROTOCOLS
 from rucio.core import did, message as message_core, request as request_core
 from rucio.core.config import get as core_config_get
+from rucio.core.distance import DISTANCE_GRAPH
 from rucio.core.monitor import record_counter, record_timer
 from rucio.core.replica import add_replicas
 from rucio.core.request import queue_requests, set_requests_state
@@ -49,7 +52,7 @@ from rucio.core.rse import get_rse_name, list_rses, get_rse_supported_checksums
 from rucio.core.rse_expression_parser import parse_expression
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import DIDType, RequestState, FTSState, RSEType, RequestType, ReplicaState
-from rucio.db.sqla.session import read_session, transactional_session
+from rucio.db.sqla.session import read_session, transactional_session, read_from_primary
 from rucio.rse import rsemanager as rsemgr
 from rucio.transfertool.fts3 import FTS3Transfertool
 from rucio.common.config import config_get
@@ -77,6 +80,11 @@ Requests accessed by request_id  are covered in the core request.py
 REGION_SHORT = make_region().configure('dogpile.cache.memcached',
                                        expiration_time=600,
                                        arguments={'url': config_get('cache', 'url', False, '127.0.0.1:11211'), 'distributed_lock': True})
+REGION_MEMORY = make_region().configure('dogpile.cache.memory',
+                                        expiration_time=600)
+
+NoMatchingScheme = namedtuple('NoMatchingScheme', ['args'])
+
 TRANSFER_TOOL = config_get('conveyor', 'transfertool', False, None)
 
 
@@ -454,86 +462,62 @@ def get_hops(source_rse_id, dest_rse_id, include_multihop=False, session=None):
     :raises:                   NoDistance
     """
 
-    # TODO: Might be problematic to always load the distance_graph, since it might be expensive
     # TODO: Have an rse_expression to specify the eligible hops
 
-    # Load the graph from the distances table
-    # distance_graph = __load_distance_graph(session=session)
-    distance_graph = __load_distance_edges_node(rse_id=source_rse_id, session=session)
-
     # 1. Check if there is a direct connection between source and dest:
-    if distance_graph.get(source_rse_id, {dest_rse_id, None}).get(dest_rse_id) is not None:
+    if DISTANCE_GRAPH.get_edges(rse_id=source_rse_id, session=session).get(dest_rse_id) is not None:
         # Check if there is a protocol match between the two RSEs
-        try:
-            matching_scheme = rsemgr.find_matching_scheme(rse_settings_dest=__load_rse_settings(rse_id=dest_rse_id, session=session),
-                                                          rse_settings_src=__load_rse_settings(rse_id=source_rse_id, session=session),
-                                                          operation_src='third_party_copy',
-                                                          operation_dest='third_party_copy',
-                                                          domain='wan')
+        matching_scheme = __find_matching_scheme(src_rse_id=source_rse_id, dest_rse_id=dest_rse_id, session=session)
+        if not isinstance(matching_scheme, NoMatchingScheme):
             return [{'source_rse_id': source_rse_id,
                      'dest_rse_id': dest_rse_id,
                      'source_scheme': matching_scheme[1],
                      'dest_scheme': matching_scheme[0],
                      'source_scheme_priority': matching_scheme[3],
                      'dest_scheme_priority': matching_scheme[2]}]
-        except RSEProtocolNotSupported as error:
-            if include_multihop:
-                # Delete the edge from the graph
-                del distance_graph[source_rse_id][dest_rse_id]
-            else:
-                raise error
+        elif not include_multihop:
+            raise RSEProtocolNotSupported(*matching_scheme.args)
 
     if not include_multihop:
         raise NoDistance()
 
     # 2. There is no connection or no scheme match --> Try a multi hop --> Dijkstra algorithm
-    HOP_PENALTY = core_config_get('transfers', 'hop_penalty', default=5, session=session)  # Penalty to be applied to each further hop
+    HOP_PENALTY = int(core_config_get('transfers', 'hop_penalty', default=5, session=session))  # Penalty to be applied to each further hop
 
-    visited_nodes = {source_rse_id: {'distance': 0,
-                                     'path': []}}  # Dijkstra already visisted nodes
-    # {rse_id: {'path': [{'source_rse_id':, 'dest_rse_id':, 'source_scheme', 'dest_scheme': }],
-    #           'distance': X}
-    # }
-    to_visit = [source_rse_id]  # Nodes to visit, once list is empty, break loop
-    local_optimum = 9999  # Local optimum to accelerated search
+    distance_graph = DISTANCE_GRAPH.get_graph(session=session)
+    distances = {source_rse_id: 0}
+    paths = {source_rse_id: []}  # [{'source_rse_id':, 'dest_rse_id':, 'source_scheme', 'dest_scheme': }]
+    visited_nodes = set()
+    to_visit = [(0, source_rse_id)]  # Heap of (distance, rse_id) to visit
 
     while to_visit:
-        for current_node in copy.deepcopy(to_visit):
-            to_visit.remove(current_node)
-            current_distance = visited_nodes[current_node]['distance']
-            current_path = visited_nodes[current_node]['path']
-
-            if current_node not in distance_graph:
-                distance_graph[current_node] = __load_distance_edges_node(rse_id=current_node, session=session)[current_node]
-
-            for out_v in distance_graph[current_node]:
-                # Check if the distance would be smaller
-                if visited_nodes.get(out_v, {'distance': 9999})['distance'] > current_distance + distance_graph[current_node][out_v] + HOP_PENALTY\
-                   and local_optimum > current_distance + distance_graph[current_node][out_v] + HOP_PENALTY:
-                    # Check if there is a compatible protocol pair
-                    try:
-                        matching_scheme = rsemgr.find_matching_scheme(rse_settings_dest=__load_rse_settings(rse_id=out_v, session=session),
-                                                                      rse_settings_src=__load_rse_settings(rse_id=current_node, session=session),
-                                                                      operation_src='third_party_copy',
-                                                                      operation_dest='third_party_copy',
-                                                                      domain='wan')
-                        visited_nodes[out_v] = {'distance': current_distance + distance_graph[current_node][out_v] + HOP_PENALTY,
-                                                'path': current_path + [{'source_rse_id': current_node,
-                                                                         'dest_rse_id': out_v,
-                                                                         'source_scheme': matching_scheme[1],
-                                                                         'dest_scheme': matching_scheme[0],
-                                                                         'source_scheme_priority': matching_scheme[3],
-                                                                         'dest_scheme_priority': matching_scheme[2]}]}
-                        if out_v != dest_rse_id:
-                            to_visit.append(out_v)
-                        else:
-                            local_optimum = current_distance + distance_graph[current_node][out_v] + HOP_PENALTY
-                    except RSEProtocolNotSupported:
-                        pass
-    if dest_rse_id in visited_nodes:
-        return visited_nodes[dest_rse_id]['path']
-    else:
-        raise NoDistance()
+        current_distance, current_node = heapq.heappop(to_visit)
+        if current_node == dest_rse_id:
+            return paths[dest_rse_id]
+        if current_node in visited_nodes:
+            continue
+        visited_nodes.add(current_node)
+
+        for out_v, ranking in distance_graph.get(current_node, {}).items():
+            if ranking is None or out_v in visited_nodes:
+                continue
+            # Check if the distance would be smaller
+            new_distance = current_distance + ranking + HOP_PENALTY
+            if out_v in distances and distances[out_v] <= new_distance:
+                continue
+            # Check if there is a compatible protocol pair
+            matching_scheme = __find_matching_scheme(src_rse_id=current_node, dest_rse_id=out_v, session=session)
+            if isinstance(matching_scheme, NoMatchingScheme):
+                continue
+            distances[out_v] = new_distance
+            paths[out_v] = paths[current_node] + [{'source_rse_id': current_node,
+                                                   'dest_rse_id': out_v,
+                                                   'source_scheme': matching_scheme[1],
+                                                   'dest_scheme': matching_scheme[0],
+                                                   'source_scheme_priority': matching_scheme[3],
+                                                   'dest_scheme_priority': matching_scheme[2]}]
+            heapq.heappush(to_visit, (new_distance, out_v))
+    raise NoDistance()
 
 
 def get_attributes(attributes):
@@ -690,7 +674,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
             # Get source protocol
             source_rse_id_key = 'read_%s_%s' % (source_rse_id, source_protocol)
             if source_rse_id_key not in protocols:
-                protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', source_protocol)
+                protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', source_protocol, pooled=True)
 
             # If the request_id is not already in the transfer dictionary, need to compute the destination URL
             if req_id not in transfers:
@@ -703,7 +687,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 # I.1 - Get destination protocol
                 dest_rse_id_key = 'write_%s_%s' % (dest_rse_id, destination_protocol)
                 if dest_rse_id_key not in protocols:
-                    protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', destination_protocol)
+                    protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', destination_protocol, pooled=True)
 
                 # I.2 - Get dest space token
                 dest_spacetoken = None
@@ -854,7 +838,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                     transfers[req_id]['dest_scheme_priority'] = dest_scheme_priority
                     dest_rse_id_key = 'write_%s_%s' % (dest_rse_id, destination_protocol)
                     if dest_rse_id_key not in protocols:
-                        protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', destination_protocol)
+                        protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', destination_protocol, pooled=True)
 
                     # I.2.1 - Get dest space token
                     dest_spacetoken = None
@@ -984,7 +968,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 # Compute the source URL. We don't need to fill the rse_mapping and rse_attrs for the intermediate RSEs cause it has already been done before
                 source_rse_id_key = 'read_%s_%s' % (source_rse_id, source_protocol)
                 if source_rse_id_key not in protocols:
-                    protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', source_protocol)
+                    protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', source_protocol, pooled=True)
                 source_url = list(protocols[source_rse_id_key].lfns2pfns(lfns={'scope': scope, 'name': name, 'path': path}).values())[0]
 
                 if transfers[req_id]['file_metadata']['dest_rse_id'] != hop['dest_rse_id']:
@@ -1044,7 +1028,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                     destination_protocol = hop['dest_scheme']
                     dest_rse_id_key = 'write_%s_%s' % (dest_rse_id, destination_protocol)
                     if dest_rse_id_key not in protocols:
-                        protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', destination_protocol)
+                        protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', destination_protocol, pooled=True)
 
                     # I.2 - Get dest space token
                     dest_spacetoken = None
@@ -1140,6 +1124,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
 
 
 @read_session
+@read_from_primary
 def __list_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                                                  limit=None, activity=None, older_than=None, rses=None, session=None):
     """
@@ -1307,43 +1292,41 @@ def __add_compatible_schemes(schemes, allowed_schemes):
 
 
 @transactional_session
-def __load_distance_edges_node(rse_id, session=None):
+def __load_rse_settings(rse_id, session=None):
     """
-    Loads the outgoing edges of the distance graph for one node.
+    Loads the RSE settings from the in-process cache of the rsemanager.
 
-    :param rse_id:    RSE id to load the edges for.
+    :param rse_id:    RSE id to load the settings from.
     :param session:   The DB Session to use.
-    :returns:         Dictionary based graph object.
+    :returns:         Dict of RSE Settings
     """
-
-    result = REGION_SHORT.get('distance_graph_%s' % str(rse_id))
-    if isinstance(result, NoValue):
-        distance_graph = {}
-        for distance in session.query(models.Distance).join(models.RSE, models.RSE.id == models.Distance.dest_rse_id)\
-                               .filter(models.Distance.src_rse_id == rse_id)\
-                               .filter(models.RSE.deleted == false()).all():
-            if distance.src_rse_id in distance_graph:
-                distance_graph[distance.src_rse_id][distance.dest_rse_id] = distance.ranking
-            else:
-                distance_graph[distance.src_rse_id] = {distance.dest_rse_id: distance.ranking}
-        REGION_SHORT.set('distance_graph_%s' % str(rse_id), distance_graph)
-        result = distance_graph
-    return result
+    return rsemgr.get_rse_info(rse=get_rse_name(rse_id=rse_id, session=session),
+                               session=session)
 
 
 @transactional_session
-def __load_rse_settings(rse_id, session=None):
+def __find_matching_scheme(src_rse_id, dest_rse_id, session=None):
     """
-    Loads the RSE settings from cache.
+    Finds the matching third party copy schemes between two RSEs, memoized per RSE pair.
 
-    :param rse_id:    RSE id to load the settings from.
-    :param session:   The DB Session to use.
-    :returns:         Dict of RSE Settings
+    :param src_rse_id:   Source RSE id.
+    :param dest_rse_id:  Destination RSE id.
+    :param session:      The DB Session to use.
+    :returns:            The matching scheme tuple as returned by rsemgr.find_matching_scheme,
+                         or NoMatchingScheme with the arguments of the RSEProtocolNotSupported error if there is none.
     """
 
-    result = REGION_SHORT.get('rse_settings_%s' % str(rse_id))
+    key = 'matching_scheme_%s_%s' % (str(src_rse_id), str(dest_rse_id))
+    result = REGION_MEMORY.get(key)
     if isinstance(result, NoValue):
-        result = rsemgr.get_rse_info(rse=get_rse_name(rse_id=rse_id, session=session),
-                                     session=session)
-        REGION_SHORT.set('rse_settings_%s' % str(rse_id), result)
+        try:
+            result = rsemgr.find_matching_scheme(rse_settings_dest=__load_rse_settings(rse_id=dest_rse_id, session=session),
+                                                 rse_settings_src=__load_rse_settings(rse_id=src_rse_id, session=session),
+                                                 operation_src='third_party_copy',
+                                                 operation_dest='third_party_copy',
+                                                 domain='wan')
+        except RSEProtocolNotSupported as error:
+            # a cached exception would keep its traceback, and the frames it references, alive
+            result = NoMatchingScheme(args=error.args)
+        REGION_MEMORY.set(key, result)
     return result
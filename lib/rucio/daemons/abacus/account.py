@@ -34,7 +34,7 @@ import traceback
 from rucio.common.config import config_get
 from rucio.common.utils import get_thread_with_periodic_running_function
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.account_counter import get_updated_account_counters, update_account_counter, fill_account_counter_history_table
+from rucio.core.account_counter import update_account_counters, fill_account_counter_history_table
 
 graceful_stop = threading.Event()
 
@@ -46,9 +46,12 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def account_update(once=False):
+def account_update(once=False, limit=10000):
     """
     Main loop to check and update the Account Counters.
+
+    :param once: Run only once.
+    :param limit: Maximum number of counter updates to compact per iteration.
     """
 
     logging.info('account_update: starting')
@@ -66,23 +69,17 @@ def account_update(once=False):
             # Heartbeat
             heartbeat = live(executable='rucio-abacus-account', hostname=hostname, pid=pid, thread=current_thread)
 
-            # Select a bunch of rses for to update for this worker
-            start = time.time()  # NOQA
-            account_rse_ids = get_updated_account_counters(total_workers=heartbeat['nr_threads'] - 1,
-                                                           worker_number=heartbeat['assign_thread'])
-            logging.debug('Index query time %f size=%d' % (time.time() - start, len(account_rse_ids)))
+            # Compact a bunch of counter updates of this worker
+            start = time.time()
+            num_updates = update_account_counters(total_workers=heartbeat['nr_threads'] - 1,
+                                                  worker_number=heartbeat['assign_thread'],
+                                                  limit=limit)
+            logging.debug('account_update[%s/%s]: compaction of %d counter updates took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, num_updates, time.time() - start))
 
-            # If the list is empty, sent the worker to sleep
-            if not account_rse_ids and not once:
+            # If there was nothing to do, sent the worker to sleep
+            if not num_updates and not once:
                 logging.info('account_update[%s/%s] did not get any work' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1))
                 time.sleep(10)
-            else:
-                for account_rse_id in account_rse_ids:
-                    if graceful_stop.is_set():
-                        break
-                    start_time = time.time()
-                    update_account_counter(account=account_rse_id[0], rse_id=account_rse_id[1])
-                    logging.debug('account_update[%s/%s]: update of account-rse counter "%s-%s" took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, account_rse_id[0], account_rse_id[1], time.time() - start_time))
         except Exception:
             logging.error(traceback.format_exc())
 
@@ -28,8 +28,9 @@ import time
 import traceback
 
 from rucio.common.config import config_get
+from rucio.common.utils import chunks
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.replica import get_cleaned_updated_collection_replicas, update_collection_replica
+from rucio.core.replica import get_cleaned_updated_collection_replicas, update_collection_replicas
 
 graceful_stop = threading.Event()
 
@@ -41,9 +42,13 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def collection_replica_update(once=False):
+def collection_replica_update(once=False, limit=1000, bulk=100):
     """
     Main loop to check and update the collection replicas.
+
+    :param once: Run only once.
+    :param limit: Maximum number of update requests to get per iteration.
+    :param bulk: Number of update requests to apply per transaction.
     """
 
     logging.info('collection_replica_update: starting')
@@ -64,7 +69,8 @@ def collection_replica_update(once=False):
             # Select a bunch of collection replicas for to update for this worker
             start = time.time()  # NOQA
             replicas = get_cleaned_updated_collection_replicas(total_workers=heartbeat['nr_threads'] - 1,
-                                                               worker_number=heartbeat['assign_thread'])
+                                                               worker_number=heartbeat['assign_thread'],
+                                                               limit=limit)
 
             logging.debug('Index query time %f size=%d' % (time.time() - start, len(replicas)))
             # If the list is empty, sent the worker to sleep
@@ -72,12 +78,12 @@ def collection_replica_update(once=False):
                 logging.info('collection_replica_update[%s/%s] did not get any work' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1))
                 time.sleep(10)
             else:
-                for replica in replicas:
+                for chunk in chunks(replicas, bulk):
                     if graceful_stop.is_set():
                         break
                     start_time = time.time()
-                    update_collection_replica(replica)
-                    logging.debug('collection_replica_update[%s/%s]: update of collection replica "%s" took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, replica['id'], time.time() - start_time))
+                    update_collection_replicas(chunk)
+                    logging.debug('collection_replica_update[%s/%s]: update of %d collection replicas took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, len(chunk), time.time() - start_time))
         except Exception:
             logging.error(traceback.format_exc())
         if once:
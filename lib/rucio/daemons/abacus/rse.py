@@ -34,7 +34,7 @@ import traceback
 from rucio.common.config import config_get
 from rucio.common.utils import get_thread_with_periodic_running_function
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.rse_counter import get_updated_rse_counters, update_rse_counter, fill_rse_counter_history_table
+from rucio.core.rse_counter import update_rse_counters, fill_rse_counter_history_table
 
 graceful_stop = threading.Event()
 
@@ -46,9 +46,12 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def rse_update(once=False):
+def rse_update(once=False, limit=10000):
     """
     Main loop to check and update the RSE Counters.
+
+    :param once: Run only once.
+    :param limit: Maximum number of counter updates to compact per iteration.
     """
 
     logging.info('rse_update: starting')
@@ -66,23 +69,17 @@ def rse_update(once=False):
             # Heartbeat
             heartbeat = live(executable='rucio-abacus-rse', hostname=hostname, pid=pid, thread=current_thread)
 
-            # Select a bunch of rses for to update for this worker
-            start = time.time()  # NOQA
-            rse_ids = get_updated_rse_counters(total_workers=heartbeat['nr_threads'] - 1,
-                                               worker_number=heartbeat['assign_thread'])
-            logging.debug('Index query time %f size=%d' % (time.time() - start, len(rse_ids)))
+            # Compact a bunch of counter updates of this worker
+            start = time.time()
+            num_updates = update_rse_counters(total_workers=heartbeat['nr_threads'] - 1,
+                                              worker_number=heartbeat['assign_thread'],
+                                              limit=limit)
+            logging.debug('rse_update[%s/%s]: compaction of %d counter updates took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, num_updates, time.time() - start))
 
-            # If the list is empty, sent the worker to sleep
-            if not rse_ids and not once:
+            # If there was nothing to do, sent the worker to sleep
+            if not num_updates and not once:
                 logging.info('rse_update[%s/%s] did not get any work' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1))
                 time.sleep(10)
-            else:
-                for rse_id in rse_ids:
-                    if graceful_stop.is_set():
-                        break
-                    start_time = time.time()
-                    update_rse_counter(rse_id=rse_id)
-                    logging.debug('rse_update[%s/%s]: update of rse "%s" took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, rse_id, time.time() - start_time))
         except Exception:
             logging.error(traceback.format_exc())
         if once:
@@ -49,7 +49,7 @@ from dogpile.cache import make_region
 from dogpile.cache.api import NoValue
 from sqlalchemy.exc import DatabaseError
 
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_int
 from rucio.common.types import InternalAccount
 from rucio.common.utils import chunks
 from rucio.common.exception import DatabaseException, ConfigNotFound, UnsupportedOperation, ReplicaNotFound, RequestNotFound
@@ -71,6 +71,9 @@ logging.basicConfig(stream=sys.stdout,
 
 graceful_stop = threading.Event()
 
+# Number of partitions used to balance the requests between the finishers, 0 to use the number of threads
+NR_PARTITIONS = config_get_int('conveyor', 'nr_partitions', False, 0)
+
 region = make_region().configure('dogpile.cache.memory', expiration_time=3600)
 
 
@@ -109,7 +112,7 @@ def finisher(once=False, sleep_time=60, activities=None, bulk=100, db_bulk=1000)
 
         start_time = time.time()
         try:
-            heart_beat = heartbeat.live(executable, hostname, pid, hb_thread, older_than=3600)
+            heart_beat = heartbeat.live(executable, hostname, pid, hb_thread, older_than=3600, nr_partitions=NR_PARTITIONS)
             prepend_str = 'Thread [%i/%i] : ' % (heart_beat['assign_thread'] + 1, heart_beat['nr_threads'])
             logging.debug('%s Starting new cycle', prepend_str)
             if activities is None:
@@ -125,6 +128,7 @@ def finisher(once=False, sleep_time=60, activities=None, bulk=100, db_bulk=1000)
                                              older_than=datetime.datetime.utcnow(),
                                              total_workers=heart_beat['nr_threads'] - 1,
                                              worker_number=heart_beat['assign_thread'],
+                                             nr_partitions=NR_PARTITIONS, partitions=heart_beat.get('partitions'),
                                              mode_all=True,
                                              hash_variable='rule_id')
                 record_timer('daemons.conveyor.finisher.000-get_next', (time.time() - time1) * 1000)
@@ -242,7 +246,7 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
                     scheme = urlparse(pfn).scheme
                     dest_rse_id_scheme = '%s_%s' % (req['dest_rse_id'], scheme)
                     if dest_rse_id_scheme not in protocols:
-                        protocols[dest_rse_id_scheme] = rsemanager.create_protocol(rses_info[req['dest_rse_id']], 'write', scheme)
+                        protocols[dest_rse_id_scheme] = rsemanager.create_protocol(rses_info[req['dest_rse_id']], 'write', scheme, pooled=True)
                     path = protocols[dest_rse_id_scheme].parse_pfns([pfn])[pfn]['path']
                     replica['path'] = os.path.join(path, os.path.basename(pfn))
 
@@ -369,6 +373,17 @@ def __handle_terminated_replicas(replicas, prepend_str=''):
     """
 
     for req_type in replicas:
+        # First try to handle all the replicas of the request type in one transaction
+        req_type_replicas = [replica for rule_id in replicas[req_type] for replica in replicas[req_type][rule_id]]
+        try:
+            __update_bulk_replicas(req_type_replicas)
+            record_counter('daemons.conveyor.finisher.bulk_update_replicas', len(req_type_replicas))
+            continue
+        except (UnsupportedOperation, ReplicaNotFound, DatabaseException, DatabaseError) as error:
+            logging.warn('%s Problem to bulk update the replicas states of %s requests. Will try rule by rule: %s', prepend_str, req_type, str(error))
+        except Exception as error:
+            logging.warn('%s Something unexpected happened when bulk updating the replicas states of %s requests. Will try rule by rule: %s', prepend_str, req_type, str(error))
+
         for rule_id in replicas[req_type]:
             try:
                 __update_bulk_replicas(replicas[req_type][rule_id])
@@ -408,14 +423,13 @@ def __update_bulk_replicas(replicas, session=None):
     :returns commit_or_rollback:  Boolean.
     """
     try:
-        replica_core.update_replicas_states(replicas, nowait=True, add_tombstone=True, session=session)
+        replica_core.bulk_update_replicas_states(replicas, nowait=True, add_tombstone=True, session=session)
     except ReplicaNotFound as error:
         logging.warn('Failed to bulk update replicas, will do it one by one: %s', str(error))
         raise ReplicaNotFound(error)
 
+    request_core.archive_requests([replica['request_id'] for replica in replicas if not replica['archived']], session=session)
     for replica in replicas:
-        if not replica['archived']:
-            request_core.archive_request(replica['request_id'], session=session)
         logging.info("HANDLED REQUEST %s DID %s:%s AT RSE %s STATE %s", replica['request_id'], replica['scope'], replica['name'], replica['rse_id'], str(replica['state']))
     return True
 
@@ -47,7 +47,7 @@ except Exception:
 from requests.exceptions import RequestException
 from sqlalchemy.exc import DatabaseError
 
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_int
 from rucio.common.exception import DatabaseException, TransferToolTimeout, TransferToolWrongAnswer
 from rucio.common.utils import chunks
 from rucio.core import heartbeat, transfer as transfer_core, request as request_core
@@ -67,6 +67,8 @@ graceful_stop = threading.Event()
 datetime.datetime.strptime('', '')
 
 TRANSFER_TOOL = config_get('conveyor', 'transfertool', False, None)
+# Number of partitions used to balance the requests between the pollers, 0 to use the number of threads
+NR_PARTITIONS = config_get_int('conveyor', 'nr_partitions', False, 0)
 
 
 def poller(once=False, activities=None, sleep_time=60,
@@ -108,7 +110,7 @@ def poller(once=False, activities=None, sleep_time=60,
     while not graceful_stop.is_set():
 
         try:
-            heart_beat = heartbeat.live(executable, hostname, pid, hb_thread, older_than=3600)
+            heart_beat = heartbeat.live(executable, hostname, pid, hb_thread, older_than=3600, nr_partitions=NR_PARTITIONS)
             prepend_str = 'Thread [%i/%i] : ' % (heart_beat['assign_thread'] + 1, heart_beat['nr_threads'])
 
             if activities is None:
@@ -125,6 +127,7 @@ def poller(once=False, activities=None, sleep_time=60,
                                                 limit=db_bulk,
                                                 older_than=datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than),
                                                 total_workers=heart_beat['nr_threads'] - 1, worker_number=heart_beat['assign_thread'],
+                                                nr_partitions=NR_PARTITIONS, partitions=heart_beat.get('partitions'),
                                                 mode_all=False, hash_variable='id',
                                                 activity=activity,
                                                 activity_shares=activity_shares)
@@ -43,7 +43,7 @@ from rucio.common.config import config_get
 from rucio.common.utils import get_parsed_throttler_mode
 from rucio.core import heartbeat, config as config_core
 from rucio.core.monitor import record_counter, record_gauge
-from rucio.core.request import get_stats_by_activity_direction_state, release_all_waiting_requests, release_waiting_requests_fifo, release_waiting_requests_grouped_fifo
+from rucio.core.request import get_stats_by_activity_direction_state, release_all_waiting_requests, release_waiting_requests_grouped_fifo, WaitingRequestQueues
 from rucio.core.rse import get_rse, set_rse_transfer_limits, delete_rse_transfer_limits, get_rse_transfer_limits
 from rucio.db.sqla.constants import RequestState
 
@@ -56,6 +56,8 @@ logging.basicConfig(stream=sys.stdout,
 
 graceful_stop = threading.Event()
 
+WAITING_REQUEST_QUEUES = {}  # {direction: WaitingRequestQueues}
+
 
 def throttler(once=False, sleep_time=600):
     """
@@ -218,20 +220,25 @@ def __schedule_requests():
         direction, all_activities = get_parsed_throttler_mode(throttler_mode)
         result_dict = __get_request_stats(all_activities, direction)
         if direction == 'destination' or direction == 'source':
+            if direction not in WAITING_REQUEST_QUEUES:
+                WAITING_REQUEST_QUEUES.clear()
+                WAITING_REQUEST_QUEUES[direction] = WaitingRequestQueues(direction=direction)
+            waiting_queues = WAITING_REQUEST_QUEUES[direction]
+            waiting_queues.refresh()
             for rse_id in result_dict:
                 rse_name = result_dict[rse_id]['rse']
                 availability = get_rse(rse_id).availability
                 # dest_rse is not blacklisted for write or src_rse is not blacklisted for read
                 if (direction == 'destination' and availability & 2) or (direction == 'source' and availability & 4):
                     if all_activities:
-                        __release_all_activities(result_dict[rse_id], direction, rse_name, rse_id)
+                        __release_all_activities(result_dict[rse_id], direction, rse_name, rse_id, waiting_queues)
                     else:
-                        __release_per_activity(result_dict[rse_id], direction, rse_name, rse_id)
+                        __release_per_activity(result_dict[rse_id], direction, rse_name, rse_id, waiting_queues)
     except Exception:
         logging.critical("Failed to schedule requests, error: %s" % (traceback.format_exc()))
 
 
-def __release_all_activities(stats, direction, rse_name, rse_id):
+def __release_all_activities(stats, direction, rse_name, rse_id, waiting_queues):
     """
     Release requests if activities should be ignored.
 
@@ -239,6 +246,7 @@ def __release_all_activities(stats, direction, rse_name, rse_id):
     :param direction:      String whether request statistics are based on source or destination RSEs.
     :param rse_name:       RSE name.
     :param rse_id:         RSE id.
+    :param waiting_queues: WaitingRequestQueues of the direction.
     """
     threshold = stats['threshold']
     transfer = stats['transfer']
@@ -250,12 +258,13 @@ def __release_all_activities(stats, direction, rse_name, rse_id):
         record_gauge('daemons.conveyor.throttler.set_rse_transfer_limits.%s.waitings' % (rse_name), waiting)
         if transfer < 0.8 * threshold:
             to_be_released = threshold - transfer
+            # only fifo is served from the in-memory queues: grouped_fifo, with its release per deadline and free volume, queries the database on each release
             if strategy == 'grouped_fifo':
                 deadline = stats.get('deadline')
                 volume = stats.get('volume')
                 release_waiting_requests_grouped_fifo(rse_id, count=to_be_released, direction=direction, volume=volume, deadline=deadline)
             elif strategy == 'fifo':
-                release_waiting_requests_fifo(rse_id, count=to_be_released, direction=direction)
+                waiting_queues.release(rse_id, count=to_be_released)
         else:
             logging.debug("Throttler has done nothing on rse %s (transfer > 0.8 * threshold)" % rse_name)
     elif waiting > 0 or not threshold:
@@ -265,7 +274,7 @@ def __release_all_activities(stats, direction, rse_name, rse_id):
         record_counter('daemons.conveyor.throttler.delete_rse_transfer_limits.%s' % (rse_name))
 
 
-def __release_per_activity(stats, direction, rse_name, rse_id):
+def __release_per_activity(stats, direction, rse_name, rse_id, waiting_queues):
     """
     Release requests per activity.
 
@@ -273,6 +282,7 @@ def __release_per_activity(stats, direction, rse_name, rse_id):
     :param direction:      String whether request statistics are based on source or destination RSEs.
     :param rse_name:       RSE name.
     :param rse_id:         RSE id.
+    :param waiting_queues: WaitingRequestQueues of the direction.
     """
     for activity in stats['activities']:
         threshold = stats['activities'][activity]['threshold']
@@ -304,7 +314,7 @@ def __release_per_activity(stats, direction, rse_name, rse_id):
                     for account in accounts:
                         if nr_accounts == 1:
                             logging.debug("Throttler release %s waiting requests for activity %s, rse %s, account %s " % (to_release, activity, rse_name, account))
-                            release_waiting_requests_fifo(rse_id, activity=activity, account=account, count=to_release, direction=direction)
+                            waiting_queues.release(rse_id, activity=activity, account=account, count=to_release)
                             record_gauge('daemons.conveyor.throttler.release_waiting_requests.%s.%s.%s' % (activity, rse_name, account), to_release)
                         elif accounts[account]['transfer'] > threshold_per_account:
                             logging.debug("Throttler will not release  %s waiting requests for activity %s, rse %s, account %s: It queued more transfers than its share " %
@@ -313,14 +323,14 @@ def __release_per_activity(stats, direction, rse_name, rse_id):
                             to_release_per_account = math.ceil(to_release / nr_accounts)
                         elif accounts[account]['waiting'] < to_release_per_account:
                             logging.debug("Throttler release %s waiting requests for activity %s, rse %s, account %s " % (accounts[account]['waiting'], activity, rse_name, account))
-                            release_waiting_requests_fifo(rse_id, activity=activity, account=account, count=accounts[account]['waiting'], direction=direction)
+                            waiting_queues.release(rse_id, activity=activity, account=account, count=accounts[account]['waiting'])
                             record_gauge('daemons.conveyor.throttler.release_waiting_requests.%s.%s.%s' % (activity, rse_name, account), accounts[account]['waiting'])
                             to_release = to_release - accounts[account]['waiting']
                             nr_accounts -= 1
                             to_release_per_account = math.ceil(to_release / nr_accounts)
                         else:
                             logging.debug("Throttler release %s waiting requests for activity %s, rse %s, account %s " % (to_release_per_account, activity, rse_name, account))
-                            release_waiting_requests_fifo(rse_id, activity=activity, account=account, count=to_release_per_account, direction=direction)
+                            waiting_queues.release(rse_id, activity=activity, account=account, count=to_release_per_account)
                             record_gauge('daemons.conveyor.throttler.release_waiting_requests.%s.%s.%s' % (activity, rse_name, account), to_release_per_account)
                             to_release = to_release - to_release_per_account
                             nr_accounts -= 1
@@ -29,7 +29,6 @@
 import json
 import logging
 import os
-import random
 import smtplib
 import socket
 import sys
@@ -38,12 +37,19 @@ import time
 import traceback
 
 from email.mime.text import MIMEText
+
+try:
+    from Queue import Queue, Empty, Full  # py2
+except ImportError:
+    from queue import Queue, Empty, Full  # py3
+
 from six import PY2
 from sqlalchemy.orm.exc import NoResultFound
 
 import stomp
 
 from rucio.common.config import config_get, config_get_int, config_get_bool
+from rucio.common.utils import chunks
 from rucio.core.heartbeat import live, die, sanity_check
 from rucio.core.message import retrieve_messages, delete_messages
 from rucio.core.monitor import record_counter
@@ -166,6 +172,319 @@ class HermesListener(stomp.ConnectionListener):
         logging.error('[broker] [%s]: %s', self.__broker, body)
 
 
+def __log_message(message, heartbeat):
+    '''
+    Log the content of a delivered message.
+    '''
+    if str(message['event_type']).lower().startswith('transfer') or str(message['event_type']).lower().startswith('stagein'):
+        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, request-id: %s, transfer-id: %s, created_at: %s',
+                      heartbeat['assign_thread'], heartbeat['nr_threads'],
+                      str(message['event_type']).lower(),
+                      message['payload'].get('scope', None),
+                      message['payload'].get('name', None),
+                      message['payload'].get('dst-rse', None),
+                      message['payload'].get('request-id', None),
+                      message['payload'].get('transfer-id', None),
+                      str(message['created_at']))
+
+    elif str(message['event_type']).lower().startswith('dataset'):
+        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, rule-id: %s, created_at: %s)',
+                      heartbeat['assign_thread'],
+                      heartbeat['nr_threads'],
+                      str(message['event_type']).lower(),
+                      message['payload']['scope'],
+                      message['payload']['name'],
+                      message['payload']['rse'],
+                      message['payload']['rule_id'],
+                      str(message['created_at']))
+
+    elif str(message['event_type']).lower().startswith('deletion'):
+        if 'url' not in message['payload']:
+            message['payload']['url'] = 'unknown'
+        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, url: %s, created_at: %s)',
+                      heartbeat['assign_thread'],
+                      heartbeat['nr_threads'],
+                      str(message['event_type']).lower(),
+                      message['payload']['scope'],
+                      message['payload']['name'],
+                      message['payload']['rse'],
+                      message['payload']['url'],
+                      str(message['created_at']))
+    else:
+        logging.debug('[broker] %i:%i - other message: %s',
+                      heartbeat['assign_thread'], heartbeat['nr_threads'],
+                      message)
+
+
+def __publisher(conn, name, queue, retries, delivered, pending, alive, lock, destination, heartbeat, use_ssl, username, password, max_failures=3):
+    '''
+    Publish the messages of the queue to one broker, until a None is received.
+    The messages sent without error are put into the delivered queue.
+
+    A message which could not be sent is put into the retries queue, which the publishers drain before
+    the queue, so that it is tried on another broker. A publisher never retries a message it failed itself.
+    The publisher stops after max_failures consecutive failures, so that a broker which fails fast does not
+    take more than its share of the messages.
+    '''
+    host_and_ports = conn.transport._Transport__host_and_ports[0][0]
+    failures = 0
+    try:
+        while True:
+            message = None
+            try:
+                message = retries.get_nowait()
+                with lock:
+                    tried = pending.get(message['id'])
+                if tried is None:
+                    # Given up on by the other publishers, the message stays in the database
+                    message = None
+                elif name in tried:
+                    # Leave the message to another publisher
+                    retries.put(message)
+                    message = None
+            except Empty:
+                pass
+            if message is None:
+                try:
+                    message = queue.get(timeout=1)
+                except Empty:
+                    continue
+            if message is None:
+                break
+            try:
+                if not conn.is_connected():
+                    record_counter('daemons.hermes.reconnect.%s' % host_and_ports.split('.')[0])
+                    conn.start()
+                    if not use_ssl:
+                        logging.info('[broker] %i:%i - connecting with USERPASS to %s',
+                                     heartbeat['assign_thread'],
+                                     heartbeat['nr_threads'],
+                                     host_and_ports)
+                        conn.connect(username, password, wait=True)
+                    else:
+                        logging.info('[broker] %i:%i - connecting with SSL to %s',
+                                     heartbeat['assign_thread'],
+                                     heartbeat['nr_threads'],
+                                     host_and_ports)
+                        conn.connect(wait=True)
+
+                conn.send(body=json.dumps({'event_type': str(message['event_type']).lower(),
+                                           'payload': message['payload'],
+                                           'created_at': str(message['created_at'])}),
+                          destination=destination,
+                          headers={'persistent': 'true',
+                                   'event_type': str(message['event_type']).lower()})
+
+                delivered.put({'id': message['id'],
+                               'created_at': message['created_at'],
+                               'updated_at': message['created_at'],
+                               'payload': json.dumps(message['payload']),
+                               'event_type': message['event_type']})
+                with lock:
+                    pending.pop(message['id'], None)
+                failures = 0
+            except ValueError:
+                logging.warn('Cannot serialize payload to JSON: %s',
+                             str(message['payload']))
+                delivered.put({'id': message['id'],
+                               'created_at': message['created_at'],
+                               'updated_at': message['created_at'],
+                               'payload': str(message['payload']),
+                               'event_type': message['event_type']})
+                with lock:
+                    pending.pop(message['id'], None)
+                continue
+            except Exception as error:
+                if isinstance(error, stomp.exception.NotConnectedException):
+                    logging.warn('Could not deliver message due to NotConnectedException: %s',
+                                 str(error))
+                elif isinstance(error, stomp.exception.ConnectFailedException):
+                    logging.warn('Could not deliver message due to ConnectFailedException: %s',
+                                 str(error))
+                else:
+                    logging.warn('Could not deliver message: %s', str(error))
+                    logging.critical(traceback.format_exc())
+                __requeue(retries, message, name, pending, alive, lock)
+                failures += 1
+                if failures >= max_failures:
+                    logging.error('[broker] %i:%i - giving up on %s after %i consecutive failures',
+                                  heartbeat['assign_thread'], heartbeat['nr_threads'],
+                                  host_and_ports, failures)
+                    record_counter('daemons.hermes.publisher_stopped.%s' % host_and_ports.split('.')[0])
+                    break
+                continue
+
+            try:
+                __log_message(message, heartbeat)
+            except Exception as error:
+                logging.warn('Could not log message %s: %s', message.get('id'), str(error))
+    finally:
+        __retire(name, pending, alive, lock)
+
+
+def __requeue(retries, message, name, pending, alive, lock):
+    '''
+    Put a message which could not be sent into the retries queue, unless no live publisher is left to try it.
+    A message which is not retried stays in the database for the next run.
+
+    :param retries: The unbounded queue of messages to publish again.
+    :param message: The message.
+    :param name: The name of the publisher which failed to send the message.
+    :param pending: Dictionary with the names of the publishers which failed to send it, per pending message id.
+    :param alive: The names of the publishers still running.
+    :param lock: The lock protecting pending and alive.
+    '''
+    with lock:
+        tried = pending.get(message['id'])
+        if tried is None:
+            return
+        tried.add(name)
+        if not alive - tried:
+            pending.pop(message['id'])
+            return
+    retries.put(message)
+
+
+def __retire(name, pending, alive, lock):
+    '''
+    Remove a stopping publisher from the live ones, and give up on the messages that no live publisher
+    is left to try. Those messages stay in the database for the next run.
+
+    :param name: The name of the stopping publisher.
+    :param pending: Dictionary with the names of the publishers which failed to send it, per pending message id.
+    :param alive: The names of the publishers still running.
+    :param lock: The lock protecting pending and alive.
+    '''
+    with lock:
+        alive.discard(name)
+        for message_id, tried in list(pending.items()):
+            if tried and not alive - tried:
+                pending.pop(message_id)
+
+
+def __put(queue, item, publishers, timeout=1):
+    '''
+    Put an item into the queue as long as one of the publishers is alive.
+
+    :param queue: The queue of messages to publish.
+    :param item: The message, or None to stop a publisher.
+    :param publishers: The publisher threads.
+    :param timeout: Seconds to wait for room in the queue before checking the publishers again.
+    :returns: True if the item was put into the queue, False if no publisher is left.
+    '''
+    while any(publisher.is_alive() for publisher in publishers):
+        try:
+            queue.put(item, timeout=timeout)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def __drain(delivered, to_delete, timeout=None):
+    '''
+    Move the delivered messages into the list of messages to delete.
+
+    :param delivered: The queue of delivered messages.
+    :param to_delete: The list of messages to delete.
+    :param timeout: Seconds to wait for a first delivered message, None not to wait.
+    '''
+    try:
+        if timeout:
+            to_delete.append(delivered.get(timeout=timeout))
+        while True:
+            to_delete.append(delivered.get_nowait())
+    except Empty:
+        pass
+
+
+def publish_messages(messages, conns, destination, heartbeat, use_ssl=True, username=None, password=None, queue_size=100, delete_bulk=100,
+                     max_failures=3, timeout=600):
+    '''
+    Publish messages concurrently to the brokers and delete the delivered ones.
+
+    One publisher thread per broker connection consumes a bounded queue fed by the caller,
+    while the delivered messages are deleted from the database in bulk. The publishers are only
+    stopped once every message was delivered or tried on every live broker, no publisher is left,
+    or the timeout expired.
+
+    :param messages: List of messages as returned by retrieve_messages.
+    :param conns: List of broker connections.
+    :param destination: The destination on the brokers.
+    :param heartbeat: The heartbeat of the calling thread, used for logging.
+    :param use_ssl: Connect to the brokers with SSL cert/key authentication, otherwise with username/password.
+    :param username: The username for the brokers.
+    :param password: The password for the brokers.
+    :param queue_size: Maximum number of messages waiting to be published.
+    :param delete_bulk: Number of delivered messages deleted at a time.
+    :param max_failures: Number of consecutive failures after which a publisher stops.
+    :param timeout: Seconds to wait for the messages in flight once all of them were queued.
+    :returns: The number of delivered messages.
+    '''
+    queue, retries, delivered, lock = Queue(maxsize=queue_size), Queue(), Queue(), threading.Lock()
+    pending = dict((message['id'], set()) for message in messages)
+    alive = set(range(len(conns)))
+    publishers = [threading.Thread(target=__publisher, kwargs={'conn': conn,
+                                                               'name': name,
+                                                               'queue': queue,
+                                                               'retries': retries,
+                                                               'delivered': delivered,
+                                                               'pending': pending,
+                                                               'alive': alive,
+                                                               'lock': lock,
+                                                               'destination': destination,
+                                                               'heartbeat': heartbeat,
+                                                               'use_ssl': use_ssl,
+                                                               'username': username,
+                                                               'password': password,
+                                                               'max_failures': max_failures}) for name, conn in enumerate(conns)]
+    for publisher in publishers:
+        publisher.start()
+
+    to_delete, nb_delivered = [], 0
+
+    def delete_delivered():
+        deleted = 0
+        while len(to_delete) >= delete_bulk:
+            delete_messages(to_delete[:delete_bulk])
+            deleted += delete_bulk
+            del to_delete[:delete_bulk]
+        return deleted
+
+    try:
+        for message in messages:
+            if not __put(queue, message, publishers):
+                logging.error('[broker] %i:%i - no publisher left, the remaining messages stay in the database',
+                              heartbeat['assign_thread'], heartbeat['nr_threads'])
+                break
+            # Delete what has been delivered so far while the publishers keep on sending
+            __drain(delivered, to_delete)
+            nb_delivered += delete_delivered()
+        # Wait for the messages in flight and the retries before stopping the publishers
+        deadline = time.time() + timeout
+        while any(publisher.is_alive() for publisher in publishers):
+            with lock:
+                if not pending:
+                    break
+            if time.time() > deadline:
+                logging.error('[broker] %i:%i - timeout waiting for %i messages, they stay in the database',
+                              heartbeat['assign_thread'], heartbeat['nr_threads'], len(pending))
+                break
+            __drain(delivered, to_delete, timeout=0.1)
+            nb_delivered += delete_delivered()
+    finally:
+        for _ in publishers:
+            if not __put(queue, None, publishers):
+                break
+        for publisher in publishers:
+            publisher.join()
+        __drain(delivered, to_delete)
+        for chunk in chunks(to_delete, delete_bulk):
+            delete_messages(chunk)
+            nb_delivered += len(chunk)
+    return nb_delivered
+
+
 def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, delay=10,
                      broker_timeout=3, broker_retry=3):
     '''
@@ -189,6 +508,7 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
 
     port = config_get_int('messaging-hermes', 'port')
     vhost = config_get('messaging-hermes', 'broker_virtual_host', raise_exception=False)
+    username, password = None, None
     if not use_ssl:
         username = config_get('messaging-hermes', 'username')
         password = config_get('messaging-hermes', 'password')
@@ -247,105 +567,13 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
                 logging.debug('[broker] %i:%i - retrieved %i messages',
                               heartbeat['assign_thread'], heartbeat['nr_threads'],
                               len(messages))
-                to_delete = []
-                for message in messages:
-                    try:
-                        conn = random.sample(conns, 1)[0]
-                        if not conn.is_connected():
-                            host_and_ports = conn.transport._Transport__host_and_ports[0][0]
-                            record_counter('daemons.hermes.reconnect.%s' % host_and_ports.split('.')[0])
-                            conn.start()
-                            if not use_ssl:
-                                logging.info('[broker] %i:%i - connecting with USERPASS to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(username, password, wait=True)
-                            else:
-                                logging.info('[broker] %i:%i - connecting with SSL to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(wait=True)
-
-                        conn.send(body=json.dumps({'event_type': str(message['event_type']).lower(),
-                                                   'payload': message['payload'],
-                                                   'created_at': str(message['created_at'])}),
-                                  destination=destination,
-                                  headers={'persistent': 'true',
-                                           'event_type': str(message['event_type']).lower()})
-
-                        to_delete.append({'id': message['id'],
-                                          'created_at': message['created_at'],
-                                          'updated_at': message['created_at'],
-                                          'payload': json.dumps(message['payload']),
-                                          'event_type': message['event_type']})
-                    except ValueError:
-                        logging.warn('Cannot serialize payload to JSON: %s',
-                                     str(message['payload']))
-                        to_delete.append({'id': message['id'],
-                                          'created_at': message['created_at'],
-                                          'updated_at': message['created_at'],
-                                          'payload': str(message['payload']),
-                                          'event_type': message['event_type']})
-                        continue
-                    except stomp.exception.NotConnectedException as error:
-                        logging.warn('Could not deliver message due to NotConnectedException: %s',
-                                     str(error))
-                        continue
-                    except stomp.exception.ConnectFailedException as error:
-                        logging.warn('Could not deliver message due to ConnectFailedException: %s',
-                                     str(error))
-                        continue
-                    except Exception as error:
-                        logging.warn('Could not deliver message: %s', str(error))
-                        logging.critical(traceback.format_exc())
-                        continue
-
-                    if str(message['event_type']).lower().startswith('transfer') or str(message['event_type']).lower().startswith('stagein'):
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, request-id: %s, transfer-id: %s, created_at: %s',
-                                      heartbeat['assign_thread'], heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload'].get('scope', None),
-                                      message['payload'].get('name', None),
-                                      message['payload'].get('dst-rse', None),
-                                      message['payload'].get('request-id', None),
-                                      message['payload'].get('transfer-id', None),
-                                      str(message['created_at']))
-
-                    elif str(message['event_type']).lower().startswith('dataset'):
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, rule-id: %s, created_at: %s)',
-                                      heartbeat['assign_thread'],
-                                      heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload']['scope'],
-                                      message['payload']['name'],
-                                      message['payload']['rse'],
-                                      message['payload']['rule_id'],
-                                      str(message['created_at']))
-
-                    elif str(message['event_type']).lower().startswith('deletion'):
-                        if 'url' not in message['payload']:
-                            message['payload']['url'] = 'unknown'
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, url: %s, created_at: %s)',
-                                      heartbeat['assign_thread'],
-                                      heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload']['scope'],
-                                      message['payload']['name'],
-                                      message['payload']['rse'],
-                                      message['payload']['url'],
-                                      str(message['created_at']))
-                    else:
-                        logging.debug('[broker] %i:%i - other message: %s',
-                                      heartbeat['assign_thread'], heartbeat['nr_threads'],
-                                      message)
-
-                delete_messages(to_delete)
+                nb_delivered = publish_messages(messages, conns, destination, heartbeat,
+                                                use_ssl=use_ssl, username=username, password=password,
+                                                max_failures=broker_retry)
                 logging.info('[broker] %i:%i - submitted %i messages',
                              heartbeat['assign_thread'],
                              heartbeat['nr_threads'],
-                             len(to_delete))
+                             nb_delivered)
 
                 if once:
                     break
@@ -34,6 +34,7 @@ import threading
 import time
 import traceback
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from re import match
 from random import randint
@@ -45,8 +46,9 @@ from sqlalchemy.orm.exc import FlushError
 from rucio.common.config import config_get
 from rucio.common.exception import DatabaseException, DataIdentifierNotFound, ReplicationRuleCreationTemporaryFailed
 from rucio.common.types import InternalScope
+from rucio.common.utils import chunks
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.rule import re_evaluate_did, get_updated_dids, delete_updated_did
+from rucio.core.rule import re_evaluate_did, re_evaluate_dids, get_updated_dids, delete_updated_dids
 from rucio.core.monitor import record_counter
 
 graceful_stop = threading.Event()
@@ -59,9 +61,13 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def re_evaluator(once=False):
+def re_evaluator(once=False, bulk=1000, batch_size=100):
     """
     Main loop to check the re-evaluation of dids.
+
+    :param once:        Run only once.
+    :param bulk:        Maximum number of updated dids to fetch per iteration.
+    :param batch_size:  Maximum number of coalesced dids evaluated in one transaction.
     """
 
     hostname = socket.gethostname()
@@ -87,7 +93,7 @@ def re_evaluator(once=False):
             # Select a bunch of dids for re evaluation for this worker
             dids = get_updated_dids(total_workers=heartbeat['nr_threads'] - 1,
                                     worker_number=heartbeat['assign_thread'],
-                                    limit=100,
+                                    limit=bulk,
                                     blacklisted_dids=[(InternalScope(key[0], fromExternal=False), key[1]) for key in paused_dids])
             logging.debug('re_evaluator[%s/%s] index query time %f fetch size is %d' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, time.time() - start, len(dids)))
 
@@ -96,33 +102,50 @@ def re_evaluator(once=False):
                 logging.debug('re_evaluator[%s/%s] did not get any work (paused_dids=%s)' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, str(len(paused_dids))))
                 graceful_stop.wait(30)
             else:
-                done_dids = {}
+                # Coalesce the fetched rows, so that every did is evaluated only once per action
+                # and all its rows are deleted with a single statement.
+                coalesced_dids = OrderedDict()  # {(scope, name): {'actions': [rule_evaluation_action], 'ids': [id]}}
                 for did in dids:
+                    coalesced_did = coalesced_dids.setdefault((did.scope, did.name), {'actions': [], 'ids': []})
+                    if did.rule_evaluation_action not in coalesced_did['actions']:
+                        coalesced_did['actions'].append(did.rule_evaluation_action)
+                    coalesced_did['ids'].append(did.id)
+                logging.debug('re_evaluator[%s/%s]: %d updated dids coalesced into %d dids' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, len(dids), len(coalesced_dids)))
+
+                # Evaluate the dids in batches, resolving their rules and locks together in one transaction.
+                # A batch which fails is evaluated again one did at a time, so that a single did does not hold back the others.
+                failed_dids = OrderedDict()
+                for batch in chunks(list(iteritems(coalesced_dids)), batch_size):
+                    if graceful_stop.is_set():
+                        break
+                    try:
+                        start_time = time.time()
+                        re_evaluate_dids(dids=[(scope, name, coalesced_did['actions']) for (scope, name), coalesced_did in batch])
+                        logging.debug('re_evaluator[%s/%s]: evaluation of %d dids took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, len(batch), time.time() - start_time))
+                        delete_updated_dids(ids=[id for _, coalesced_did in batch for id in coalesced_did['ids']])
+                        record_counter('rule.judge.evaluator.coalesced_updated_dids', sum(len(coalesced_did['ids']) - len(coalesced_did['actions']) for _, coalesced_did in batch))
+                    except Exception as e:
+                        logging.warning('re_evaluator[%s/%s]: evaluation of %d dids failed, evaluating them one at a time: %s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, len(batch), str(e)))
+                        record_counter('rule.judge.evaluator.failed_batches')
+                        failed_dids.update(batch)
+
+                for (scope, name), coalesced_did in iteritems(failed_dids):
                     if graceful_stop.is_set():
                         break
-
-                    # Check if this did has already been operated on
-                    did_tag = '%s:%s' % (did.scope.internal, did.name)
-                    if did_tag in done_dids:
-                        if did.rule_evaluation_action in done_dids[did_tag]:
-                            logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s already done' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
-                            delete_updated_did(id=did.id)
-                            continue
-                    else:
-                        done_dids[did_tag] = []
 
                     try:
                         start_time = time.time()
-                        re_evaluate_did(scope=did.scope, name=did.name, rule_evaluation_action=did.rule_evaluation_action)
-                        logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name, time.time() - start_time))
-                        delete_updated_did(id=did.id)
-                        done_dids[did_tag].append(did.rule_evaluation_action)
-                    except DataIdentifierNotFound as e:
-                        delete_updated_did(id=did.id)
+                        for rule_evaluation_action in coalesced_did['actions']:
+                            re_evaluate_did(scope=scope, name=name, rule_evaluation_action=rule_evaluation_action)
+                        logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name, time.time() - start_time))
+                        delete_updated_dids(ids=coalesced_did['ids'])
+                        record_counter('rule.judge.evaluator.coalesced_updated_dids', len(coalesced_did['ids']) - len(coalesced_did['actions']))
+                    except DataIdentifierNotFound:
+                        delete_updated_dids(ids=coalesced_did['ids'])
                     except (DatabaseException, DatabaseError) as e:
                         if match('.*ORA-00054.*', str(e.args[0])):
-                            paused_dids[(did.scope.internal, did.name)] = datetime.utcnow() + timedelta(seconds=randint(60, 600))
-                            logging.warning('re_evaluator[%s/%s]: Locks detected for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                            paused_dids[(scope.internal, name)] = datetime.utcnow() + timedelta(seconds=randint(60, 600))
+                            logging.warning('re_evaluator[%s/%s]: Locks detected for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name))
                             record_counter('rule.judge.exceptions.LocksDetected')
                         elif match('.*QueuePool.*', str(e.args[0])):
                             logging.warning(traceback.format_exc())
@@ -135,10 +158,10 @@ def re_evaluator(once=False):
                             record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
                     except ReplicationRuleCreationTemporaryFailed as e:
                         record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
-                        logging.warning('re_evaluator[%s/%s]: Replica Creation temporary failed, retrying later for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                        logging.warning('re_evaluator[%s/%s]: Replica Creation temporary failed, retrying later for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name))
                     except FlushError as e:
                         record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
-                        logging.warning('re_evaluator[%s/%s]: Flush error for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                        logging.warning('re_evaluator[%s/%s]: Flush error for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name))
         except (DatabaseException, DatabaseError) as e:
             if match('.*QueuePool.*', str(e.args[0])):
                 logging.warning(traceback.format_exc())
@@ -167,7 +190,7 @@ def stop(signum=None, frame=None):
     graceful_stop.set()
 
 
-def run(once=False, threads=1):
+def run(once=False, threads=1, bulk=1000, batch_size=100):
     """
     Starts up the Judge-Eval threads.
     """
@@ -176,10 +199,10 @@ def run(once=False, threads=1):
     sanity_check(executable='rucio-judge-evaluator', hostname=hostname)
 
     if once:
-        re_evaluator(once)
+        re_evaluator(once=once, bulk=bulk, batch_size=batch_size)
     else:
         logging.info('Evaluator starting %s threads' % str(threads))
-        threads = [threading.Thread(target=re_evaluator, kwargs={'once': once}) for i in range(0, threads)]
+        threads = [threading.Thread(target=re_evaluator, kwargs={'once': once, 'bulk': bulk, 'batch_size': batch_size}) for i in range(0, threads)]
         [t.start() for t in threads]
         # Interruptible joins require a timeout.
         while threads[0].is_alive():
@@ -44,6 +44,11 @@ from math import ceil
 from operator import itemgetter
 from collections import OrderedDict
 
+try:
+    from Queue import Queue, Empty  # py2
+except ImportError:
+    from queue import Queue, Empty  # py3
+
 from dogpile.cache import make_region
 from dogpile.cache.api import NO_VALUE
 from sqlalchemy.exc import DatabaseError, IntegrityError
@@ -79,6 +84,9 @@ REGION = make_region().configure('dogpile.cache.memcached',
                                  arguments={'url': config_get('cache', 'url', False, '127.0.0.1:11211'),
                                             'distributed_lock': True})
 
+HOSTNAME_SEMAPHORES = {}
+HOSTNAME_SEMAPHORES_LOCK = threading.Lock()
+
 
 def get_rses_to_process(rses, include_rses, exclude_rses):
     """
@@ -120,79 +128,104 @@ def get_rses_to_process(rses, include_rses, exclude_rses):
 
 def delete_from_storage(replicas, prot, rse_info, staging_areas, prepend_str):
     deleted_files = []
-    rse_name = rse_info['rse']
-    rse_id = rse_info['id']
     try:
         prot.connect()
-        for replica in replicas:
-            # Physical deletion
-            try:
-                deletion_dict = {'scope': replica['scope'].external,
-                                 'name': replica['name'],
-                                 'rse': rse_name,
-                                 'file-size': replica['bytes'],
-                                 'bytes': replica['bytes'],
-                                 'url': replica['pfn'],
-                                 'protocol': prot.attributes['scheme']}
-                logging.info('%s Deletion ATTEMPT of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
-                start = time.time()
-                # For STAGING RSEs, no physical deletion
-                if rse_id in staging_areas:
-                    logging.warning('%s Deletion STAGING of %s:%s as %s on %s, will only delete the catalog and not do physical deletion', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
-                    deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
-                    continue
-
-                if replica['pfn']:
-                    pfn = replica['pfn']
-                    # sign the URL if necessary
-                    if prot.attributes['scheme'] == 'https' and rse_info['sign_url'] is not None:
-                        pfn = get_signed_url(rse_id, rse_info['sign_url'], 'delete', pfn)
-                    prot.delete(pfn)
-                else:
-                    logging.warning('%s Deletion UNAVAILABLE of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+        __delete_replicas(replicas, prot, rse_info, staging_areas, prepend_str, deleted_files)
+    except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
+        __report_noaccess(replicas, prot, rse_info, prepend_str, error)
+    finally:
+        prot.close()
+    return deleted_files
 
-                monitor.record_timer('daemons.reaper.delete.%s.%s' % (prot.attributes['scheme'], rse_name), (time.time() - start) * 1000)
-                duration = time.time() - start
 
+def __delete_replicas(replicas, prot, rse_info, staging_areas, prepend_str, deleted_files):
+    """
+    Delete replicas from the storage with a connected protocol.
+
+    :param replicas:       List of replicas with their pfn.
+    :param prot:           The connected protocol.
+    :param rse_info:       The RSE settings.
+    :param staging_areas:  List of staging areas.
+    :param prepend_str:    String to prepend to the log messages.
+    :param deleted_files:  List extended with every file as soon as it is deleted from the storage.
+    """
+    rse_name = rse_info['rse']
+    rse_id = rse_info['id']
+    for replica in replicas:
+        # Physical deletion
+        try:
+            deletion_dict = {'scope': replica['scope'].external,
+                             'name': replica['name'],
+                             'rse': rse_name,
+                             'file-size': replica['bytes'],
+                             'bytes': replica['bytes'],
+                             'url': replica['pfn'],
+                             'protocol': prot.attributes['scheme']}
+            logging.info('%s Deletion ATTEMPT of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+            start = time.time()
+            # For STAGING RSEs, no physical deletion
+            if rse_id in staging_areas:
+                logging.warning('%s Deletion STAGING of %s:%s as %s on %s, will only delete the catalog and not do physical deletion', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
                 deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+                continue
+
+            if replica['pfn']:
+                pfn = replica['pfn']
+                # sign the URL if necessary
+                if prot.attributes['scheme'] == 'https' and rse_info['sign_url'] is not None:
+                    pfn = get_signed_url(rse_id, rse_info['sign_url'], 'delete', pfn)
+                prot.delete(pfn)
+            else:
+                logging.warning('%s Deletion UNAVAILABLE of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+
+            monitor.record_timer('daemons.reaper.delete.%s.%s' % (prot.attributes['scheme'], rse_name), (time.time() - start) * 1000)
+            duration = time.time() - start
+
+            deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+
+            deletion_dict['duration'] = duration
+            add_message('deletion-done', deletion_dict)
+            logging.info('%s Deletion SUCCESS of %s:%s as %s on %s in %s seconds', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, duration)
+
+        except SourceNotFound:
+            err_msg = 'Deletion NOTFOUND of %s:%s as %s on %s' % (replica['scope'], replica['name'], replica['pfn'], rse_name)
+            logging.warning('%s %s', prepend_str, err_msg)
+            deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+            if replica['state'] == ReplicaState.AVAILABLE:
+                deletion_dict['reason'] = str(err_msg)
+                add_message('deletion-failed', deletion_dict)
 
-                deletion_dict['duration'] = duration
-                add_message('deletion-done', deletion_dict)
-                logging.info('%s Deletion SUCCESS of %s:%s as %s on %s in %s seconds', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, duration)
-
-            except SourceNotFound:
-                err_msg = 'Deletion NOTFOUND of %s:%s as %s on %s' % (replica['scope'], replica['name'], replica['pfn'], rse_name)
-                logging.warning('%s %s', prepend_str, err_msg)
-                deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
-                if replica['state'] == ReplicaState.AVAILABLE:
-                    deletion_dict['reason'] = str(err_msg)
-                    add_message('deletion-failed', deletion_dict)
+        except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
+            logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(error))
+            deletion_dict['reason'] = str(error)
+            add_message('deletion-failed', deletion_dict)
 
-            except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
-                logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(error))
-                deletion_dict['reason'] = str(error)
-                add_message('deletion-failed', deletion_dict)
+        except Exception as error:
+            logging.critical('%s Deletion CRITICAL of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(traceback.format_exc()))
+            deletion_dict['reason'] = str(error)
+            add_message('deletion-failed', deletion_dict)
 
-            except Exception as error:
-                logging.critical('%s Deletion CRITICAL of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(traceback.format_exc()))
-                deletion_dict['reason'] = str(error)
-                add_message('deletion-failed', deletion_dict)
 
-    except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
-        for replica in replicas:
-            logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(error))
-            add_message('deletion-failed', {'scope': replica['scope'].external,
-                                            'name': replica['name'],
-                                            'rse': rse_name,
-                                            'file-size': replica['bytes'],
-                                            'bytes': replica['bytes'],
-                                            'url': replica['pfn'],
-                                            'reason': str(error),
-                                            'protocol': prot.attributes['scheme']})
+def __report_noaccess(replicas, prot, rse_info, prepend_str, error):
+    """
+    Report the replicas which could not be deleted because the storage could not be accessed.
 
-    finally:
-        prot.close()
-    return deleted_files
+    :param replicas:     List of replicas with their pfn.
+    :param prot:         The protocol.
+    :param rse_info:     The RSE settings.
+    :param prepend_str:  String to prepend to the log messages.
+    :param error:        The access error.
+    """
+    for replica in replicas:
+        logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_info['rse'], str(error))
+        add_message('deletion-failed', {'scope': replica['scope'].external,
+                                        'name': replica['name'],
+                                        'rse': rse_info['rse'],
+                                        'file-size': replica['bytes'],
+                                        'bytes': replica['bytes'],
+                                        'url': replica['pfn'],
+                                        'reason': str(error),
+                                        'protocol': prot.attributes['scheme']})
 
 
 def get_rses_to_hostname_mapping():
@@ -242,6 +275,131 @@ def get_max_deletion_threads_by_hostname(hostname):
     return result
 
 
+def get_hostname_semaphore(hostname):
+    """
+    Return the semaphore limiting the number of concurrent deletions of this process on a SE.
+
+    :param hostname: the hostname of the SE
+
+    :returns: A threading.BoundedSemaphore shared by all the reaper threads of the process.
+    """
+    with HOSTNAME_SEMAPHORES_LOCK:
+        if hostname not in HOSTNAME_SEMAPHORES:
+            HOSTNAME_SEMAPHORES[hostname] = threading.BoundedSemaphore(int(get_max_deletion_threads_by_hostname(hostname)))
+        return HOSTNAME_SEMAPHORES[hostname]
+
+
+def __deletion_worker(queue, deleted_files, rse_info, staging_areas, prepend_str, scheme, semaphore):
+    """
+    Thread deleting the chunks of replicas from the queue with its own protocol connection.
+    The protocol is connected once and reused for all the chunks of the thread.
+
+    :param queue:          Queue of lists of replicas to delete.
+    :param deleted_files:  List extended with the files deleted from the storage.
+    :param rse_info:       The RSE settings.
+    :param staging_areas:  List of staging areas.
+    :param prepend_str:    String to prepend to the log messages.
+    :param scheme:         Force the worker to use a particular protocol, e.g., mock.
+    :param semaphore:      Semaphore limiting the concurrent deletions on the SE.
+    """
+    try:
+        prot = rsemgr.create_protocol(rse_info, 'delete', scheme=scheme)
+    except Exception:
+        logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+        return
+
+    connected = False
+    try:
+        while not GRACEFUL_STOP.is_set():
+            try:
+                file_replicas = queue.get_nowait()
+            except Empty:
+                break
+            with semaphore:
+                try:
+                    if not connected:
+                        prot.connect()
+                        connected = True
+                    __delete_replicas(file_replicas, prot, rse_info, staging_areas, prepend_str, deleted_files)
+                except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
+                    __report_noaccess(file_replicas, prot, rse_info, prepend_str, error)
+                except Exception:
+                    logging.critical('%s Deletion CRITICAL of %i replicas on %s: %s', prepend_str, len(file_replicas), rse_info['rse'], str(traceback.format_exc()))
+                    # Connect again for the next chunk
+                    if connected:
+                        connected = False
+                        __close(prot, rse_info, prepend_str)
+    except Exception:
+        logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+    finally:
+        if connected:
+            __close(prot, rse_info, prepend_str)
+
+
+def __close(prot, rse_info, prepend_str):
+    """
+    Close the connection of a deletion worker, logging instead of raising errors.
+
+    :param prot:         The connected protocol.
+    :param rse_info:     The RSE settings.
+    :param prepend_str:  String to prepend to the log messages.
+    """
+    try:
+        prot.close()
+    except Exception:
+        logging.warning('%s Could not close the connection to %s: %s', prepend_str, rse_info['rse'], str(traceback.format_exc()))
+
+
+def start_deletion(replicas, rse_info, rse_hostname, staging_areas, prepend_str, scheme=None, nb_threads=1, bulk=10):
+    """
+    Start the concurrent deletion of replicas from the storage.
+
+    :param replicas:       List of replicas with their pfn.
+    :param rse_info:       The RSE settings.
+    :param rse_hostname:   The hostname of the SE used for the deletion.
+    :param staging_areas:  List of staging areas.
+    :param prepend_str:    String to prepend to the log messages.
+    :param scheme:         Force the reaper to use a particular protocol, e.g., mock.
+    :param nb_threads:     Maximum number of deletion threads, further limited by the max_deletion_threads of the SE.
+    :param bulk:           Number of replicas handled by a thread at a time.
+
+    :returns: A tuple (threads, deleted_files). deleted_files is complete once all the threads are joined.
+    """
+    queue = Queue()
+    for file_replicas in chunks(replicas, bulk):
+        queue.put(file_replicas)
+
+    deleted_files = []
+    semaphore = get_hostname_semaphore(rse_hostname)
+    nb_threads = max(1, min(nb_threads, int(get_max_deletion_threads_by_hostname(rse_hostname)), queue.qsize()))
+    threads = [threading.Thread(target=__deletion_worker, kwargs={'queue': queue,
+                                                                  'deleted_files': deleted_files,
+                                                                  'rse_info': rse_info,
+                                                                  'staging_areas': staging_areas,
+                                                                  'prepend_str': prepend_str,
+                                                                  'scheme': scheme,
+                                                                  'semaphore': semaphore}) for _ in range(nb_threads)]
+    for thread in threads:
+        thread.start()
+    return threads, deleted_files
+
+
+def delete_from_catalog(rse_id, rse_name, deleted_files, prepend_str):
+    """
+    Delete from the catalog the replicas deleted from the storage.
+
+    :param rse_id:         The RSE id.
+    :param rse_name:       The RSE name.
+    :param deleted_files:  List of files deleted from the storage.
+    :param prepend_str:    String to prepend to the log messages.
+    """
+    del_start = time.time()
+    with monitor.record_timer_block('reaper.delete_replicas'):
+        delete_replicas(rse_id=rse_id, files=deleted_files)
+    logging.debug('%s delete_replicas successed on %s : %s replicas in %s seconds', prepend_str, rse_name, len(deleted_files), time.time() - del_start)
+    monitor.record_counter(counters='reaper.deletion.done', delta=len(deleted_files))
+
+
 def __check_rse_usage(rse, rse_id, prepend_str):
     """
     Internal method to check RSE usage and limits.
@@ -331,7 +489,7 @@ def __check_rse_usage(rse, rse_id, prepend_str):
 
 
 def reaper(rses, include_rses, exclude_rses, chunk_size=100, once=False, greedy=False,
-           scheme=None, delay_seconds=0, sleep_time=60):
+           scheme=None, delay_seconds=0, sleep_time=60, threads_per_worker=1):
     """
     Main loop to select and delete files.
 
@@ -344,6 +502,7 @@ def reaper(rses, include_rses, exclude_rses, chunk_size=100, once=False, greedy=
     :param scheme:         Force the reaper to use a particular protocol, e.g., mock.
     :param delay_seconds:  The delay to query replicas in BEING_DELETED state.
     :param sleep_time:     Time between two cycles.
+    :param threads_per_worker: Maximum number of threads deleting concurrently the files of a chunk.
     """
     hostname = socket.getfqdn()
     executable = sys.argv[0]
@@ -461,17 +620,18 @@ def reaper(rses, include_rses, exclude_rses, chunk_size=100, once=False, greedy=
                     logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
 
                 # Physical  deletion will take place there
+                # The catalog deletion of a chunk overlaps with the storage deletion of the next one
+                pending_files = []
                 try:
-                    prot = rsemgr.create_protocol(rse_info, 'delete', scheme=scheme)
                     for file_replicas in chunks(replicas, 100):
                         # Refresh heartbeat
                         live(executable, hostname, pid, hb_thread, older_than=600, hash_executable=None, payload=rse_hostname_key, session=None)
                         del_start_time = time.time()
                         for replica in file_replicas:
                             try:
-                                replica['pfn'] = str(rsemgr.lfns2pfns(rse_settings=rse_info,
-                                                                      lfns=[{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']}],
-                                                                      operation='delete', scheme=scheme).values()[0])
+                                replica['pfn'] = str(list(rsemgr.lfns2pfns(rse_settings=rse_info,
+                                                                           lfns=[{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']}],
+                                                                           operation='delete', scheme=scheme).values())[0])
                             except (ReplicaUnAvailable, ReplicaNotFound) as error:
                                 logging.warning('%s Failed get pfn UNAVAILABLE replica %s:%s on %s with error %s', prepend_str, replica['scope'], replica['name'], rse_name, str(error))
                                 replica['pfn'] = None
@@ -479,19 +639,28 @@ def reaper(rses, include_rses, exclude_rses, chunk_size=100, once=False, greedy=
                             except Exception:
                                 logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
 
-                        deleted_files = delete_from_storage(file_replicas, prot, rse_info, staging_areas, prepend_str)
+                        deletion_threads, deleted_files = start_deletion(file_replicas, rse_info, rse_hostname, staging_areas, prepend_str,
+                                                                         scheme=scheme, nb_threads=threads_per_worker)
+                        try:
+                            if pending_files:
+                                delete_from_catalog(rse_id, rse_name, pending_files, prepend_str)
+                        finally:
+                            pending_files = []
+                            for thread in deletion_threads:
+                                thread.join()
                         logging.info('%s %i files processed in %s seconds', prepend_str, len(file_replicas), time.time() - del_start_time)
-
-                        # Then finally delete the replicas
-                        del_start = time.time()
-                        with monitor.record_timer_block('reaper.delete_replicas'):
-                            delete_replicas(rse_id=rse_id, files=deleted_files)
-                        logging.debug('%s delete_replicas successed on %s : %s replicas in %s seconds', prepend_str, rse_name, len(deleted_files), time.time() - del_start)
-                        monitor.record_counter(counters='reaper.deletion.done', delta=len(deleted_files))
+                        pending_files = deleted_files
 
                 except Exception as error:
                     logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
 
+                # Then finally delete the replicas of the last chunk
+                try:
+                    if pending_files:
+                        delete_from_catalog(rse_id, rse_name, pending_files, prepend_str)
+                except Exception:
+                    logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+
             if once:
                 break
 
@@ -521,13 +690,13 @@ def stop(signum=None, frame=None):
     GRACEFUL_STOP.set()
 
 
-def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=None, exclude_rses=None, include_rses=None, delay_seconds=0, sleep_time=60):
+def run(threads=1, chunk_size=100, threads_per_worker=1, once=False, greedy=False, rses=None, scheme=None, exclude_rses=None, include_rses=None, delay_seconds=0, sleep_time=60):
     """
     Starts up the reaper threads.
 
     :param threads:            The total number of workers.
     :param chunk_size:         The size of chunk for deletion.
-    :param threads_per_worker: Total number of threads created by each worker.
+    :param threads_per_worker: Maximum number of deletion threads created by each worker, limited by the max_deletion_threads of the SE.
     :param once:               If True, only runs one iteration of the main loop.
     :param greedy:             If True, delete right away replicas with tombstone.
     :param rses:               List of RSEs the reaper should work against. If empty, it considers all RSEs.
@@ -558,6 +727,7 @@ def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=N
                                                             'greedy': greedy,
                                                             'sleep_time': sleep_time,
                                                             'delay_seconds': delay_seconds,
+                                                            'threads_per_worker': threads_per_worker,
                                                             'scheme': scheme}) for _ in range(0, threads)]
 
     for thread in threads_list:
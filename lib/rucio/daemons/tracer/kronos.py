@@ -44,6 +44,7 @@ from threading import Event, Thread, current_thread
 from time import sleep, time
 from traceback import format_exc
 
+from six import string_types
 from stomp import Connection
 
 from rucio.common.config import config_get, config_get_bool, config_get_int
@@ -135,128 +136,163 @@ class AMQConsumer(object):
     def __update_atime(self):
         """
         Bulk update atime.
+
+        The reports of the chunk are first reduced in memory: the counters are aggregated,
+        the suspicious files are grouped by reason and protocol and the atime touches are deduplicated
+        per replica and per dataset, keeping the most recent access. The database is then
+        updated once per distinct replica, dataset and suspicious reason and protocol.
         """
-        replicas = []
-        rses = []
+        counters = {}
+        suspicious = {}
+        replicas = {}
+        files = {}
+        datasets = {}
+        rse_ids = {}
+
+        def __count(counter):
+            counters[counter] = counters.get(counter, 0) + 1
+
+        def __get_rse_id(rse):
+            if rse not in rse_ids:
+                rse_ids[rse] = get_rse_id(rse=rse)
+            return rse_ids[rse]
+
+        def __touch_dataset(dataset):
+            key = (dataset['scope'], dataset['name'], dataset['rse_id'])
+            if key not in datasets or datasets[key]['accessed_at'] < dataset['accessed_at']:
+                datasets[key] = dataset
+
         for report in self.__reports:
             try:
                 # Identify suspicious files
-                try:
-                    if self.__bad_files_patterns and report['eventType'] in ['get_sm', 'get_sm_a', 'get'] and 'clientState' in report and report['clientState'] not in ['DONE', 'FOUND_ROOT', 'ALREADY_DONE']:
-                        for pattern in self.__bad_files_patterns:
-                            if 'stateReason' in report and report['stateReason'] and isinstance(report['stateReason'], str) and pattern.match(report['stateReason']):
-                                reason = report['stateReason'][:255]
-                                if 'url' not in report or not report['url']:
-                                    logging.error('Missing url in the following trace : ' + str(report))
-                                else:
-                                    try:
-                                        surl = report['url']
-                                        declare_bad_file_replicas([surl, ], reason=reason, issuer=InternalAccount('root'), status=BadFilesStatus.SUSPICIOUS)
-                                        logging.info('Declare suspicious file %s with reason %s' % (report['url'], reason))
-                                    except Exception as error:
-                                        logging.error('Failed to declare suspicious file' + str(error))
-                except Exception as error:
-                    logging.error('Problem with bad trace : %s . Error %s' % (str(report), str(error)))
+                if self.__bad_files_patterns and report.get('eventType') in ['get_sm', 'get_sm_a', 'get'] and 'clientState' in report and report['clientState'] not in ['DONE', 'FOUND_ROOT', 'ALREADY_DONE']:
+                    if report.get('stateReason') and isinstance(report['stateReason'], string_types) and any(pattern.match(report['stateReason']) for pattern in self.__bad_files_patterns):
+                        if not report.get('url'):
+                            logging.error('Missing url in the following trace : ' + str(report))
+                        else:
+                            # declare_bad_file_replicas only accepts PFNs of the same protocol
+                            scheme = report['url'].split('://')[0]
+                            suspicious.setdefault((report['stateReason'][:255], scheme), set()).add(report['url'])
 
                 # check if scope in report. if not skip this one.
                 if 'scope' not in report:
-                    record_counter('daemons.tracer.kronos.missing_scope')
+                    __count('daemons.tracer.kronos.missing_scope')
                     if report['eventType'] != 'touch':
                         continue
                 else:
-                    record_counter('daemons.tracer.kronos.with_scope')
+                    __count('daemons.tracer.kronos.with_scope')
                     report['scope'] = InternalScope(report['scope'])
 
                 # handle all events starting with get* and download and touch events.
-                if not report['eventType'].startswith('get') and not report['eventType'].startswith('sm_get') and not report['eventType'] == 'download' and not report['eventType'] == 'touch':
+                event_type = report['eventType']
+                if not event_type.startswith('get') and not event_type.startswith('sm_get') and not event_type == 'download' and not event_type == 'touch':
                     continue
-                if report['eventType'].endswith('_es'):
+                if event_type.endswith('_es'):
                     continue
-                record_counter('daemons.tracer.kronos.total_get')
-                if report['eventType'] == 'get':
-                    record_counter('daemons.tracer.kronos.dq2clients')
-                elif report['eventType'] == 'get_sm' or report['eventType'] == 'sm_get':
-                    if report['eventVersion'] == 'aCT':
-                        record_counter('daemons.tracer.kronos.panda_production_act')
-                    else:
-                        record_counter('daemons.tracer.kronos.panda_production')
-                elif report['eventType'] == 'get_sm_a' or report['eventType'] == 'sm_get_a':
-                    if report['eventVersion'] == 'aCT':
-                        record_counter('daemons.tracer.kronos.panda_analysis_act')
-                    else:
-                        record_counter('daemons.tracer.kronos.panda_analysis')
-                elif report['eventType'] == 'download':
-                    record_counter('daemons.tracer.kronos.rucio_download')
-                elif report['eventType'] == 'touch':
-                    record_counter('daemons.tracer.kronos.rucio_touch')
+                __count('daemons.tracer.kronos.total_get')
+                if event_type == 'get':
+                    __count('daemons.tracer.kronos.dq2clients')
+                elif event_type in ('get_sm', 'sm_get'):
+                    __count('daemons.tracer.kronos.panda_production_act' if report['eventVersion'] == 'aCT' else 'daemons.tracer.kronos.panda_production')
+                elif event_type in ('get_sm_a', 'sm_get_a'):
+                    __count('daemons.tracer.kronos.panda_analysis_act' if report['eventVersion'] == 'aCT' else 'daemons.tracer.kronos.panda_analysis')
+                elif event_type == 'download':
+                    __count('daemons.tracer.kronos.rucio_download')
+                elif event_type == 'touch':
+                    __count('daemons.tracer.kronos.rucio_touch')
                 else:
-                    record_counter('daemons.tracer.kronos.other_get')
+                    __count('daemons.tracer.kronos.other_get')
 
-                if report['eventType'] == 'download' or report['eventType'] == 'touch':
+                if event_type == 'download' or event_type == 'touch':
                     report['usrdn'] = report['account']
 
                 if report['usrdn'] in self.__excluded_usrdns:
                     continue
 
+                accessed_at = datetime.utcfromtimestamp(report['traceTimeentryUnix'])
+
                 # handle touch and non-touch traces differently
-                if report['eventType'] != 'touch':
+                if event_type != 'touch':
                     # check if the report has the right state.
                     if 'eventVersion' in report:
                         if report['eventVersion'] != 'aCT':
                             if report['clientState'] in self.__excluded_states:
                                 continue
 
-                    if 'remoteSite' not in report:
-                        continue
-                    if not report['remoteSite']:
+                    if not report.get('remoteSite'):
                         continue
 
                     if 'filename' not in report:
                         if 'name' in report:
                             report['filename'] = report['name']
 
-                    rses = report['remoteSite'].strip().split(',')
-                    for rse in rses:
-                        rse_id = get_rse_id(rse=rse)
-                        replicas.append({'name': report['filename'], 'scope': report['scope'], 'rse': rse, 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix']),
-                                         'traceTimeentryUnix': report['traceTimeentryUnix'], 'eventVersion': report['eventVersion']})
+                    rses = [(rse, __get_rse_id(rse)) for rse in report['remoteSite'].strip().split(',')]
                 else:
                     # if touch event and if datasetScope is in the report then it means
                     # that there is no file scope/name and therefore only the dataset is
                     # put in the queue to be updated and the rest is skipped.
-                    rse_id = None
-                    rse = None
+                    rses = []
                     if 'remoteSite' in report:
-                        rse = report['remoteSite']
-                        rse_id = get_rse_id(rse=rse)
+                        rses = [(report['remoteSite'], __get_rse_id(report['remoteSite']))]
                     if 'datasetScope' in report:
-                        self.__dataset_queue.put({'scope': report['datasetScope'], 'name': report['dataset'], 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+                        __touch_dataset({'scope': report['datasetScope'], 'name': report['dataset'], 'rse_id': rses[0][1] if rses else None, 'accessed_at': accessed_at})
                         continue
-                    else:
-                        if 'remoteSite' not in report:
-                            continue
-                        replicas.append({'name': report['filename'], 'scope': report['scope'], 'rse': rse, 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+                    if not rses:
+                        continue
+
+                for rse, rse_id in rses:
+                    key = (report['scope'], report['filename'], rse_id)
+                    if key not in replicas or replicas[key]['accessed_at'] < accessed_at:
+                        replicas[key] = {'name': report['filename'], 'scope': report['scope'], 'rse': rse, 'rse_id': rse_id, 'accessed_at': accessed_at,
+                                         'traceTimeentryUnix': report['traceTimeentryUnix'], 'eventVersion': report.get('eventVersion')}
+                    file_rses = files.setdefault((report['scope'], report['filename']), {})
+                    file_rses[rse_id] = max(file_rses.get(rse_id, accessed_at), accessed_at)
 
             except (KeyError, AttributeError):
                 logging.error(format_exc())
-                record_counter('daemons.tracer.kronos.report_error')
+                __count('daemons.tracer.kronos.report_error')
                 continue
 
-            for did in list_parent_dids(report['scope'], report['filename']):
-                if did['type'] != DIDType.DATASET:
-                    continue
-                # do not update _dis datasets
-                if did['scope'].external == 'panda' and '_dis' in did['name']:
-                    continue
-                for rse in rses:
-                    rse_id = get_rse_id(rse=rse)
-                    self.__dataset_queue.put({'scope': did['scope'], 'name': did['name'], 'did_type': did['type'], 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+        for counter, delta in counters.items():
+            record_counter(counter, delta)
+
+        # Declare the suspicious files, one call per distinct reason and protocol
+        for (reason, _), surls in suspicious.items():
+            try:
+                declare_bad_file_replicas(list(surls), reason=reason, issuer=InternalAccount('root'), status=BadFilesStatus.SUSPICIOUS)
+                logging.info('Declare suspicious files %s with reason %s' % (list(surls), reason))
+            except Exception as error:
+                logging.warning('Failed to declare suspicious files %s, declaring them one by one: %s' % (list(surls), str(error)))
+                for surl in surls:
+                    try:
+                        declare_bad_file_replicas([surl, ], reason=reason, issuer=InternalAccount('root'), status=BadFilesStatus.SUSPICIOUS)
+                        logging.info('Declare suspicious file %s with reason %s' % (surl, reason))
+                    except Exception as error:
+                        logging.error('Failed to declare suspicious file' + str(error))
+
+        # Resolve the parent datasets once per distinct file
+        for (scope, name), file_rses in files.items():
+            try:
+                parents = list_parent_dids(scope, name)
+                for did in parents:
+                    if did['type'] != DIDType.DATASET:
+                        continue
+                    # do not update _dis datasets
+                    if did['scope'].external == 'panda' and '_dis' in did['name']:
+                        continue
+                    for rse_id, accessed_at in file_rses.items():
+                        __touch_dataset({'scope': did['scope'], 'name': did['name'], 'did_type': did['type'], 'rse_id': rse_id, 'accessed_at': accessed_at})
+            except Exception:
+                logging.error(format_exc())
+
+        for dataset in datasets.values():
+            self.__dataset_queue.put(dataset)
 
         logging.debug(replicas)
 
         try:
             start_time = time()
-            for replica in replicas:
+            for replica in replicas.values():
                 # if touch replica hits a locked row put the trace back into queue for later retry
                 if not touch_replica(replica):
                     resubmit = {'filename': replica['name'], 'scope': replica['scope'].external, 'remoteSite': replica['rse'], 'traceTimeentryUnix': replica['traceTimeentryUnix'],
@@ -269,7 +305,7 @@ class AMQConsumer(object):
             logging.error(format_exc())
             record_counter('daemons.tracer.kronos.update_error')
 
-        logging.info('(kronos_file) updated %d replicas' % len(replicas))
+        logging.info('(kronos_file) updated %d replicas from %d reports' % (len(replicas), len(self.__reports)))
 
 
 def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None, sleep_time=60):
@@ -42,9 +42,9 @@ from rucio.db.sqla.constants import DIDType, SubscriptionState
 from rucio.common.exception import (DatabaseException, DataIdentifierNotFound, InvalidReplicationRule, DuplicateRule, RSEBlacklisted,
                                     InvalidRSEExpression, InsufficientTargetRSEs, InsufficientAccountLimit, InputValidationError, RSEOverQuota,
                                     ReplicationRuleCreationTemporaryFailed, InvalidRuleWeight, StagingAreaRuleRequiresLifetime, SubscriptionNotFound)
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_int
 from rucio.common.schema import validate_schema
-from rucio.common.utils import chunks
+from rucio.common.utils import chunks, LRUCache
 from rucio.core import monitor, heartbeat
 from rucio.core.did import list_new_dids, set_new_dids, get_metadata
 from rucio.core.rse import list_rses
@@ -64,6 +64,9 @@ logging.basicConfig(stream=stdout,
 
 graceful_stop = threading.Event()
 
+REGEX_CHARACTERS = set('.^$*+?{}[]\\|()')
+SUBSCRIPTION_FILTERS = LRUCache(maxsize=config_get_int('transmogrifier', 'subscription_cache_size', False, 10000))
+
 
 def _retrial(func, *args, **kwargs):
     """
@@ -91,6 +94,71 @@ def _retrial(func, *args, **kwargs):
             raise
 
 
+def compile_subscription_filter(subscription):
+    """
+    Parse the filter of a subscription and compile its regular expressions.
+    The result is cached per subscription and version of the subscription.
+
+    param subscription: The subscription dictionnary.
+    return: The compiled filter as a dictionnary or None if the filter is invalid.
+    """
+    key = (subscription['id'], subscription.get('updated_at'), subscription['filter'])
+    compiled = SUBSCRIPTION_FILTERS.get(key)
+    if compiled is not None:
+        return compiled or None
+
+    try:
+        filter_string = loads(subscription['filter'])
+        compiled = {'pattern': None, 'excluded_pattern': None, 'scope': None, 'split_rule': False, 'metadata': [], 'literals': {}}
+        for key_filter in filter_string:
+            values = filter_string[key_filter]
+            if key_filter in ('pattern', 'excluded_pattern'):
+                compiled[key_filter] = re.compile(values)
+            elif key_filter == 'split_rule':
+                compiled['split_rule'] = values
+                if values == 'true':
+                    compiled['split_rule'] = True
+                elif values == 'false':
+                    compiled['split_rule'] = False
+            else:
+                if not isinstance(values, list):
+                    values = [values, ]
+                values = [str(value) for value in values]
+                if key_filter == 'scope':
+                    compiled['scope'] = [re.compile(value) for value in values]
+                else:
+                    compiled['metadata'].append((str(key_filter), [re.compile(value) for value in values]))
+                # Filters without any regular expression character only match the DIDs starting with one of the values
+                if not [value for value in values if REGEX_CHARACTERS.intersection(value)]:
+                    compiled['literals'][str(key_filter)] = values
+    except (ValueError, re.error) as error:
+        logging.error('%s : Subscription will be skipped' % error)
+        compiled = False
+
+    SUBSCRIPTION_FILTERS.set(key, compiled)
+    return compiled or None
+
+
+def _match_filter(compiled, did, metadata):
+    """
+    Check a DID against a compiled subscription filter.
+    """
+    if metadata['hidden']:
+        return False
+    if compiled['pattern'] and not compiled['pattern'].match(did['name']):
+        return False
+    if compiled['excluded_pattern'] and compiled['excluded_pattern'].match(did['name']):
+        return False
+    if compiled['scope'] is not None and not [scope for scope in compiled['scope'] if scope.match(did['scope'].external)]:
+        return False
+    for key, values in compiled['metadata']:
+        if key not in metadata:
+            return False
+        if not [value for value in values if value.match(str(metadata[key]))]:
+            return False
+    return True
+
+
 def is_matching_subscription(subscription, did, metadata):
     """
     Method to identify if a DID matches a subscription.
@@ -100,49 +168,71 @@ def is_matching_subscription(subscription, did, metadata):
     param metadata: The metadata dictionnary for the DID
     return: True/False
     """
-    if metadata['hidden']:
-        return False
-    try:
-        filter_string = loads(subscription['filter'])
-    except ValueError as error:
-        logging.error('%s : Subscription will be skipped' % error)
+    compiled = compile_subscription_filter(subscription)
+    if compiled is None:
         return False
-    # Loop over the keys of filter_string for subscription
-    for key in filter_string:
-        values = filter_string[key]
-        if key == 'pattern':
-            if not re.match(values, did['name']):
-                return False
-        elif key == 'excluded_pattern':
-            if re.match(values, did['name']):
-                return False
-        elif key == 'split_rule':
-            pass
-        elif key == 'scope':
-            match_scope = False
-            for scope in values:
-                if re.match(scope, did['scope'].external):
-                    match_scope = True
-                    break
-            if not match_scope:
-                return False
-        else:
-            if not isinstance(values, list):
-                values = [values, ]
-            has_metadata = False
-            for meta in metadata:
-                if str(meta) == str(key):
-                    has_metadata = True
-                    match_meta = False
-                    for value in values:
-                        if re.match(str(value), str(metadata[meta])):
-                            match_meta = True
-                            break
-                    if not match_meta:
-                        return False
-            if not has_metadata:
-                return False
-    return True
+    return _match_filter(compiled, did, metadata)
+
+
+class SubscriptionIndex(object):
+    """
+    Index of the compiled subscription filters.
+
+    Each subscription is bucketed under the literal values of one of its filter keys
+    (the scope if possible, otherwise a metadata key), so that a DID is only tested
+    against the subscriptions which can possibly match it.
+    """
+
+    def __init__(self, subscriptions):
+        """
+        :param subscriptions: The list of subscriptions, ordered by priority.
+        """
+        self.__subscriptions = []
+        self.__unindexed = []
+        self.__buckets = {}
+        self.__max_length = {}
+        for subscription in subscriptions:
+            compiled = compile_subscription_filter(subscription)
+            if compiled is None:
+                continue
+            position = len(self.__subscriptions)
+            self.__subscriptions.append((subscription, compiled))
+
+            literals = compiled['literals']
+            if not literals:
+                self.__unindexed.append(position)
+                continue
+            key = 'scope' if 'scope' in literals else sorted(literals)[0]
+            for value in literals[key]:
+                self.__buckets.setdefault(key, {}).setdefault(value, []).append(position)
+                self.__max_length[key] = max(self.__max_length.get(key, 0), len(value))
+
+    def __len__(self):
+        return len(self.__subscriptions)
+
+    def match(self, did, metadata):
+        """
+        Return the subscriptions matching a DID.
+
+        :param did: The DID dictionnary.
+        :param metadata: The metadata dictionnary for the DID.
+        :returns: The list of (subscription, compiled filter) tuples matching the DID, ordered by priority.
+        """
+        if metadata['hidden']:
+            return []
+        candidates = set(self.__unindexed)
+        for key, bucket in self.__buckets.items():
+            if key == 'scope':
+                value = did['scope'].external
+            elif key in metadata:
+                value = str(metadata[key])
+            else:
+                continue
+            # The values are regular expressions matched at the beginning of the string
+            for length in range(min(len(value), self.__max_length[key]) + 1):
+                candidates.update(bucket.get(value[:length], []))
+        return [self.__subscriptions[position] for position in sorted(candidates)
+                if _match_filter(self.__subscriptions[position][1], did, metadata)]
 
 
 def transmogrifier(bulk=5, once=False, sleep_time=60):
@@ -208,6 +298,7 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
             blacklisted_rse_id = [rse['id'] for rse in list_rses({'availability_write': False})]
             logging.debug(prepend_str + 'In transmogrifier worker')
             identifiers = []
+            subscription_index = SubscriptionIndex(subscriptions)
             #  Loop over all the new dids
             for did in dids:
                 did_success = True
@@ -216,140 +307,133 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
                     results[did_tag] = []
                     try:
                         metadata = get_metadata(did['scope'], did['name'])
-                        # Loop over all the subscriptions
-                        for subscription in subscriptions:
-                            #  Check if the DID match the subscription
-                            if is_matching_subscription(subscription, did, metadata) is True:
-                                filter_string = loads(subscription['filter'])
-                                split_rule = filter_string.get('split_rule', False)
-                                if split_rule == 'true':
-                                    split_rule = True
-                                elif split_rule == 'false':
-                                    split_rule = False
-                                stime = time.time()
-                                results[did_tag].append(subscription['id'])
-                                logging.info(prepend_str + '%s:%s matches subscription %s' % (did['scope'], did['name'], subscription['name']))
-                                for rule_string in loads(subscription['replication_rules']):
-                                    # Get all the rule and subscription parameters
-                                    grouping = rule_string.get('grouping', 'DATASET')
-                                    lifetime = rule_string.get('lifetime', None)
-                                    ignore_availability = rule_string.get('ignore_availability', None)
-                                    weight = rule_string.get('weight', None)
-                                    source_replica_expression = rule_string.get('source_replica_expression', None)
-                                    locked = rule_string.get('locked', None)
-                                    if locked == 'True':
-                                        locked = True
-                                    else:
-                                        locked = False
-                                    purge_replicas = rule_string.get('purge_replicas', False)
-                                    if purge_replicas == 'True':
-                                        purge_replicas = True
-                                    else:
-                                        purge_replicas = False
-                                    rse_expression = str(rule_string['rse_expression'])
-                                    comment = str(subscription['comments'])
-                                    subscription_id = str(subscription['id'])
-                                    account = subscription['account']
-                                    copies = int(rule_string['copies'])
-                                    activity = rule_string.get('activity', 'User Subscriptions')
+                        # Loop over the subscriptions matching the DID
+                        for subscription, compiled_filter in subscription_index.match(did, metadata):
+                            split_rule = compiled_filter['split_rule']
+                            stime = time.time()
+                            results[did_tag].append(subscription['id'])
+                            logging.info(prepend_str + '%s:%s matches subscription %s' % (did['scope'], did['name'], subscription['name']))
+                            for rule_string in loads(subscription['replication_rules']):
+                                # Get all the rule and subscription parameters
+                                grouping = rule_string.get('grouping', 'DATASET')
+                                lifetime = rule_string.get('lifetime', None)
+                                ignore_availability = rule_string.get('ignore_availability', None)
+                                weight = rule_string.get('weight', None)
+                                source_replica_expression = rule_string.get('source_replica_expression', None)
+                                locked = rule_string.get('locked', None)
+                                if locked == 'True':
+                                    locked = True
+                                else:
+                                    locked = False
+                                purge_replicas = rule_string.get('purge_replicas', False)
+                                if purge_replicas == 'True':
+                                    purge_replicas = True
+                                else:
+                                    purge_replicas = False
+                                rse_expression = str(rule_string['rse_expression'])
+                                comment = str(subscription['comments'])
+                                subscription_id = str(subscription['id'])
+                                account = subscription['account']
+                                copies = int(rule_string['copies'])
+                                activity = rule_string.get('activity', 'User Subscriptions')
+                                try:
+                                    validate_schema(name='activity', obj=activity)
+                                except InputValidationError as error:
+                                    logging.error(prepend_str + 'Error validating the activity %s' % (str(error)))
+                                    activity = 'User Subscriptions'
+                                if lifetime:
+                                    lifetime = int(lifetime)
+
+                                str_activity = "".join(activity.split())
+                                success = False
+                                nattempt = 5
+                                attemptnr = 0
+                                skip_rule_creation = False
+
+                                if split_rule:
+                                    rses = parse_expression(rse_expression)
+                                    list_of_rses = [rse['id'] for rse in rses]
+                                    # Check that some rule doesn't already exist for this DID and subscription
+                                    preferred_rse_ids = []
+                                    for rule in list_rules(filters={'subscription_id': subscription_id, 'scope': did['scope'], 'name': did['name']}):
+                                        already_existing_rses = [(rse['rse'], rse['id']) for rse in parse_expression(rule['rse_expression'])]
+                                        for rse, rse_id in already_existing_rses:
+                                            if (rse_id in list_of_rses) and (rse_id not in preferred_rse_ids):
+                                                preferred_rse_ids.append(rse_id)
+                                    if len(preferred_rse_ids) >= copies:
+                                        skip_rule_creation = True
+
+                                    rse_id_dict = {}
+                                    for rse in rses:
+                                        rse_id_dict[rse['id']] = rse['rse']
                                     try:
-                                        validate_schema(name='activity', obj=activity)
-                                    except InputValidationError as error:
-                                        logging.error(prepend_str + 'Error validating the activity %s' % (str(error)))
-                                        activity = 'User Subscriptions'
-                                    if lifetime:
-                                        lifetime = int(lifetime)
-
-                                    str_activity = "".join(activity.split())
-                                    success = False
-                                    nattempt = 5
-                                    attemptnr = 0
-                                    skip_rule_creation = False
-
-                                    if split_rule:
-                                        rses = parse_expression(rse_expression)
-                                        list_of_rses = [rse['id'] for rse in rses]
-                                        # Check that some rule doesn't already exist for this DID and subscription
-                                        preferred_rse_ids = []
-                                        for rule in list_rules(filters={'subscription_id': subscription_id, 'scope': did['scope'], 'name': did['name']}):
-                                            already_existing_rses = [(rse['rse'], rse['id']) for rse in parse_expression(rule['rse_expression'])]
-                                            for rse, rse_id in already_existing_rses:
-                                                if (rse_id in list_of_rses) and (rse_id not in preferred_rse_ids):
-                                                    preferred_rse_ids.append(rse_id)
-                                        if len(preferred_rse_ids) >= copies:
-                                            skip_rule_creation = True
-
-                                        rse_id_dict = {}
-                                        for rse in rses:
-                                            rse_id_dict[rse['id']] = rse['rse']
+                                        rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
+                                        selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=blacklisted_rse_id)]
+                                    except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
+                                        logging.warning(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Try including blacklisted sites' %
+                                                        (subscription['name'], account, str(error)))
+                                        # Now including the blacklisted sites
                                         try:
                                             rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
-                                            selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=blacklisted_rse_id)]
+                                            selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=[])]
+                                            ignore_availability = True
                                         except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
-                                            logging.warning(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Try including blacklisted sites' %
-                                                            (subscription['name'], account, str(error)))
-                                            # Now including the blacklisted sites
-                                            try:
-                                                rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
-                                                selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=[])]
-                                                ignore_availability = True
-                                            except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
-                                                logging.error(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Skipping rule creation.' %
-                                                              (subscription['name'], account, str(error)))
-                                                monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                                # The DID won't be reevaluated at the next cycle
-                                                did_success = did_success and True
-                                                continue
-
-                                    for attempt in range(0, nattempt):
-                                        attemptnr = attempt
-                                        nb_rule = 0
-                                        #  Try to create the rule
-                                        try:
-                                            if split_rule:
-                                                if not skip_rule_creation:
-                                                    for rse in selected_rses:
-                                                        logging.info(prepend_str + 'Will insert one rule for %s:%s on %s' % (did['scope'], did['name'], rse))
-                                                        add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=1,
-                                                                 rse_expression=rse, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
-                                                                 subscription_id=subscription_id, source_replica_expression=source_replica_expression, activity=activity,
-                                                                 purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
-
-                                                        nb_rule += 1
-                                                        if nb_rule == copies:
-                                                            success = True
-                                                            break
-                                            else:
-                                                add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=copies,
-                                                         rse_expression=rse_expression, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
-                                                         subscription_id=subscription['id'], source_replica_expression=source_replica_expression, activity=activity,
-                                                         purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
-                                                nb_rule += 1
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.done', delta=nb_rule)
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.activity.%s' % str_activity, delta=nb_rule)
-                                            success = True
-                                            break
-                                        except (InvalidReplicationRule, InvalidRuleWeight, InvalidRSEExpression, StagingAreaRuleRequiresLifetime, DuplicateRule) as error:
-                                            # Errors that won't be retried
-                                            success = True
-                                            logging.error(prepend_str + '%s' % (str(error)))
+                                            logging.error(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Skipping rule creation.' %
+                                                          (subscription['name'], account, str(error)))
                                             monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                            break
-                                        except (ReplicationRuleCreationTemporaryFailed, InsufficientTargetRSEs, InsufficientAccountLimit, DatabaseException, RSEBlacklisted) as error:
-                                            # Errors to be retried
-                                            logging.error(prepend_str + '%s Will perform an other attempt %i/%i' % (str(error), attempt + 1, nattempt))
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                        except Exception as error:
-                                            # Unexpected errors
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.unknown', delta=1)
-                                            exc_type, exc_value, exc_traceback = exc_info()
-                                            logging.critical(prepend_str + ''.join(format_exception(exc_type, exc_value, exc_traceback)).strip())
-
-                                    did_success = (did_success and success)
-                                    if (attemptnr + 1) == nattempt and not success:
-                                        logging.error(prepend_str + 'Rule for %s:%s on %s cannot be inserted' % (did['scope'], did['name'], rse_expression))
-                                    else:
-                                        logging.info(prepend_str + '%s rule(s) inserted in %f seconds' % (str(nb_rule), time.time() - stime))
+                                            # The DID won't be reevaluated at the next cycle
+                                            did_success = did_success and True
+                                            continue
+
+                                for attempt in range(0, nattempt):
+                                    attemptnr = attempt
+                                    nb_rule = 0
+                                    #  Try to create the rule
+                                    try:
+                                        if split_rule:
+                                            if not skip_rule_creation:
+                                                for rse in selected_rses:
+                                                    logging.info(prepend_str + 'Will insert one rule for %s:%s on %s' % (did['scope'], did['name'], rse))
+                                                    add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=1,
+                                                             rse_expression=rse, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
+                                                             subscription_id=subscription_id, source_replica_expression=source_replica_expression, activity=activity,
+                                                             purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
+
+                                                    nb_rule += 1
+                                                    if nb_rule == copies:
+                                                        success = True
+                                                        break
+                                        else:
+                                            add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=copies,
+                                                     rse_expression=rse_expression, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
+                                                     subscription_id=subscription['id'], source_replica_expression=source_replica_expression, activity=activity,
+                                                     purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
+                                            nb_rule += 1
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.done', delta=nb_rule)
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.activity.%s' % str_activity, delta=nb_rule)
+                                        success = True
+                                        break
+                                    except (InvalidReplicationRule, InvalidRuleWeight, InvalidRSEExpression, StagingAreaRuleRequiresLifetime, DuplicateRule) as error:
+                                        # Errors that won't be retried
+                                        success = True
+                                        logging.error(prepend_str + '%s' % (str(error)))
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+                                        break
+                                    except (ReplicationRuleCreationTemporaryFailed, InsufficientTargetRSEs, InsufficientAccountLimit, DatabaseException, RSEBlacklisted) as error:
+                                        # Errors to be retried
+                                        logging.error(prepend_str + '%s Will perform an other attempt %i/%i' % (str(error), attempt + 1, nattempt))
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+                                    except Exception as error:
+                                        # Unexpected errors
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.errortype.unknown', delta=1)
+                                        exc_type, exc_value, exc_traceback = exc_info()
+                                        logging.critical(prepend_str + ''.join(format_exception(exc_type, exc_value, exc_traceback)).strip())
+
+                                did_success = (did_success and success)
+                                if (attemptnr + 1) == nattempt and not success:
+                                    logging.error(prepend_str + 'Rule for %s:%s on %s cannot be inserted' % (did['scope'], did['name'], rse_expression))
+                                else:
+                                    logging.info(prepend_str + '%s rule(s) inserted in %f seconds' % (str(nb_rule), time.time() - stime))
                     except DataIdentifierNotFound as error:
                         logging.warning(prepend_str + error)
 
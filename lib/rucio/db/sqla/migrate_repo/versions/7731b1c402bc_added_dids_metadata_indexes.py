@@ -0,0 +1,45 @@
+# Copyright 2013-2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' added dids metadata indexes '''
+
+from alembic import context
+from alembic.op import create_index, drop_index
+
+
+# Alembic revision identifiers
+revision = '7731b1c402bc'
+down_revision = '810a41685bc1'
+
+
+def upgrade():
+    '''
+    Upgrade the database to this revision
+    '''
+
+    if context.get_context().dialect.name in ['oracle', 'mysql', 'postgresql']:
+        create_index('DIDS_SCOPE_DATATYPE_IDX', 'dids', ['scope', 'datatype', 'name'])
+        create_index('DIDS_SCOPE_PROJECT_IDX', 'dids', ['scope', 'project', 'name'])
+        create_index('DIDS_SCOPE_RUN_NUMBER_IDX', 'dids', ['scope', 'run_number', 'name'])
+
+
+def downgrade():
+    '''
+    Downgrade the database to the previous revision
+    '''
+
+    if context.get_context().dialect.name in ['oracle', 'mysql', 'postgresql']:
+        drop_index('DIDS_SCOPE_DATATYPE_IDX', 'dids')
+        drop_index('DIDS_SCOPE_PROJECT_IDX', 'dids')
+        drop_index('DIDS_SCOPE_RUN_NUMBER_IDX', 'dids')
@@ -406,7 +406,10 @@ class DataIdentifier(BASE, ModelBase):
                    CheckConstraint('PURGE_REPLICAS IS NOT NULL', name='DIDS_PURGE_REPLICAS_NN'),
                    # UniqueConstraint('guid', name='DIDS_GUID_UQ'),
                    Index('DIDS_IS_NEW_IDX', 'is_new'),
-                   Index('DIDS_EXPIRED_AT_IDX', 'expired_at'))
+                   Index('DIDS_EXPIRED_AT_IDX', 'expired_at'),
+                   Index('DIDS_SCOPE_DATATYPE_IDX', 'scope', 'datatype', 'name'),
+                   Index('DIDS_SCOPE_PROJECT_IDX', 'scope', 'project', 'name'),
+                   Index('DIDS_SCOPE_RUN_NUMBER_IDX', 'scope', 'run_number', 'name'))
 
 
 class DidMeta(BASE, ModelBase):
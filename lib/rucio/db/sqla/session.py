@@ -23,8 +23,12 @@
 
 from __future__ import print_function
 
+import heapq
 import os
+import random
 import sys
+import time
+import traceback
 
 from functools import wraps
 from inspect import isgeneratorfunction
@@ -37,8 +41,9 @@ from sqlalchemy.exc import DatabaseError, DisconnectionError, OperationalError,
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_bool, config_get_float, config_get_int
 from rucio.common.exception import RucioException, DatabaseException
+from rucio.core.monitor import record_counter, record_gauge, record_timer
 
 try:
     main_script = os.path.basename(sys.argv[0])
@@ -63,6 +68,19 @@ if DEFAULT_SCHEMA_NAME:
 
 _MAKER, _ENGINE, _LOCK = None, None, Lock()
 
+# Opt-in instrumentation of the session decorators and of the connection pool.
+# When disabled, neither the decorators nor the engine are wrapped at all.
+INSTRUMENTATION = config_get_bool(DATABASE_SECTION, 'instrumentation', raise_exception=False, default=False)
+SLOW_STATEMENT_THRESHOLD = config_get_float(DATABASE_SECTION, 'slow_statement_threshold', raise_exception=False, default=1.0)
+SLOW_STATEMENTS_SIZE = config_get_int(DATABASE_SECTION, 'slow_statements_size', raise_exception=False, default=50)
+_SLOW_STATEMENTS, _SLOW_STATEMENTS_LOCK = [], Lock()
+
+# Optional read replicas used by read_session and stream_session, as a comma-separated list of connection strings.
+# A replica which cannot be connected to is skipped in favour of the others, or of the primary, for a while.
+READ_REPLICAS = [url.strip() for url in config_get(DATABASE_SECTION, 'read_default', raise_exception=False, default='').split(',') if url.strip()]
+READ_REPLICA_RETRY_INTERVAL = config_get_int(DATABASE_SECTION, 'read_replica_retry_interval', raise_exception=False, default=60)
+_READ_MAKERS, _READ_REPLICA_FAILURES = {}, {}
+
 
 def _fk_pragma_on_connect(dbapi_con, con_record):
     # Hack for previous versions of sqlite3
@@ -155,34 +173,146 @@ def my_on_connect(dbapi_con, connection_record):
     dbapi_con.action = caller
 
 
+def _call_site():
+    """
+    Returns the innermost frame of the stack which is neither in sqlalchemy nor in this module.
+
+    :returns: the call site as a 'file:line:function' string.
+    """
+    this_module = os.path.splitext(__file__)[0]
+    for filename, lineno, name, _ in reversed(traceback.extract_stack()):
+        if 'sqlalchemy' in filename or os.path.splitext(filename)[0] == this_module:
+            continue
+        return '%s:%s:%s' % (filename, lineno, name)
+    return ''
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Remembers the start time of a statement on the connection.
+    """
+    conn.info.setdefault('statement_start_time', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Records the duration of a statement and keeps track of the slowest ones with their call site.
+    """
+    start_times = conn.info.get('statement_start_time')
+    if not start_times:
+        return
+    duration = time.time() - start_times.pop()
+    record_timer('db.statement', duration * 1000)
+    if duration < SLOW_STATEMENT_THRESHOLD:
+        return
+    record_counter('db.statement.slow')
+    entry = (duration, statement, _call_site())
+    with _SLOW_STATEMENTS_LOCK:
+        if len(_SLOW_STATEMENTS) < SLOW_STATEMENTS_SIZE:
+            heapq.heappush(_SLOW_STATEMENTS, entry)
+        elif entry > _SLOW_STATEMENTS[0]:
+            heapq.heapreplace(_SLOW_STATEMENTS, entry)
+
+
+def _handle_error(exception_context):
+    """
+    Forgets the start time of a failed statement, after_cursor_execute is not called for it.
+    """
+    if exception_context.connection is None:
+        return
+    start_times = exception_context.connection.info.get('statement_start_time')
+    if start_times:
+        start_times.pop()
+
+
+def _record_pool_usage(pool):
+    """
+    Records the number of connections in use and in overflow of a pool.
+
+    :param pool: the connection pool.
+    """
+    if hasattr(pool, 'checkedout'):
+        record_gauge('db.pool.checkedout', pool.checkedout())
+    if hasattr(pool, 'overflow'):
+        record_gauge('db.pool.overflow', max(pool.overflow(), 0))
+
+
+def instrument_engine(engine):
+    """
+    Attaches the statement and pool instrumentation listeners to an engine.
+
+    :param engine: the engine.
+    """
+    def pool_checkout(dbapi_conn, connection_rec, connection_proxy):
+        _record_pool_usage(engine.pool)
+
+    def pool_checkin(dbapi_conn, connection_rec):
+        _record_pool_usage(engine.pool)
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    event.listen(engine.pool, 'checkout', pool_checkout)
+    event.listen(engine.pool, 'checkin', pool_checkin)
+
+
+def get_slow_statements():
+    """
+    Returns the slowest statements seen since startup, slowest first.
+
+    :returns: a list of dictionaries with the duration in seconds, the statement and its call site.
+    """
+    with _SLOW_STATEMENTS_LOCK:
+        slow_statements = sorted(_SLOW_STATEMENTS, reverse=True)
+    return [{'duration': duration, 'statement': statement, 'call_site': call_site} for duration, statement, call_site in slow_statements]
+
+
+def reset_slow_statements():
+    """
+    Forgets the slowest statements seen so far.
+    """
+    with _SLOW_STATEMENTS_LOCK:
+        del _SLOW_STATEMENTS[:]
+
+
+def _create_engine(sql_connection):
+    """ Creates an engine with its own pool, configured from the database section.
+        :param sql_connection: the connection string.
+        :returns: engine
+    """
+    config_params = [('pool_size', int), ('max_overflow', int), ('pool_timeout', int),
+                     ('pool_recycle', int), ('echo', int), ('echo_pool', str),
+                     ('pool_reset_on_return', str), ('use_threadlocal', int)]
+    params = {}
+    if 'mysql' in sql_connection:
+        conv = mysql_convert_decimal_to_float()
+        params['connect_args'] = {'conv': conv}
+    for param, param_type in config_params:
+        try:
+            params[param] = param_type(config_get(DATABASE_SECTION, param))
+        except:
+            pass
+    engine = create_engine(sql_connection, **params)
+    if 'mysql' in sql_connection:
+        event.listen(engine, 'checkout', mysql_ping_listener)
+    elif 'postgresql' in sql_connection:
+        event.listen(engine, 'connect', psql_convert_decimal_to_float)
+    elif 'sqlite' in sql_connection:
+        event.listen(engine, 'connect', _fk_pragma_on_connect)
+    elif 'oracle' in sql_connection:
+        event.listen(engine, 'connect', my_on_connect)
+    if INSTRUMENTATION:
+        instrument_engine(engine)
+    return engine
+
+
 def get_engine(echo=True):
     """ Creates a engine to a specific database.
         :returns: engine
     """
     global _ENGINE
     if not _ENGINE:
-        sql_connection = config_get(DATABASE_SECTION, 'default')
-        config_params = [('pool_size', int), ('max_overflow', int), ('pool_timeout', int),
-                         ('pool_recycle', int), ('echo', int), ('echo_pool', str),
-                         ('pool_reset_on_return', str), ('use_threadlocal', int)]
-        params = {}
-        if 'mysql' in sql_connection:
-            conv = mysql_convert_decimal_to_float()
-            params['connect_args'] = {'conv': conv}
-        for param, param_type in config_params:
-            try:
-                params[param] = param_type(config_get(DATABASE_SECTION, param))
-            except:
-                pass
-        _ENGINE = create_engine(sql_connection, **params)
-        if 'mysql' in sql_connection:
-            event.listen(_ENGINE, 'checkout', mysql_ping_listener)
-        elif 'postgresql' in sql_connection:
-            event.listen(_ENGINE, 'connect', psql_convert_decimal_to_float)
-        elif 'sqlite' in sql_connection:
-            event.listen(_ENGINE, 'connect', _fk_pragma_on_connect)
-        elif 'oracle' in sql_connection:
-            event.listen(_ENGINE, 'connect', my_on_connect)
+        _ENGINE = _create_engine(config_get(DATABASE_SECTION, 'default'))
     assert _ENGINE
     return _ENGINE
 
@@ -218,7 +348,7 @@ def get_maker():
         Return a SQLAlchemy sessionmaker.
         May assign __MAKER if not already assigned.
     """
-    global _MAKER, _ENGINE
+    global _MAKER
     assert _ENGINE
     if not _MAKER:
         _MAKER = sessionmaker(bind=_ENGINE, autocommit=False, autoflush=True, expire_on_commit=True)
@@ -229,7 +359,6 @@ def get_session():
     """ Creates a session to a specific database, assumes that schema already in place.
         :returns: session
     """
-    global _MAKER, _LOCK
     if not _MAKER:
         _LOCK.acquire()
         try:
@@ -242,6 +371,50 @@ def get_session():
     return session
 
 
+def get_read_maker(sql_connection):
+    """
+        Return a SQLAlchemy sessionmaker bound to a read replica.
+        Creates the engine of the replica if not already created.
+
+        :param sql_connection: the connection string of the read replica.
+    """
+    if sql_connection not in _READ_MAKERS:
+        _LOCK.acquire()
+        try:
+            if sql_connection not in _READ_MAKERS:
+                _READ_MAKERS[sql_connection] = sessionmaker(bind=_create_engine(sql_connection), autocommit=False, autoflush=True, expire_on_commit=True)
+        finally:
+            _LOCK.release()
+    return _READ_MAKERS[sql_connection]
+
+
+def get_read_session(use_primary=False):
+    """ Creates a session to one of the healthy read replicas, or to the primary database if none is available.
+        :param use_primary: always use the primary database, e.g. to read one's own writes.
+        :returns: session
+    """
+    if not use_primary and READ_REPLICAS:
+        now = time.time()
+        replicas = [url for url in READ_REPLICAS if _READ_REPLICA_FAILURES.get(url, 0) + READ_REPLICA_RETRY_INTERVAL <= now]
+        random.shuffle(replicas)
+        for sql_connection in replicas:
+            session = scoped_session(get_read_maker(sql_connection))
+            try:
+                if INSTRUMENTATION:
+                    _record_checkout(session)
+                else:
+                    session.connection()
+                _READ_REPLICA_FAILURES.pop(sql_connection, None)
+                return session
+            except (DatabaseError, DisconnectionError, TimeoutError) as error:
+                print(error)
+                session.remove()
+                _READ_REPLICA_FAILURES[sql_connection] = now
+                if INSTRUMENTATION:
+                    record_counter('db.read_replica.failover')
+    return get_session()
+
+
 def retry_if_db_connection_error(exception):
     """Return True if error in connecting to db."""
     print(exception)
@@ -259,6 +432,64 @@ def retry_if_db_connection_error(exception):
     return False
 
 
+def _record_checkout(session):
+    """
+    Checks out the connection of a new session and records how long it waited for the pool.
+
+    :param session: the session.
+    """
+    start = time.time()
+    session.connection()
+    record_timer('db.pool.checkout', (time.time() - start) * 1000)
+
+
+def _instrument(new_funct, function):
+    """
+    Wraps a decorated function to record its latency and the number of rows it returned.
+
+    :param new_funct: the decorated function.
+    :param function: the original function.
+    :returns: the instrumented function.
+    """
+    stat = 'db.session.%s.%s' % (function.__module__, function.__name__)
+
+    if isgeneratorfunction(function):
+        @wraps(function)
+        def instrumented(*args, **kwargs):
+            start, rows = time.time(), 0
+            try:
+                for row in new_funct(*args, **kwargs):
+                    rows += 1
+                    yield row
+            finally:
+                record_timer(stat, (time.time() - start) * 1000)
+                if rows:
+                    record_counter('%s.rows' % stat, rows)
+    else:
+        @wraps(function)
+        def instrumented(*args, **kwargs):
+            start = time.time()
+            result = new_funct(*args, **kwargs)
+            record_timer(stat, (time.time() - start) * 1000)
+            if isinstance(result, (list, tuple, set, dict)) and result:
+                record_counter('%s.rows' % stat, len(result))
+            return result
+    return instrumented
+
+
+def read_from_primary(function):
+    '''
+    decorator marking a function decorated with read_session or stream_session to always
+    read from the primary database, even if read replicas are configured.
+
+    This is needed if the function reads rows written by its caller, or selects work which
+    its caller then claims: a lagging replica would return the rows again.
+    To be placed below read_session or stream_session.
+    '''
+    function.use_primary = True
+    return function
+
+
 def read_session(function):
     '''
     decorator that set the session variable to use inside a function.
@@ -267,6 +498,10 @@ def read_session(function):
     session is a sqlalchemy session, and you can get one calling get_session().
     This is useful if only SELECTs and the like are being done; anything involving
     INSERTs, UPDATEs etc should use transactional_session.
+
+    If read replicas are configured, the session is opened on one of them. Pass
+    use_primary=True, or decorate the function with read_from_primary, to read from
+    the primary database instead, e.g. to read one's own writes.
     '''
     @retry(retry_on_exception=retry_if_db_connection_error,
            wait_fixed=500,
@@ -277,12 +512,17 @@ def read_session(function):
         if isgeneratorfunction(function):
             raise RucioException('read_session decorator should not be used with generator. Use stream_session instead.')
 
+        use_primary = kwargs.pop('use_primary', getattr(function, 'use_primary', False))
         if not kwargs.get('session'):
-            session = get_session()
+            session = get_read_session(use_primary=use_primary)
             try:
+                if INSTRUMENTATION and session.bind is _ENGINE:  # read replica sessions are already checked out
+                    _record_checkout(session)
                 kwargs['session'] = session
                 return function(*args, **kwargs)
             except TimeoutError as error:
+                if INSTRUMENTATION:
+                    record_counter('db.pool.timeout')
                 session.rollback()  # pylint: disable=maybe-no-member
                 raise DatabaseException(str(error))
             except DatabaseError as error:
@@ -298,6 +538,8 @@ def read_session(function):
         except:
             raise
     new_funct.__doc__ = function.__doc__
+    if INSTRUMENTATION:
+        return _instrument(new_funct, function)
     return new_funct
 
 
@@ -309,6 +551,10 @@ def stream_session(function):
     session is a sqlalchemy session, and you can get one calling get_session().
     This is useful if only SELECTs and the like are being done; anything involving
     INSERTs, UPDATEs etc should use transactional_session.
+
+    If read replicas are configured, the session is opened on one of them. Pass
+    use_primary=True, or decorate the function with read_from_primary, to read from
+    the primary database instead, e.g. to read one's own writes.
     '''
     @retry(retry_on_exception=retry_if_db_connection_error,
            wait_fixed=500,
@@ -320,13 +566,18 @@ def stream_session(function):
         if not isgeneratorfunction(function):
             raise RucioException('stream_session decorator should be used only with generator. Use read_session instead.')
 
+        use_primary = kwargs.pop('use_primary', getattr(function, 'use_primary', False))
         if not kwargs.get('session'):
-            session = get_session()
+            session = get_read_session(use_primary=use_primary)
             try:
+                if INSTRUMENTATION and session.bind is _ENGINE:  # read replica sessions are already checked out
+                    _record_checkout(session)
                 kwargs['session'] = session
                 for row in function(*args, **kwargs):
                     yield row
             except TimeoutError as error:
+                if INSTRUMENTATION:
+                    record_counter('db.pool.timeout')
                 print(error)
                 session.rollback()  # pylint: disable=maybe-no-member
                 raise DatabaseException(str(error))
@@ -346,6 +597,8 @@ def stream_session(function):
             except:
                 raise
     new_funct.__doc__ = function.__doc__
+    if INSTRUMENTATION:
+        return _instrument(new_funct, function)
     return new_funct
 
 
@@ -361,10 +614,14 @@ def transactional_session(function):
         if not kwargs.get('session'):
             session = get_session()
             try:
+                if INSTRUMENTATION:
+                    _record_checkout(session)
                 kwargs['session'] = session
                 result = function(*args, **kwargs)
                 session.commit()  # pylint: disable=maybe-no-member
             except TimeoutError as error:
+                if INSTRUMENTATION:
+                    record_counter('db.pool.timeout')
                 print(error)
                 session.rollback()  # pylint: disable=maybe-no-member
                 raise DatabaseException(str(error))
@@ -381,4 +638,6 @@ def transactional_session(function):
             result = function(*args, **kwargs)
         return result
     new_funct.__doc__ = function.__doc__
+    if INSTRUMENTATION:
+        return _instrument(new_funct, function)
     return new_funct
@@ -24,26 +24,47 @@ import logging
 import time
 import numpy as np
 
+from sqlalchemy.sql.expression import false
+
 from rucio.common.exception import RSENotFound
-from rucio.core.rse import list_rses, list_rse_attributes, get_rse_name
+from rucio.core.rse import get_rse_name
 from rucio.db.sqla.session import read_session
 from rucio.db.sqla import models
 
 
+# Largest exponent used to rescale a block of the EWMA recurrence, keeps the powers of the decay finite
+EWMA_MAX_EXPONENT = 300
+
+
 def ewma(x_values, span):
     """
     Method to calculate the Exponetialy Weighted Moving Average
 
+    The recurrence smoothed[i] = alpha * x[i] + (1 - alpha) * smoothed[i - 1] is unrolled with
+    cumulative sums over blocks, short enough for the powers of (1 - alpha) not to overflow.
+
     :param x_values: numpy array with the values to smooth.
     :param span: size of the window for smoothing.
     :returns: the smoothed x_values.
     """
-    x_lenght = x_values.size
+    x_values = np.asarray(x_values, dtype=float)
     alpha = 2.0 / (1 + span)
-    smoothed = np.zeros((x_lenght,))
-    smoothed[0] = x_values[0]
-    for i in range(1, x_lenght):
-        smoothed[i] = alpha * x_values[i] + (1 - alpha) * (smoothed[i - 1])
+    decay = 1 - alpha
+    if x_values.size == 0 or decay <= 0:
+        return x_values.copy()
+
+    # smoothed[i] = decay * smoothed[i - 1] + inputs[i], starting from smoothed[-1] = 0
+    inputs = alpha * x_values
+    inputs[0] = x_values[0]
+
+    block = max(1, int(EWMA_MAX_EXPONENT / -np.log(decay))) if decay < 1 else x_values.size
+    smoothed = np.empty(x_values.size)
+    previous = 0.0
+    for start in range(0, x_values.size, block):
+        chunk = inputs[start:start + block]
+        powers = decay ** np.arange(chunk.size)
+        smoothed[start:start + chunk.size] = powers * (decay * previous + np.cumsum(chunk / powers))
+        previous = smoothed[start + chunk.size - 1]
     return smoothed
 
 
@@ -67,20 +88,24 @@ class T3CModel():
         self._rseid2site = {}
         self._site2rses = {}
         self._site2rseids = {}
+        self._load_sites()
+
+    @read_session
+    def _load_sites(self, session=None):
+        """
+        Build the RSE to site mappings with a single query on the site attribute of the RSEs.
 
-        for rse in list_rses():
-            if rse['deleted'] is False:
-                attribs = list_rse_attributes(rse['id'])
-                try:
-                    self._rse2site[rse['rse']] = attribs['site']
-                    self._rseid2site[rse['id']] = attribs['site']
-                except KeyError:
-                    continue
-                if attribs['site'] not in list(self._site2rses.keys()):
-                    self._site2rses[attribs['site']] = []
-                    self._site2rseids[attribs['site']] = []
-                self._site2rses[attribs['site']].append(rse['rse'])
-                self._site2rseids[attribs['site']].append(rse['id'])
+        :param session: The database session in use.
+        """
+        query = session.query(models.RSE.id, models.RSE.rse, models.RSEAttrAssociation.value)\
+                       .join(models.RSEAttrAssociation, models.RSE.id == models.RSEAttrAssociation.rse_id)\
+                       .filter(models.RSE.deleted == false(),
+                               models.RSEAttrAssociation.key == 'site')
+        for rse_id, rse, site in query:
+            self._rse2site[rse] = site
+            self._rseid2site[rse_id] = site
+            self._site2rses.setdefault(site, []).append(rse)
+            self._site2rseids.setdefault(site, []).append(rse_id)
 
     # Site to RSE and RSE to site conversions
     def rse2site(self, rse_name):
@@ -176,6 +201,30 @@ class T3CModel():
         rate_pred = min((size / (size / rate) + overhead), diskrw)
         return size / rate_pred
 
+    def predict_batch(self, srcs, dsts, sizes):
+        """
+        Network transfer estimation for many transfers at once. The parameters
+        are looked up once per link and the estimation is computed on arrays.
+
+        :param srcs: Sequence of source RSE names.
+        :param dsts: Sequence of destination RSE names.
+        :param sizes: Sequence of sizes in bytes.
+        :returns: numpy array with the number of seconds each transfer is going to take.
+        """
+        links = {}
+        params = np.empty((len(sizes), 3))
+        for i, (src, dst) in enumerate(zip(srcs, dsts)):
+            link = (self.rse2site(src), self.rse2site(dst))
+            if link not in links:
+                link_true, rate, overhead, diskrw = self.recover_params(*link)
+                if link_true == 'STANDARD_LINK':
+                    logging.warning('Link ' + '__'.join(link) + ' not found, using standard parameters...')
+                links[link] = (rate, overhead, diskrw)
+            params[i] = links[link]
+        sizes = np.asarray(sizes, dtype=float)
+        rate_pred = np.minimum(sizes / (sizes / params[:, 0]) + params[:, 1], params[:, 2])
+        return sizes / rate_pred
+
     # Queue time prediction
     @read_session
     def get_submitted_at_rucio(self, src, dst, act, session=None):
@@ -234,14 +283,18 @@ class T3CModel():
         :param transfers: A list of dictionaries, each of wich at least have the keys src: The name of the source RSE for the transfer. dst: The name of the destination RSE for the transfer. act: The activity of the transfer. size: The size in bytes.
         :returns: A list of the previous dictionaries extended with two new keys ntime: Number of seconds the transfer is going to spend in in the network. qtime: Number of seconds the transfer is going to spend in FTS queue.
         """
+        ntimes = self.predict_batch([transfer['src'] for transfer in transfers],
+                                    [transfer['dst'] for transfer in transfers],
+                                    [transfer['size'] for transfer in transfers])
+        # the queue time only depends on the link and the activity
+        qtimes = {}
         result = []
-        for transfer in transfers:
-            src = transfer['src']
-            dst = transfer['dst']
-            act = transfer['activity']
-            size = transfer['size']
-            transfer['ntime'] = self.predict_n(src, dst, size)
-            transfer['qtime'] = self.predict_q(src, dst, act)
+        for transfer, ntime in zip(transfers, ntimes):
+            key = (transfer['src'], transfer['dst'], transfer['activity'])
+            if key not in qtimes:
+                qtimes[key] = self.predict_q(*key)
+            transfer['ntime'] = ntime
+            transfer['qtime'] = qtimes[key]
             result.append(transfer)
         return result
 
@@ -253,16 +306,23 @@ class T3CModel():
         :param rule_id: Some rule id.
         :returns: Number of seconds the rules is going to take till is complete.
         """
-        requests = session.query(models.Request).filter(models.Request.rule_id == rule_id).all()
+        requests = session.query(models.Request.source_rse_id,
+                                 models.Request.dest_rse_id,
+                                 models.Request.activity,
+                                 models.Request.bytes).filter(models.Request.rule_id == rule_id)
+        rse_names = {}
         transfers = []
-        for req in requests:
+        for source_rse_id, dest_rse_id, activity, bytes in requests:
             try:
-                transfers.append({'src': get_rse_name(req.source_rse_id),
-                                  'dst': get_rse_name(req.dest_rse_id),
-                                  'activity': req.activity,
-                                  'size': req.bytes})
+                for rse_id in (source_rse_id, dest_rse_id):
+                    if rse_id not in rse_names:
+                        rse_names[rse_id] = get_rse_name(rse_id, session=session)
             except RSENotFound:
                 continue
+            transfers.append({'src': rse_names[source_rse_id],
+                              'dst': rse_names[dest_rse_id],
+                              'activity': activity,
+                              'size': bytes})
         results = self.predict(transfers)
         max_q = 0
         max_n = 0
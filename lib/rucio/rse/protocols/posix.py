@@ -83,6 +83,33 @@ class Default(protocol.RSEProtocol):
             else:
                 raise exception.ServiceUnavailable(e)
 
+    def iter_range(self, pfn, start, end, chunksize=1024 ** 2):
+        """ Iterates over a byte range of a file stored inside the connected RSE.
+
+            :param pfn: Physical file name of requested file
+            :param start: First byte of the range
+            :param end: Last byte of the range, included
+            :param chunksize: Size of the chunks yielded
+
+            :raises ServiceUnavailable: if some generic error occured in the library.
+            :raises SourceNotFound: if the source file was not found on the referred storage.
+        """
+        try:
+            with open(self.pfn2path(pfn), 'rb') as f:
+                f.seek(start)
+                left = end - start + 1
+                while left > 0:
+                    chunk = f.read(min(chunksize, left))
+                    if not chunk:
+                        break
+                    left -= len(chunk)
+                    yield chunk
+        except IOError as e:
+            if e.errno == 2:
+                raise exception.SourceNotFound(e)
+            else:
+                raise exception.ServiceUnavailable(e)
+
     def put(self, source, target, source_dir=None, transfer_timeout=None):
         """
             Allows to store files inside the referred RSE.
@@ -63,6 +63,7 @@ class RSEDeterministicTranslation(object):
     """
 
     _LFN2PFN_ALGORITHMS = {}
+    _LFN2PFN_BULK_ALGORITHMS = {}
     _DEFAULT_LFN2PFN = "hash"
 
     def __init__(self, rse=None, rse_attributes=None, protocol_attributes=None):
@@ -102,12 +103,29 @@ class RSEDeterministicTranslation(object):
         The return value should be the last part of the PFN - it will be appended to the
         rest of the URL.
 
+        Registering an algorithm again drops its bulk version, so that the bulk translation
+        falls back to the new callable until register_bulk is called for it.
+
         :param lfn2pfn_callable: Callable function to use for generating paths.
         :param name: Algorithm name used for registration.  If None, then `lfn2pfn_callable.__name__` is used.
         """
         if name is None:
             name = lfn2pfn_callable.__name__
         RSEDeterministicTranslation._LFN2PFN_ALGORITHMS[name] = lfn2pfn_callable
+        RSEDeterministicTranslation._LFN2PFN_BULK_ALGORITHMS.pop(name, None)
+
+    @staticmethod
+    def register_bulk(lfn2pfn_bulk_callable, name):
+        """
+        Provided a callable function, register it as the bulk version of a LFN2PFN algorithm.
+
+        The callable receives the same arguments as the algorithm, except that scope and name
+        are replaced by the lists of scopes and names. It must return the list of paths in the same order.
+
+        :param lfn2pfn_bulk_callable: Callable function to use for generating the paths in bulk.
+        :param name: Name of the algorithm.
+        """
+        RSEDeterministicTranslation._LFN2PFN_BULK_ALGORITHMS[name] = lfn2pfn_bulk_callable
 
     @staticmethod
     def __hash(scope, name, rse, rse_attrs, protocol_attrs):
@@ -132,6 +150,33 @@ class RSEDeterministicTranslation(object):
             scope = scope.replace('.', '/')
         return '%s/%s/%s/%s' % (scope, hstr[0:2], hstr[2:4], name)
 
+    @staticmethod
+    def __hash_bulk(scopes, names, rse, rse_attrs, protocol_attrs):
+        """
+        Bulk version of the hash algorithm, the path of each scope is only computed once.
+
+        :param scopes: List of scopes of the LFNs.
+        :param names: List of file names of the LFNs.
+        :param rse: RSE for PFN (ignored)
+        :param rse_attrs: RSE attributes for PFN (ignored)
+        :param protocol_attrs: RSE protocol attributes for PFN (ignored)
+        :returns: List of paths for use in the PFN generation.
+        """
+        del rse
+        del rse_attrs
+        del protocol_attrs
+        md5 = hashlib.md5
+        scope_paths = {}
+        paths = []
+        for scope, name in zip(scopes, names):
+            hstr = md5(('%s:%s' % (scope, name)).encode('utf-8')).hexdigest()
+            scope_path = scope_paths.get(scope)
+            if scope_path is None:
+                scope_path = scope.replace('.', '/') if scope.startswith('user') or scope.startswith('group') else scope
+                scope_paths[scope] = scope_path
+            paths.append('%s/%s/%s/%s' % (scope_path, hstr[0:2], hstr[2:4], name))
+        return paths
+
     @staticmethod
     def __identity(scope, name, rse, rse_attrs, protocol_attrs):
         """
@@ -182,6 +227,7 @@ class RSEDeterministicTranslation(object):
         cls.register(cls.__hash, "hash")
         cls.register(cls.__identity, "identity")
         cls.register(cls.__ligo, "ligo")
+        cls.register_bulk(cls.__hash_bulk, "hash")
         policy_module = None
         try:
             policy_module = config.config_get('policy', 'lfn2pfn_module')
@@ -209,6 +255,22 @@ class RSEDeterministicTranslation(object):
         algorithm_callable = RSEDeterministicTranslation._LFN2PFN_ALGORITHMS[algorithm]
         return algorithm_callable(scope, name, self.rse, self.rse_attributes, self.protocol_attributes)
 
+    def paths(self, scopes, names):
+        """ Transforms a list of logical file names into PFN paths.
+
+            :param scopes: list of scopes
+            :param names: list of filenames, in the same order as the scopes
+
+            :returns: list of RSE specific paths, in the same order as the LFNs
+        """
+        algorithm = self.rse_attributes.get('lfn2pfn_algorithm', 'default')
+        if algorithm == 'default':
+            algorithm = RSEDeterministicTranslation._DEFAULT_LFN2PFN
+        if algorithm in RSEDeterministicTranslation._LFN2PFN_BULK_ALGORITHMS:
+            return RSEDeterministicTranslation._LFN2PFN_BULK_ALGORITHMS[algorithm](scopes, names, self.rse, self.rse_attributes, self.protocol_attributes)
+        algorithm_callable = RSEDeterministicTranslation._LFN2PFN_ALGORITHMS[algorithm]
+        return [algorithm_callable(scope, name, self.rse, self.rse_attributes, self.protocol_attributes) for scope, name in zip(scopes, names)]
+
 
 RSEDeterministicTranslation._module_init_()  # pylint: disable=protected-access
 
@@ -226,6 +288,7 @@ class RSEProtocol(object):
         self.renaming = True
         self.overwrite = False
         self.rse = rse_settings
+        self.__pfn_prefix = None
         if self.rse['deterministic']:
             self.translator = RSEDeterministicTranslation(self.rse['rse'], rse_settings, self.attributes)
             if getattr(rsemanager, 'CLIENT_MODE', None) and \
@@ -238,6 +301,20 @@ class RSEProtocol(object):
             if getattr(rsemanager, 'SERVER_MODE', None):
                 setattr(self, '_get_path', self._get_path_nondeterministic_server)
 
+    def _get_pfn_prefix(self):
+        """
+            Returns the part of the PFNs preceding the path, e.g. scheme://hostname:port/prefix/.
+            It is computed once per protocol instance.
+        """
+        if self.__pfn_prefix is None:
+            prefix = self.attributes['prefix']
+            if not prefix.startswith('/'):
+                prefix = ''.join(['/', prefix])
+            if not prefix.endswith('/'):
+                prefix = ''.join([prefix, '/'])
+            self.__pfn_prefix = ''.join([self.attributes['scheme'], '://', self.attributes['hostname'], ':', str(self.attributes['port']), prefix])
+        return self.__pfn_prefix
+
     def lfns2pfns(self, lfns):
         """
             Retruns a fully qualified PFN for the file referred by path.
@@ -246,35 +323,53 @@ class RSEProtocol(object):
 
             :returns: Fully qualified PFN.
         """
-        pfns = {}
-        prefix = self.attributes['prefix']
-
-        if not prefix.startswith('/'):
-            prefix = ''.join(['/', prefix])
-        if not prefix.endswith('/'):
-            prefix = ''.join([prefix, '/'])
-
         lfns = [lfns] if isinstance(lfns, dict) else lfns
-        for lfn in lfns:
-            scope, name = str(lfn['scope']), lfn['name']
-            if 'path' in lfn and lfn['path'] is not None:
-                pfns['%s:%s' % (scope, name)] = ''.join([self.attributes['scheme'],
-                                                         '://',
-                                                         self.attributes['hostname'],
-                                                         ':',
-                                                         str(self.attributes['port']),
-                                                         prefix,
-                                                         lfn['path'] if not lfn['path'].startswith('/') else lfn['path'][1:]
-                                                         ])
+        scopes = [str(lfn['scope']) for lfn in lfns]
+        names = [lfn['name'] for lfn in lfns]
+        paths = [lfn.get('path') for lfn in lfns]
+        pfns = self.__lfns2pfns_bulk(scopes, names, paths)
+        return dict(('%s:%s' % (scope, name), pfn) for scope, name, pfn in zip(scopes, names, pfns))
+
+    def lfns2pfns_bulk(self, scopes, names, paths=None):
+        """
+            Returns the fully qualified PFNs for lists of scopes and names.
+
+            :param scopes: list of scopes
+            :param names: list of filenames, in the same order as the scopes
+            :param paths: optional list of paths, a path which is not None is used instead of the one from the LFN2PFN algorithm
+
+            :returns: list of PFNs, in the same order as the LFNs
+        """
+        scopes = [str(scope) for scope in scopes]
+        if 'lfns2pfns' in self.__dict__ or type(self).lfns2pfns != RSEProtocol.lfns2pfns:
+            # The protocol has its own way to build the PFNs
+            lfns = [{'scope': scope, 'name': name} for scope, name in zip(scopes, names)]
+            if paths:
+                for lfn, path in zip(lfns, paths):
+                    lfn['path'] = path
+            pfns = self.lfns2pfns(lfns)
+            return [pfns['%s:%s' % (scope, name)] for scope, name in zip(scopes, names)]
+        return self.__lfns2pfns_bulk(scopes, names, paths)
+
+    def __lfns2pfns_bulk(self, scopes, names, paths=None):
+        """
+            Builds the PFNs of the protocol for lists of scopes and names.
+        """
+        pfn_prefix = self._get_pfn_prefix()
+        to_translate = [i for i in range(len(scopes)) if not paths or paths[i] is None]
+        translated = {}
+        if to_translate:
+            if self.translator and type(self)._get_path == RSEProtocol._get_path:
+                translated = dict(zip(to_translate, self.translator.paths([scopes[i] for i in to_translate], [names[i] for i in to_translate])))
+            else:
+                translated = dict((i, self._get_path(scope=scopes[i], name=names[i])) for i in to_translate)
+
+        pfns = []
+        for i in range(len(scopes)):
+            if i in translated:
+                pfns.append(''.join([pfn_prefix, translated[i]]))
             else:
-                pfns['%s:%s' % (scope, name)] = ''.join([self.attributes['scheme'],
-                                                         '://',
-                                                         self.attributes['hostname'],
-                                                         ':',
-                                                         str(self.attributes['port']),
-                                                         prefix,
-                                                         self._get_path(scope=scope, name=name)
-                                                         ])
+                pfns.append(''.join([pfn_prefix, paths[i] if not paths[i].startswith('/') else paths[i][1:]]))
         return pfns
 
     def __lfns2pfns_client(self, lfns):
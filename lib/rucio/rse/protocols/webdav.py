@@ -290,6 +290,41 @@ class Default(protocol.RSEProtocol):
         except requests.exceptions.ReadTimeout as error:
             raise exception.ServiceUnavailable(error)
 
+    def iter_range(self, pfn, start, end, chunksize=1024 ** 2):
+        """ Iterates over a byte range of a file stored inside the connected RSE, with a HTTP range request.
+
+            :param pfn Physical file name of requested file
+            :param start First byte of the range
+            :param end Last byte of the range, included
+            :param chunksize Size of the chunks yielded
+
+            :raises ServiceUnavailable, SourceNotFound, RSEAccessDenied, RangeNotSupported
+        """
+        path = self.path2pfn(pfn)
+        try:
+            result = self.session.get(path, verify=False, stream=True, timeout=self.timeout, cert=self.cert,
+                                      headers={'Range': 'bytes=%d-%d' % (start, end)})
+            try:
+                if result.status_code in [206, ] or (result.status_code in [200, ] and start == 0):
+                    # a server ignoring the range sends the whole file, which is fine from the first byte
+                    for chunk in result.iter_content(chunksize):
+                        yield chunk
+                elif result.status_code in [200, ]:
+                    raise exception.RangeNotSupported()
+                elif result.status_code in [404, ]:
+                    raise exception.SourceNotFound()
+                elif result.status_code in [401, 403]:
+                    raise exception.RSEAccessDenied()
+                else:
+                    # catchall exception, the body of the response is not read
+                    raise exception.RucioException(result.status_code, result.reason)
+            finally:
+                result.close()
+        except requests.exceptions.ConnectionError as error:
+            raise exception.ServiceUnavailable(error)
+        except requests.exceptions.ReadTimeout as error:
+            raise exception.ServiceUnavailable(error)
+
     def put(self, source, target, source_dir=None, transfer_timeout=None, progressbar=False):
         """ Allows to store files inside the referred RSE.
 
@@ -34,7 +34,8 @@ from __future__ import print_function
 
 import copy
 import random
-from time import sleep
+import threading
+from time import sleep, time
 
 try:
     from urlparse import urlparse
@@ -44,7 +45,16 @@ except ImportError:
 from rucio.common import exception, utils, constants
 from rucio.common.config import config_get_int
 from rucio.common.constraints import STRING_TYPES
-from rucio.common.utils import make_valid_did, GLOBALLY_SUPPORTED_CHECKSUMS
+from rucio.common.utils import make_valid_did, GLOBALLY_SUPPORTED_CHECKSUMS, LRUCache
+
+
+# In-process tier in front of RSE_REGION, the entries are (expiration, version, rse_info)
+RSE_INFO_CACHE = LRUCache(maxsize=config_get_int('rsemanager', 'rse_info_cache_size', False, 1000))
+RSE_INFO_CACHE_TTL = config_get_int('rsemanager', 'rse_info_cache_ttl', False, 60)
+RSE_VERSIONS = {}
+RSE_VERSIONS_LOCK = threading.Lock()
+# Protocol instances shared by the callers of create_protocol(pooled=True)
+PROTOCOLS = LRUCache(maxsize=config_get_int('rsemanager', 'protocol_pool_size', False, 1000))
 
 
 def get_rse_info(rse, session=None):
@@ -75,13 +85,37 @@ def get_rse_info(rse, session=None):
     """
     # __request_rse_info will be assigned when the module is loaded as it depends on the rucio environment (server or client)
     # __request_rse_info, rse_region are defined in /rucio/rse/__init__.py
+    entry = RSE_INFO_CACHE.get(str(rse))
+    version = RSE_VERSIONS.get(str(rse), 0)
+    if entry and entry[0] > time() and entry[1] == version:
+        return entry[2]
+
     rse_info = RSE_REGION.get(str(rse))   # NOQA pylint: disable=undefined-variable
     if not rse_info:  # no cached entry found
         rse_info = __request_rse_info(str(rse), session=session)  # NOQA pylint: disable=undefined-variable
         RSE_REGION.set(str(rse), rse_info)  # NOQA pylint: disable=undefined-variable
+    if RSE_INFO_CACHE_TTL > 0:
+        RSE_INFO_CACHE.set(str(rse), (time() + RSE_INFO_CACHE_TTL, version, rse_info))
     return rse_info
 
 
+def invalidate_rse_info(rse):
+    """
+        Invalidates the cached RSE information, e.g. after the update of a protocol or an attribute.
+        The version of the RSE is bumped, so the entries of the in-process cache and the pooled protocols
+        are not used anymore, and the entry of the shared cache is deleted.
+
+        :param rse: Name of the RSE.
+    """
+    with RSE_VERSIONS_LOCK:
+        RSE_VERSIONS[str(rse)] = RSE_VERSIONS.get(str(rse), 0) + 1
+    RSE_INFO_CACHE.delete(str(rse))
+    try:
+        RSE_REGION.delete(str(rse))   # NOQA pylint: disable=undefined-variable
+    except Exception:
+        pass
+
+
 def _get_possible_protocols(rse_settings, operation, scheme=None, domain=None):
     """
     Filter the list of available protocols or provided by the supported ones.
@@ -152,7 +186,17 @@ def select_protocol(rse_settings, operation, scheme=None, domain='wan'):
     return min(candidates, key=lambda k: k['domains'][domain][operation])
 
 
-def create_protocol(rse_settings, operation, scheme=None, domain='wan'):
+def __get_protocol_pool_key(rse_settings, protocol_attr):
+    """
+    Returns the key of the protocol in the pool, or None if the RSE settings are not the cached ones.
+    """
+    entry = RSE_INFO_CACHE.get(str(rse_settings.get('rse')))
+    if not entry or entry[2] is not rse_settings:
+        return None
+    return (str(rse_settings['rse']), entry[1], protocol_attr['scheme'], protocol_attr['hostname'], protocol_attr['port'], protocol_attr['prefix'], protocol_attr['impl'])
+
+
+def create_protocol(rse_settings, operation, scheme=None, domain='wan', pooled=False):
     """
     Instanciates the protocol defined for the given operation.
 
@@ -160,6 +204,8 @@ def create_protocol(rse_settings, operation, scheme=None, domain='wan'):
     :param operation: Intended operation for this protocol
     :param scheme:    Optional filter if no specific protocol is defined in rse_setting for the provided operation
     :param domain:    Optional specification of the domain
+    :param pooled:    Return a protocol instance shared with the other callers, if the RSE settings come from get_rse_info.
+                      Pooled instances must only be used for the PFN translation, not connected.
     :returns:         An instance of the requested protocol
     """
 
@@ -173,6 +219,12 @@ def create_protocol(rse_settings, operation, scheme=None, domain='wan'):
 
     protocol_attr = select_protocol(rse_settings, operation, scheme, domain)
 
+    pool_key = __get_protocol_pool_key(rse_settings, protocol_attr) if pooled else None
+    if pool_key:
+        protocol = PROTOCOLS.get(pool_key)
+        if protocol is not None:
+            return protocol
+
     # Instantiate protocol
     comp = protocol_attr['impl'].split('.')
     mod = __import__('.'.join(comp[:-1]))
@@ -183,6 +235,8 @@ def create_protocol(rse_settings, operation, scheme=None, domain='wan'):
             print('Protocol implementation not found')
             raise  # TODO: provide proper rucio exception
     protocol = mod(protocol_attr, rse_settings)
+    if pool_key:
+        PROTOCOLS.set(pool_key, protocol)
     return protocol
 
 
@@ -196,7 +250,7 @@ def lfns2pfns(rse_settings, lfns, operation='write', scheme=None, domain='wan'):
         :returns: a dict with scope:name as key and the PFN as value
 
     """
-    return create_protocol(rse_settings, operation, scheme, domain).lfns2pfns(lfns)
+    return create_protocol(rse_settings, operation, scheme, domain, pooled=True).lfns2pfns(lfns)
 
 
 def parse_pfns(rse_settings, pfns, operation='read', domain='wan'):
@@ -215,7 +269,7 @@ def parse_pfns(rse_settings, pfns, operation='read', domain='wan'):
     """
     if len(set([urlparse(pfn).scheme for pfn in pfns])) != 1:
         raise ValueError('All PFNs must provide the same protocol scheme')
-    return create_protocol(rse_settings, operation, urlparse(pfns[0]).scheme, domain).parse_pfns(pfns)
+    return create_protocol(rse_settings, operation, urlparse(pfns[0]).scheme, domain, pooled=True).parse_pfns(pfns)
 
 
 def exists(rse_settings, files):
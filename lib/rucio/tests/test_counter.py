@@ -144,3 +144,21 @@ class TestCoreAccountCounter():
         current_usage = [(usage['rse_id'], usage['files'], usage['account'], usage['bytes']) for usage in db_session.query(models.AccountUsage)]
         for usage in history_usage:
             assert_in(usage, current_usage)
+
+    def test_update_account_counters(self):
+        """ACCOUNT COUNTER (CORE): Compact the counter updates of several accounts at once."""
+        account_update(once=True)
+        rse_id = get_rse_id(rse='MOCK')
+        accounts = [InternalAccount('jdoe'), InternalAccount('root')]
+        before = dict((account, get_usage(rse_id=rse_id, account=account)) for account in accounts)
+        for i in range(3):
+            for account in accounts:
+                account_counter.increase(rse_id=rse_id, account=account, files=1, bytes=10)
+        account_counter.decrease(rse_id=rse_id, account=accounts[1], files=1, bytes=10)
+
+        assert_equal(account_counter.update_account_counters(total_workers=0, worker_number=0), 7)
+        assert_equal(account_counter.update_account_counters(total_workers=0, worker_number=0), 0)
+        for account, files in zip(accounts, (3, 2)):
+            cnt = get_usage(rse_id=rse_id, account=account)
+            assert_equal(cnt['files'], before[account]['files'] + files)
+            assert_equal(cnt['bytes'], before[account]['bytes'] + 10 * files)
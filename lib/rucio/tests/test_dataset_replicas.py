@@ -24,7 +24,8 @@
 from nose.tools import assert_equal, assert_true
 
 from rucio.core.did import attach_dids, add_did, add_dids
-from rucio.core.replica import list_datasets_per_rse, update_collection_replica, get_cleaned_updated_collection_replicas, delete_replicas, add_replicas
+from rucio.core.replica import (list_datasets_per_rse, update_collection_replica, update_collection_replicas, get_cleaned_updated_collection_replicas,
+                                delete_replicas, add_replicas)
 from rucio.core.rse import add_rse, del_rse, add_protocol, get_rse_id
 from rucio.client.didclient import DIDClient
 from rucio.client.replicaclient import ReplicaClient
@@ -345,3 +346,39 @@ class TestDatasetReplicaUpdate:
         assert_equal(dataset_replica['available_bytes'], len(files) * file_size)
         assert_equal(dataset_replica['available_replicas_cnt'], len(files))
         assert_equal(str(dataset_replica['state']), 'AVAILABLE')
+
+    def test_update_collection_replicas(self):
+        """ REPLICA (CORE): Update several collection replicas from update requests at once. """
+        file_size = 2
+        dataset_names = ['dataset_test_%s' % generate_uuid() for i in range(0, 3)]
+        dataset_files = {}
+        for dataset_name in dataset_names:
+            files = [{'name': 'file_%s' % generate_uuid(), 'scope': self.scope, 'bytes': file_size} for i in range(0, 2)]
+            dataset_files[dataset_name] = files
+            add_replicas(rse_id=self.rse_id, files=files, account=self.account, session=self.db_session)
+            add_did(scope=self.scope, name=dataset_name, type=constants.DIDType.DATASET, account=self.account, session=self.db_session)
+            attach_dids(scope=self.scope, name=dataset_name, dids=files, account=self.account, session=self.db_session)
+            models.CollectionReplica(rse_id=self.rse_id, scope=self.scope, state=constants.ReplicaState.UNAVAILABLE, name=dataset_name, did_type=constants.DIDType.DATASET, bytes=len(files) * file_size, length=len(files), available_replicas_cnt=1)\
+                  .save(session=self.db_session)
+
+        # first dataset complete, second dataset with one file, third dataset without files
+        delete_replicas(rse_id=self.rse_id, files=dataset_files[dataset_names[1]][:1] + dataset_files[dataset_names[2]], session=self.db_session)
+        self.db_session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.name.in_(dataset_names)).delete(synchronize_session=False)  # pylint: disable=no-member
+        for dataset_name in dataset_names + dataset_names:
+            models.UpdatedCollectionReplica(rse_id=self.rse_id, scope=self.scope, name=dataset_name, did_type=constants.DIDType.DATASET).save(session=self.db_session)
+
+        update_requests = [update_request for update_request in get_cleaned_updated_collection_replicas(total_workers=0, worker_number=0, session=self.db_session)
+                           if update_request['name'] in dataset_names]
+        assert_equal(len(update_requests), 3)
+        update_collection_replicas(update_requests=update_requests, session=self.db_session)
+
+        assert_equal(self.db_session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.name.in_(dataset_names)).count(), 0)  # pylint: disable=no-member
+        dataset_replica = self.db_session.query(models.CollectionReplica).filter_by(scope=self.scope, name=dataset_names[0]).one()  # pylint: disable=no-member
+        assert_equal(dataset_replica['available_bytes'], 2 * file_size)
+        assert_equal(dataset_replica['available_replicas_cnt'], 2)
+        assert_equal(str(dataset_replica['state']), 'AVAILABLE')
+        dataset_replica = self.db_session.query(models.CollectionReplica).filter_by(scope=self.scope, name=dataset_names[1]).one()  # pylint: disable=no-member
+        assert_equal(dataset_replica['available_bytes'], file_size)
+        assert_equal(dataset_replica['available_replicas_cnt'], 1)
+        assert_equal(str(dataset_replica['state']), 'UNAVAILABLE')
+        assert_equal(self.db_session.query(models.CollectionReplica).filter_by(scope=self.scope, name=dataset_names[2]).count(), 0)  # pylint: disable=no-member
@@ -9,7 +9,14 @@
   Authors:
   - Vincent Garonne, <vincent.garonne@cern.ch>, 2013-2017
 '''
-from rucio.db.sqla.session import get_session
+from nose.tools import assert_equal, assert_false, assert_in, assert_raises, assert_true
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from rucio.common.config import config_get
+from rucio.db.sqla import session as db_session
+from rucio.db.sqla.session import (get_engine, get_read_session, get_session, get_slow_statements, instrument_engine, read_from_primary,
+                                   read_session, reset_slow_statements)
 
 
 def test_db_connection():
@@ -20,3 +27,74 @@ def test_db_connection():
     else:
         session.execute('select 1')
     session.close()
+
+
+def test_db_instrumentation():
+    """ DB (CORE): Test the statement and pool instrumentation """
+    engine = create_engine('sqlite://')
+    instrument_engine(engine)
+    threshold = db_session.SLOW_STATEMENT_THRESHOLD
+    db_session.SLOW_STATEMENT_THRESHOLD = 0
+    reset_slow_statements()
+    try:
+        with engine.connect() as conn:
+            conn.execute('select 1')
+            # the start time of a failed statement is not left on the connection
+            assert_raises(OperationalError, conn.execute, 'select * from nonexistent')
+            assert_equal(conn.info['statement_start_time'], [])
+        slow_statements = get_slow_statements()
+    finally:
+        db_session.SLOW_STATEMENT_THRESHOLD = threshold
+        reset_slow_statements()
+    assert_equal(len(slow_statements), 1)
+    assert_equal(slow_statements[0]['statement'], 'select 1')
+    assert_in('test_db_instrumentation', slow_statements[0]['call_site'])
+
+
+def test_db_read_replica():
+    """ DB (CORE): Test the routing of read sessions to read replicas """
+    primary = config_get(db_session.DATABASE_SECTION, 'default')
+    broken = 'sqlite:////nonexistent/rucio.db'
+    read_replicas = db_session.READ_REPLICAS
+    try:
+        db_session.READ_REPLICAS = [primary]
+        session = get_read_session()
+        assert_false(session.bind is get_engine())
+        session.execute('select 1')
+        session.remove()
+
+        session = get_read_session(use_primary=True)
+        assert_true(session.bind is get_engine())
+        session.remove()
+
+        db_session.READ_REPLICAS = [broken]
+        session = get_read_session()
+        assert_true(session.bind is get_engine())
+        session.remove()
+        assert_in(broken, db_session._READ_REPLICA_FAILURES)
+    finally:
+        db_session.READ_REPLICAS = read_replicas
+        db_session._READ_REPLICA_FAILURES.clear()
+
+
+@read_session
+def _read_bind(session=None):
+    return session.bind
+
+
+@read_session
+@read_from_primary
+def _read_bind_from_primary(session=None):
+    return session.bind
+
+
+def test_db_read_from_primary():
+    """ DB (CORE): Test that read-your-writes functions bypass the read replicas """
+    read_replicas = db_session.READ_REPLICAS
+    try:
+        db_session.READ_REPLICAS = [config_get(db_session.DATABASE_SECTION, 'default')]
+        assert_false(_read_bind() is get_engine())
+        assert_true(_read_bind(use_primary=True) is get_engine())
+        assert_true(_read_bind_from_primary() is get_engine())
+    finally:
+        db_session.READ_REPLICAS = read_replicas
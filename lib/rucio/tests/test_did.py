@@ -29,6 +29,7 @@ from __future__ import print_function
 
 from datetime import datetime, timedelta
 
+from paste.fixture import TestApp
 from nose.tools import assert_equal, assert_not_equal, assert_raises, assert_true, assert_in, assert_not_in, raises
 
 from rucio.api import did
@@ -53,6 +54,8 @@ from rucio.core.replica import add_replica
 from rucio.db.sqla.constants import DIDType
 
 from rucio.tests.common import rse_name_generator, scope_name_generator
+from rucio.web.rest.authentication import APP as auth_app
+from rucio.web.rest.did import APP as did_app
 
 
 class TestDIDCore:
@@ -62,6 +65,25 @@ class TestDIDCore:
         for d in list_dids(scope=InternalScope('data13_hip'), filters={'name': '*'}, type='collection'):
             print(d)
 
+    def test_list_dids_pagination(self):
+        """ DATA IDENTIFIERS (CORE): List dids page by page with a marker """
+        tmp_scope = InternalScope('mock')
+        root = InternalAccount('root')
+        prefix = 'dsn_%s_' % generate_uuid()
+        dsns = ['%s%d' % (prefix, i) for i in range(7)]
+        for dsn in dsns:
+            add_did(scope=tmp_scope, name=dsn, type='DATASET', account=root, meta={'datatype': 'RAW'})
+
+        pages = []
+        marker = None
+        while True:
+            page = list(list_dids(scope=tmp_scope, filters={'name': prefix + '*', 'datatype': 'RAW'}, type='dataset', limit=3, marker=marker))
+            if not page:
+                break
+            pages.append(page)
+            marker = page[-1]
+        assert_equal(pages, [dsns[0:3], dsns[3:6], dsns[6:]])
+
     def test_delete_dids(self):
         """ DATA IDENTIFIERS (CORE): Delete dids """
         tmp_scope = InternalScope('mock')
@@ -265,6 +287,24 @@ class TestDIDApi:
             did.set_new_dids([{'scope': 'dummyscope', 'name': 'dummyname', 'did_type': DIDType.DATASET}], None)
 
 
+class TestDIDRestApi:
+
+    def test_search_invalid_limit(self):
+        """ DATA IDENTIFIERS (REST): Search with an invalid limit """
+        mw = []
+        headers1 = {'X-Rucio-Account': 'root', 'X-Rucio-Username': 'ddmlab', 'X-Rucio-Password': 'secret'}
+        res1 = TestApp(auth_app.wsgifunc(*mw)).get('/userpass', headers=headers1, expect_errors=True)
+        assert_equal(res1.status, 200)
+
+        headers2 = {'X-Rucio-Auth-Token': str(res1.header('X-Rucio-Auth-Token'))}
+        for limit in ('abc', '0', '-1'):
+            res2 = TestApp(did_app.wsgifunc(*mw)).get('/mock/dids/search?type=collection&limit=%s' % limit, headers=headers2, expect_errors=True)
+            assert_equal(res2.status, 400)
+            assert_equal(res2.header('ExceptionClass'), 'ValueError')
+        res2 = TestApp(did_app.wsgifunc(*mw)).get('/mock/dids/search?type=collection&limit=1', headers=headers2, expect_errors=True)
+        assert_equal(res2.status, 200)
+
+
 class TestDIDClients:
 
     def setup(self):
@@ -18,17 +18,161 @@
 # PY3K COMPATIBLE
 
 import logging
+import os
+import tempfile
+import threading
+import time
 
 import nose.tools
 import os.path
 
+from mock import patch
+
 from rucio.client.client import Client
-from rucio.client.downloadclient import DownloadClient
+from rucio.client.downloadclient import DownloadClient, EndpointLimiter, BandwidthBudget, run_hedged, download_ranged
 from rucio.client.uploadclient import UploadClient
-from rucio.common.utils import generate_uuid
+from rucio.common.exception import RangeNotSupported, RucioException
+from rucio.common.utils import adler32, md5, generate_uuid
 from rucio.tests.common import file_generator
 
 
+def test_endpoint_limiter():
+    """ DOWNLOAD (CLIENT): Limit the concurrent downloads per storage endpoint. """
+    limiter = EndpointLimiter(max_per_endpoint=2)
+    running, max_running, lock = [0], [0], threading.Lock()
+
+    def download():
+        limiter.acquire('storage.example.org:1094')
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        limiter.release('storage.example.org:1094')
+
+    threads = [threading.Thread(target=download) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.02)
+    nose.tools.assert_true(limiter.is_full('storage.example.org:1094'))
+    nose.tools.assert_false(limiter.is_full('other.example.org:1094'))
+    for thread in threads:
+        thread.join()
+    nose.tools.assert_equal(max_running[0], 2)
+    nose.tools.assert_false(EndpointLimiter().is_full('storage.example.org:1094'))
+
+
+def test_bandwidth_budget():
+    """ DOWNLOAD (CLIENT): Pace the downloads according to the bandwidth budget. """
+    budget = BandwidthBudget(bytes_per_second=1000)
+    nose.tools.assert_equal(budget.reserve(500), 0)
+    nose.tools.assert_almost_equal(budget.reserve(500), 0.5, places=1)
+    nose.tools.assert_almost_equal(budget.reserve(None), 1.0, places=1)
+
+
+def test_run_hedged():
+    """ DOWNLOAD (CLIENT): Hedge a slow download with the next replica. """
+    # without hedging, the next attempt only starts when the previous one failed
+    nose.tools.assert_equal(run_hedged([lambda cancel: None, lambda cancel: 'second']), 'second')
+    nose.tools.assert_equal(run_hedged([lambda cancel: None, lambda cancel: None]), None)
+    nose.tools.assert_equal(run_hedged([lambda cancel: None, lambda cancel: None], hedge_delay=0.01), None)
+
+    # the slow attempt is cancelled once the hedged one succeeded
+    cancelled = threading.Event()
+
+    def slow(cancel):
+        if cancel.wait(5):
+            cancelled.set()
+            return None
+        return 'slow'
+    nose.tools.assert_equal(run_hedged([slow, lambda cancel: 'fast'], hedge_delay=0.05), 'fast')
+    nose.tools.assert_true(cancelled.wait(5))
+
+    # an attempt which cannot be cancelled is discarded when it succeeds later
+    discarded, discarded_event = [], threading.Event()
+
+    def discard(result):
+        discarded.append(result)
+        discarded_event.set()
+    nose.tools.assert_equal(run_hedged([lambda cancel: time.sleep(0.2) or 'slow', lambda cancel: 'fast'], hedge_delay=0.05, discard=discard), 'fast')
+    nose.tools.assert_true(discarded_event.wait(5))
+    nose.tools.assert_equal(discarded, ['slow'])
+
+    # a fast attempt does not start the next one
+    started = []
+    nose.tools.assert_equal(run_hedged([lambda cancel: 'first', lambda cancel: started.append(1)], hedge_delay=1), 'first')
+    nose.tools.assert_equal(started, [])
+
+
+class RangeProtocol(object):
+    """ Protocol serving byte ranges of in-memory data, failing once at the given offset. """
+
+    def __init__(self, data, fail_at=None):
+        self.data = data
+        self.fail_at = fail_at
+        self.requests = 0
+
+    def iter_range(self, pfn, start, end, chunksize):
+        self.requests += 1
+        for offset in range(start, end + 1, chunksize):
+            if self.fail_at is not None and offset >= self.fail_at:
+                self.fail_at = None
+                raise RucioException('Connection reset')
+            yield self.data[offset:min(offset + chunksize, end + 1)]
+
+
+class NoRangeProtocol(RangeProtocol):
+    """ Protocol of a storage ignoring the range requests, which only sends the whole file. """
+
+    def iter_range(self, pfn, start, end, chunksize):
+        if start > 0:
+            raise RangeNotSupported()
+        return super(NoRangeProtocol, self).iter_range(pfn, 0, len(self.data) - 1, chunksize)
+
+
+def test_download_ranged():
+    """ DOWNLOAD (CLIENT): Download a file with range requests and checksum it on the fly. """
+    data = os.urandom(10000)
+    path = os.path.join(tempfile.mkdtemp(), 'file')
+
+    # parallel parts, the adler32 of the parts is combined
+    protocol = RangeProtocol(data)
+    with patch('rucio.client.downloadclient.RANGE_MIN_PART_SIZE', 1000):
+        checksums = download_ranged(protocol, 'pfn', path, len(data), ['adler32'], streams=4, chunk_size=512)
+    nose.tools.assert_equal(protocol.requests, 4)
+    with open(path, 'rb') as f:
+        nose.tools.assert_equal(f.read(), data)
+    nose.tools.assert_equal(checksums, {'adler32': adler32(path)})
+
+    # md5 is computed over a single stream, which is resumed after an error
+    protocol = RangeProtocol(data, fail_at=3000)
+    with patch('rucio.client.downloadclient.RANGE_MIN_PART_SIZE', 1000):
+        checksums = download_ranged(protocol, 'pfn', path, len(data), ['md5'], streams=4, chunk_size=512)
+    nose.tools.assert_equal(protocol.requests, 2)
+    with open(path, 'rb') as f:
+        nose.tools.assert_equal(f.read(), data)
+    nose.tools.assert_equal(checksums, {'md5': md5(path)})
+
+    # a storage ignoring the ranges is read again as a single stream, also when resuming after an error
+    for protocol in (NoRangeProtocol(data), NoRangeProtocol(data, fail_at=3000)):
+        with patch('rucio.client.downloadclient.RANGE_MIN_PART_SIZE', 1000):
+            checksums = download_ranged(protocol, 'pfn', path, len(data), ['adler32'], streams=4, chunk_size=512)
+        with open(path, 'rb') as f:
+            nose.tools.assert_equal(f.read(), data)
+        nose.tools.assert_equal(checksums, {'adler32': adler32(path)})
+
+    # empty file
+    nose.tools.assert_equal(download_ranged(RangeProtocol(b''), 'pfn', path, 0, ['adler32']), {'adler32': '00000001'})
+    nose.tools.assert_equal(os.path.getsize(path), 0)
+
+    # a cancelled download stops
+    cancel = threading.Event()
+    cancel.set()
+    nose.tools.assert_raises(RucioException, download_ranged, RangeProtocol(data), 'pfn', path, len(data), ['adler32'], cancel=cancel)
+    os.unlink(path)
+
+
 class TestDownloadClient(object):
 
     def setup(self):
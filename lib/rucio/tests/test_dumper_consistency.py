@@ -24,6 +24,7 @@ from six import PY3
 from rucio.common.dumper.consistency import Consistency
 from rucio.common.dumper.consistency import _try_to_advance
 from rucio.common.dumper.consistency import compare3
+from rucio.common.dumper.consistency import external_sort
 from rucio.common.dumper.consistency import gnu_sort
 from rucio.common.dumper.consistency import min3
 from rucio.common.dumper.consistency import parse_and_filter_file
@@ -444,3 +445,50 @@ class TestConsistency(object):
 
         os.unlink(path)
         os.unlink(sorted_file)
+
+    def test_external_sort_sorts_strings_using_byte_value(self):
+        ''' DUMPER '''
+        unsorted_data = ''.join(['z\n', 'a\n', '\xc3\xb1\n'])
+        path = make_temp_file(self.tmp_dir, unsorted_data)
+
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines(True)
+
+        sorted_file = external_sort(path, cache_dir=self.tmp_dir)
+        with open(sorted_file, 'rb') as f:
+            eq_(f.read().splitlines(True), [lines[1], lines[0], lines[2]])
+
+    def test_external_sort_can_sort_by_field(self):
+        ''' DUMPER '''
+        unsorted_data = ''.join(['1,z\n', '2,a\n', '3,\xc3\xb1\n', '4,a'])
+        path = make_temp_file(self.tmp_dir, unsorted_data)
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines(True)
+
+        sorted_file = external_sort(path, delimiter=',', fieldspec='2', cache_dir=self.tmp_dir)
+        with open(sorted_file, 'rb') as f:
+            eq_(f.read().splitlines(True), [lines[1], lines[3] + b'\n', lines[0], lines[2]])
+
+    def test_external_sort_merges_runs_sorted_in_parallel(self):
+        ''' DUMPER '''
+        lines = ['path%d,%s\n' % ((i * 7919) % 1000, 'AU'[i % 2]) for i in range(1000)]
+        path = make_temp_file(self.tmp_dir, ''.join(lines))
+
+        # Small buffer to force many runs and several merge passes
+        sorted_file = external_sort(path, delimiter=',', fieldspec='1', cache_dir=self.tmp_dir,
+                                    buffer_size=512, processes=2, max_merge=4)
+        with open(sorted_file, 'rb') as f:
+            eq_(f.read(), ''.join(sorted(lines)).encode('utf-8'))
+        eq_(sorted(os.listdir(self.tmp_dir)), sorted([os.path.basename(path), os.path.basename(sorted_file)]))
+
+    def test_compare3_with_bytes(self):
+        ''' DUMPER '''
+        comp = list(compare3([b'path1,A\n', b'path2,U\n'], [b'path0\n', b'path1\n'], [b'path2,A\n'], sep=b','))
+        eq_(
+            comp,
+            [
+                (b'path0', (False, True, False), (None, None)),
+                (b'path1', (True, True, False), (b'A', None)),
+                (b'path2', (True, False, True), (b'U', b'A')),
+            ],
+        )
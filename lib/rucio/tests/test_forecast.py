@@ -8,9 +8,13 @@
 # Authors:
 # - Joaquin Bogado, <jbogadog@cern.ch>, 2017
 
+import numpy as np
+
+from nose.tools import assert_equal, assert_true
+
 from rucio.db.sqla import models
 from rucio.db.sqla.session import read_session
-from rucio.extensions.forecast import T3CModel
+from rucio.extensions.forecast import T3CModel, ewma
 
 from random import choice
 
@@ -36,3 +40,28 @@ class TestForecast():
         data = [{'src': src, 'dst': dst, 'activity': act, 'size': size}]
         result = model.predict(data)
         return result[0]['ntime'] > 0 and result[0]['qtime'] > 0
+
+    def test_ewma(self):
+        """ FORECAST: Vectorised exponentially weighted moving average """
+        x_values = np.random.rand(5000) * 1000
+        for span in (1, 2, 10, 1000):
+            alpha = 2.0 / (1 + span)
+            expected = np.zeros(x_values.size)
+            expected[0] = x_values[0]
+            for i in range(1, x_values.size):
+                expected[i] = alpha * x_values[i] + (1 - alpha) * expected[i - 1]
+            assert_true(np.allclose(ewma(x_values, span), expected))
+
+    def test_predict_batch(self):
+        """ FORECAST: Predict the network time of many transfers at once """
+        session = get_session()
+        rses = [rse.rse for rse in session.query(models.RSE).all()]
+        srcs = [choice(rses) for _ in range(100)]
+        dsts = [choice(rses) for _ in range(100)]
+        sizes = [choice([10**6, 10**9]) for _ in range(100)]
+
+        model = T3CModel()
+        ntimes = model.predict_batch(srcs, dsts, sizes)
+        assert_equal(len(ntimes), 100)
+        for src, dst, size, ntime in zip(srcs, dsts, sizes, ntimes):
+            assert_true(np.isclose(model.predict_n(src, dst, size), ntime))
@@ -11,10 +11,12 @@
 
 import random
 import threading
+import time
 
+from mock import patch
 from nose.tools import assert_equal
 
-from rucio.core.heartbeat import live, die, cardiac_arrest, list_payload_counts
+from rucio.core.heartbeat import live, die, cardiac_arrest, list_payload_counts, calc_hash, HashRing, MEMBERSHIPS, MEMBERSHIPS_LOCK
 
 
 class TestHeartbeat:
@@ -95,5 +97,36 @@ class TestHeartbeat:
 
         assert_equal(list_payload_counts('test5'), {})
 
+    def test_heartbeat_partitions(self):
+        """ HEARTBEAT (CORE): Consistent hashing of the partitions between the threads """
+
+        pids = [self.__pid() for _ in range(3)]
+        threads = [self.__thread() for _ in range(3)]
+        for pid, thread in zip(pids, threads):
+            live('test6', 'host0', pid, thread)
+        partitions = [live('test6', 'host0', pid, thread, nr_partitions=64)['partitions'] for pid, thread in zip(pids, threads)]
+        assert_equal(sorted(sum(partitions, [])), list(range(64)))
+
+        # Only the partitions taken by the new member move
+        before = HashRing(['a', 'b', 'c']).get_partitions(256)
+        after = HashRing(['a', 'b', 'c', 'd']).get_partitions(256)
+        for member in ['a', 'b', 'c']:
+            assert_equal(set(after[member]) - set(before[member]), set())
+        assert_equal(sorted(sum(after.values(), [])), list(range(256)))
+
+    def test_heartbeat_partitions_cached_membership(self):
+        """ HEARTBEAT (CORE): The partitions are not computed from a cached membership """
+
+        pid = self.__pid()
+        thread = self.__thread()
+        member = ('host0', pid, thread.ident)
+        with patch('rucio.core.heartbeat.config_get_int', return_value=600):
+            live('test7', 'host0', pid, thread)
+            # Membership cached before another thread of the executable stopped
+            with MEMBERSHIPS_LOCK:
+                MEMBERSHIPS[(calc_hash('test7'), 600)] = (time.time() + 600, [member, ('host1', 1, 1)])
+            assert_equal(live('test7', 'host0', pid, thread)['nr_threads'], 2)
+            assert_equal(live('test7', 'host0', pid, thread, nr_partitions=64), {'assign_thread': 0, 'nr_threads': 1, 'partitions': list(range(64))})
+
     def tearDown(self):
         cardiac_arrest()
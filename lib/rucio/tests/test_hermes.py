@@ -13,11 +13,50 @@
 Hermes Test
 """
 
+import json
+import time
+
+from nose.tools import assert_equal
+
 from rucio.common.config import config_get
-from rucio.core.message import add_message
+from rucio.common.utils import generate_uuid
+from rucio.core.message import add_message, retrieve_messages
 from rucio.daemons.hermes import hermes
 
 
+class FakeTransport(object):
+    def __init__(self, host):
+        self._Transport__host_and_ports = [(host, 61613)]
+
+
+class FakeConnection(object):
+    ''' In-process stand-in for a stomp connection. '''
+
+    def __init__(self, host, fail=False, delay=0):
+        self.transport = FakeTransport(host)
+        self.connected = False
+        self.fail = fail
+        self.delay = delay
+        self.sent = []
+        self.failed = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def start(self):
+        pass
+
+    def connect(self, *args, **kwargs):
+        self.connected = True
+
+    def send(self, body, destination, headers):
+        if self.fail if not callable(self.fail) else self.fail(body):
+            self.failed += 1
+            raise Exception('Broker unavailable')
+        time.sleep(self.delay)
+        self.sent.append((body, destination, headers))
+
+
 class TestHermes(object):
     ''' Test the messaging deamon. '''
 
@@ -39,3 +78,82 @@ class TestHermes(object):
                                   Thank you, and have a very safe, and productive day.'''})
 
         hermes.run(once=True, send_email=False)
+
+    def test_publish_messages(self):
+        ''' HERMES (DAEMON): Publish messages concurrently and delete the delivered ones. '''
+        event_type = 'test-publish_%s' % generate_uuid()
+        for i in range(25):
+            add_message(event_type, {'test': i})
+        messages = retrieve_messages(bulk=100, event_type=event_type)
+        assert_equal(len(messages), 25)
+
+        heartbeat = {'assign_thread': 0, 'nr_threads': 1}
+        conns = [FakeConnection('broker%i.localhost' % i) for i in range(3)]
+        nb_delivered = hermes.publish_messages(messages, conns, '/topic/rucio.events', heartbeat,
+                                               use_ssl=False, username='user', password='pass',
+                                               queue_size=2, delete_bulk=10)
+        assert_equal(nb_delivered, 25)
+        assert_equal(sum([len(conn.sent) for conn in conns]), 25)
+        assert_equal(retrieve_messages(bulk=100, event_type=event_type), [])
+
+        # Messages which could not be sent stay in the database
+        for i in range(5):
+            add_message(event_type, {'test': i})
+        messages = retrieve_messages(bulk=100, event_type=event_type)
+        nb_delivered = hermes.publish_messages(messages, [FakeConnection('broker.localhost', fail=True)],
+                                               '/topic/rucio.events', heartbeat, use_ssl=False)
+        assert_equal(nb_delivered, 0)
+        assert_equal(len(retrieve_messages(bulk=100, event_type=event_type)), 5)
+
+    def test_publish_messages_failing_broker(self):
+        ''' HERMES (DAEMON): A failing broker does not take the messages of the healthy ones. '''
+        event_type = 'test-publish_%s' % generate_uuid()
+        for i in range(20):
+            add_message(event_type, {'test': i})
+        # Incomplete dataset payloads must not stop the publishers
+        for i in range(5):
+            add_message('DATASETLOCK_OK', {'name': 'test_%i' % i})
+        messages = [message for message in retrieve_messages(bulk=1000) if message['event_type'] in (event_type, 'DATASETLOCK_OK')]
+        assert_equal(len(messages), 25)
+
+        heartbeat = {'assign_thread': 0, 'nr_threads': 1}
+        # The healthy broker is slow, so that the failing one takes messages until it gives up
+        healthy, failing = FakeConnection('healthy.localhost', delay=0.01), FakeConnection('failing.localhost', fail=True)
+        nb_delivered = hermes.publish_messages(messages, [failing, healthy], '/topic/rucio.events', heartbeat,
+                                               use_ssl=False, queue_size=2, delete_bulk=10, max_failures=2)
+        assert_equal(nb_delivered, 25)
+        assert_equal(len(healthy.sent), 25)
+        assert_equal(failing.failed, 2)
+        assert_equal(retrieve_messages(bulk=100, event_type=event_type), [])
+        assert_equal(retrieve_messages(bulk=100, event_type='DATASETLOCK_OK'), [])
+
+    def test_publish_messages_stopped_broker(self):
+        ''' HERMES (DAEMON): A message failed by the last live broker stays in the database. '''
+        event_type = 'test-publish_%s' % generate_uuid()
+        for i in range(3):
+            add_message(event_type, {'test': i})
+        messages = retrieve_messages(bulk=100, event_type=event_type)
+        assert_equal(len(messages), 3)
+
+        heartbeat = {'assign_thread': 0, 'nr_threads': 1}
+        failing, held = FakeConnection('failing.localhost', fail=True), []
+
+        def fail_first(body):
+            # The picky broker fails the first message it gets, once the failing one stopped on the other two
+            if not held:
+                held.append(json.loads(body)['payload'])
+                deadline = time.time() + 5
+                while failing.failed < 2 and time.time() < deadline:
+                    time.sleep(0.01)
+                time.sleep(0.1)
+            return json.loads(body)['payload'] == held[0]
+        picky = FakeConnection('picky.localhost', fail=fail_first)
+        start = time.time()
+        nb_delivered = hermes.publish_messages(messages, [picky, failing], '/topic/rucio.events', heartbeat,
+                                               use_ssl=False, queue_size=1, max_failures=2, timeout=60)
+        assert_equal(time.time() - start < 30, True)
+        assert_equal(nb_delivered, 2)
+        assert_equal(failing.failed, 2)
+        assert_equal(picky.failed, 1)
+        remaining = retrieve_messages(bulk=100, event_type=event_type)
+        assert_equal([message['payload'] for message in remaining], held)
@@ -19,6 +19,11 @@
 # - Andrew Lister, <andrew.lister@stfc.ac.uk>, 2019
 # - Hannes Hansen, <hannes.jakob.hansen@cern.ch>, 2019
 
+from mock import patch
+from nose.tools import assert_equal
+
+from rucio.common.exception import DatabaseException
+
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid as uuid
 from rucio.core.account import get_usage
@@ -29,7 +34,9 @@ from rucio.core.rse import add_rse_attribute, get_rse_id
 from rucio.core.rule import add_rule, get_rule
 from rucio.daemons.judge.evaluator import re_evaluator
 from rucio.daemons.abacus.account import account_update
+from rucio.db.sqla import models
 from rucio.db.sqla.constants import DIDType
+from rucio.db.sqla.session import get_session
 from rucio.tests.test_rule import create_files, tag_generator
 
 
@@ -304,3 +311,79 @@ class TestJudgeEvaluator():
         # Check if the Locks are created properly
         for file in more_files:
             assert(len(get_replica_locks(scope=file['scope'], name=file['name'])) == 2)
+
+    def test_judge_coalesce_updated_dids(self):
+        """ JUDGE EVALUATOR: Test the judge coalescing several attachments to the same dataset"""
+        scope = InternalScope('mock')
+        dataset = 'dataset_' + str(uuid())
+        add_did(scope, dataset, DIDType.from_sym('DATASET'), self.jdoe)
+        add_rule(dids=[{'scope': scope, 'name': dataset}], account=self.jdoe, copies=1, rse_expression=self.rse1, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None)
+
+        files = []
+        for _ in range(3):
+            new_files = create_files(2, scope, self.rse1_id)
+            attach_dids(scope, dataset, new_files, self.jdoe)
+            files.extend(new_files)
+        assert_equal(get_session().query(models.UpdatedDID).filter_by(scope=scope, name=dataset).count(), 3)
+
+        # Fake judge
+        re_evaluator(once=True)
+
+        # All the attachments are evaluated and their updated dids deleted at once
+        for file in files:
+            assert_equal(len(get_replica_locks(scope=file['scope'], name=file['name'])), 1)
+        assert_equal(get_session().query(models.UpdatedDID).filter_by(scope=scope, name=dataset).count(), 0)
+
+    def test_judge_batch_re_evaluation(self):
+        """ JUDGE EVALUATOR: Test the judge evaluating attachments and detachments of several dids in one batch"""
+        scope = InternalScope('mock')
+        container = 'container_' + str(uuid())
+        add_did(scope, container, DIDType.from_sym('CONTAINER'), self.jdoe)
+        datasets, files = [], {}
+        for _ in range(3):
+            dataset = 'dataset_' + str(uuid())
+            add_did(scope, dataset, DIDType.from_sym('DATASET'), self.jdoe)
+            datasets.append({'scope': scope, 'name': dataset})
+        attach_dids(scope, container, datasets, self.jdoe)
+        add_rule(dids=[{'scope': scope, 'name': container}], account=self.jdoe, copies=1, rse_expression=self.rse1, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None)
+        re_evaluator(once=True)
+
+        for dataset in datasets:
+            files[dataset['name']] = create_files(2, scope, self.rse1_id)
+            attach_dids(scope, dataset['name'], files[dataset['name']], self.jdoe)
+        re_evaluator(once=True)
+        detach_dids(scope, datasets[0]['name'], files[datasets[0]['name']][:1])
+        more_files = create_files(2, scope, self.rse1_id)
+        attach_dids(scope, datasets[1]['name'], more_files, self.jdoe)
+
+        # Fake judge, evaluating all the dids in batches
+        with patch('rucio.daemons.judge.evaluator.re_evaluate_did', side_effect=AssertionError('no evaluation of a single did expected')):
+            re_evaluator(once=True, batch_size=2)
+
+        assert_equal(len(get_replica_locks(scope=scope, name=files[datasets[0]['name']][0]['name'])), 0)
+        for file in files[datasets[0]['name']][1:] + files[datasets[1]['name']] + files[datasets[2]['name']] + more_files:
+            assert_equal(len(get_replica_locks(scope=file['scope'], name=file['name'])), 1)
+        for dataset in datasets:
+            assert_equal(get_session().query(models.UpdatedDID).filter_by(scope=scope, name=dataset['name']).count(), 0)
+
+    def test_judge_batch_re_evaluation_failure(self):
+        """ JUDGE EVALUATOR: Test the judge evaluating the dids of a failed batch one at a time"""
+        scope = InternalScope('mock')
+        datasets, files = [], []
+        for _ in range(2):
+            dataset = 'dataset_' + str(uuid())
+            add_did(scope, dataset, DIDType.from_sym('DATASET'), self.jdoe)
+            add_rule(dids=[{'scope': scope, 'name': dataset}], account=self.jdoe, copies=1, rse_expression=self.rse1, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None)
+            new_files = create_files(2, scope, self.rse1_id)
+            attach_dids(scope, dataset, new_files, self.jdoe)
+            datasets.append(dataset)
+            files.extend(new_files)
+
+        # Fake judge
+        with patch('rucio.daemons.judge.evaluator.re_evaluate_dids', side_effect=DatabaseException('ORA-00054: resource busy')):
+            re_evaluator(once=True)
+
+        for file in files:
+            assert_equal(len(get_replica_locks(scope=file['scope'], name=file['name'])), 1)
+        for dataset in datasets:
+            assert_equal(get_session().query(models.UpdatedDID).filter_by(scope=scope, name=dataset).count(), 0)
@@ -0,0 +1,103 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+import re
+
+from datetime import datetime
+from json import dumps
+
+try:
+    from Queue import Queue  # py2
+except ImportError:
+    from queue import Queue  # py3
+
+from mock import patch
+from nose.tools import assert_equal
+
+from rucio.common.exception import InvalidType
+from rucio.common.types import InternalAccount, InternalScope
+from rucio.common.utils import generate_uuid
+from rucio.core.did import add_did, attach_dids
+from rucio.core.replica import add_replica, get_replica
+from rucio.core.rse import get_rse_id
+from rucio.daemons.tracer.kronos import AMQConsumer
+from rucio.db.sqla.constants import DIDType
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.acked = []
+        self.sent = []
+
+    def ack(self, msg_id, subscription_id):
+        self.acked.append(msg_id)
+
+    def send(self, body, destination, headers):
+        self.sent.append(body)
+
+
+def test_kronos_micro_batch():
+    """ KRONOS (DAEMON): Deduplicate the atime touches of a chunk of traces """
+    account, scope = InternalAccount('root'), InternalScope('mock')
+    rse_id = get_rse_id(rse='MOCK')
+    dataset, files = 'dataset_%s' % generate_uuid(), ['file_%s' % generate_uuid() for _ in range(2)]
+    add_did(scope=scope, name=dataset, type=DIDType.DATASET, account=account)
+    for name in files:
+        add_replica(rse_id=rse_id, scope=scope, name=name, bytes=1, account=account)
+    attach_dids(scope=scope, name=dataset, dids=[{'scope': scope, 'name': name} for name in files], account=account)
+
+    conn, dataset_queue = FakeConnection(), Queue()
+    consumer = AMQConsumer(broker='localhost', conn=conn, queue='/queue/Consumer.kronos.rucio.tracer', chunksize=6,
+                           subscription_id='rucio-tracer-kronos', excluded_usrdns=set(), dataset_queue=dataset_queue, bad_files_patterns=[])
+    timestamps = [1500000000 + i for i in range(6)]
+    for i, timestamp in enumerate(timestamps):
+        report = {'eventType': 'download', 'eventVersion': 'rucio', 'clientState': 'DONE', 'account': 'root',
+                  'scope': 'mock', 'filename': files[i % 2], 'remoteSite': 'MOCK', 'traceTimeentryUnix': timestamp}
+        consumer.on_message({'message-id': str(i), 'appversion': 'rucio'}, dumps(report))
+
+    assert_equal(len(conn.acked), 6)
+    assert_equal(get_replica(rse_id=rse_id, scope=scope, name=files[0])['accessed_at'], datetime.utcfromtimestamp(timestamps[4]))
+    assert_equal(get_replica(rse_id=rse_id, scope=scope, name=files[1])['accessed_at'], datetime.utcfromtimestamp(timestamps[5]))
+
+    # the touches of the dataset are merged, keeping the most recent access
+    datasets = [dataset_queue.get() for _ in range(dataset_queue.qsize())]
+    assert_equal([(did['name'], did['rse_id'], did['accessed_at']) for did in datasets],
+                 [(dataset, rse_id, datetime.utcfromtimestamp(timestamps[5]))])
+
+
+def test_kronos_suspicious_files():
+    """ KRONOS (DAEMON): Declare the suspicious files once per reason and protocol """
+    declared = []
+
+    def declare_bad_file_replicas(pfns, reason, issuer, status):
+        if len(set(pfn.split('://')[0] for pfn in pfns)) > 1:
+            raise InvalidType('The PFNs specified must have the same protocol')
+        declared.append((sorted(pfns), reason))
+
+    conn, dataset_queue = FakeConnection(), Queue()
+    # the flags of each pattern are kept
+    consumer = AMQConsumer(broker='localhost', conn=conn, queue='/queue/Consumer.kronos.rucio.tracer', chunksize=3,
+                           subscription_id='rucio-tracer-kronos', excluded_usrdns=set(), dataset_queue=dataset_queue,
+                           bad_files_patterns=[re.compile('.*checksum mismatch.*', re.IGNORECASE)])
+    urls = ['root://host/file_1', 'srm://host/file_2', 'root://host/file_3']
+    with patch('rucio.daemons.tracer.kronos.declare_bad_file_replicas', side_effect=declare_bad_file_replicas):
+        for i, url in enumerate(urls):
+            report = {'eventType': 'get', 'eventVersion': 'pilot', 'clientState': 'FAILED', 'stateReason': 'Checksum Mismatch', 'url': url}
+            consumer.on_message({'message-id': str(i), 'appversion': 'pilot'}, dumps(report))
+
+    assert_equal(len(conn.acked), 3)
+    assert_equal(sorted(declared), [(['root://host/file_1', 'root://host/file_3'], 'Checksum Mismatch'),
+                                    (['srm://host/file_2'], 'Checksum Mismatch')])
@@ -19,11 +19,15 @@
 # - Andrew Lister <andrew.lister@stfc.ac.uk>, 2019
 # - Mario Lassnig <mario.lassnig@cern.ch>, 2019
 
+from mock import patch
+
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid
 from rucio.core import rse as rse_core
 from rucio.core import replica as replica_core
 from rucio.daemons.reaper.reaper import reaper
+from rucio.daemons.reaper.reaper2 import start_deletion
+from rucio.db.sqla.constants import ReplicaState
 
 
 def test_reaper():
@@ -44,3 +48,75 @@ def test_reaper():
     rses = [rse_core.get_rse(rse_core.get_rse_id('MOCK')), ]
     reaper(once=True, rses=rses)
     reaper(once=True, rses=rses)
+
+
+def test_reaper2_concurrent_deletion():
+    """ REAPER2 (DAEMON): Test the concurrent deletion of replicas from the storage."""
+    rse_id = rse_core.get_rse_id(rse='MOCK')
+    rse_info = rse_core.get_rse_protocols(rse_id=rse_id)
+    replicas = [{'scope': InternalScope('mock'), 'name': 'lfn' + generate_uuid(), 'bytes': 1,
+                 'state': ReplicaState.AVAILABLE, 'pfn': 'mock://localhost/tmp/%s' % generate_uuid()} for _ in range(25)]
+
+    threads, deleted_files = start_deletion(replicas, rse_info, 'localhost', [], '', scheme='mock', nb_threads=3, bulk=4)
+    assert len(threads) == 3
+    for thread in threads:
+        thread.join()
+    assert sorted([replica['name'] for replica in deleted_files]) == sorted([replica['name'] for replica in replicas])
+
+
+class FakeDeletionProtocol(object):
+    """ Protocol counting its connections, failing to connect or to close on demand. """
+
+    def __init__(self, fail_connect=0, fail_close=False):
+        self.attributes = {'scheme': 'mock'}
+        self.fail_connect = fail_connect
+        self.fail_close = fail_close
+        self.connects = 0
+        self.closes = 0
+        self.deleted = []
+
+    def connect(self):
+        self.connects += 1
+        if self.connects <= self.fail_connect:
+            raise RuntimeError('Unexpected connection error')
+
+    def close(self):
+        self.closes += 1
+        if self.fail_close:
+            raise RuntimeError('Unexpected close error')
+
+    def delete(self, pfn):
+        self.deleted.append(pfn)
+
+
+def test_reaper2_deletion_worker_connection():
+    """ REAPER2 (DAEMON): Test the deletion threads connect once and survive unexpected protocol errors."""
+    rse_id = rse_core.get_rse_id(rse='MOCK')
+    rse_info = rse_core.get_rse_protocols(rse_id=rse_id)
+    replicas = [{'scope': InternalScope('mock'), 'name': 'lfn' + generate_uuid(), 'bytes': 1,
+                 'state': ReplicaState.AVAILABLE, 'pfn': 'mock://localhost/tmp/%s' % generate_uuid()} for _ in range(25)]
+
+    def run(protocols, nb_threads):
+        with patch('rucio.daemons.reaper.reaper2.rsemgr.create_protocol', side_effect=protocols):
+            threads, deleted_files = start_deletion(replicas, rse_info, 'localhost', [], '', nb_threads=nb_threads, bulk=4)
+            for thread in threads:
+                thread.join()
+        return deleted_files
+
+    # One connection per thread, reused for all its chunks
+    protocols = [FakeDeletionProtocol(), FakeDeletionProtocol()]
+    deleted_files = run(protocols, 2)
+    assert len(deleted_files) == 25
+    assert [(prot.connects, prot.closes) for prot in protocols] == [(1, 1), (1, 1)]
+
+    # An unexpected connection error only skips the chunk in progress
+    protocol = FakeDeletionProtocol(fail_connect=1)
+    deleted_files = run([protocol], 1)
+    assert len(deleted_files) == 21
+    assert protocol.connects == 2
+
+    # An unexpected error when closing keeps the deleted files
+    protocol = FakeDeletionProtocol(fail_close=True)
+    deleted_files = run([protocol], 1)
+    assert len(deleted_files) == 25
+    assert protocol.closes == 1
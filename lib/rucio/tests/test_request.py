@@ -18,9 +18,11 @@
 # PY3K COMPATIBLE
 
 from datetime import datetime
-from nose.tools import assert_equal
+from mock import patch
+from nose.tools import assert_equal, assert_raises
 from paste.fixture import TestApp
 
+from rucio.common.exception import DatabaseException
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid, parse_response
 from rucio.core.config import set as config_set
@@ -28,7 +30,7 @@ from rucio.core.did import attach_dids, add_did
 from rucio.core.distance import add_distance
 from rucio.core.replica import add_replica
 from rucio.core.request import release_all_waiting_requests, queue_requests, get_request_by_did, release_waiting_requests_per_free_volume,\
-    release_waiting_requests_grouped_fifo, release_waiting_requests_fifo, list_requests, release_waiting_requests_per_deadline
+    release_waiting_requests_grouped_fifo, release_waiting_requests_fifo, list_requests, release_waiting_requests_per_deadline, WaitingRequestQueues
 from rucio.core.rse import get_rse_id, set_rse_transfer_limits, add_rse_attribute
 from rucio.db.sqla import session, models, constants
 from rucio.web.rest.authentication import APP as auth_app
@@ -1051,6 +1053,88 @@ class TestRequestCoreRelease(object):
         request = get_request_by_did(self.scope, name4, self.dest_rse_id, session=self.db_session)
         assert_equal(request['state'], constants.RequestState.QUEUED)
 
+    def test_waiting_request_queues(self):
+        """ REQUEST (CORE): release waiting requests from the in-memory priority queues. """
+        def add_request(name, requested_at, priority=None, activity=self.user_activity, account=self.account):
+            add_replica(self.source_rse_id, self.scope, name, 1, self.account, session=self.db_session)
+            models.Request(state=constants.RequestState.WAITING, scope=self.scope, name=name, source_rse_id=self.source_rse_id, dest_rse_id=self.dest_rse_id,
+                           activity=activity, account=account, priority=priority, requested_at=requested_at).save(session=self.db_session)
+
+        names = [generate_uuid() for _ in range(5)]
+        add_request(names[0], datetime.now().replace(year=2018))
+        add_request(names[1], datetime.now().replace(year=2020), priority=5)
+        add_request(names[2], datetime.now().replace(year=2019), account=InternalAccount('jdoe'))
+        add_request(names[3], datetime.now().replace(year=2017), activity='ignore')
+
+        waiting_queues = WaitingRequestQueues(direction='destination')
+        waiting_queues.refresh(session=self.db_session)
+
+        # the request with the highest priority goes first, then the oldest one
+        assert_equal(waiting_queues.release(self.dest_rse_id, count=1, activity=self.user_activity, session=self.db_session), 1)
+        assert_equal(get_request_by_did(self.scope, names[1], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.QUEUED)
+        assert_equal(waiting_queues.release(self.dest_rse_id, count=1, activity=self.user_activity, account=self.account, session=self.db_session), 1)
+        assert_equal(get_request_by_did(self.scope, names[0], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.QUEUED)
+        assert_equal(get_request_by_did(self.scope, names[2], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.WAITING)
+
+        # requests which are not waiting anymore are skipped, and new waiting requests are picked up by the refresh
+        self.db_session.query(models.Request).filter_by(name=names[2]).update({'state': constants.RequestState.QUEUED})
+        add_request(names[4], datetime.now().replace(year=2021))
+        waiting_queues.refresh(session=self.db_session)
+        assert_equal(waiting_queues.release(self.dest_rse_id, count=1, activity=self.user_activity, session=self.db_session), 1)
+        assert_equal(get_request_by_did(self.scope, names[4], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.QUEUED)
+        assert_equal(get_request_by_did(self.scope, names[3], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.WAITING)
+
+        assert_equal(waiting_queues.release(self.dest_rse_id, session=self.db_session), 1)
+        assert_equal(get_request_by_did(self.scope, names[3], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.QUEUED)
+
+    def test_waiting_request_queues_rollback(self):
+        """ REQUEST (CORE): requests released in a rolled back transaction are released again. """
+        names = [generate_uuid() for _ in range(2)]
+        for name in names:
+            add_replica(self.source_rse_id, self.scope, name, 1, self.account, session=self.db_session)
+            models.Request(state=constants.RequestState.WAITING, scope=self.scope, name=name, source_rse_id=self.source_rse_id, dest_rse_id=self.dest_rse_id,
+                           activity='rollback', account=self.account, requested_at=datetime.now()).save(session=self.db_session)
+        self.db_session.commit()
+
+        waiting_queues = WaitingRequestQueues(direction='destination')
+        waiting_queues.refresh(session=self.db_session)
+
+        # the transaction of the caller is rolled back, the request is put back on the next refresh
+        assert_equal(waiting_queues.release(self.dest_rse_id, count=1, activity='rollback', session=self.db_session), 1)
+        self.db_session.rollback()
+        waiting_queues.refresh(session=self.db_session)
+        assert_equal(waiting_queues.release(self.dest_rse_id, activity='rollback', session=self.db_session), 2)
+
+        # the release fails, the requests are put back right away
+        self.db_session.rollback()
+        waiting_queues.refresh(session=self.db_session)
+        with patch.object(self.db_session, 'query', side_effect=DatabaseException('update failed')):
+            assert_raises(DatabaseException, waiting_queues.release, self.dest_rse_id, activity='rollback', session=self.db_session)
+        self.db_session.rollback()
+        assert_equal(waiting_queues.release(self.dest_rse_id, activity='rollback'), 2)
+        for name in names:
+            assert_equal(get_request_by_did(self.scope, name, self.dest_rse_id)['state'], constants.RequestState.QUEUED)
+
+    def test_waiting_request_queues_priority_change(self):
+        """ REQUEST (CORE): a change of priority of a queued request is picked up by the refresh. """
+        names = [generate_uuid() for _ in range(2)]
+        for name, year in zip(names, (2018, 2019)):
+            add_replica(self.source_rse_id, self.scope, name, 1, self.account, session=self.db_session)
+            models.Request(state=constants.RequestState.WAITING, scope=self.scope, name=name, source_rse_id=self.source_rse_id, dest_rse_id=self.dest_rse_id,
+                           activity='priority', account=self.account, requested_at=datetime.now().replace(year=year)).save(session=self.db_session)
+
+        waiting_queues = WaitingRequestQueues(direction='destination')
+        waiting_queues.refresh(session=self.db_session)
+
+        # the newer request is boosted, its previous entry is skipped once it has been released
+        self.db_session.query(models.Request).filter_by(name=names[1]).update({'priority': 5})
+        waiting_queues.refresh(session=self.db_session)
+        assert_equal(waiting_queues.release(self.dest_rse_id, count=1, activity='priority', session=self.db_session), 1)
+        assert_equal(get_request_by_did(self.scope, names[1], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.QUEUED)
+        assert_equal(get_request_by_did(self.scope, names[0], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.WAITING)
+        assert_equal(waiting_queues.release(self.dest_rse_id, activity='priority', session=self.db_session), 1)
+        assert_equal(get_request_by_did(self.scope, names[0], self.dest_rse_id, session=self.db_session)['state'], constants.RequestState.QUEUED)
+
     def test_release_waiting_requests_all(self):
         """ REQUEST (CORE): release all waiting requests. """
         name1 = generate_uuid()
@@ -43,7 +43,7 @@ from rucio.common.exception import (Duplicate, RSENotFound, RSEProtocolNotSuppor
 from rucio.common.utils import generate_uuid
 from rucio.core.rse import (add_rse, get_rse_id, del_rse, list_rses, rse_exists, add_rse_attribute, list_rse_attributes,
                             set_rse_transfer_limits, get_rse_transfer_limits, delete_rse_transfer_limits,
-                            get_rse_protocols, del_rse_attribute, get_rse_attribute, get_rse, rse_is_empty)
+                            get_rse_protocols, del_rse_attribute, get_rse_attribute, get_rse, rse_is_empty, add_protocol, update_rse)
 from rucio.rse import rsemanager as mgr
 from rucio.tests.common import rse_name_generator
 from rucio.web.rest.rse import APP as rse_app
@@ -192,6 +192,41 @@ class TestRSECoreApi(object):
         db_session.commit()
         assert_equal(rse_is_empty(rse_id=rse_id), False)
 
+    def test_rse_info_cache(self):
+        """ RSE (CORE): Test the invalidation of the cached RSE info and of the pooled protocols """
+        rse_name = rse_name_generator()
+        rse_id = add_rse(rse_name)
+        add_protocol(rse_id, {'scheme': 'mock', 'hostname': 'localhost', 'port': 0, 'prefix': '/tmp/rucio_rse/',
+                              'impl': 'rucio.rse.protocols.mock.Default',
+                              'domains': {'wan': {'read': 1, 'write': 1, 'delete': 1, 'third_party_copy': 1}}})
+        rse_info = mgr.get_rse_info(rse_name)
+        assert_equal(mgr.get_rse_info(rse_name), rse_info)
+        protocol = mgr.create_protocol(rse_info, 'read', pooled=True)
+        assert_true(mgr.create_protocol(rse_info, 'read', pooled=True) is protocol)
+        assert_true(mgr.create_protocol(rse_info, 'read') is not protocol)
+        assert_true(mgr.create_protocol(dict(rse_info), 'read', pooled=True) is not protocol)
+
+        add_protocol(rse_id, {'scheme': 'file', 'hostname': 'localhost', 'port': 0, 'prefix': '/tmp/rucio_rse/',
+                              'impl': 'rucio.rse.protocols.posix.Default',
+                              'domains': {'wan': {'read': 2, 'write': 2, 'delete': 2}}})
+        new_rse_info = mgr.get_rse_info(rse_name)
+        assert_equal(sorted([proto['scheme'] for proto in new_rse_info['protocols']]), ['file', 'mock'])
+        assert_true(mgr.create_protocol(new_rse_info, 'read', scheme='mock', pooled=True) is not protocol)
+        assert_true(mgr.create_protocol(rse_info, 'read', pooled=True) is not protocol)
+
+        update_rse(rse_id, {'availability_write': False})
+        assert_equal(mgr.get_rse_info(rse_name)['availability_write'], False)
+
+        # the RSE info cached by a reader before the commit is invalidated by the commit
+        db_session = session.get_session()
+        add_protocol(rse_id, {'scheme': 'root', 'hostname': 'localhost', 'port': 1094, 'prefix': '/tmp/rucio_rse/',
+                              'impl': 'rucio.rse.protocols.xrootd.Default',
+                              'domains': {'wan': {'read': 3, 'write': 3, 'delete': 3}}}, session=db_session)
+        assert_equal(sorted([proto['scheme'] for proto in mgr.get_rse_info(rse_name)['protocols']]), ['file', 'mock'])
+        db_session.commit()
+        db_session.remove()
+        assert_equal(sorted([proto['scheme'] for proto in mgr.get_rse_info(rse_name)['protocols']]), ['file', 'mock', 'root'])
+
 
 class TestRSE(object):
 
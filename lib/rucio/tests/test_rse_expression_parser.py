@@ -10,6 +10,7 @@
 # - Hannes Hansen, <hannes.jakob.hansen@cern.ch>, 2019
 # - Andrew Lister, <andrew.lister@stfc.ac.uk>, 2019
 
+from datetime import timedelta
 from random import choice
 from string import ascii_uppercase, digits, ascii_lowercase
 
@@ -19,6 +20,7 @@ from rucio.core import rse
 from rucio.core import rse_expression_parser
 from rucio.client.rseclient import RSEClient
 from rucio.common.exception import InvalidRSEExpression, RSEBlacklisted
+from rucio.db.sqla import models, session
 
 
 def rse_name_generator(size=10):
@@ -175,6 +177,86 @@ class TestRSEExpressionParserCore(object):
         assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, "%s>51" % self.attribute_numeric)
         assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression("%s>30" % self.attribute_numeric)]), sorted([self.rse4_id, self.rse5_id]))
 
+    def test_attribute_changes(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that cached expressions follow the changes of RSE attributes """
+        attribute = tag_generator()
+        rse.add_rse_attribute(self.rse1_id, attribute, True)
+        assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute)], [self.rse1_id])
+        rse.add_rse_attribute(self.rse2_id, attribute, True)
+        assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute)]), sorted([self.rse1_id, self.rse2_id]))
+        rse.del_rse_attribute(self.rse1_id, attribute)
+        assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute)], [self.rse2_id])
+        rse.del_rse_attribute(self.rse2_id, attribute)
+        assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute)
+
+    def test_attribute_changes_other_process(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that the RSE index follows committed changes done without invalidation """
+        attribute = tag_generator()
+        version_interval = rse.RSE_ATTRIBUTE_INDEX.version_interval
+        # the version of the tables is read on every access
+        rse.RSE_ATTRIBUTE_INDEX.version_interval = timedelta(0)
+        try:
+            db_session = session.get_session()
+            models.RSEAttrAssociation(rse_id=self.rse3_id, key=attribute, value=True).save(session=db_session)
+            # an index built on uncommitted changes is not shared
+            assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute, session=db_session)], [self.rse3_id])
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute)
+            db_session.rollback()
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute, session=db_session)
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute)
+
+            # a change done by another process, without going through the session
+            db_session.execute(models.RSEAttrAssociation.__table__.insert().values(rse_id=self.rse4_id, key=attribute, value=True))
+            db_session.commit()
+            db_session.remove()
+            assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute)], [self.rse4_id])
+            rse.del_rse_attribute(self.rse4_id, attribute)
+        finally:
+            rse.RSE_ATTRIBUTE_INDEX.version_interval = version_interval
+
+    def test_attribute_changes_uncommitted(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that the RSE index is only invalidated once the changes are committed """
+        attribute = tag_generator()
+        version_interval = rse.RSE_ATTRIBUTE_INDEX.version_interval
+        rse.RSE_ATTRIBUTE_INDEX.version_interval = timedelta(hours=1)
+        try:
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute)
+            shared_index = rse.RSE_ATTRIBUTE_INDEX.get_index()
+            db_session = session.get_session()
+            rse.add_rse_attribute(self.rse3_id, attribute, True, session=db_session)
+            # the transaction sees its own change, the other sessions keep the shared index
+            assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute, session=db_session)], [self.rse3_id])
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute)
+            assert_equal(rse.RSE_ATTRIBUTE_INDEX.get_index() is shared_index, True)
+            db_session.commit()
+            db_session.remove()
+            assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute)], [self.rse3_id])
+            rse.del_rse_attribute(self.rse3_id, attribute)
+        finally:
+            rse.RSE_ATTRIBUTE_INDEX.version_interval = version_interval
+
+    def test_attribute_changes_version_interval(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that the version of the RSE tables is only read once per interval """
+        attribute = tag_generator()
+        version_interval = rse.RSE_ATTRIBUTE_INDEX.version_interval
+        rse.RSE_ATTRIBUTE_INDEX.version_interval = timedelta(hours=1)
+        try:
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute)
+            # a change done by another process, without going through the session
+            db_session = session.get_session()
+            db_session.execute(models.RSEAttrAssociation.__table__.insert().values(rse_id=self.rse3_id, key=attribute, value=True))
+            db_session.commit()
+            db_session.remove()
+            # a change done without invalidation is not seen before the next version check
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, attribute)
+            # a change done through the core is seen at once
+            rse.add_rse_attribute(self.rse4_id, attribute, True)
+            assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(attribute)]), sorted([self.rse3_id, self.rse4_id]))
+            rse.del_rse_attribute(self.rse3_id, attribute)
+            rse.del_rse_attribute(self.rse4_id, attribute)
+        finally:
+            rse.RSE_ATTRIBUTE_INDEX.version_interval = version_interval
+
 
 class TestRSEExpressionParserClient(object):
 
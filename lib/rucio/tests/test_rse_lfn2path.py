@@ -19,7 +19,7 @@ except ImportError:
     from configparser import NoOptionError, NoSectionError
 from nose.tools import assert_equal
 
-from rucio.rse.protocols.protocol import RSEDeterministicTranslation
+from rucio.rse.protocols.protocol import RSEDeterministicTranslation, RSEProtocol
 from rucio.common import config
 
 
@@ -116,6 +116,41 @@ class TestDeterministicTranslation(object):
         self.create_translator()
         assert_equal(self.translator.path("foo", "bar"), "srm://T2_Mock/foo/bar")
 
+    def test_bulk_paths(self):
+        """LFN2PFN: Translate lists of LFNs to paths in bulk (Success)"""
+        scopes, names = ["foo", "user.foo", "foo"], ["bar", "bar", "baz"]
+        for algorithm in ['hash', 'identity', 'rse_algorithm_bulk']:
+            self.rse_attributes['lfn2pfn_algorithm'] = algorithm
+            if algorithm == 'rse_algorithm_bulk':
+                RSEDeterministicTranslation.register(lambda scope, name, rse, rse_attrs, proto_attrs: "%s/%s/%s" % (rse, scope, name), name=algorithm)
+            self.create_translator()
+            assert_equal(self.translator.paths(scopes, names), [self.translator.path(scope, name) for scope, name in zip(scopes, names)])
+
+    def test_bulk_paths_override(self):
+        """LFN2PFN: Translate in bulk with an overridden built-in algorithm (Success)"""
+        hash_callable = RSEDeterministicTranslation._LFN2PFN_ALGORITHMS['hash']  # pylint: disable=protected-access
+        hash_bulk_callable = RSEDeterministicTranslation._LFN2PFN_BULK_ALGORITHMS['hash']  # pylint: disable=protected-access
+        try:
+            RSEDeterministicTranslation.register(lambda scope, name, rse, rse_attrs, proto_attrs: "custom/%s/%s" % (scope, name), name='hash')
+            self.rse_attributes['lfn2pfn_algorithm'] = 'hash'
+            self.create_translator()
+            assert_equal(self.translator.path("foo", "bar"), "custom/foo/bar")
+            assert_equal(self.translator.paths(["foo"], ["bar"]), ["custom/foo/bar"])
+        finally:
+            RSEDeterministicTranslation.register(hash_callable, name='hash')
+            RSEDeterministicTranslation.register_bulk(hash_bulk_callable, name='hash')
+
+    def test_bulk_pfns(self):
+        """LFN2PFN: Build the PFNs of a protocol in bulk (Success)"""
+        rse_settings = {'rse': 'Mock', 'deterministic': True}
+        protocol = RSEProtocol({'scheme': 'root', 'hostname': 'localhost', 'port': 1094, 'prefix': 'rucio'}, rse_settings)
+        scopes, names = ["foo", "user.foo"], ["bar", "bar"]
+        pfns = protocol.lfns2pfns_bulk(scopes, names)
+        assert_equal(pfns, ['root://localhost:1094/rucio/foo/4e/99/bar', 'root://localhost:1094/rucio/user/foo/13/7f/bar'])
+        assert_equal(protocol.lfns2pfns_bulk(scopes, names, paths=[None, '/some/path']), [pfns[0], 'root://localhost:1094/rucio/some/path'])
+        assert_equal(protocol.lfns2pfns([{'scope': scope, 'name': name} for scope, name in zip(scopes, names)]),
+                     {'foo:bar': pfns[0], 'user.foo:bar': pfns[1]})
+
     def test_module_load(self):
         """LFN2PFN: Test ability to provide LFN2PFN functions via module (Success)"""
         if not config.config_has_section('policy'):
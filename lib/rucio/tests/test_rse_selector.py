@@ -24,7 +24,7 @@ from rucio.common.types import InternalAccount
 from rucio.core.account_counter import update_account_counter, increase
 from rucio.core.account_limit import set_local_account_limit, set_global_account_limit
 from rucio.core.rse import get_rse_id
-from rucio.core.rse_selector import RSESelector
+from rucio.core.rse_selector import RSESelector, get_rse_snapshot
 from rucio.db.sqla import session, models
 
 
@@ -121,6 +121,18 @@ class TestRSESelectorInit(object):
         rse_selector = RSESelector(self.account, rses, None, copies)
         assert_equal(len(rse_selector.rses), 1)
 
+    def test_7(self):
+        # snapshot of the quota and space of a set of RSEs
+        set_local_account_limit(account=self.account, rse_id=self.mock1_id, bytes=20)
+        set_local_account_limit(account=self.account, rse_id=self.mock2_id, bytes=-1)
+        increase(self.mock1_id, self.account, 10, 10)
+        update_account_counter(account=self.account, rse_id=self.mock1_id)
+        snapshot = get_rse_snapshot(self.account, [self.mock1_id, self.mock2_id])
+        assert_equal((snapshot[self.mock1_id]['local_limit'], snapshot[self.mock1_id]['usage']), (20, 10))
+        assert_equal((snapshot[self.mock2_id]['local_limit'], snapshot[self.mock2_id]['usage']), (float('inf'), 0))
+        snapshot = get_rse_snapshot(self.account, [self.mock1_id], quota=False)
+        assert_equal((snapshot[self.mock1_id]['local_limit'], snapshot[self.mock1_id]['usage']), (None, 0))
+
 
 class TestRSESelectorDynamic(object):
 
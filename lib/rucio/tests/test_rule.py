@@ -32,22 +32,23 @@ from rucio.client.ruleclient import RuleClient
 from rucio.client.subscriptionclient import SubscriptionClient
 from rucio.common.utils import generate_uuid as uuid
 from rucio.common.exception import (RuleNotFound, AccessDenied, InsufficientAccountLimit, DuplicateRule, RSEBlacklisted, RSEOverQuota,
-                                    RuleReplaceFailed, ManualRuleApprovalBlocked, InputValidationError, UnsupportedOperation)
+                                    RuleReplaceFailed, ManualRuleApprovalBlocked, InputValidationError, UnsupportedOperation,
+                                    ReplicaNotFound, RequestNotFound)
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.daemons.judge.evaluator import re_evaluator
 from rucio.core.did import add_did, attach_dids, set_status
 from rucio.core.lock import get_replica_locks, get_dataset_locks, successful_transfer
 from rucio.core.account import add_account_attribute, get_usage
 from rucio.core.account_limit import set_local_account_limit, set_global_account_limit
-from rucio.core.request import get_request_by_did
-from rucio.core.replica import add_replica, get_replica
+from rucio.core.request import get_request_by_did, archive_requests
+from rucio.core.replica import add_replica, get_replica, bulk_update_replicas_states
 from rucio.core.rse import add_rse_attribute, add_rse, update_rse, get_rse_id, del_rse_attribute, set_rse_limits
 from rucio.core.rse_counter import get_counter as get_rse_counter
 from rucio.core.rule import add_rule, get_rule, delete_rule, add_rules, update_rule, reduce_rule, move_rule, list_rules
 from rucio.daemons.abacus.account import account_update
 from rucio.daemons.abacus.rse import rse_update
 from rucio.db.sqla import models, session
-from rucio.db.sqla.constants import DIDType, OBSOLETE, RuleState, LockState
+from rucio.db.sqla.constants import DIDType, OBSOLETE, RuleState, LockState, ReplicaState
 from rucio.db.sqla.session import transactional_session
 from rucio.tests.common import rse_name_generator, account_name_generator
 
@@ -637,6 +638,33 @@ class TestReplicationRuleCore():
         # Check if rule exists
         assert(True is check_dataset_ok_callback(scope, dataset, self.rse3, self.rse3_id, rule_id))
 
+    def test_bulk_update_replicas_states(self):
+        """ REPLICATION RULE (CORE): Update the locks and rule counters of terminated transfers in bulk"""
+        scope = InternalScope('mock')
+        files = create_files(4, scope, self.rse1_id)
+        dataset = 'dataset_' + str(uuid())
+        add_did(scope, dataset, DIDType.from_sym('DATASET'), self.jdoe)
+        attach_dids(scope, dataset, files, self.jdoe)
+
+        rule_id = add_rule(dids=[{'scope': scope, 'name': dataset}], account=self.jdoe, copies=1, rse_expression=self.rse3, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None)[0]
+        request_ids = [get_request_by_did(scope=file['scope'], name=file['name'], rse_id=self.rse3_id)['id'] for file in files]
+
+        replicas = [{'scope': file['scope'], 'name': file['name'], 'rse_id': self.rse3_id, 'state': ReplicaState.AVAILABLE} for file in files[:3]]
+        replicas.append({'scope': files[3]['scope'], 'name': files[3]['name'], 'rse_id': self.rse3_id, 'state': ReplicaState.UNAVAILABLE, 'error_message': 'transfer failed'})
+        bulk_update_replicas_states(replicas, nowait=False, add_tombstone=True)
+        archive_requests(request_ids)
+
+        rule = get_rule(rule_id)
+        assert_equal((rule['locks_ok_cnt'], rule['locks_replicating_cnt'], rule['locks_stuck_cnt']), (3, 0, 1))
+        assert_equal(rule['state'], RuleState.STUCK)
+        assert_equal([get_replica(rse_id=self.rse3_id, scope=file['scope'], name=file['name'])['state'] for file in files],
+                     [ReplicaState.AVAILABLE] * 3 + [ReplicaState.UNAVAILABLE])
+        for file in files:
+            assert_raises(RequestNotFound, get_request_by_did, scope=file['scope'], name=file['name'], rse_id=self.rse3_id)
+
+        # A missing replica makes the whole bulk fail
+        assert_raises(ReplicaNotFound, bulk_update_replicas_states, [{'scope': scope, 'name': 'file_' + str(uuid()), 'rse_id': self.rse3_id, 'state': ReplicaState.AVAILABLE}])
+
     def test_dataset_callback_no(self):
         """ REPLICATION RULE (CORE): Test dataset callback should not be sent"""
 
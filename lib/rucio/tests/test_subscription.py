@@ -40,7 +40,7 @@ from rucio.core.did import add_did, set_new_dids
 from rucio.core.rse import add_rse
 from rucio.core.rule import add_rule
 from rucio.core.scope import add_scope
-from rucio.daemons.transmogrifier.transmogrifier import run
+from rucio.daemons.transmogrifier.transmogrifier import run, is_matching_subscription, SubscriptionIndex
 from rucio.db.sqla.constants import DIDType
 from rucio.web.rest.authentication import APP as auth_app
 from rucio.web.rest.subscription import APP as subs_app
@@ -134,6 +134,28 @@ class TestSubscriptionCoreApi():
         for rule in list_subscription_rule_states(account='root', name=subscription_name):
             assert_equal(rule[3], 2)
 
+    def test_subscription_index(self):
+        """ SUBSCRIPTION (DAEMON): Test the indexed matching of the DIDs against the subscriptions """
+        filters = [{'scope': ['data12_8TeV', 'mc'], 'pattern': '.*AOD.*'},
+                   {'project': self.projects, 'datatype': ['AOD', ], 'excluded_pattern': self.pattern1},
+                   {'datatype': ['A.D', ], 'split_rule': 'true'},
+                   {'scope': ['data1[23].*', ]},
+                   {'scope': ['data12_8TeV'], 'pattern': '(invalid'}]
+        subscriptions = [{'id': uuid(), 'filter': dumps(filter_string)} for filter_string in filters]
+        index = SubscriptionIndex(subscriptions)
+        assert_equal(len(index), 4)
+
+        dids = [({'scope': InternalScope('data12_8TeV'), 'name': 'data12_8TeV.AOD.1'}, {'hidden': False, 'project': 'data12_8TeV', 'datatype': 'AOD'}),
+                ({'scope': InternalScope('mc16_13TeV'), 'name': 'mc16_13TeV.EVNT.1'}, {'hidden': False, 'project': 'mc16_13TeV', 'datatype': 'EVNT'}),
+                ({'scope': InternalScope('data13_8TeV'), 'name': 'data13_8TeV.ESD.1'}, {'hidden': False, 'project': 'data13_8TeV', 'datatype': 'ADD'}),
+                ({'scope': InternalScope('data12_8TeV'), 'name': 'data12_8TeV.AOD.2'}, {'hidden': True, 'project': 'data12_8TeV', 'datatype': 'AOD'})]
+        expected = [[0, 1, 2, 3], [], [2, 3], []]
+        for (did, metadata), positions in zip(dids, expected):
+            matching = [subscription['id'] for subscription, _ in index.match(did, metadata)]
+            assert_equal(matching, [subscriptions[position]['id'] for position in positions])
+            assert_equal(matching, [subscription['id'] for subscription in subscriptions if is_matching_subscription(subscription, did, metadata)])
+        assert_equal(index.match(*dids[2])[0][1]['split_rule'], True)
+
 
 class TestSubscriptionRestApi():
 
@@ -0,0 +1,93 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from rucio.common.exception import NoDistance, RSEProtocolNotSupported
+from rucio.core.distance import add_distance, update_distances
+from rucio.core.rse import add_rse, add_protocol, del_rse
+from rucio.core.transfer import get_hops
+from rucio.tests.common import rse_name_generator
+
+
+class TestTransferCore(object):
+
+    def setup(self):
+        self.rse_ids = []
+        for _ in range(4):
+            rse_id = add_rse(rse_name_generator())
+            add_protocol(rse_id, {'scheme': 'mock',
+                                  'hostname': 'localhost',
+                                  'port': 0,
+                                  'prefix': '/tmp/rucio_rse/',
+                                  'impl': 'rucio.rse.protocols.mock.Default',
+                                  'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                              'wan': {'read': 1, 'write': 1, 'delete': 1, 'third_party_copy': 1}}})
+            self.rse_ids.append(rse_id)
+
+    def teardown(self):
+        for rse_id in self.rse_ids:
+            del_rse(rse_id)
+
+    def test_get_hops(self):
+        """ TRANSFER (CORE): Get the direct and multihop paths between RSEs """
+        rse_a, rse_b, rse_c, rse_d = self.rse_ids
+        add_distance(rse_a, rse_b, ranking=1)
+        add_distance(rse_b, rse_c, ranking=1)
+        add_distance(rse_a, rse_d, ranking=1)
+        add_distance(rse_d, rse_c, ranking=3)
+
+        hops = get_hops(rse_a, rse_b)
+        assert_equal([(hop['source_rse_id'], hop['dest_rse_id'], hop['source_scheme'], hop['dest_scheme']) for hop in hops],
+                     [(rse_a, rse_b, 'mock', 'mock')])
+
+        with assert_raises(NoDistance):
+            get_hops(rse_a, rse_c)
+
+        hops = get_hops(rse_a, rse_c, include_multihop=True)
+        assert_equal([(hop['source_rse_id'], hop['dest_rse_id']) for hop in hops], [(rse_a, rse_b), (rse_b, rse_c)])
+
+        # The updated distances must be picked up by the in-memory graph
+        update_distances(src_rse_id=rse_b, dest_rse_id=rse_c, parameters={'ranking': 10})
+        hops = get_hops(rse_a, rse_c, include_multihop=True)
+        assert_equal([(hop['source_rse_id'], hop['dest_rse_id']) for hop in hops], [(rse_a, rse_d), (rse_d, rse_c)])
+
+        with assert_raises(NoDistance):
+            get_hops(rse_c, rse_a, include_multihop=True)
+
+    def test_get_hops_no_matching_scheme(self):
+        """ TRANSFER (CORE): A missing protocol match raises a new error on every call """
+        rse_a = self.rse_ids[0]
+        rse_e = add_rse(rse_name_generator())
+        self.rse_ids.append(rse_e)
+        add_protocol(rse_e, {'scheme': 'root',
+                             'hostname': 'localhost',
+                             'port': 1094,
+                             'prefix': '/tmp/rucio_rse/',
+                             'impl': 'rucio.rse.protocols.xrootd.Default',
+                             'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                         'wan': {'read': 1, 'write': 1, 'delete': 1, 'third_party_copy': 1}}})
+        add_distance(rse_a, rse_e, ranking=1)
+
+        errors = []
+        for _ in range(2):
+            try:
+                get_hops(rse_a, rse_e)
+            except RSEProtocolNotSupported as error:
+                errors.append(error)
+        assert_equal(len(errors), 2)
+        assert_true(errors[0] is not errors[1])
+        assert_equal(errors[0].args, errors[1].args)
@@ -0,0 +1,213 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+import logging
+import os
+import threading
+
+from mock import patch
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from rucio.client.client import Client
+from rucio.client.uploadclient import UploadClient
+from rucio.common.exception import DataIdentifierAlreadyExists
+from rucio.common.utils import generate_uuid
+from rucio.tests.common import file_generator
+
+
+class FakeClient(object):
+    ''' In-process stand-in for the rucio client, recording the calls of the upload client. '''
+
+    def __init__(self, events, replicas=None):
+        self.account = 'root'
+        self.events = events
+        self.replicas = replicas or {}
+        self.lock = threading.Lock()
+
+    def __record(self, *event):
+        with self.lock:
+            self.events.append(event)
+
+    def list_replicas(self, dids, all_states=False):
+        self.__record('list_replicas', tuple(did['name'] for did in dids))
+        return [self.replicas[did['name']] for did in dids if did['name'] in self.replicas]
+
+    def add_replicas(self, rse, files):
+        self.__record('add_replicas', rse, tuple((file['name'], file['state']) for file in files))
+        return True
+
+    def add_replication_rule(self, dids, copies, rse_expression, lifetime=None):
+        self.__record('add_replication_rule', tuple(did['name'] for did in dids), rse_expression, lifetime)
+        return [generate_uuid()]
+
+    def add_dataset(self, scope, name, rules):
+        self.__record('add_dataset', name, rules[0]['rse_expression'])
+        return True
+
+    def update_replicas_states(self, rse, files):
+        self.__record('update_replicas_states', rse, tuple((file['name'], file['state']) for file in files))
+        return True
+
+    def attach_dids(self, scope, name, dids):
+        self.__record('attach_dids', name, tuple(did['name'] for did in dids))
+        return True
+
+
+class TestUploadClientBulk(object):
+    ''' Test the threaded upload mode of the upload client against a fake client and storage. '''
+
+    def setup(self):
+        self.rse = 'MOCK_UPLOAD'
+        self.events = []
+        self.paths = [file_generator() for _ in range(4)]
+        self.upload_client = UploadClient(_client=FakeClient(self.events), tracing=False)
+        self.upload_client.rses[self.rse] = {'availability_write': 1, 'deterministic': True}
+
+    def teardown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def upload(self, items, num_threads=2):
+        ''' Upload the items, the storage only records the uploaded files. '''
+        def upload(rse_settings, lfns, **kwargs):
+            with self.upload_client.client.lock:
+                self.events.append(('upload', lfns['name']))
+            return {'success': True, 'pfn': 'mock://localhost/%s' % lfns['name']}
+
+        with patch('rucio.client.uploadclient.rsemgr.exists', return_value=False), \
+                patch('rucio.client.uploadclient.rsemgr.get_protocols_ordered', side_effect=lambda **kwargs: [{'scheme': 'mock'}]), \
+                patch('rucio.client.uploadclient.rsemgr.upload', side_effect=upload):
+            return self.upload_client.upload(items, num_threads=num_threads, bulk_size=3)
+
+    def names(self):
+        return [os.path.basename(path) for path in self.paths]
+
+    def calls(self, name):
+        return [event for event in self.events if event[0] == name]
+
+    def test_upload_threads_with_dataset(self):
+        ''' UPLOAD (CLIENT): Upload several files with threads into a dataset '''
+        dataset = 'dataset_%s' % generate_uuid()
+        items = [{'path': path, 'rse': self.rse, 'did_scope': 'mock', 'dataset_scope': 'mock', 'dataset_name': dataset} for path in self.paths]
+        assert_equal(self.upload(items), 0)
+
+        names = self.names()
+        assert_equal(self.calls('add_dataset'), [('add_dataset', dataset, self.rse)])
+        # the files are registered in bulk before the upload, in chunks of bulk_size
+        assert_equal(sorted(name for event in self.calls('add_replicas') for name, state in event[2]), sorted(names))
+        assert_true(all(state == 'C' for event in self.calls('add_replicas') for _, state in event[2]))
+        assert_equal(len(self.calls('add_replicas')), 2)
+        assert_equal(sorted(event[1] for event in self.calls('upload')), sorted(names))
+        # the dataset has a rule, the files do not need one
+        assert_equal(self.calls('add_replication_rule'), [])
+        # one state update per RSE, one attachment per bulk_size files
+        assert_equal(len(self.calls('update_replicas_states')), 1)
+        assert_equal(sorted(self.calls('update_replicas_states')[0][2]), sorted((name, 'A') for name in names))
+        assert_equal(sorted(name for event in self.calls('attach_dids') for name in event[2]), sorted(names))
+        assert_true(all(event[1] == dataset for event in self.calls('attach_dids')))
+
+    def test_upload_threads_without_dataset(self):
+        ''' UPLOAD (CLIENT): Upload several files with threads without a dataset '''
+        items = [{'path': path, 'rse': self.rse, 'did_scope': 'mock', 'lifetime': 3600} for path in self.paths]
+        assert_equal(self.upload(items, num_threads=3), 0)
+
+        names = self.names()
+        assert_equal(self.calls('add_dataset'), [])
+        assert_equal(self.calls('attach_dids'), [])
+        # the files without a dataset get a rule with their lifetime
+        assert_equal(sorted(name for event in self.calls('add_replication_rule') for name in event[1]), sorted(names))
+        assert_true(all(event[2:] == (self.rse, 3600) for event in self.calls('add_replication_rule')))
+        assert_equal(sorted(self.calls('update_replicas_states')[0][2]), sorted((name, 'A') for name in names))
+
+    def test_upload_threads_register_after_upload(self):
+        ''' UPLOAD (CLIENT): Files with register_after_upload are registered after their upload '''
+        items = [{'path': path, 'rse': self.rse, 'did_scope': 'mock', 'register_after_upload': True} for path in self.paths[:2]]
+        items += [{'path': path, 'rse': self.rse, 'did_scope': 'mock'} for path in self.paths[2:]]
+        assert_equal(self.upload(items), 0)
+
+        names = self.names()
+        for name in names[:2]:
+            uploaded_at = self.events.index(('upload', name))
+            registered_at = [index for index, event in enumerate(self.events) if event[0] == 'add_replicas' and name in [file_name for file_name, _ in event[2]]]
+            assert_equal(len(registered_at), 1)
+            assert_true(registered_at[0] > uploaded_at)
+        for name in names[2:]:
+            uploaded_at = self.events.index(('upload', name))
+            registered_at = [index for index, event in enumerate(self.events) if event[0] == 'add_replicas' and name in [file_name for file_name, _ in event[2]]]
+            assert_true(registered_at[0] < uploaded_at)
+        assert_equal(sorted(self.calls('update_replicas_states')[0][2]), sorted((name, 'A') for name in names))
+
+    def test_register_files_bulk_checksum_mismatch(self):
+        ''' UPLOAD (CLIENT): Bulk registration aborts if a file is registered with another checksum '''
+        items = [{'path': path, 'rse': self.rse, 'did_scope': 'mock'} for path in self.paths]
+        files = self.upload_client._collect_and_validate_file_info(items)
+        name = files[1]['did_name']
+        self.upload_client.client.replicas[name] = {'scope': 'mock', 'name': name, 'adler32': 'deadbeef', 'rses': {}}
+
+        with assert_raises(DataIdentifierAlreadyExists):
+            self.upload_client._register_files_bulk(files, set(), bulk_size=10)
+        assert_equal(self.calls('add_replicas'), [])
+        assert_equal(self.calls('add_replication_rule'), [])
+
+        # with the same checksum the file is registered at the new RSE
+        self.upload_client.client.replicas[name]['adler32'] = files[1]['adler32']
+        self.upload_client._register_files_bulk(files, set(), bulk_size=10)
+        assert_equal(sorted(name for event in self.calls('add_replicas') for name, _ in event[2]), sorted(self.names()))
+
+
+class TestUploadClient(object):
+    ''' Test the threaded upload mode of the upload client against the server. '''
+
+    def setup(self):
+        logger = logging.getLogger('dlul_client')
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.DEBUG)
+        self.client = Client()
+        self.upload_client = UploadClient(_client=self.client, logger=logger)
+        self.rse = 'MOCK4'
+        self.scope = 'mock'
+        self.paths = [file_generator() for _ in range(3)]
+
+    def teardown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def names(self):
+        return [os.path.basename(path) for path in self.paths]
+
+    def test_upload_threads_with_dataset(self):
+        ''' UPLOAD (CLIENT): Upload several files with threads into a dataset '''
+        dataset = 'dataset_%s' % generate_uuid()
+        items = [{'path': path, 'rse': self.rse, 'did_scope': self.scope, 'dataset_scope': self.scope, 'dataset_name': dataset} for path in self.paths]
+        assert_equal(self.upload_client.upload(items, num_threads=2), 0)
+
+        dids = [{'scope': self.scope, 'name': name} for name in self.names()]
+        for replica in self.client.list_replicas(dids, all_states=True):
+            assert_equal(replica['states'], {self.rse: 'AVAILABLE'})
+        assert_equal(sorted(did['name'] for did in self.client.list_content(self.scope, dataset)), sorted(self.names()))
+        assert_equal([rule['rse_expression'] for rule in self.client.list_did_rules(self.scope, dataset)], [self.rse])
+
+    def test_upload_threads_without_dataset(self):
+        ''' UPLOAD (CLIENT): Upload several files with threads without a dataset '''
+        items = [{'path': path, 'rse': self.rse, 'did_scope': self.scope} for path in self.paths]
+        items[0]['register_after_upload'] = True
+        assert_equal(self.upload_client.upload(items, num_threads=2), 0)
+
+        dids = [{'scope': self.scope, 'name': name} for name in self.names()]
+        for replica in self.client.list_replicas(dids, all_states=True):
+            assert_equal(replica['states'], {self.rse: 'AVAILABLE'})
+        for name in self.names():
+            assert_equal([rule['rse_expression'] for rule in self.client.list_did_rules(self.scope, name)], [self.rse])
@@ -15,11 +15,13 @@
 import datetime
 import unittest
 import tempfile
+import zlib
 
+from mock import patch
 from nose.tools import assert_raises, assert_equal, assert_is_instance, assert_is_not_none
 from re import match
 from rucio.common.exception import InvalidType
-from rucio.common.utils import md5, adler32, parse_did_filter_from_string
+from rucio.common.utils import md5, adler32, adler32_combine, bulk_checksums, checksums, parse_did_filter_from_string, LRUCache
 
 
 class TestUtils(unittest.TestCase):
@@ -64,6 +66,50 @@ class TestUtils(unittest.TestCase):
             adler32('no_file')
         self.check_exception_message('FATAL - could not get Adler32 checksum of file no_file - [Errno 2] No such file or directory: \'no_file\'', e)
 
+    def test_utils_checksums(self):
+        """(COMMON/UTILS): test calculating several checksums of files in a single pass"""
+        with tempfile.NamedTemporaryFile() as temp_file_2:
+            temp_file_2.write(b'\x00\xff' * (1024 ** 2 + 1))
+            temp_file_2.flush()
+
+            ret = checksums(temp_file_2.name, ['adler32', 'md5', 'sha256', 'crc32'])
+            assert_equal(ret['adler32'], '0d3ff010')
+            assert_equal(ret['md5'], '2b2955c8315d61559f81bdae6f884094')
+            assert_equal(ret['sha256'], '69ec4129dc241c555c7d96c87b58e18472576bfae00add292b33338067f95f4e')
+            assert_equal(ret['crc32'], '7DD96E25')
+
+            expected = [{'adler32': '198d03ff', 'md5': '31d50dd6285b9ff9f8611d0762265d04'},
+                        {'adler32': '0d3ff010', 'md5': '2b2955c8315d61559f81bdae6f884094'},
+                        {'adler32': '198d03ff', 'md5': '31d50dd6285b9ff9f8611d0762265d04'}]
+            files = [self.temp_file_1.name, temp_file_2.name, self.temp_file_1.name]
+            assert_equal(bulk_checksums(files, ['adler32', 'md5'], processes=2, min_size=0), expected)
+
+            # small files are not worth starting a pool of processes
+            with patch('rucio.common.utils.multiprocessing.Pool', side_effect=AssertionError('no pool expected')):
+                assert_equal(bulk_checksums(files, ['adler32', 'md5'], processes=2), expected)
+
+    def test_utils_adler32_combine(self):
+        """(COMMON/UTILS): test combining the adler32 checksums of consecutive blocks"""
+        data = b'\x00\xff' * (1024 ** 2 + 1) + b'rucio'
+        for split in (0, 1, 65521, len(data) // 2, len(data)):
+            first, second = data[:split], data[split:]
+            combined = adler32_combine(zlib.adler32(first) & 0xffffffff, zlib.adler32(second) & 0xffffffff, len(second))
+            assert_equal(combined, zlib.adler32(data) & 0xffffffff)
+
+    def test_lru_cache(self):
+        """(COMMON/UTILS): test the least recently used entries are evicted from the LRU cache"""
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert_equal(cache.get('a'), 1)
+        cache.set('c', 3)
+        assert_equal(cache.get('b'), None)
+        assert_equal(cache.get('a'), 1)
+        assert_equal(cache.get('c'), 3)
+        cache.delete('a')
+        assert_equal(cache.get('a', 0), 0)
+        assert_equal(len(cache), 1)
+
     def test_parse_did_filter_string(self):
         """(COMMON/UTILS): test parsing of did filter string"""
         test_cases = [{
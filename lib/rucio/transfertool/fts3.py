@@ -27,6 +27,7 @@ except ImportError:
     JSONDecodeError = ValueError
 import logging
 import sys
+import threading
 import time
 import traceback
 try:
@@ -36,13 +37,14 @@ except ImportError:
 import uuid
 
 import requests
-from requests.adapters import ReadTimeout
+from requests.adapters import HTTPAdapter, ReadTimeout
 from requests.packages.urllib3 import disable_warnings  # pylint: disable=import-error
+from requests.packages.urllib3.util.retry import Retry  # pylint: disable=import-error
 
 from dogpile.cache import make_region
 from dogpile.cache.api import NoValue
 
-from rucio.common.config import config_get, config_get_bool
+from rucio.common.config import config_get, config_get_bool, config_get_float, config_get_int
 from rucio.common.exception import TransferToolTimeout, TransferToolWrongAnswer, DuplicateFileTransferSubmission
 from rucio.common.utils import APIEncoder
 from rucio.core.monitor import record_counter, record_timer
@@ -62,6 +64,37 @@ logging.basicConfig(stream=sys.stdout,
 REGION_SHORT = make_region().configure('dogpile.cache.memory',
                                        expiration_time=1800)
 
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(external_host):
+    """
+    Get the HTTP session for an FTS3 server, shared by all threads of the process.
+
+    The session keeps a pool of keep-alive connections to the server, so that the
+    TCP and TLS handshakes are not paid on every call. Idempotent requests failing
+    on connection errors or with 502/503/504 are retried with exponential backoff.
+
+    :param external_host: The FTS3 server URL.
+    :returns: A requests.Session object.
+    """
+    with SESSIONS_LOCK:
+        session = SESSIONS.get(external_host)
+        if session is None:
+            retries = Retry(total=config_get_int('conveyor', 'fts_max_retries', False, 3),
+                            backoff_factor=config_get_float('conveyor', 'fts_backoff_factor', False, 0.5),
+                            status_forcelist=(502, 503, 504),
+                            raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=config_get_int('conveyor', 'fts_pool_size', False, 10),
+                                  max_retries=retries)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            SESSIONS[external_host] = session
+    return session
+
 
 class FTS3Transfertool(Transfertool):
     """
@@ -84,6 +117,7 @@ class FTS3Transfertool(Transfertool):
         else:
             self.cert = None
             self.verify = True  # True is the default setting of a requests.* method
+        self.session = get_session(self.external_host)
 
     def submit(self, files, job_params, timeout=None):
         """
@@ -132,12 +166,12 @@ class FTS3Transfertool(Transfertool):
         post_result = None
         try:
             start_time = time.time()
-            post_result = requests.post('%s/jobs' % self.external_host,
-                                        verify=self.verify,
-                                        cert=self.cert,
-                                        data=params_str,
-                                        headers={'Content-Type': 'application/json'},
-                                        timeout=timeout)
+            post_result = self.session.post('%s/jobs' % self.external_host,
+                                            verify=self.verify,
+                                            cert=self.cert,
+                                            data=params_str,
+                                            headers={'Content-Type': 'application/json'},
+                                            timeout=timeout)
             record_timer('transfertool.fts3.submit_transfer.%s' % self.__extract_host(self.external_host), (time.time() - start_time) * 1000 / len(files))
         except ReadTimeout as error:
             raise TransferToolTimeout(error)
@@ -179,11 +213,11 @@ class FTS3Transfertool(Transfertool):
 
         job = None
 
-        job = requests.delete('%s/jobs/%s' % (self.external_host, transfer_id),
-                              verify=self.verify,
-                              cert=self.cert,
-                              headers={'Content-Type': 'application/json'},
-                              timeout=timeout)
+        job = self.session.delete('%s/jobs/%s' % (self.external_host, transfer_id),
+                                  verify=self.verify,
+                                  cert=self.cert,
+                                  headers={'Content-Type': 'application/json'},
+                                  timeout=timeout)
 
         if job and job.status_code == 200:
             record_counter('transfertool.fts3.%s.cancel.success' % self.__extract_host(self.external_host))
@@ -206,12 +240,12 @@ class FTS3Transfertool(Transfertool):
         params_dict = {"params": {"priority": priority}}
         params_str = json.dumps(params_dict, cls=APIEncoder)
 
-        job = requests.post('%s/jobs/%s' % (self.external_host, transfer_id),
-                            verify=self.verify,
-                            data=params_str,
-                            cert=self.cert,
-                            headers={'Content-Type': 'application/json'},
-                            timeout=timeout)  # TODO set to 3 in conveyor
+        job = self.session.post('%s/jobs/%s' % (self.external_host, transfer_id),
+                                verify=self.verify,
+                                data=params_str,
+                                cert=self.cert,
+                                headers={'Content-Type': 'application/json'},
+                                timeout=timeout)  # TODO set to 3 in conveyor
 
         if job and job.status_code == 200:
             record_counter('transfertool.fts3.%s.update_priority.success' % self.__extract_host(self.external_host))
@@ -239,11 +273,11 @@ class FTS3Transfertool(Transfertool):
 
         job = None
 
-        job = requests.get('%s/jobs/%s' % (self.external_host, transfer_id),
-                           verify=self.verify,
-                           cert=self.cert,
-                           headers={'Content-Type': 'application/json'},
-                           timeout=timeout)  # TODO Set to 5 in conveyor
+        job = self.session.get('%s/jobs/%s' % (self.external_host, transfer_id),
+                               verify=self.verify,
+                               cert=self.cert,
+                               headers={'Content-Type': 'application/json'},
+                               timeout=timeout)  # TODO Set to 5 in conveyor
         if job and job.status_code == 200:
             record_counter('transfertool.fts3.%s.query.success' % self.__extract_host(self.external_host))
             return [job.json()]
@@ -262,10 +296,10 @@ class FTS3Transfertool(Transfertool):
 
         get_result = None
 
-        get_result = requests.get('%s/whoami' % self.external_host,
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'})
+        get_result = self.session.get('%s/whoami' % self.external_host,
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'})
 
         if get_result and get_result.status_code == 200:
             record_counter('transfertool.fts3.%s.whoami.success' % self.__extract_host(self.external_host))
@@ -283,10 +317,10 @@ class FTS3Transfertool(Transfertool):
 
         get_result = None
 
-        get_result = requests.get('%s/' % self.external_host,
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'})
+        get_result = self.session.get('%s/' % self.external_host,
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'})
 
         if get_result and get_result.status_code == 200:
             record_counter('transfertool.fts3.%s.version.success' % self.__extract_host(self.external_host))
@@ -306,22 +340,22 @@ class FTS3Transfertool(Transfertool):
         jobs = None
 
         try:
-            whoami = requests.get('%s/whoami' % (self.external_host),
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'})
+            whoami = self.session.get('%s/whoami' % (self.external_host),
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'})
             if whoami and whoami.status_code == 200:
                 delegation_id = whoami.json()['delegation_id']
             else:
                 raise Exception('Could not retrieve delegation id: %s', whoami.content)
             state_string = ','.join(state)
-            jobs = requests.get('%s/jobs?dlg_id=%s&state_in=%s&time_window=%s' % (self.external_host,
-                                                                                  delegation_id,
-                                                                                  state_string,
-                                                                                  last_nhours),
-                                verify=self.verify,
-                                cert=self.cert,
-                                headers={'Content-Type': 'application/json'})
+            jobs = self.session.get('%s/jobs?dlg_id=%s&state_in=%s&time_window=%s' % (self.external_host,
+                                                                                      delegation_id,
+                                                                                      state_string,
+                                                                                      last_nhours),
+                                    verify=self.verify,
+                                    cert=self.cert,
+                                    headers={'Content-Type': 'application/json'})
         except ReadTimeout as error:
             raise TransferToolTimeout(error)
         except JSONDecodeError as error:
@@ -357,13 +391,12 @@ class FTS3Transfertool(Transfertool):
             transfer_ids = [transfer_ids]
 
         responses = {}
-        fts_session = requests.Session()
         xfer_ids = ','.join(transfer_ids)
-        jobs = fts_session.get('%s/jobs/%s?files=file_state,dest_surl,finish_time,start_time,reason,source_surl,file_metadata' % (self.external_host, xfer_ids),
-                               verify=self.verify,
-                               cert=self.cert,
-                               headers={'Content-Type': 'application/json'},
-                               timeout=timeout)
+        jobs = self.session.get('%s/jobs/%s?files=file_state,dest_surl,finish_time,start_time,reason,source_surl,file_metadata' % (self.external_host, xfer_ids),
+                                verify=self.verify,
+                                cert=self.cert,
+                                headers={'Content-Type': 'application/json'},
+                                timeout=timeout)
 
         if jobs is None:
             record_counter('transfertool.fts3.%s.bulk_query.failure' % self.__extract_host(self.external_host))
@@ -395,11 +428,11 @@ class FTS3Transfertool(Transfertool):
         """
 
         try:
-            result = requests.get('%s/ban/se' % self.external_host,
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'},
-                                  timeout=None)
+            result = self.session.get('%s/ban/se' % self.external_host,
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'},
+                                      timeout=None)
         except Exception as error:
             raise Exception('Could not retrieve transfer information: %s', error)
         if result and result.status_code == 200:
@@ -414,11 +447,11 @@ class FTS3Transfertool(Transfertool):
         """
 
         try:
-            result = requests.get('%s/config/se' % (self.external_host),
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'},
-                                  timeout=None)
+            result = self.session.get('%s/config/se' % (self.external_host),
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'},
+                                      timeout=None)
         except Exception:
             logging.warn('Could not get config of %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
         if result and result.status_code == 200:
@@ -472,12 +505,12 @@ class FTS3Transfertool(Transfertool):
         params_str = json.dumps(params_dict, cls=APIEncoder)
 
         try:
-            result = requests.post('%s/config/se' % (self.external_host),
-                                   verify=self.verify,
-                                   cert=self.cert,
-                                   data=params_str,
-                                   headers={'Content-Type': 'application/json'},
-                                   timeout=None)
+            result = self.session.post('%s/config/se' % (self.external_host),
+                                       verify=self.verify,
+                                       cert=self.cert,
+                                       data=params_str,
+                                       headers={'Content-Type': 'application/json'},
+                                       timeout=None)
 
         except Exception:
             logging.warn('Could not set the config of %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
@@ -511,12 +544,12 @@ class FTS3Transfertool(Transfertool):
         result = None
         if ban:
             try:
-                result = requests.post('%s/ban/se' % self.external_host,
-                                       verify=self.verify,
-                                       cert=self.cert,
-                                       data=params_str,
-                                       headers={'Content-Type': 'application/json'},
-                                       timeout=None)
+                result = self.session.post('%s/ban/se' % self.external_host,
+                                           verify=self.verify,
+                                           cert=self.cert,
+                                           data=params_str,
+                                           headers={'Content-Type': 'application/json'},
+                                           timeout=None)
             except Exception:
                 logging.warn('Could not ban %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
             if result and result.status_code == 200:
@@ -525,12 +558,12 @@ class FTS3Transfertool(Transfertool):
         else:
 
             try:
-                result = requests.delete('%s/ban/se?storage=%s' % (self.external_host, storage_element),
-                                         verify=self.verify,
-                                         cert=self.cert,
-                                         data=params_str,
-                                         headers={'Content-Type': 'application/json'},
-                                         timeout=None)
+                result = self.session.delete('%s/ban/se?storage=%s' % (self.external_host, storage_element),
+                                             verify=self.verify,
+                                             cert=self.cert,
+                                             data=params_str,
+                                             headers={'Content-Type': 'application/json'},
+                                             timeout=None)
             except Exception:
                 logging.warn('Could not unban %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
             if result and result.status_code == 204:
@@ -559,11 +592,11 @@ class FTS3Transfertool(Transfertool):
 
                 get_result = None
                 try:
-                    get_result = requests.get('%s/whoami' % self.external_host,
-                                              verify=self.verify,
-                                              cert=self.cert,
-                                              headers={'Content-Type': 'application/json'},
-                                              timeout=5)
+                    get_result = self.session.get('%s/whoami' % self.external_host,
+                                                  verify=self.verify,
+                                                  cert=self.cert,
+                                                  headers={'Content-Type': 'application/json'},
+                                                  timeout=5)
                 except ReadTimeout as error:
                     raise TransferToolTimeout(error)
                 except JSONDecodeError as error:
@@ -764,11 +797,11 @@ class FTS3Transfertool(Transfertool):
 
         files = None
 
-        files = requests.get('%s/jobs/%s/files' % (self.external_host, transfer_id),
-                             verify=self.verify,
-                             cert=self.cert,
-                             headers={'Content-Type': 'application/json'},
-                             timeout=5)
+        files = self.session.get('%s/jobs/%s/files' % (self.external_host, transfer_id),
+                                 verify=self.verify,
+                                 cert=self.cert,
+                                 headers={'Content-Type': 'application/json'},
+                                 timeout=5)
         if files and (files.status_code == 200 or files.status_code == 207):
             record_counter('transfertool.fts3.%s.query_details.success' % self.__extract_host(self.external_host))
             return files.json()
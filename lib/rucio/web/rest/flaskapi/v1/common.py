@@ -21,6 +21,7 @@
 
 from __future__ import print_function
 from functools import wraps
+from itertools import chain
 from flask import request
 from time import time
 from traceback import format_exc
@@ -91,3 +92,21 @@ def check_accept_header_wrapper_flask(supported_content_types):
             return f(*args, **kwargs)
         return decorated
     return wrapper
+
+
+def prefetch_first(generator):
+    """
+    Fetch the first element of a generator before a streaming response is started.
+
+    Exceptions raised while the generator sets up (e.g. DataIdentifierNotFound) are
+    thereby propagated before any byte is sent, and can still be mapped to a proper
+    HTTP error code. The remaining elements are fetched lazily while streaming.
+
+    :param generator: The generator to prefetch from.
+    :returns: An iterator over all elements of the generator.
+    """
+    try:
+        first = next(generator)
+    except StopIteration:
+        return iter(())
+    return chain((first, ), generator)
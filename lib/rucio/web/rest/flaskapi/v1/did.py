@@ -147,8 +147,11 @@ class Search(MethodView):
         :query length.gte: Number of attached DIDs greater than or equal to
         :query length.lte: Number of attached DIDs less than or equal to
         :query name: Name or pattern of a DID name
+        :query limit: Maximum number of DIDs, ordered by name
+        :query marker: Only DIDs with a name greater than the marker, e.g. the last name of the previous page
         :resheader Content-Type: application/x-json-stream
         :status 200: DIDs found
+        :status 400: Invalid limit
         :status 401: Invalid Auth Token
         :status 404: Invalid key in filters
         :status 406: Not Acceptable
@@ -160,6 +163,8 @@ class Search(MethodView):
         long = False
         recursive = False
         type = 'collection'
+        limit = None
+        marker = None
         for k, v in request.args.items():
             if k == 'type':
                 type = v
@@ -167,12 +172,21 @@ class Search(MethodView):
                 long = v == '1'
             elif k == 'recursive':
                 recursive = v == 'True'
+            elif k == 'limit':
+                try:
+                    limit = int(v)
+                except ValueError:
+                    return generate_http_error_flask(400, 'ValueError', 'Parameter "limit" must be a positive integer')
+                if limit < 1:
+                    return generate_http_error_flask(400, 'ValueError', 'Parameter "limit" must be a positive integer')
+            elif k == 'marker':
+                marker = v
             else:
                 filters[k] = v
 
         try:
             data = ""
-            for did in list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive):
+            for did in list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive, limit=limit, marker=marker):
                 data += dumps(did) + '\n'
             return Response(data, content_type='application/x-json-stream')
         except UnsupportedOperation as error:
@@ -47,7 +47,7 @@ from rucio.common.exception import (AccessDenied, DataIdentifierAlreadyExists, I
                                     RSENotFound, UnsupportedOperation, ReplicaNotFound)
 from rucio.common.replica_sorter import sort_random, sort_geoip, sort_closeness, sort_dynamic, sort_ranking
 from rucio.common.utils import generate_http_error_flask, parse_response, APIEncoder, render_json_list
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, prefetch_first
 
 
 class Replicas(MethodView):
@@ -93,20 +93,17 @@ class Replicas(MethodView):
         if limit:
             limit = int(limit)
 
-        data = ""
-        content_type = 'application/x-json-stream'
-        try:
-            # first, set the appropriate content type, and stream the header
+        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR')
+        if client_ip is None:
+            client_ip = request.remote_addr
+
+        def generate(rfiles):
+            # first, stream the metalink header
             if metalink:
-                content_type = 'application/metalink4+xml'
-                data += '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
+                yield '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
 
             # then, stream the replica information
-            for rfile in list_replicas(dids=dids, schemes=schemes):
-                client_ip = request.environ.get('HTTP_X_FORWARDED_FOR')
-                if client_ip is None:
-                    client_ip = request.remote_addr
-
+            for rfile in rfiles:
                 replicas = []
                 dictreplica = {}
                 for rse in rfile['rses']:
@@ -121,34 +118,40 @@ class Replicas(MethodView):
                 else:
                     replicas = sort_random(dictreplica)
                 if not metalink:
-                    data += dumps(rfile) + '\n'
+                    yield dumps(rfile) + '\n'
                 else:
-                    data += ' <file name="' + rfile['name'] + '">\n'
-                    data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+                    xml = ' <file name="' + rfile['name'] + '">\n'
+                    xml += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
 
                     if rfile['adler32'] is not None:
-                        data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+                        xml += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
                     if rfile['md5'] is not None:
-                        data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
+                        xml += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
 
-                    data += '  <size>' + str(rfile['bytes']) + '</size>\n'
+                    xml += '  <size>' + str(rfile['bytes']) + '</size>\n'
 
-                    data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    data += '</glfn>\n'
+                    xml += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
+                    xml += '</glfn>\n'
 
                     idx = 0
                     for replica in replicas:
-                        data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
+                        xml += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
                         idx += 1
                         if limit and limit == idx:
                             break
-                    data += ' </file>\n'
+                    xml += ' </file>\n'
+                    yield xml
 
             # don't forget to send the metalink footer
             if metalink:
-                data += '</metalink>\n'
+                yield '</metalink>\n'
 
-            return Response(data, content_type=content_type)
+        try:
+            # we need to fetch the first replica before starting to reply
+            # otherwise the exceptions won't be propagated correctly
+            rfiles = prefetch_first(list_replicas(dids=dids, schemes=schemes))
+            content_type = 'application/metalink4+xml' if metalink else 'application/x-json-stream'
+            return Response(generate(rfiles), content_type=content_type)
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -316,7 +319,7 @@ class ListReplicas(MethodView):
             client_ip = request.remote_addr
 
         dids, schemes, select, unavailable, limit = [], None, None, False, None
-        ignore_availability, rse_expression, all_states = False, None, False
+        ignore_availability, rse_expression, all_states, domain = False, None, False, None
         client_location = {}
 
         json_data = request.data
@@ -347,23 +350,13 @@ class ListReplicas(MethodView):
         select = request.args.get('select', None)
         select = request.args.get('sort', None)
 
-        data = ""
-        content_type = 'application/x-json-stream'
-        try:
-            # first, set the appropriate content type, and stream the header
+        def generate(rfiles):
+            # first, stream the metalink header
             if metalink:
-                content_type = 'application/metalink4+xml'
-                data += '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
+                yield '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
 
             # then, stream the replica information
-            for rfile in list_replicas(dids=dids, schemes=schemes,
-                                       unavailable=unavailable,
-                                       request_id=request.environ.get('request_id'),
-                                       ignore_availability=ignore_availability,
-                                       all_states=all_states,
-                                       rse_expression=rse_expression,
-                                       client_location=client_location,
-                                       domain=domain):
+            for rfile in rfiles:
                 replicas = []
                 dictreplica = {}
                 for rse in rfile['rses']:
@@ -372,18 +365,18 @@ class ListReplicas(MethodView):
                         dictreplica[replica] = rse
 
                 if not metalink:
-                    data += dumps(rfile, cls=APIEncoder) + '\n'
+                    yield dumps(rfile, cls=APIEncoder) + '\n'
                 else:
-                    data += ' <file name="' + rfile['name'] + '">\n'
-                    data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+                    xml = ' <file name="' + rfile['name'] + '">\n'
+                    xml += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
                     if rfile['adler32'] is not None:
-                        data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+                        xml += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
                     if rfile['md5'] is not None:
-                        data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
-                    data += '  <size>' + str(rfile['bytes']) + '</size>\n'
+                        xml += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
+                    xml += '  <size>' + str(rfile['bytes']) + '</size>\n'
 
-                    data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    data += '</glfn>\n'
+                    xml += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
+                    xml += '</glfn>\n'
 
                     if select == 'geoip':
                         replicas = sort_geoip(dictreplica, client_location['ip'])
@@ -398,17 +391,30 @@ class ListReplicas(MethodView):
 
                     idx = 0
                     for replica in replicas:
-                        data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
+                        xml += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
                         idx += 1
                         if limit and limit == idx:
                             break
-                    data += ' </file>\n'
+                    xml += ' </file>\n'
+                    yield xml
 
             # don't forget to send the metalink footer
             if metalink:
-                data += '</metalink>\n'
+                yield '</metalink>\n'
 
-            return Response(data, content_type=content_type)
+        try:
+            # we need to fetch the first replica before starting to reply
+            # otherwise the exceptions won't be propagated correctly
+            rfiles = prefetch_first(list_replicas(dids=dids, schemes=schemes,
+                                                  unavailable=unavailable,
+                                                  request_id=request.environ.get('request_id'),
+                                                  ignore_availability=ignore_availability,
+                                                  all_states=all_states,
+                                                  rse_expression=rse_expression,
+                                                  client_location=client_location,
+                                                  domain=domain))
+            content_type = 'application/metalink4+xml' if metalink else 'application/x-json-stream'
+            return Response(generate(rfiles), content_type=content_type)
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
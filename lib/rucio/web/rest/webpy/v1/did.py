@@ -127,6 +127,7 @@ class Search(RucioController):
             200 OK
 
         HTTP Error:
+            400 ValueError
             401 Unauthorized
             404 KeyNotFound
             406 Not Acceptable
@@ -139,6 +140,8 @@ class Search(RucioController):
         filters = {}
         long = False
         recursive = False
+        limit = None
+        marker = None
         if ctx.query:
             params = parse_qs(ctx.query[1:])
             for k, v in params.items():
@@ -148,11 +151,20 @@ class Search(RucioController):
                     long = v[0] == '1'
                 elif k == 'recursive':
                     recursive = v[0] == 'True'
+                elif k == 'limit':
+                    try:
+                        limit = int(v[0])
+                    except ValueError:
+                        raise generate_http_error(400, 'ValueError', 'Parameter "limit" must be a positive integer')
+                    if limit < 1:
+                        raise generate_http_error(400, 'ValueError', 'Parameter "limit" must be a positive integer')
+                elif k == 'marker':
+                    marker = v[0]
                 else:
                     filters[k] = v[0]
 
         try:
-            for did in list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive):
+            for did in list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive, limit=limit, marker=marker):
                 yield dumps(did) + '\n'
         except UnsupportedOperation as error:
             raise generate_http_error(409, 'UnsupportedOperation', error.args[0])